@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the ingest pipeline at a fixed open-loop rate.
+
+Starts the whole pipeline locally: in-memory Elasticsearch and S3
+stand-ins (bench_fakes.py), the Go hash writer built from
+services/hashwriter against them (or, without a Go toolchain, the
+stand-in hash writer of bench_pipeline.py), validator, parser and ingress.
+It then sends synthetic HL7 ADT/ORU, DICOM and FHIR Observation messages
+(bench_generators.py) at the given rate. Arrivals are open-loop: a message
+is sent at its scheduled time whether or not earlier ones were answered,
+and its latency counts from that time, so a stalled pipeline shows up in
+the percentiles instead of slowing the load down.
+
+The report has throughput and end-to-end p50/p95/p99 per message type,
+and per-stage p50/p95/p99 of every service, taken from the difference of
+the services' stage_seconds histograms over the run. It is JSON, tagged
+with the commit and the configuration; --compare prints the change
+against an earlier report and fails when a percentile regressed.
+
+Usage: python3 scripts/bench_e2e.py [--rate 200] [--duration 30] [--warmup 5] [--seed 1]
+                                    [--mix hl7_oru=0.6,hl7_adt=0.2,dicom=0.1,fhir=0.1] [--obx 10]
+                                    [--hashwriter auto|go|stub] [--output run.json]
+                                    [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from bench_generators import dicom_instance, fhir_observation, hl7_adt, hl7_control_id, hl7_oru
+from bench_pipeline import ROOT, SERVICES, free_port, start, wait_healthy
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+HASHWRITER = os.path.join(SERVICES, "hashwriter")
+KINDS = ("hl7_oru", "hl7_adt", "dicom", "fhir")
+CHANNEL = "BENCH"
+BUCKET = "compliance-audit"
+QUANTILES = {"p50_ms": 0.50, "p95_ms": 0.95, "p99_ms": 0.99}
+# Stage percentiles of fewer observations are too noisy to compare
+MIN_STAGE_COUNT = 100
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown message type {kind!r}, expected one of {', '.join(KINDS)}")
+        try:
+            mix[kind] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight of {kind} is not a number: {weight!r}")
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix has no weight")
+    return mix
+
+
+def make_request(kind, rng, i, args):
+    """(kind, path, httpx keyword arguments) of message i."""
+    if kind in ("hl7_oru", "hl7_adt"):
+        message = hl7_oru(rng, i, args.obx) if kind == "hl7_oru" else hl7_adt(rng, i)
+        return kind, "/ingest/hl7", {"json": {
+            "channel_id": CHANNEL,
+            "message_id": hl7_control_id(i),
+            "payload": base64.b64encode(message.encode()).decode(),
+        }}
+    if kind == "dicom":
+        headers, body = dicom_instance(rng, i, args.dicom_bytes)
+        return kind, "/ingest/dicom/stream", {
+            "content": body,
+            "headers": {**headers, "X-Channel-ID": CHANNEL, "Content-Type": "application/dicom"},
+        }
+    resource = fhir_observation(rng, i)
+    return kind, "/ingest/fhir", {"json": {
+        "channel_id": CHANNEL,
+        "resource_type": resource["resourceType"],
+        "resource_id": resource["id"],
+        "payload": resource,
+    }}
+
+
+def plan(args, seconds, first):
+    """Messages and their send offsets for seconds of load. The arrival
+    times and the messages come from separate streams of the seed, so
+    changing the mix does not move the arrivals."""
+    arrivals = random.Random(f"{args.seed}-arrivals-{first}")
+    messages = random.Random(f"{args.seed}-messages-{first}")
+    kinds, weights = zip(*args.mix.items())
+    offsets, offset = [], 0.0
+    count = round(args.rate * seconds)
+    for n in range(count):
+        if args.arrivals == "poisson":
+            offset += arrivals.expovariate(args.rate)
+        else:
+            offset = n / args.rate
+        offsets.append(offset)
+    return [(offset, make_request(messages.choices(kinds, weights)[0], messages, first + n, args))
+            for n, offset in enumerate(offsets)]
+
+
+async def drive(base_url, schedule, max_inflight):
+    """Sends each message at its offset; returns (kind, status, latency,
+    send lag) per message, and the messages dropped because max_inflight
+    were still unanswered."""
+    results = []
+    dropped = Counter()
+    inflight = set()
+
+    async def send(client, kind, path, kwargs, due):
+        lag = time.perf_counter() - due
+        try:
+            response = await client.post(path, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append((kind, status, time.perf_counter() - due, lag))
+
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60,
+                                 headers={"Authorization": "Bearer bench"}) as client:
+        started = time.perf_counter()
+        for offset, (kind, path, kwargs) in schedule:
+            due = started + offset
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(inflight) >= max_inflight:
+                dropped[kind] += 1
+                continue
+            task = asyncio.create_task(send(client, kind, path, kwargs, due))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.wait(set(inflight))
+        elapsed = time.perf_counter() - started
+    return results, dropped, elapsed
+
+
+def percentiles(values):
+    if not values:
+        return {name: None for name in QUANTILES}
+    if len(values) == 1:
+        return {name: round(values[0] * 1000, 3) for name in QUANTILES}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {name: round(cuts[round(q * 100) - 1] * 1000, 3) for name, q in QUANTILES.items()}
+
+
+def summarize(results, dropped, elapsed, offered):
+    ok = [latency for _, status, latency, _ in results if status == 200]
+    lags = sorted(lag for *_, lag in results)
+    return {
+        "offered": offered,
+        "sent": len(results),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "dropped": sum(dropped.values()),
+        "errors": dict(Counter(str(status) for _, status, _, _ in results if status != 200)),
+        "throughput_rps": round(len(ok) / elapsed, 1) if elapsed else 0.0,
+        **percentiles(sorted(ok)),
+        "max_ms": round(max(ok) * 1000, 3) if ok else None,
+        # How late the driver sent; if large, the driver and not the pipeline is the bottleneck
+        "send_lag_p99_ms": percentiles(lags)["p99_ms"],
+    }
+
+
+def scrape(url):
+    """Cumulative stage_seconds buckets per stage of one service, or None
+    if it serves no metrics."""
+    try:
+        response = httpx.get(f"{url}/metrics", timeout=10)
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    stages = defaultdict(lambda: {"buckets": {}, "count": 0.0, "sum": 0.0})
+    for family in text_string_to_metric_families(response.text):
+        if family.name != "stage_seconds":
+            continue
+        for sample in family.samples:
+            stage = stages[sample.labels["stage"]]
+            if sample.name.endswith("_bucket"):
+                stage["buckets"][float(sample.labels["le"])] = sample.value
+            elif sample.name.endswith("_count"):
+                stage["count"] = sample.value
+            elif sample.name.endswith("_sum"):
+                stage["sum"] = sample.value
+    return dict(stages)
+
+
+def bucket_quantile(q, buckets):
+    """Quantile q of cumulative (upper bound, count) buckets, interpolated
+    within the bucket it falls in like PromQL's histogram_quantile."""
+    total = buckets[-1][1]
+    if total <= 0:
+        return None
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for upper, count in buckets:
+        if count >= rank:
+            if math.isinf(upper):
+                return lower
+            return lower + (upper - lower) * (rank - below) / max(count - below, 1e-12)
+        lower, below = upper, count
+    return lower
+
+
+def stage_report(before, after, elapsed):
+    """Per-stage throughput and percentiles of the observations made
+    between two scrapes."""
+    report = {}
+    for stage, now in sorted(after.items()):
+        then = (before or {}).get(stage, {"buckets": {}, "count": 0.0, "sum": 0.0})
+        count = now["count"] - then["count"]
+        if count <= 0:
+            continue
+        buckets = [(le, now["buckets"][le] - then["buckets"].get(le, 0.0)) for le in sorted(now["buckets"])]
+        report[stage] = {
+            "count": int(count),
+            "throughput_rps": round(count / elapsed, 1),
+            "mean_ms": round((now["sum"] - then["sum"]) / count * 1000, 3),
+            **{name: round(bucket_quantile(q, buckets) * 1000, 3) for name, q in QUANTILES.items()},
+        }
+    return report
+
+
+def build_hashwriter(mode, workdir):
+    """Path of a hash writer binary, or None to use the stand-in."""
+    if mode == "stub":
+        return None
+    if shutil.which("go") is None:
+        if mode == "go":
+            sys.exit("--hashwriter go: no Go toolchain on PATH")
+        print("No Go toolchain, using the stand-in hash writer", file=sys.stderr)
+        return None
+    binary = os.path.join(workdir, "hashwriter")
+    build = subprocess.run(["go", "build", "-o", binary, "."], cwd=HASHWRITER, capture_output=True, text=True)
+    if build.returncode != 0:
+        if mode == "go":
+            sys.exit(f"go build failed:\n{build.stderr}")
+        print(f"go build failed, using the stand-in hash writer:\n{build.stderr}", file=sys.stderr)
+        return None
+    return binary
+
+
+def start_pipeline(args, workdir):
+    """Starts every process; returns them and the URLs of the services."""
+    names = ["es", "s3", "hashwriter", "validator", "parser", "ingress"]
+    ports = {name: free_port() for name in names}
+    url = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+    common = {"PYTHONPATH": SERVICES, "PYTHONUNBUFFERED": "1"}
+
+    def traced(service):
+        if not args.trace_dir:
+            return {}
+        return {"TRACE_FILE": os.path.join(args.trace_dir, f"{service}.jsonl")}
+
+    processes = [
+        start("bench_fakes:es_app", SCRIPTS, ports["es"], {}),
+        start("bench_fakes:s3_app", SCRIPTS, ports["s3"], {}),
+    ]
+    try:
+        for name in ("es", "s3"):
+            wait_healthy(f"{url[name]}/health")
+        httpx.put(f"{url['s3']}/{BUCKET}").raise_for_status()
+
+        binary = build_hashwriter(args.hashwriter, workdir)
+        if binary is None:
+            processes.append(start("bench_pipeline:fake_hashwriter", SCRIPTS, ports["hashwriter"], {}))
+        else:
+            processes.append(subprocess.Popen(
+                [binary],
+                env={**os.environ, **traced("hashwriter"),
+                     "PORT": str(ports["hashwriter"]),
+                     "GIN_MODE": "release",
+                     "ES_HOST": "127.0.0.1",
+                     "ES_PORT": str(ports["es"]),
+                     "S3_ENDPOINT": url["s3"],
+                     "S3_BUCKET": BUCKET,
+                     "ARCHIVE_DIR": os.path.join(workdir, "segments"),
+                     "CHAIN_HEAD_FILE": os.path.join(workdir, "chain-head.wal"),
+                     # Small segments, so a run seals and uploads some
+                     "ARCHIVE_SEGMENT_BYTES": str(4 << 20)},
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            ))
+        processes += [
+            start("main:app", os.path.join(SERVICES, "validator"), ports["validator"],
+                  {**common, **traced("validator"), "HASHWRITER_SERVICE_URL": url["hashwriter"]}),
+            start("main:app", os.path.join(SERVICES, "parser"), ports["parser"],
+                  {**common, **traced("parser"), "VALIDATOR_SERVICE_URL": url["validator"]}),
+        ]
+        if args.pipeline == "fused":
+            processes.append(start("main:app", os.path.join(SERVICES, "ingress"), ports["ingress"], {
+                **traced("ingress"),
+                "PYTHONPATH": os.pathsep.join([SERVICES, os.path.join(SERVICES, "parser"),
+                                               os.path.join(SERVICES, "validator")]),
+                "PIPELINE_MODE": "fused",
+                "HASHWRITER_SERVICE_URL": url["hashwriter"],
+            }))
+        else:
+            processes.append(start("main:app", os.path.join(SERVICES, "ingress"), ports["ingress"], {
+                **common, **traced("ingress"), "PIPELINE_MODE": "distributed", "PARSER_SERVICE_URL": url["parser"],
+            }))
+        for name in ("hashwriter", "validator", "parser", "ingress"):
+            wait_healthy(f"{url[name]}/health")
+    except BaseException:
+        stop(processes)
+        raise
+    return processes, url, binary is not None
+
+
+def stop(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run(args):
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="bench-e2e-") as workdir:
+        processes, url, go_hashwriter = start_pipeline(args, workdir)
+        try:
+            # Generated before the clock starts, so the driver only sends
+            warmup = plan(args, args.warmup, 0)
+            measured = plan(args, args.duration, len(warmup))
+            scraped = ["ingress", "hashwriter"] if args.pipeline == "fused" else [
+                "ingress", "parser", "validator", "hashwriter"]
+
+            if warmup:
+                asyncio.run(drive(url["ingress"], warmup, args.max_inflight))
+            before = {service: scrape(url[service]) for service in scraped}
+            results, dropped, elapsed = asyncio.run(drive(url["ingress"], measured, args.max_inflight))
+            after = {service: scrape(url[service]) for service in scraped}
+
+            indexed = None
+            if go_hashwriter:
+                indexed = httpx.post(f"{url['es']}/audit-*/_count").json()["count"]
+        finally:
+            stop(processes)
+
+    offered = Counter(kind for _, (kind, _, _) in measured)
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "arrivals": args.arrivals,
+            "seed": args.seed,
+            "mix": args.mix,
+            "obx": args.obx,
+            "dicom_bytes": args.dicom_bytes,
+            "max_inflight": args.max_inflight,
+            "pipeline": args.pipeline,
+            "hashwriter": "go" if go_hashwriter else "stub",
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize(results, dropped, elapsed, len(measured)),
+        "by_type": {
+            kind: summarize([r for r in results if r[0] == kind], Counter({kind: dropped[kind]}), elapsed,
+                            offered[kind])
+            for kind in KINDS if offered[kind]
+        },
+        "stages": {
+            service: stage_report(before[service], after[service], elapsed)
+            for service in after if after[service] is not None
+        },
+        # Entries the hash writer stored, counted in the Elasticsearch stand-in
+        "indexed": indexed,
+    }
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['rate']} msg/s for {config['duration']} s, {config['arrivals']} arrivals, "
+          f"{config['pipeline']} pipeline, {config['hashwriter']} hash writer, commit "
+          f"{(report['commit'] or 'unknown')[:12]}{' (dirty)' if report['dirty'] else ''}")
+    rows = [("total", report["total"])] + list(report["by_type"].items())
+    for name, row in rows:
+        print(f"{name:>10}  {row['throughput_rps']:>8.1f} ok/s  " + "  ".join(
+            f"{key[:3]} {row[key]:>8.2f} ms" if row[key] is not None else f"{key[:3]}      - ms"
+            for key in QUANTILES) + f"  failed {row['failed']}  dropped {row['dropped']}")
+    for service, stages in report["stages"].items():
+        for stage, row in stages.items():
+            print(f"{service + ' ' + stage:>36}  {row['throughput_rps']:>8.1f} /s  " + "  ".join(
+                f"{key[:3]} {row[key]:>8.3f} ms" for key in QUANTILES))
+    if report["total"]["failed"]:
+        print(f"errors: {report['total']['errors']}")
+
+
+def compare(report, baseline, threshold):
+    """Prints the percentiles and throughput of report against baseline;
+    returns the number that got worse by more than threshold. Stages
+    observed fewer than MIN_STAGE_COUNT times in either run are left out."""
+    pairs = [("throughput", report["total"]["throughput_rps"], baseline["total"]["throughput_rps"], True)]
+    for name in ["total"] + list(report["by_type"]):
+        new = report["total"] if name == "total" else report["by_type"][name]
+        old = baseline["total"] if name == "total" else baseline["by_type"].get(name)
+        if old is not None:
+            pairs += [(f"{name} {key}", new[key], old[key], False) for key in QUANTILES]
+    for service, stages in report["stages"].items():
+        for stage, new in stages.items():
+            old = baseline.get("stages", {}).get(service, {}).get(stage)
+            if old is not None and min(old["count"], new["count"]) >= MIN_STAGE_COUNT:
+                pairs += [(f"{service} {stage} {key}", new[key], old[key], False) for key in QUANTILES]
+
+    if report["config"] != baseline.get("config"):
+        print("Warning: the runs were configured differently", file=sys.stderr)
+    print(f"\nAgainst {(baseline.get('commit') or 'unknown')[:12]}:")
+    regressions = 0
+    for name, new, old, higher_is_better in pairs:
+        if new is None or old is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "!" if worse > threshold else " "
+        regressions += flag == "!"
+        print(f"{flag} {name:>44}  {old:>10.3f} -> {new:>10.3f}  {change * 100:+7.1f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=200, help="messages per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the arrivals and messages")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("hl7_oru=0.6,hl7_adt=0.2,dicom=0.1,fhir=0.1"),
+                        help="relative weights of hl7_oru, hl7_adt, dicom and fhir")
+    parser.add_argument("--obx", type=int, default=10, help="OBX segments per ORU message")
+    parser.add_argument("--dicom-bytes", type=int, default=65536, help="pixel data per DICOM instance")
+    parser.add_argument("--max-inflight", type=int, default=512,
+                        help="unanswered messages after which arrivals are dropped")
+    parser.add_argument("--pipeline", choices=["distributed", "fused"], default="distributed")
+    parser.add_argument("--hashwriter", choices=["auto", "go", "stub"], default="auto",
+                        help="go: build services/hashwriter, stub: answer without storage")
+    parser.add_argument("--trace-dir", help="record spans of every service here")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative change that counts as a regression")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.duration <= 0:
+        parser.error("--rate and --duration must be positive")
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+In-memory stand-ins for Elasticsearch and S3, for benchmarks and local runs.
+
+`es_app` answers the subset of the Elasticsearch 7 REST API the hash
+writer uses: the client's product check, _bulk (index, create, delete,
+partial and `ctx._source.field += params.x` scripted updates), index
+templates, GET by id, and _search/_count with ids, term, exists, bool and
+match_all queries and field sorts. `s3_app` is a path-style S3 like
+MinIO: buckets, PUT/GET/HEAD/DELETE of objects, ranged GETs. Both keep
+everything in memory and answer without I/O, so a benchmark measures the
+services, not the stores.
+
+Run them like any ASGI app:
+    uvicorn bench_fakes:es_app --app-dir scripts --port 9200
+    uvicorn bench_fakes:s3_app --app-dir scripts --port 9000
+"""
+
+import fnmatch
+import hashlib
+import json
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+from fastapi import FastAPI, Request, Response
+
+ES_VERSION = "7.17.9"
+SCRIPT = re.compile(r"^\s*ctx\._source\.(\w+)\s*\+=\s*params\.(\w+)\s*;?\s*$")
+
+es_app = FastAPI()
+# index -> id -> source
+indices = {}
+
+
+@es_app.middleware("http")
+async def product_header(request: Request, call_next):
+    # go-elasticsearch refuses servers that do not send it
+    response = await call_next(request)
+    response.headers["X-Elastic-Product"] = "Elasticsearch"
+    return response
+
+
+def es_json(body, status=200):
+    return Response(json.dumps(body), status_code=status, media_type="application/json")
+
+
+def es_error(kind, reason, status):
+    return es_json({"error": {"root_cause": [{"type": kind, "reason": reason}], "type": kind, "reason": reason},
+                    "status": status}, status)
+
+
+@es_app.get("/")
+async def es_info():
+    return es_json({
+        "name": "bench",
+        "cluster_name": "bench",
+        "version": {"number": ES_VERSION, "build_flavor": "default", "lucene_version": "8.11.1"},
+        "tagline": "You Know, for Search",
+    })
+
+
+@es_app.get("/health")
+async def es_health():
+    return {"status": "healthy"}
+
+
+def bulk_item(action, index, doc_id, body):
+    """Applies one bulk action; returns (status, result or error)."""
+    docs = indices.setdefault(index, {})
+    if action == "delete":
+        if docs.pop(doc_id, None) is None:
+            return 404, "not_found"
+        return 200, "deleted"
+    if action == "create" and doc_id in docs:
+        return 409, {"type": "version_conflict_engine_exception", "reason": f"[{doc_id}]: document already exists"}
+    if action in ("index", "create"):
+        created = doc_id not in docs
+        docs[doc_id] = body
+        return (201, "created") if created else (200, "updated")
+
+    # update
+    source = docs.get(doc_id)
+    if source is None:
+        if "upsert" in body:
+            docs[doc_id] = body["upsert"]
+            return 201, "created"
+        if body.get("doc_as_upsert"):
+            docs[doc_id] = body["doc"]
+            return 201, "created"
+        return 404, {"type": "document_missing_exception", "reason": f"[{doc_id}]: document missing"}
+    if "doc" in body:
+        merge(source, body["doc"])
+        return 200, "updated"
+    script = body.get("script") or {}
+    match = SCRIPT.match(script.get("source", ""))
+    if match is None:
+        return 400, {"type": "illegal_argument_exception", "reason": "script not supported by the stand-in"}
+    field, param = match.groups()
+    source[field] = source.get(field, 0) + script.get("params", {}).get(param, 0)
+    return 200, "updated"
+
+
+def merge(target, update):
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+
+
+@es_app.post("/_bulk")
+@es_app.post("/{default_index}/_bulk")
+async def es_bulk(request: Request, default_index: str = None):
+    started = time.perf_counter()
+    lines = iter(line for line in (await request.body()).split(b"\n") if line.strip())
+    items, errors = [], False
+    for line in lines:
+        action, meta = next(iter(json.loads(line).items()))
+        body = json.loads(next(lines)) if action != "delete" else None
+        index = meta.get("_index", default_index)
+        doc_id = meta.get("_id") or hashlib.sha1(line + str(len(items)).encode()).hexdigest()[:20]
+        status, result = bulk_item(action, index, doc_id, body)
+        item = {"_index": index, "_type": "_doc", "_id": doc_id, "status": status}
+        if status > 299:
+            item["error"] = result if isinstance(result, dict) else {"type": result}
+            errors = True
+        else:
+            item["result"] = result
+        items.append({action: item})
+    took = int((time.perf_counter() - started) * 1000)
+    return es_json({"took": took, "errors": errors, "items": items})
+
+
+@es_app.put("/_template/{name}")
+async def es_put_template(name: str):
+    return es_json({"acknowledged": True})
+
+
+def matching_indices(pattern):
+    names = set()
+    for part in pattern.split(","):
+        names.update(name for name in indices if fnmatch.fnmatchcase(name, part))
+    return sorted(names)
+
+
+def field(source, path):
+    for key in path.split("."):
+        if not isinstance(source, dict) or key not in source:
+            return None
+        source = source[key]
+    return source
+
+
+def matches(query, doc_id, source):
+    if not query or "match_all" in query:
+        return True
+    if "ids" in query:
+        return doc_id in query["ids"]["values"]
+    if "term" in query:
+        (name, value), = query["term"].items()
+        if isinstance(value, dict):
+            value = value["value"]
+        return field(source, name) == value
+    if "terms" in query:
+        (name, values), = query["terms"].items()
+        return field(source, name) in values
+    if "exists" in query:
+        return field(source, query["exists"]["field"]) is not None
+    if "bool" in query:
+        clauses = query["bool"]
+
+        def each(key):
+            value = clauses.get(key, [])
+            return value if isinstance(value, list) else [value]
+
+        return (all(matches(q, doc_id, source) for q in each("must") + each("filter"))
+                and not any(matches(q, doc_id, source) for q in each("must_not"))
+                and (not each("should") or any(matches(q, doc_id, source) for q in each("should"))))
+    raise ValueError(f"query not supported by the stand-in: {sorted(query)}")
+
+
+def select(source, includes):
+    if includes is None or includes is True:
+        return source
+    if includes is False:
+        return {}
+    if isinstance(includes, str):
+        includes = [includes]
+    return {key: value for key, value in source.items() if key in includes}
+
+
+async def search_hits(index, request):
+    raw = await request.body()
+    body = json.loads(raw) if raw.strip() else {}
+    hits = []
+    for name in matching_indices(index):
+        for doc_id, source in indices[name].items():
+            if matches(body.get("query"), doc_id, source):
+                hits.append((name, doc_id, source))
+    for sort in reversed(body.get("sort", [])):
+        (name, order), = (sort.items() if isinstance(sort, dict) else [(sort, "asc")])
+        descending = (order.get("order") if isinstance(order, dict) else order) == "desc"
+        # Documents without the field sort last either way, as in Elasticsearch
+        present = [hit for hit in hits if field(hit[2], name) is not None]
+        missing = [hit for hit in hits if field(hit[2], name) is None]
+        hits = sorted(present, key=lambda hit: field(hit[2], name), reverse=descending) + missing
+    return body, hits
+
+
+@es_app.api_route("/{index}/_search", methods=["GET", "POST"])
+async def es_search(index: str, request: Request):
+    try:
+        body, hits = await search_hits(index, request)
+    except ValueError as e:
+        return es_error("parsing_exception", str(e), 400)
+    size = int(request.query_params.get("size", body.get("size", 10)))
+    start = int(request.query_params.get("from", body.get("from", 0)))
+    includes = body.get("_source")
+    return es_json({
+        "took": 0,
+        "timed_out": False,
+        "hits": {
+            "total": {"value": len(hits), "relation": "eq"},
+            "max_score": None,
+            "hits": [{"_index": name, "_type": "_doc", "_id": doc_id, "_score": None,
+                      "_source": select(source, includes)}
+                     for name, doc_id, source in hits[start:start + size]],
+        },
+    })
+
+
+@es_app.api_route("/{index}/_count", methods=["GET", "POST"])
+async def es_count(index: str, request: Request):
+    try:
+        _, hits = await search_hits(index, request)
+    except ValueError as e:
+        return es_error("parsing_exception", str(e), 400)
+    return es_json({"count": len(hits)})
+
+
+@es_app.get("/{index}/_doc/{doc_id}")
+async def es_get(index: str, doc_id: str):
+    source = indices.get(index, {}).get(doc_id)
+    if source is None:
+        return es_json({"_index": index, "_type": "_doc", "_id": doc_id, "found": False}, 404)
+    return es_json({"_index": index, "_type": "_doc", "_id": doc_id, "found": True, "_source": source})
+
+
+s3_app = FastAPI()
+# bucket -> key -> (body, content type, metadata headers, last modified)
+buckets = {}
+
+
+def s3_error(code, message, status, resource=""):
+    body = (f'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{code}</Code><Message>{message}</Message>'
+            f"<Resource>{resource}</Resource></Error>")
+    return Response(body, status_code=status, media_type="application/xml")
+
+
+def etag(body):
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+@s3_app.get("/health")
+async def s3_health():
+    return {"status": "healthy"}
+
+
+@s3_app.put("/{bucket}")
+async def s3_create_bucket(bucket: str):
+    if bucket in buckets:
+        return s3_error("BucketAlreadyOwnedByYou", "Your previous request to create the named bucket succeeded.",
+                        409, f"/{bucket}")
+    buckets[bucket] = {}
+    return Response(headers={"Location": f"/{bucket}"})
+
+
+@s3_app.head("/{bucket}")
+async def s3_head_bucket(bucket: str):
+    return Response(status_code=200 if bucket in buckets else 404)
+
+
+@s3_app.put("/{bucket}/{key:path}")
+async def s3_put(bucket: str, key: str, request: Request):
+    if bucket not in buckets:
+        return s3_error("NoSuchBucket", "The specified bucket does not exist", 404, f"/{bucket}")
+    body = await request.body()
+    metadata = {name: value for name, value in request.headers.items()
+                if name.startswith("x-amz-meta-") or name.startswith("x-amz-object-lock-")}
+    buckets[bucket][key] = (body, request.headers.get("content-type", "application/octet-stream"),
+                            metadata, datetime.now(timezone.utc))
+    return Response(headers={"ETag": etag(body)})
+
+
+def object_headers(body, content_type, metadata, modified):
+    return {"ETag": etag(body), "Content-Type": content_type, "Accept-Ranges": "bytes",
+            "Last-Modified": format_datetime(modified, usegmt=True), **metadata}
+
+
+@s3_app.head("/{bucket}/{key:path}")
+async def s3_head(bucket: str, key: str):
+    stored = buckets.get(bucket, {}).get(key)
+    if stored is None:
+        return Response(status_code=404)
+    body, *rest = stored
+    return Response(headers={**object_headers(body, *rest), "Content-Length": str(len(body))})
+
+
+@s3_app.get("/{bucket}/{key:path}")
+async def s3_get(bucket: str, key: str, request: Request):
+    stored = buckets.get(bucket, {}).get(key)
+    if stored is None:
+        return s3_error("NoSuchKey", "The specified key does not exist.", 404, f"/{bucket}/{key}")
+    body, *rest = stored
+    headers = object_headers(body, *rest)
+    ranged = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("range", ""))
+    if ranged is None or ranged.groups() == ("", ""):
+        return Response(body, headers=headers, media_type=headers["Content-Type"])
+    first, last = ranged.groups()
+    if first == "":
+        first, last = max(0, len(body) - int(last)), len(body) - 1
+    else:
+        first, last = int(first), min(int(last) if last else len(body) - 1, len(body) - 1)
+    if first >= len(body) or first > last:
+        return s3_error("InvalidRange", "The requested range is not satisfiable", 416, f"/{bucket}/{key}")
+    headers["Content-Range"] = f"bytes {first}-{last}/{len(body)}"
+    return Response(body[first:last + 1], status_code=206, headers=headers, media_type=headers["Content-Type"])
+
+
+@s3_app.delete("/{bucket}/{key:path}")
+async def s3_delete(bucket: str, key: str):
+    buckets.get(bucket, {}).pop(key, None)
+    return Response(status_code=204)
@@ -0,0 +1,211 @@
+"""
+Synthetic HL7 v2, DICOM and FHIR messages for the benchmarks.
+
+Every generator takes a random.Random and the message's sequence number,
+so a seed reproduces the same messages, ids included, on every run.
+Values are drawn from small realistic pools: names, LOINC analytes with
+their units and reference ranges, modalities.
+"""
+
+from datetime import datetime, timedelta
+from io import BytesIO
+
+FAMILY_NAMES = ["Mueller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker",
+                "Smith", "Johnson", "Garcia", "Nguyen", "Kowalski", "Rossi", "Dubois", "Jansen"]
+GIVEN_NAMES = ["Anna", "Lukas", "Maria", "Jonas", "Sophie", "Elias", "Emma", "Noah", "Mia", "Paul",
+               "Lea", "Ben", "Hannah", "Felix", "Laura", "David"]
+STREETS = ["Hauptstr.", "Bahnhofstr.", "Gartenweg", "Lindenallee", "Schulstr.", "Main St"]
+CITIES = [("Berlin", "10115"), ("Hamburg", "20095"), ("Munich", "80331"), ("Cologne", "50667")]
+
+# LOINC code, name, unit, reference low, reference high
+ANALYTES = [
+    ("2345-7", "Glucose", "mg/dL", 70, 99),
+    ("2951-2", "Sodium", "mmol/L", 136, 145),
+    ("2823-3", "Potassium", "mmol/L", 3.5, 5.1),
+    ("2075-0", "Chloride", "mmol/L", 98, 107),
+    ("2160-0", "Creatinine", "mg/dL", 0.7, 1.3),
+    ("3094-0", "Urea nitrogen", "mg/dL", 7, 20),
+    ("17861-6", "Calcium", "mg/dL", 8.6, 10.3),
+    ("718-7", "Hemoglobin", "g/dL", 12, 17.5),
+    ("4544-3", "Hematocrit", "%", 36, 50),
+    ("6690-2", "Leukocytes", "10*3/uL", 4.5, 11),
+    ("777-3", "Platelets", "10*3/uL", 150, 400),
+    ("1742-6", "ALT", "U/L", 7, 56),
+    ("1920-8", "AST", "U/L", 10, 40),
+    ("2093-3", "Cholesterol", "mg/dL", 125, 200),
+    ("2571-8", "Triglyceride", "mg/dL", 0, 150),
+    ("4548-4", "Hemoglobin A1c", "%", 4, 5.6),
+]
+PANELS = [("24323-8", "Comprehensive metabolic panel"), ("58410-2", "CBC panel"), ("57698-3", "Lipid panel")]
+ADT_EVENTS = ["A01", "A03", "A04", "A08"]
+MODALITIES = ["CT", "MR", "CR", "US", "DX"]
+SOP_CLASSES = {
+    "CT": "1.2.840.10008.5.1.4.1.1.2",
+    "MR": "1.2.840.10008.5.1.4.1.1.4",
+    "CR": "1.2.840.10008.5.1.4.1.1.1",
+    "US": "1.2.840.10008.5.1.4.1.1.6.1",
+    "DX": "1.2.840.10008.5.1.4.1.1.1.1",
+}
+BASE_TIME = datetime(2024, 3, 1, 8, 0, 0)
+
+
+def _when(rng):
+    return BASE_TIME + timedelta(seconds=rng.randrange(30 * 86400))
+
+
+def _patient(rng):
+    return {
+        "id": str(rng.randrange(100000, 999999)),
+        "family": rng.choice(FAMILY_NAMES),
+        "given": rng.choice(GIVEN_NAMES),
+        "birth": (datetime(1930, 1, 1) + timedelta(days=rng.randrange(33000))).strftime("%Y%m%d"),
+        "sex": rng.choice("MF"),
+    }
+
+
+def _pid(rng, patient):
+    street = f"{rng.randrange(1, 200)} {rng.choice(STREETS)}"
+    city, postcode = rng.choice(CITIES)
+    return (f"PID|1||{patient['id']}^^^HOSP^MR||{patient['family']}^{patient['given']}||{patient['birth']}|"
+            f"{patient['sex']}|||{street}^^{city}^^{postcode}^DE||+49{rng.randrange(10**9, 10**10)}")
+
+
+def _result(rng, low, high):
+    """A value inside the reference range most of the time, with its flag."""
+    span = high - low
+    value = round(rng.uniform(low - span * 0.3, high + span * 0.3), 1)
+    flag = "L" if value < low else "H" if value > high else "N"
+    return value, flag
+
+
+def hl7_control_id(i):
+    return f"BENCH{i:09d}"
+
+
+def hl7_adt(rng, i):
+    """An ADT admit, discharge, registration or update message."""
+    event = rng.choice(ADT_EVENTS)
+    when = _when(rng).strftime("%Y%m%d%H%M%S")
+    patient = _patient(rng)
+    segments = [
+        f"MSH|^~\\&|ADT|HOSP|EHR|HOSP|{when}||ADT^{event}|{hl7_control_id(i)}|P|2.5",
+        f"EVN|{event}|{when}",
+        _pid(rng, patient),
+        f"PV1|1|{rng.choice('IOE')}|WARD{rng.randrange(1, 20)}^{rng.randrange(100, 400)}^{rng.randrange(1, 4)}"
+        f"||||{rng.randrange(1000, 9999)}^{rng.choice(FAMILY_NAMES)}^{rng.choice(GIVEN_NAMES)}|||MED",
+    ]
+    return "\r".join(segments)
+
+
+def hl7_oru(rng, i, obx_count):
+    """An ORU^R01 lab result with obx_count OBX segments."""
+    when = _when(rng).strftime("%Y%m%d%H%M%S")
+    patient = _patient(rng)
+    panel_code, panel_name = rng.choice(PANELS)
+    segments = [
+        f"MSH|^~\\&|LAB|HOSP|EHR|HOSP|{when}||ORU^R01|{hl7_control_id(i)}|P|2.5",
+        _pid(rng, patient),
+        f"OBR|1|ORD{i}|FIL{i}|{panel_code}^{panel_name}^LN|||{when}",
+    ]
+    for n in range(1, obx_count + 1):
+        code, name, unit, low, high = ANALYTES[(n - 1) % len(ANALYTES)]
+        value, flag = _result(rng, low, high)
+        segments.append(f"OBX|{n}|NM|{code}^{name}^LN||{value}|{unit}|{low}-{high}|{flag}|||F|||{when}")
+    return "\r".join(segments)
+
+
+def _uid(rng):
+    # UUID-derived UIDs under the 2.25 root need no registered prefix
+    return f"2.25.{rng.getrandbits(120)}"
+
+
+def dicom_instance(rng, i, pixel_bytes):
+    """A DICOM Part 10 file with a typical header and pixel_bytes of pixel
+    data, and the X-* headers ingress takes its UIDs and modality from."""
+    import pydicom
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian
+
+    modality = rng.choice(MODALITIES)
+    study_uid, series_uid, instance_uid = _uid(rng), _uid(rng), _uid(rng)
+    when = _when(rng)
+    patient = _patient(rng)
+
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = SOP_CLASSES[modality]
+    ds.file_meta.MediaStorageSOPInstanceUID = instance_uid
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = SOP_CLASSES[modality]
+    ds.SOPInstanceUID = instance_uid
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.PatientName = f"{patient['family']}^{patient['given']}"
+    ds.PatientID = patient["id"]
+    ds.PatientBirthDate = patient["birth"]
+    ds.PatientSex = patient["sex"]
+    ds.StudyDate = ds.SeriesDate = when.strftime("%Y%m%d")
+    ds.StudyTime = when.strftime("%H%M%S")
+    ds.AccessionNumber = f"ACC{i:09d}"
+    ds.ReferringPhysicianName = f"{rng.choice(FAMILY_NAMES)}^{rng.choice(GIVEN_NAMES)}"
+    ds.Modality = modality
+    ds.InstitutionName = "HOSP"
+    ds.SeriesNumber = rng.randrange(1, 10)
+    ds.InstanceNumber = i % 500 + 1
+    columns = 256
+    ds.Rows = max(1, pixel_bytes // columns)
+    ds.Columns = columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.PixelData = rng.randbytes(ds.Rows * columns)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, write_like_original=False)
+    headers = {
+        "X-Study-UID": study_uid,
+        "X-Series-UID": series_uid,
+        "X-Instance-UID": instance_uid,
+        "X-Modality": modality,
+    }
+    return headers, buffer.getvalue()
+
+
+def fhir_observation(rng, i):
+    """A laboratory Observation with a quantity, reference range and
+    interpretation."""
+    code, name, unit, low, high = rng.choice(ANALYTES)
+    value, flag = _result(rng, low, high)
+    patient = _patient(rng)
+    when = _when(rng)
+    return {
+        "resourceType": "Observation",
+        "id": f"bench-obs-{i:09d}",
+        "meta": {"lastUpdated": when.strftime("%Y-%m-%dT%H:%M:%SZ")},
+        "identifier": [{"system": "urn:oid:1.2.276.0.76.4.8", "value": f"OBS{i:09d}"}],
+        "status": "final",
+        "category": [{"coding": [{
+            "system": "http://terminology.hl7.org/CodeSystem/observation-category",
+            "code": "laboratory",
+            "display": "Laboratory",
+        }]}],
+        "code": {"coding": [{"system": "http://loinc.org", "code": code, "display": name}], "text": name},
+        "subject": {"reference": f"Patient/{patient['id']}",
+                    "display": f"{patient['given']} {patient['family']}"},
+        "effectiveDateTime": when.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "issued": (when + timedelta(minutes=rng.randrange(5, 240))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "valueQuantity": {"value": value, "unit": unit, "system": "http://unitsofmeasure.org", "code": unit},
+        "interpretation": [{"coding": [{
+            "system": "http://terminology.hl7.org/CodeSystem/v3-ObservationInterpretation",
+            "code": flag,
+        }]}],
+        "referenceRange": [{
+            "low": {"value": low, "unit": unit, "system": "http://unitsofmeasure.org", "code": unit},
+            "high": {"value": high, "unit": unit, "system": "http://unitsofmeasure.org", "code": unit},
+        }],
+    }
+
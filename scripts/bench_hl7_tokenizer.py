@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark HL7 parse throughput against OBX segment count.
+
+Compares the parser's tokenizer path with the previous python-hl7 path
+(reproduced below as `legacy_parse`), both producing the named fields and
+the validator field index.
+
+Usage: python3 scripts/bench_hl7_tokenizer.py [--messages 500] [--obx-counts 1,10,100,500]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import hl7
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services', 'parser'))
+from hl7_tokenizer import HL7Message, index_fields
+
+
+def make_message(i, obx_count):
+    segments = [
+        f"MSH|^~\\&|LAB|FAC|EHR|FAC|20231201120500||ORU^R01|MSG{i}|P|2.5",
+        f"PID|1||{100000 + i}^^^HOSP||Doe^John||19800101|M",
+        "OBR|1|ORD1|FIL1|CBC^Complete blood count^LN|||20231201120000",
+    ]
+    for n in range(1, obx_count + 1):
+        segments.append(f"OBX|{n}|NM|{n}-7^Analyte {n}^LN||{n % 97}.{n % 10}|mmol/L|3.9-5.5|N|||F")
+    return "\r".join(segments)
+
+
+def legacy_parse(payload):
+    """The parser's HL7 extraction before the tokenizer."""
+    message = hl7.parse(payload)
+    parsed_data = {
+        "message_type": str(message.segment('MSH')[9]) if message.segment('MSH') else None,
+        "message_control_id": str(message.segment('MSH')[10]) if message.segment('MSH') else None,
+        "sending_application": str(message.segment('MSH')[3]) if message.segment('MSH') else None,
+        "receiving_application": str(message.segment('MSH')[5]) if message.segment('MSH') else None,
+        "segments": {}
+    }
+    if message.segment('PID'):
+        pid = message.segment('PID')
+        parsed_data["segments"]["PID"] = {
+            "patient_id": str(pid[3]) if len(pid) > 3 else None,
+            "patient_name": str(pid[5]) if len(pid) > 5 else None,
+        }
+    obx_segments = []
+    for segment in message:
+        if str(segment[0]) == 'OBX':
+            obx_segments.append({
+                "observation_id": str(segment[3]) if len(segment) > 3 else None,
+                "observation_value": str(segment[5]) if len(segment) > 5 else None,
+            })
+    if obx_segments:
+        parsed_data["segments"]["OBX"] = obx_segments
+    segments = ((s[:3], lambda s=s: _legacy_fields(s)) for s in payload.split("\r") if s)
+    parsed_data["field_index"], parsed_data["segment_counts"] = index_fields(segments)
+    return parsed_data
+
+
+def _legacy_fields(segment):
+    fields = segment.split("|")
+    if fields[0] == "MSH":
+        fields = [fields[0], "|"] + fields[1:]
+    return fields
+
+
+def tokenizer_parse(payload):
+    message = HL7Message(payload)
+    msh = message.segment('MSH')
+    pid = message.segment('PID')
+    parsed_data = {
+        "message_type": msh[9],
+        "message_control_id": msh[10],
+        "sending_application": msh[3],
+        "receiving_application": msh[5],
+        "segments": {"PID": {"patient_id": pid[3], "patient_name": pid[5]}},
+    }
+    parsed_data["segments"]["OBX"] = [
+        {"observation_id": obx[3], "observation_value": obx[5]} for obx in message.segments('OBX')
+    ]
+    parsed_data["field_index"], parsed_data["segment_counts"] = message.field_index()
+    return parsed_data
+
+
+def measure(parse, messages):
+    start = time.perf_counter()
+    for message in messages:
+        parse(message)
+    elapsed = time.perf_counter() - start
+    return len(messages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--obx-counts", default="1,10,50,100,250,500")
+    args = parser.parse_args()
+
+    rows = []
+    for count in [int(c) for c in args.obx_counts.split(",")]:
+        messages = [make_message(i, count) for i in range(args.messages)]
+        assert tokenizer_parse(messages[0])["field_index"] == legacy_parse(messages[0])["field_index"]
+        tokenized = measure(tokenizer_parse, messages)
+        legacy = measure(legacy_parse, messages)
+        rows.append({
+            "obx_segments": count,
+            "tokenizer_msgs_per_sec": round(tokenized),
+            "python_hl7_msgs_per_sec": round(legacy),
+            "speedup": round(tokenized / legacy, 1),
+        })
+        print(f"{count:>5} OBX  tokenizer {tokenized:>9.0f} msg/s  python-hl7 {legacy:>9.0f} msg/s  x{tokenized / legacy:.1f}")
+
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark the overhead of the shared stage instrumentation.
+
+Times an empty block bare and inside `stage(...)`: enabled with and without
+a message id exemplar, buffered as in an executor worker, and disabled
+(INSTRUMENTATION=off). Also compares validating messages with and without
+per-rule timing, the cost paid by the sampled messages.
+
+Usage: python3 scripts/bench_instrumentation.py [--iterations 200000] [--rules 100]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services', 'validator'))
+sys.path.insert(0, os.path.dirname(__file__))
+from common import instrumentation
+from common.instrumentation import stage
+from rule_engine import RulePlan
+from bench_rule_engine import make_message, make_rules
+
+
+def per_call_ns(block, iterations):
+    start = time.perf_counter()
+    block(iterations)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def bare(iterations):
+    for _ in range(iterations):
+        pass
+
+
+def timed(message_id):
+    def block(iterations):
+        for _ in range(iterations):
+            with stage("bench.empty", message_id):
+                pass
+    return block
+
+
+def buffered(iterations):
+    # Drained now and then, as the executor does after each call
+    token = instrumentation.start_buffer()
+    for i in range(iterations):
+        with stage("bench.empty", "MSG0001"):
+            pass
+        if i % 1000 == 999:
+            instrumentation.finish_buffer(token)
+            token = instrumentation.start_buffer()
+    instrumentation.finish_buffer(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--rules", type=int, default=100)
+    args = parser.parse_args()
+
+    baseline = per_call_ns(bare, args.iterations)
+    results = {
+        "enabled_ns": per_call_ns(timed(None), args.iterations) - baseline,
+        "enabled_exemplar_ns": per_call_ns(timed("MSG0001"), args.iterations) - baseline,
+        "buffered_ns": per_call_ns(buffered, args.iterations) - baseline,
+    }
+    instrumentation.ENABLED = False
+    results["disabled_ns"] = per_call_ns(timed("MSG0001"), args.iterations) - baseline
+    instrumentation.ENABLED = True
+
+    plan = RulePlan(make_rules(args.rules))
+    messages = [make_message(i) for i in range(args.messages)]
+    for name, observe in [("rules_untimed_us", None), ("rules_timed_us", instrumentation.observe_rule)]:
+        start = time.perf_counter()
+        for message in messages:
+            plan.evaluate(message, observe)
+        results[name] = (time.perf_counter() - start) / len(messages) * 1e6
+
+    for name, value in results.items():
+        print(f"{name:>22} {value:>10.1f}")
+    print(json.dumps({name: round(value, 1) for name, value in results.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
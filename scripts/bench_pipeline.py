@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark HL7 ingest latency and throughput, fused vs distributed pipeline.
+
+Starts local uvicorn processes: a stand-in hash writer that answers without
+storage, the validator, parser and an ingress in PIPELINE_MODE=distributed,
+and a second ingress in PIPELINE_MODE=fused. Both ingresses are then
+driven with the same closed-loop load.
+
+Usage: python3 scripts/bench_pipeline.py [--requests 2000] [--concurrency 16] [--obx 10]
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SERVICES = os.path.join(ROOT, 'services')
+
+# Hash writer stand-in so the benchmark measures the Python hops only
+fake_hashwriter = FastAPI()
+
+
+@fake_hashwriter.post("/hash")
+async def fake_hash(request: Request):
+    return {"hash": hashlib.sha256(await request.body()).hexdigest(), "status": "success"}
+
+
+@fake_hashwriter.post("/hash/batch")
+async def fake_hash_batch(request: Request):
+    messages = json.loads(await request.body())["messages"]
+    return {"results": [{"hash": "0" * 64, "status": "success"} for _ in messages]}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(app, app_dir, port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", app_dir,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_healthy(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code in (200, 404):
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def make_payload(i, obx_count):
+    segments = [
+        f"MSH|^~\\&|LAB|FAC|EHR|FAC|20231201120500||ORU^R01|MSG{i}|P|2.5",
+        f"PID|1||{100000 + i}^^^HOSP||Doe^John||19800101|M",
+    ]
+    segments += [f"OBX|{n}|NM|{n}-7^Analyte {n}^LN||{n}.5|mmol/L|3.9-5.5" for n in range(1, obx_count + 1)]
+    return base64.b64encode("\r".join(segments).encode()).decode()
+
+
+async def drive(base_url, total, concurrency, obx_count):
+    latencies = []
+    failures = 0
+    counter = iter(range(total))
+    payloads = [make_payload(i, obx_count) for i in range(100)]
+
+    async def worker(client):
+        nonlocal failures
+        for i in counter:
+            start_time = time.perf_counter()
+            response = await client.post(
+                "/ingest/hl7",
+                headers={"Authorization": "Bearer bench"},
+                json={"channel_id": "BENCH", "payload": payloads[i % len(payloads)]},
+            )
+            latencies.append(time.perf_counter() - start_time)
+            if response.status_code != 200:
+                failures += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        # Warm up connection pools on every hop
+        await asyncio.gather(*(client.post("/ingest/hl7", headers={"Authorization": "Bearer bench"},
+                                           json={"channel_id": "BENCH", "payload": payloads[0]})
+                               for _ in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": total,
+        "failures": failures,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--obx", type=int, default=10, help="OBX segments per message")
+    args = parser.parse_args()
+
+    ports = {name: free_port() for name in ("hashwriter", "validator", "parser", "distributed", "fused")}
+    url = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+    common = {"PYTHONPATH": SERVICES, "PYTHONUNBUFFERED": "1"}
+    processes = [
+        start("bench_pipeline:fake_hashwriter", os.path.dirname(os.path.abspath(__file__)), ports["hashwriter"], {}),
+        start("main:app", os.path.join(SERVICES, "validator"), ports["validator"],
+              {**common, "HASHWRITER_SERVICE_URL": url["hashwriter"]}),
+        start("main:app", os.path.join(SERVICES, "parser"), ports["parser"],
+              {**common, "VALIDATOR_SERVICE_URL": url["validator"]}),
+        start("main:app", os.path.join(SERVICES, "ingress"), ports["distributed"],
+              {**common, "PIPELINE_MODE": "distributed", "PARSER_SERVICE_URL": url["parser"]}),
+        start("main:app", os.path.join(SERVICES, "ingress"), ports["fused"],
+              {"PYTHONPATH": os.pathsep.join([SERVICES, os.path.join(SERVICES, "parser"),
+                                              os.path.join(SERVICES, "validator")]),
+               "PIPELINE_MODE": "fused", "HASHWRITER_SERVICE_URL": url["hashwriter"]}),
+    ]
+    try:
+        for name in ports:
+            wait_healthy(f"{url[name]}/health")
+        rows = {}
+        for mode in ("distributed", "fused"):
+            rows[mode] = asyncio.run(drive(url[mode], args.requests, args.concurrency, args.obx))
+            row = rows[mode]
+            print(f"{mode:>11}  {row['throughput_rps']:>8.1f} req/s  p50 {row['p50_ms']:>7.2f} ms  "
+                  f"p95 {row['p95_ms']:>7.2f} ms  p99 {row['p99_ms']:>7.2f} ms  failures {row['failures']}")
+        print(json.dumps(rows, indent=2))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark validator rule evaluation throughput against rule count.
+
+Compares the compiled, indexed RulePlan with the previous per-message linear
+scan (reproduced below as `legacy_evaluate`).
+
+Usage: python3 scripts/bench_rule_engine.py [--messages 2000] [--rule-counts 10,100,500]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services', 'validator'))
+from rule_engine import RulePlan, Severity, ValidationResult, ValidationRule
+
+SEGMENTS = ["PID", "OBX", "PV1", "ORC", "OBR", "NK1", "AL1", "DG1"]
+
+
+def make_rules(count):
+    rules = []
+    for i in range(count):
+        segment = SEGMENTS[i % len(SEGMENTS)]
+        if i % 3 == 0:
+            rules.append(ValidationRule(
+                id=f"R{i}", name=f"Rule {i}", description="not empty", segment=segment, field=3,
+                operator="NOT_EMPTY", severity=Severity.ERROR, message=f"{segment}-3 must not be empty"))
+        elif i % 3 == 1:
+            rules.append(ValidationRule(
+                id=f"R{i}", name=f"Rule {i}", description="regex", segment=segment, field=3,
+                operator="REGEX", value=r"^\d{1,5}-\d$", severity=Severity.WARN, message=f"{segment}-3 format"))
+        else:
+            rules.append(ValidationRule(
+                id=f"R{i}", name=f"Rule {i}", description="modality", segment="DICOM",
+                operator="IN_LIST", value=["CT", "MR", "US"], severity=Severity.WARN, message="modality"))
+    return rules
+
+
+def make_message(i):
+    patient_id = str(100000 + i)
+    observation_id = "2345-7" if i % 2 else "GLU"
+    return {
+        "message_id": f"MSG{i}",
+        "message_type": "HL7",
+        "parsed_data": {
+            "segments": {
+                "PID": {"patient_id": patient_id, "patient_name": "Doe^John"},
+                "OBX": [{"observation_id": observation_id}],
+            },
+            # As emitted by the parser
+            "field_index": {"PID-3": [patient_id], "PID-5": ["Doe^John"], "OBX-3": [observation_id]},
+            "segment_counts": {"PID": 1, "OBX": 1},
+        },
+    }
+
+
+def legacy_evaluate(rules, data):
+    """The validator's evaluation loop before rules were compiled."""
+    results = []
+    for rule in rules:
+        if not rule.active:
+            continue
+        if rule.segment and rule.segment != "DICOM":
+            segment_data = data.get("parsed_data", {}).get("segments", {}).get(rule.segment, {})
+            if rule.operator == "NOT_EMPTY":
+                field_key = {3: "patient_id", 5: "patient_name"}.get(rule.field)
+                value = segment_data.get(field_key) if field_key and isinstance(segment_data, dict) else None
+                passed = bool(value and str(value).strip())
+            elif rule.operator == "REGEX":
+                field_data = segment_data[0] if isinstance(segment_data, list) and segment_data else segment_data
+                value = field_data.get("observation_id", "")
+                passed = bool(re.match(rule.value, str(value))) if value else False
+            else:
+                passed = True
+        elif rule.segment == "DICOM" and data.get("message_type") == "DICOM":
+            passed = data.get("parsed_data", {}).get("modality", "") in rule.value
+        else:
+            passed = True
+        results.append(ValidationResult(
+            rule_id=rule.id,
+            passed=passed,
+            severity=Severity.OK if passed else rule.severity,
+            message=rule.message if not passed else "Validation passed",
+            details={"rule": rule.dict()} if not passed else None
+        ))
+    return results
+
+
+def measure(evaluate, messages):
+    start = time.perf_counter()
+    for message in messages:
+        evaluate(message)
+    elapsed = time.perf_counter() - start
+    return len(messages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--rule-counts", default="10,50,100,250,500,1000")
+    args = parser.parse_args()
+
+    messages = [make_message(i) for i in range(args.messages)]
+    rows = []
+    for count in [int(c) for c in args.rule_counts.split(",")]:
+        rules = make_rules(count)
+        plan = RulePlan(rules)
+        compiled = measure(plan.evaluate, messages)
+        legacy = measure(lambda m: legacy_evaluate(rules, m), messages)
+        rows.append({
+            "rules": count,
+            "compiled_msgs_per_sec": round(compiled),
+            "legacy_msgs_per_sec": round(legacy),
+            "speedup": round(compiled / legacy, 1),
+        })
+        print(f"{count:>6} rules  compiled {compiled:>10.0f} msg/s  legacy {legacy:>10.0f} msg/s  x{compiled / legacy:.1f}")
+
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
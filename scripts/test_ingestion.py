@@ -5,27 +5,42 @@ Works on both Windows and Linux/macOS
 """
 
 import requests
-import json
+import base64
+import struct
 import time
 import sys
+import uuid
 from datetime import datetime
 
 # Base URLs for services
 INGRESS_URL = "http://localhost:8000"
 VALIDATOR_URL = "http://localhost:8002"
 
+# Ingress wants a bearer token on every ingest call
+AUTH_HEADERS = {"Authorization": "Bearer test-token"}
+CHANNEL_ID = "TEST"
+
 def test_hl7_ingestion():
     """Test HL7 message ingestion"""
     print("Testing HL7 message ingestion...")
     
-    # Sample HL7 message
-    hl7_message = "MSH|^~\\&|SENDING_APP|SENDING_FAC|RECEIVING_APP|RECEIVING_FAC|20231201120000||ADT^A01|123456|P|2.5|||AL|AL|USA"
+    # Sample HL7 message, sent base64 encoded in a JSON envelope
+    hl7_message = "\r".join([
+        "MSH|^~\\&|SENDING_APP|SENDING_FAC|RECEIVING_APP|RECEIVING_FAC|20231201120000||ADT^A01|123456|P|2.5|||AL|AL|USA",
+        "EVN|A01|20231201120000",
+        "PID|1||12345^^^HOSP^MR||Test^Patient||19900101|M",
+        "PV1|1|I|WARD1^101^1"
+    ])
     
     try:
         response = requests.post(
             f"{INGRESS_URL}/ingest/hl7",
-            data=hl7_message,
-            headers={"Content-Type": "text/plain"}
+            json={
+                "channel_id": CHANNEL_ID,
+                "message_id": f"TEST-{uuid.uuid4()}",
+                "payload": base64.b64encode(hl7_message.encode("utf-8")).decode("ascii")
+            },
+            headers=AUTH_HEADERS
         )
         
         if response.status_code == 200:
@@ -101,24 +116,63 @@ def test_health_endpoints():
     
     return all_healthy
 
+def dicom_element(group, element, vr, value):
+    """Encode one explicit VR little endian data element"""
+    if len(value) % 2:
+        value += b"\0" if vr in ("UI", "OB") else b" "
+    if vr in ("OB", "OW"):
+        return struct.pack("<HH2sHI", group, element, vr.encode(), 0, len(value)) + value
+    return struct.pack("<HH2sH", group, element, vr.encode(), len(value)) + value
+
+def make_dicom(study_uid, series_uid, instance_uid, rows=16, columns=16):
+    """Build a small CT image as a DICOM Part 10 file"""
+    sop_class = b"1.2.840.10008.5.1.4.1.1.2"
+    meta = b"".join([
+        dicom_element(0x0002, 0x0001, "OB", b"\x00\x01"),
+        dicom_element(0x0002, 0x0002, "UI", sop_class),
+        dicom_element(0x0002, 0x0003, "UI", instance_uid.encode()),
+        dicom_element(0x0002, 0x0010, "UI", b"1.2.840.10008.1.2.1")
+    ])
+    dataset = b"".join([
+        dicom_element(0x0008, 0x0016, "UI", sop_class),
+        dicom_element(0x0008, 0x0018, "UI", instance_uid.encode()),
+        dicom_element(0x0008, 0x0020, "DA", b"20231201"),
+        dicom_element(0x0008, 0x0060, "CS", b"CT"),
+        dicom_element(0x0010, 0x0010, "PN", b"Test^Patient"),
+        dicom_element(0x0010, 0x0020, "LO", b"12345"),
+        dicom_element(0x0020, 0x000D, "UI", study_uid.encode()),
+        dicom_element(0x0020, 0x000E, "UI", series_uid.encode()),
+        dicom_element(0x0028, 0x0010, "US", struct.pack("<H", rows)),
+        dicom_element(0x0028, 0x0011, "US", struct.pack("<H", columns)),
+        dicom_element(0x0028, 0x0100, "US", struct.pack("<H", 8)),
+        dicom_element(0x7FE0, 0x0010, "OW", bytes(rows * columns))
+    ])
+    group_length = dicom_element(0x0002, 0x0000, "UL", struct.pack("<I", len(meta)))
+    return b"\0" * 128 + b"DICM" + group_length + meta + dataset
+
 def test_dicom_ingestion():
     """Test DICOM data ingestion"""
     print("\nTesting DICOM data ingestion...")
     
-    # Sample DICOM metadata (simplified)
-    dicom_data = {
-        "PatientID": "12345",
-        "PatientName": "Test^Patient",
-        "StudyInstanceUID": "1.2.840.113619.2.1.1.1.1.20231201.120000",
-        "Modality": "CT",
-        "StudyDate": "20231201"
-    }
+    # Minimal DICOM Part 10 file, streamed with its UIDs in X-* headers
+    study_uid = f"2.25.{uuid.uuid4().int}"
+    series_uid = f"2.25.{uuid.uuid4().int}"
+    instance_uid = f"2.25.{uuid.uuid4().int}"
+    dicom_file = make_dicom(study_uid, series_uid, instance_uid)
     
     try:
         response = requests.post(
-            f"{INGRESS_URL}/ingest/dicom",
-            json=dicom_data,
-            headers={"Content-Type": "application/json"}
+            f"{INGRESS_URL}/ingest/dicom/stream",
+            data=dicom_file,
+            headers={
+                **AUTH_HEADERS,
+                "Content-Type": "application/dicom",
+                "X-Channel-ID": CHANNEL_ID,
+                "X-Study-UID": study_uid,
+                "X-Series-UID": series_uid,
+                "X-Instance-UID": instance_uid,
+                "X-Modality": "CT"
+            }
         )
         
         if response.status_code == 200:
@@ -126,6 +180,7 @@ def test_dicom_ingestion():
             return True
         else:
             print(f"✗ DICOM ingestion failed with status code: {response.status_code}")
+            print(f"  Response: {response.text}")
             return False
     except Exception as e:
         print(f"✗ DICOM ingestion failed with error: {e}")
@@ -154,8 +209,13 @@ def test_fhir_ingestion():
     try:
         response = requests.post(
             f"{INGRESS_URL}/ingest/fhir",
-            json=fhir_patient,
-            headers={"Content-Type": "application/json"}
+            json={
+                "channel_id": CHANNEL_ID,
+                "resource_type": fhir_patient["resourceType"],
+                "resource_id": fhir_patient["id"],
+                "payload": fhir_patient
+            },
+            headers=AUTH_HEADERS
         )
         
         if response.status_code == 200:
@@ -163,6 +223,7 @@ def test_fhir_ingestion():
             return True
         else:
             print(f"✗ FHIR ingestion failed with status code: {response.status_code}")
+            print(f"  Response: {response.text}")
             return False
     except Exception as e:
         print(f"✗ FHIR ingestion failed with error: {e}")
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Critical paths and flame summaries of the slowest traced messages.
+
+Reads the span files the services write with TRACE_FILE (JSON lines, see
+services/common/tracing.py), groups the spans by trace and prints, for the
+slowest traces in the window, the critical path: where the end-to-end time
+went, span by span, along the chain of work the response waited for. The
+flame summary adds up the self time of every call stack over those traces,
+in the folded format flamegraph.pl and speedscope read.
+
+Usage: python3 scripts/trace_report.py traces/*.jsonl [--slowest 10] [--last 15m]
+                                       [--message MSG00001] [--folded] [--json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "service", "name", "start", "end", "message_id", "children")
+
+    def __init__(self, record):
+        self.span_id = record["span_id"]
+        self.parent_id = record.get("parent_id")
+        self.service = record.get("service") or ""
+        self.name = record["name"]
+        self.start = record["start_us"]
+        self.end = record["start_us"] + record["duration_us"]
+        self.message_id = record.get("message_id")
+        self.children = []
+
+    @property
+    def label(self):
+        # Request spans already name their service
+        if self.service and not self.name.startswith(self.service + " "):
+            return f"{self.service} {self.name}"
+        return self.name
+
+
+class Trace:
+    def __init__(self, trace_id, spans):
+        self.trace_id = trace_id
+        by_id = {span.span_id: span for span in spans}
+        self.roots = []
+        for span in sorted(spans, key=lambda s: s.start):
+            parent = by_id.get(span.parent_id)
+            (parent.children if parent is not None else self.roots).append(span)
+        self.start = min(span.start for span in spans)
+        self.end = max(span.end for span in spans)
+        named = [span.message_id for span in sorted(spans, key=lambda s: s.start) if span.message_id]
+        self.message_id = named[0] if named else None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def read_spans(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    traces[record["trace_id"]].append(Span(record))
+                except (ValueError, KeyError):
+                    # A line cut short by a crash
+                    continue
+    return [Trace(trace_id, spans) for trace_id, spans in traces.items()]
+
+
+def critical_path(span, limit):
+    """(span, microseconds) segments of the work span's end waited for,
+    latest first. A child that ended before a later one started is off
+    the path; clocks of different hosts may disagree, so children are
+    clipped to their parent."""
+    segments = []
+    cursor = min(span.end, limit)
+    for child in sorted(span.children, key=lambda c: c.end, reverse=True):
+        if child.start >= cursor or cursor <= span.start:
+            continue
+        child_end = min(child.end, cursor)
+        if child_end < cursor:
+            segments.append((span, cursor - child_end))
+        segments.extend(critical_path(child, child_end))
+        cursor = max(child.start, span.start)
+    if cursor > span.start:
+        segments.append((span, cursor - span.start))
+    return segments
+
+
+def trace_critical_path(trace):
+    """Critical path across the trace's roots, e.g. a request and the
+    queued task that continued it."""
+    segments = []
+    cursor = trace.end
+    for root in sorted(trace.roots, key=lambda s: s.end, reverse=True):
+        if root.start >= cursor:
+            continue
+        segments.extend(critical_path(root, cursor))
+        cursor = root.start
+    totals = defaultdict(int)
+    for span, micros in segments:
+        totals[span.label] += micros
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def self_time(span):
+    """span's duration minus the time covered by its children."""
+    covered, cursor = 0, span.start
+    for child in sorted(span.children, key=lambda c: c.start):
+        start, end = max(child.start, cursor), min(child.end, span.end)
+        if end > start:
+            covered += end - start
+            cursor = end
+    return max(0, span.end - span.start - covered)
+
+
+def fold(span, prefix, stacks):
+    stack = f"{prefix};{span.label}" if prefix else span.label
+    stacks[stack] += self_time(span)
+    for child in span.children:
+        fold(child, stack, stacks)
+
+
+def parse_age(value):
+    try:
+        return float(value[:-1]) * UNITS[value[-1]] if value[-1] in UNITS else float(value)
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError(f"expected a duration such as 90s, 15m or 2h, got {value!r}")
+
+
+def expand(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl"))))
+        else:
+            files.extend(sorted(glob.glob(path)) or [path])
+    return files
+
+
+def iso(micros):
+    return datetime.fromtimestamp(micros / 1e6, timezone.utc).isoformat(timespec="milliseconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("paths", nargs="+", help="span files or directories of them")
+    parser.add_argument("--slowest", type=int, default=10, help="number of traces to report")
+    parser.add_argument("--last", type=parse_age, help="only traces started in this window, e.g. 15m")
+    parser.add_argument("--message", help="only the traces of this message id")
+    parser.add_argument("--folded", action="store_true", help="print only the folded stacks")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    traces = read_spans(expand(args.paths))
+    if args.last is not None:
+        since = (time.time() - args.last) * 1e6
+        traces = [trace for trace in traces if trace.start >= since]
+    if args.message:
+        traces = [trace for trace in traces if trace.message_id == args.message]
+    slowest = sorted(traces, key=lambda t: t.duration, reverse=True)[:args.slowest]
+
+    stacks = defaultdict(int)
+    for trace in slowest:
+        for root in trace.roots:
+            fold(root, "", stacks)
+    folded = sorted(stacks.items(), key=lambda item: -item[1])
+
+    if args.folded:
+        for stack, micros in folded:
+            print(f"{stack} {micros}")
+        return 0
+
+    report = []
+    for trace in slowest:
+        path = trace_critical_path(trace)
+        report.append({
+            "trace_id": trace.trace_id,
+            "message_id": trace.message_id,
+            "start": iso(trace.start),
+            "duration_ms": trace.duration / 1000,
+            "critical_path": [
+                {"span": label, "ms": micros / 1000, "share": round(micros / max(trace.duration, 1), 4)}
+                for label, micros in path
+            ],
+        })
+    if args.json:
+        print(json.dumps({"traces": len(traces), "slowest": report,
+                          "folded": {stack: micros for stack, micros in folded}}, indent=2))
+        return 0
+
+    print(f"Slowest {len(slowest)} of {len(traces)} traces")
+    for rank, trace in enumerate(report, 1):
+        print(f"\n{rank}. {trace['message_id'] or '(no message id)'}  {trace['duration_ms']:.1f} ms"
+              f"  trace {trace['trace_id']}  {trace['start']}")
+        for segment in trace["critical_path"]:
+            print(f"   {segment['share'] * 100:5.1f}%  {segment['ms']:9.2f} ms  {segment['span']}")
+    if folded:
+        print("\nSelf time by call stack, slowest traces together:")
+        for stack, micros in folded[:30]:
+            print(f"  {micros / 1000:9.2f} ms  {stack}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
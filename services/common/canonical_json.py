@@ -0,0 +1,123 @@
+"""Canonical JSON (RFC 8785, JCS) and the payload digest of the hash chain.
+
+`sha256_payload` is the SHA-256 of the canonical form of `parsed_data`:
+object keys sorted by their UTF-16 code units, no whitespace, strings
+escaped as ECMAScript's JSON.stringify does and numbers formatted as
+ECMAScript's Number.prototype.toString. The hash writer implements the
+same rules (canonical.go), so either side computes the same digest;
+tests/canonical_json_vectors.json holds the vectors both test suites
+check.
+
+The canonical text is produced piece by piece and fed to the hash in
+bounded chunks, so a large resource is never serialized as one string.
+"""
+import hashlib
+import math
+from json.encoder import encode_basestring
+from typing import Any, Iterator
+
+# Digest of the canonical parsed data, or of the message bytes as received
+ENCODING_CANONICAL = "jcs"
+ENCODING_RAW = "raw"
+
+_HASH_CHUNK = 64 * 1024
+# Integers up to 2**53 are exact doubles and print as their digits
+_MAX_EXACT_INT = 2 ** 53
+
+
+def format_number(value: float) -> str:
+    """Formats a number as ECMAScript's Number.prototype.toString."""
+    if isinstance(value, int) and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT:
+        return str(value)
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError("NaN and Infinity are not valid JSON numbers")
+    if value == 0:
+        return "0"
+    sign = "-" if value < 0 else ""
+    # repr gives the shortest digits that round-trip, as ECMAScript requires
+    mantissa, _, exponent = repr(abs(value)).partition("e")
+    integer, _, fraction = mantissa.partition(".")
+    digits = integer + fraction
+    # The value is 0.digits * 10**n
+    n = len(integer) + (int(exponent) if exponent else 0)
+    stripped = digits.lstrip("0")
+    n -= len(digits) - len(stripped)
+    digits = stripped.rstrip("0")
+    k = len(digits)
+    if k <= n <= 21:
+        return sign + digits + "0" * (n - k)
+    if 0 < n <= 21:
+        return sign + digits[:n] + "." + digits[n:]
+    if -6 < n <= 0:
+        return sign + "0." + "0" * -n + digits
+    e = n - 1
+    exp = ("e+" if e >= 0 else "e-") + str(abs(e))
+    if k == 1:
+        return sign + digits + exp
+    return sign + digits[0] + "." + digits[1:] + exp
+
+
+def _key_order(key: str) -> bytes:
+    # Big-endian UTF-16 bytes compare as the code units do
+    return key.encode("utf-16-be")
+
+
+def iter_canonical(value: Any) -> Iterator[str]:
+    """Yields the canonical JSON text of value in pieces."""
+    if value is None:
+        yield "null"
+    elif value is True:
+        yield "true"
+    elif value is False:
+        yield "false"
+    elif isinstance(value, str):
+        yield encode_basestring(value)
+    elif isinstance(value, (int, float)):
+        yield format_number(value)
+    elif isinstance(value, dict):
+        yield "{"
+        keys = list(value)
+        if not all(isinstance(key, str) for key in keys):
+            raise TypeError("object keys must be strings")
+        keys.sort(key=None if all(key.isascii() for key in keys) else _key_order)
+        for i, key in enumerate(keys):
+            if i:
+                yield ","
+            yield encode_basestring(key)
+            yield ":"
+            yield from iter_canonical(value[key])
+        yield "}"
+    elif isinstance(value, (list, tuple)):
+        yield "["
+        for i, item in enumerate(value):
+            if i:
+                yield ","
+            yield from iter_canonical(item)
+        yield "]"
+    else:
+        raise TypeError(f"{type(value).__name__} is not a JSON value")
+
+
+def canonical_json(value: Any) -> str:
+    return "".join(iter_canonical(value))
+
+
+def canonical_sha256(value: Any) -> str:
+    """SHA-256 of the canonical JSON text of value, as hex."""
+    digest = hashlib.sha256()
+    pieces = []
+    size = 0
+    for piece in iter_canonical(value):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= _HASH_CHUNK:
+            digest.update("".join(pieces).encode("utf-8"))
+            pieces.clear()
+            size = 0
+    digest.update("".join(pieces).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def raw_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
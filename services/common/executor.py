@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from prometheus_client import Gauge, Histogram
+
+from common import instrumentation
+
+logger = logging.getLogger(__name__)
+
+QUEUE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+executor_queued = Gauge(
+    "executor_queued_tasks",
+    "Calls waiting for an in-flight slot",
+    ["executor"]
+)
+executor_in_flight = Gauge(
+    "executor_in_flight_tasks",
+    "Calls handed to the pool, queued there or running",
+    ["executor"]
+)
+executor_queue_seconds = Histogram(
+    "executor_queue_seconds",
+    "Time from the call until a worker starts it",
+    ["executor", "task"],
+    buckets=QUEUE_BUCKETS
+)
+executor_run_seconds = Histogram(
+    "executor_run_seconds",
+    "Time a worker spends on a call",
+    ["executor", "task"]
+)
+
+
+def _timed(fn: Callable, args: tuple, kwargs: dict):
+    # Runs in the worker; wall-clock start so queue time spans processes.
+    # Stages timed by fn come back with the result to be observed here.
+    started = time.time()
+    token = instrumentation.start_buffer()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        timings = instrumentation.finish_buffer(token)
+    return started, time.time() - started, result, timings
+
+
+class BoundedExecutor:
+    """Runs blocking calls off the event loop with bounded in-flight work.
+
+    `kind` is "process" (ProcessPoolExecutor, for GIL-bound work such as
+    parsing), "thread" (for calls that mostly release the GIL, e.g.
+    hashing) or "inline" (call directly on the loop). At most
+    `workers * inflight_per_worker` calls are handed to the pool at once;
+    further callers wait for a slot, and that wait counts as time in queue.
+    Defaults come from <NAME>_EXECUTOR, <NAME>_WORKERS and
+    <NAME>_INFLIGHT_PER_WORKER. Functions and arguments given to a process
+    pool must be picklable and importable by the workers.
+    """
+
+    def __init__(self, name: str, default_kind: str = "process", workers: Optional[int] = None,
+                 inflight_per_worker: Optional[int] = None):
+        prefix = name.upper()
+        self.name = name
+        self.kind = os.getenv(f"{prefix}_EXECUTOR", default_kind).lower()
+        if self.kind not in ("process", "thread", "inline"):
+            raise ValueError(f"Unknown executor kind for {name}: {self.kind}")
+        self.workers = workers or int(os.getenv(f"{prefix}_WORKERS", "0")) or os.cpu_count() or 1
+        self.inflight_per_worker = inflight_per_worker or int(os.getenv(f"{prefix}_INFLIGHT_PER_WORKER", "2"))
+        # forkserver: workers must not inherit the event loop or open sockets
+        self.start_method = os.getenv(f"{prefix}_START_METHOD", "forkserver")
+        self._pool: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._queued = executor_queued.labels(name)
+        self._in_flight = executor_in_flight.labels(name)
+
+    @property
+    def max_in_flight(self) -> int:
+        return self.workers * self.inflight_per_worker
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method)
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            logger.info(f"Started {self.kind} executor {self.name} ({self.workers} workers, "
+                        f"{self.max_in_flight} in flight)")
+        return self._pool
+
+    async def run(self, fn: Callable, *args, task: str = "default", **kwargs) -> Any:
+        if self.kind == "inline":
+            started, duration, result, timings = _timed(fn, args, kwargs)
+            executor_run_seconds.labels(self.name, task).observe(duration)
+            instrumentation.replay(timings)
+            return result
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        submitted = time.time()
+        self._queued.inc()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued.dec()
+        self._in_flight.inc()
+        try:
+            started, duration, result, timings = await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), _timed, fn, args, kwargs
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); start a fresh pool for later calls
+            logger.error(f"Executor {self.name} lost a worker process; restarting pool")
+            self._pool = None
+            raise
+        finally:
+            self._in_flight.dec()
+            self._slots.release()
+        executor_queue_seconds.labels(self.name, task).observe(max(0.0, started - submitted))
+        executor_run_seconds.labels(self.name, task).observe(duration)
+        instrumentation.replay(timings)
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,158 @@
+import os
+import logging
+from typing import Dict, Optional
+
+import httpx
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from common import tracing
+from common.instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class ServiceClient:
+    """Long-lived pooled httpx client for calls to one downstream service.
+
+    Pool limits and timeouts come from HTTP_* environment variables. The
+    client is opened on app startup and closed on shutdown; `client` opens
+    it lazily so code paths that run without lifespan events still work.
+    """
+
+    def __init__(self, name: str, base_url: str):
+        self.name = name
+        self.base_url = base_url
+        self.max_connections = _env_int("HTTP_MAX_CONNECTIONS", 100)
+        self.max_keepalive_connections = _env_int("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+        self.keepalive_expiry = _env_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+        self.connect_timeout = _env_float("HTTP_CONNECT_TIMEOUT", 5.0)
+        self.read_timeout = _env_float("HTTP_READ_TIMEOUT", 30.0)
+        self.write_timeout = _env_float("HTTP_WRITE_TIMEOUT", 30.0)
+        self.pool_timeout = _env_float("HTTP_POOL_TIMEOUT", 5.0)
+        self.http2 = _env_bool("HTTP2_ENABLED", False)
+        self._client: Optional[httpx.AsyncClient] = None
+        _pool_collector.register(self)
+
+    def _build(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=self.connect_timeout,
+                read=self.read_timeout,
+                write=self.write_timeout,
+                pool=self.pool_timeout,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build()
+        return self._client
+
+    async def start(self):
+        self.client
+        logger.info(
+            f"HTTP pool for {self.name} -> {self.base_url} "
+            f"(max_connections={self.max_connections}, http2={self.http2})"
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        # Round trip to the downstream service, including its own handling;
+        # the service continues the trace as a child of this span
+        with stage(f"forward.{self.name}"):
+            header = tracing.traceparent()
+            if header:
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), "traceparent": header}
+            return await self.client.post(url, **kwargs)
+
+    def pool_stats(self) -> Dict[str, int]:
+        stats = {"open": 0, "idle": 0, "active": 0, "http2": 0, "queued_requests": 0}
+        if self._client is None:
+            return stats
+        # httpx does not expose its pool publicly; httpcore's pool does.
+        pool = getattr(self._client._transport, "_pool", None)
+        if pool is None:
+            return stats
+        for connection in pool.connections:
+            if connection.is_closed():
+                continue
+            stats["open"] += 1
+            if connection.is_idle():
+                stats["idle"] += 1
+            else:
+                stats["active"] += 1
+            if "HTTP/2" in connection.info():
+                stats["http2"] += 1
+        stats["queued_requests"] = sum(
+            1 for request in getattr(pool, "_requests", ()) if request.is_queued()
+        )
+        return stats
+
+
+class _PoolStatsCollector:
+    """Reports pool stats of every ServiceClient at scrape time."""
+
+    def __init__(self):
+        self._clients: Dict[str, ServiceClient] = {}
+
+    def register(self, service_client: ServiceClient):
+        self._clients[service_client.name] = service_client
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            "http_pool_connections",
+            "Connections held by the outbound HTTP pool",
+            labels=["target", "state"],
+        )
+        queued = GaugeMetricFamily(
+            "http_pool_queued_requests",
+            "Requests waiting for a pooled connection",
+            labels=["target"],
+        )
+        limit = GaugeMetricFamily(
+            "http_pool_max_connections",
+            "Configured connection limit of the outbound HTTP pool",
+            labels=["target"],
+        )
+        for name, service_client in self._clients.items():
+            stats = service_client.pool_stats()
+            for state in ("open", "idle", "active", "http2"):
+                connections.add_metric([name, state], stats[state])
+            queued.add_metric([name], stats["queued_requests"])
+            limit.add_metric([name], service_client.max_connections)
+        yield connections
+        yield queued
+        yield limit
+
+
+_pool_collector = _PoolStatsCollector()
+REGISTRY.register(_pool_collector)
@@ -0,0 +1,150 @@
+"""Per-stage latency histograms shared by the Python services.
+
+Each hot-path stage (decode, parse, payload hash, rule evaluation, the
+forward to the next service, ...) is timed into `stage_seconds{stage}`.
+Observations carry the message id as an OpenMetrics exemplar, so a slow
+bucket links to a message that can be followed through every service's
+histograms and logs. Exemplars are only exposed in the OpenMetrics format,
+which `metrics_payload` serves when the scraper asks for it.
+
+Stages timed inside executor workers are buffered per call and handed back
+with the result (see common.executor), because observations made in a
+worker process would never be scraped. Stages are also spans of the
+message's trace when it is recorded (see common.tracing).
+
+A timed stage costs two perf_counter calls and one histogram observation,
+a few microseconds with its exemplar (scripts/bench_instrumentation.py
+measures it), against milliseconds per message. Per-rule timing multiplies
+that by the rule count, so only RULE_TIMING_SAMPLE_RATE of the messages pay
+for it. INSTRUMENTATION=off turns stage timing into a no-op to measure its
+overhead.
+"""
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics
+
+from common import tracing
+
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ENABLED = os.getenv("INSTRUMENTATION", "on").lower() not in ("0", "off", "false", "no")
+RULE_TIMING_SAMPLE_RATE = float(os.getenv("RULE_TIMING_SAMPLE_RATE", "0.01"))
+# OpenMetrics limits an exemplar's labels to 128 characters
+_MAX_EXEMPLAR_ID = 100
+
+stage_seconds = Histogram(
+    "stage_seconds",
+    "Time spent in one stage of handling a message",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+rule_eval_seconds = Histogram(
+    "rule_eval_seconds",
+    "Time to evaluate one validation rule, for a sample of messages",
+    ["rule"],
+    buckets=STAGE_BUCKETS
+)
+
+# (stage, seconds, message id, wall-clock end) observed in an executor worker
+StageTimings = List[Tuple[str, float, Optional[str], float]]
+
+# Message being handled by the current request or task
+_message_id: ContextVar[Optional[str]] = ContextVar("message_id", default=None)
+# Set while an executor call runs; stages are buffered instead of observed
+_buffer: ContextVar[Optional[StageTimings]] = ContextVar("stage_buffer", default=None)
+_children: Dict[Tuple[Histogram, str], object] = {}
+
+
+def bind_message_id(message_id: Optional[str]):
+    """Makes message_id the exemplar of stages observed in this context and
+    names it in the request's span."""
+    _message_id.set(message_id)
+    tracing.annotate(message_id)
+
+
+def current_message_id() -> Optional[str]:
+    return _message_id.get()
+
+
+def _child(histogram: Histogram, label: str):
+    child = _children.get((histogram, label))
+    if child is None:
+        child = _children[(histogram, label)] = histogram.labels(label)
+    return child
+
+
+def observe(stage: str, seconds: float, message_id: Optional[str] = None):
+    buffer = _buffer.get()
+    if buffer is not None:
+        buffer.append((stage, seconds, message_id, time.time()))
+        return
+    message_id = message_id or _message_id.get()
+    if message_id:
+        _child(stage_seconds, stage).observe(seconds, {"message_id": message_id[:_MAX_EXEMPLAR_ID]})
+    else:
+        _child(stage_seconds, stage).observe(seconds)
+
+
+class stage:
+    """Times a block: `with stage("hl7.parse", message_id): ...`"""
+
+    __slots__ = ("name", "message_id", "started", "span")
+
+    def __init__(self, name: str, message_id: Optional[str] = None):
+        self.name = name
+        self.message_id = message_id
+
+    def __enter__(self):
+        # Buffered stages become spans when replayed
+        self.span = tracing.start_span(self.name, self.message_id) if _buffer.get() is None else None
+        self.started = time.perf_counter() if ENABLED else 0.0
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            observe(self.name, time.perf_counter() - self.started, self.message_id)
+        if self.span is not None:
+            tracing.end_span(self.span)
+        return False
+
+
+def start_buffer() -> object:
+    """Buffers the stages of the current call; see `finish_buffer`."""
+    return _buffer.set([])
+
+
+def finish_buffer(token) -> StageTimings:
+    timings = _buffer.get() or []
+    _buffer.reset(token)
+    return timings
+
+
+def replay(timings: StageTimings):
+    """Observes stages buffered in a worker."""
+    for name, seconds, message_id, ended in timings:
+        observe(name, seconds, message_id)
+        tracing.record_span(name, ended, seconds, message_id)
+
+
+def sample_rules() -> bool:
+    return ENABLED and RULE_TIMING_SAMPLE_RATE > 0 and random.random() < RULE_TIMING_SAMPLE_RATE
+
+
+def observe_rule(rule_id: str, seconds: float):
+    message_id = _message_id.get()
+    exemplar = {"message_id": message_id[:_MAX_EXEMPLAR_ID]} if message_id else None
+    _child(rule_eval_seconds, rule_id).observe(seconds, exemplar)
+
+
+def metrics_payload(accept: Optional[str]) -> Tuple[bytes, str]:
+    """The registry in the format the scraper accepts: OpenMetrics, with
+    exemplars, or the Prometheus text format."""
+    if accept and "application/openmetrics-text" in accept:
+        return openmetrics.generate_latest(REGISTRY), openmetrics.CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
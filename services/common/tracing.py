@@ -0,0 +1,239 @@
+"""W3C trace context propagation and a local span collector.
+
+A request entering a service continues the trace in its `traceparent`
+header, or starts one with probability TRACE_SAMPLE_RATE. The request and
+every `instrumentation.stage` inside it become spans; ServiceClient passes
+the current span on to the next service, so one message's trace covers
+ingress, parser, validator and hash writer.
+
+Sampled spans are appended as JSON lines to TRACE_FILE, one file per
+service, and read back by scripts/trace_report.py. Without TRACE_FILE the
+service records nothing but still passes the trace on.
+"""
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# Scrapes and probes are not worth a trace
+UNTRACED_PATHS = ("/metrics", "/health")
+
+
+class Span:
+    """A span of the current trace. Remote parents, read from a header,
+    are not recorded here."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "name", "start_ns", "message_id", "token")
+
+    def __init__(self, trace_id: str, span_id: str, parent_id: Optional[str], sampled: bool,
+                 name: Optional[str] = None, message_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.message_id = message_id
+        self.start_ns = time.time_ns()
+        self.token = None
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class SpanWriter:
+    """Appends spans to a JSON lines file in batches.
+
+    Each flush is one write to a file opened for appending, so lines from
+    the processes sharing a file stay whole. Spans are flushed every
+    `max_spans` spans and at least once per `interval` seconds.
+    """
+
+    def __init__(self, path: str, max_spans: int = 256, interval: float = 1.0):
+        self.path = path
+        self.max_spans = max_spans
+        self.interval = interval
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            self._pending.append(line)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+            if len(self._pending) < self.max_spans:
+                return
+            lines, self._pending = self._pending, []
+        self._append(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._pending = self._pending, []
+        if lines:
+            self._append(lines)
+
+    def _append(self, lines: List[str]):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+_writer: Optional[SpanWriter] = SpanWriter(TRACE_FILE) if TRACE_FILE else None
+_service = ""
+
+
+def configure(path: Optional[str]):
+    """Writes spans to path from now on, or nowhere when it is empty."""
+    global _writer
+    if _writer is not None:
+        _writer.flush()
+    _writer = SpanWriter(path) if path else None
+
+
+def set_service(service: str):
+    global _service
+    _service = service
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+def _is_hex(value: str, length: int) -> bool:
+    return len(value) == length and value.strip("0123456789abcdef") == "" and value.strip("0") != ""
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Span]:
+    """The remote parent in a traceparent header, if the header is valid."""
+    if not value:
+        return None
+    parts = value.strip().lower().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff" or (parts[0] == "00" and len(parts) != 4):
+        return None
+    version, trace_id, span_id, flags = parts[:4]
+    if not (_is_hex(trace_id, 32) and _is_hex(span_id, 16) and len(flags) == 2):
+        return None
+    try:
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    return Span(trace_id, span_id, None, sampled)
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+def traceparent() -> Optional[str]:
+    """The header that makes a downstream call a child of the current span."""
+    span = _current.get()
+    return span.traceparent() if span is not None else None
+
+
+def start_trace(name: str, header: Optional[str] = None, message_id: Optional[str] = None) -> Span:
+    """Starts the span of a request or queued task, continuing the trace in
+    header or starting a new one. End it with `end_span`."""
+    parent = parse_traceparent(header)
+    if parent is None:
+        span = Span(_new_id(128), _new_id(64), None, random.random() < TRACE_SAMPLE_RATE, name, message_id)
+    else:
+        span = Span(parent.trace_id, _new_id(64), parent.span_id, parent.sampled, name, message_id)
+    span.token = _current.set(span)
+    return span
+
+
+def start_span(name: str, message_id: Optional[str] = None) -> Optional[Span]:
+    """Starts a child of the current span if it is recorded here."""
+    parent = _current.get()
+    if parent is None or not parent.sampled or _writer is None:
+        return None
+    span = Span(parent.trace_id, _new_id(64), parent.span_id, True, name, message_id)
+    span.token = _current.set(span)
+    return span
+
+
+def _record(span: Span, end_ns: int):
+    _writer.write({
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "service": _service,
+        "name": span.name,
+        "start_us": span.start_ns // 1000,
+        "duration_us": max(0, end_ns - span.start_ns) // 1000,
+        "message_id": span.message_id,
+    })
+
+
+def end_span(span: Span):
+    end_ns = time.time_ns()
+    _current.reset(span.token)
+    if span.sampled and _writer is not None:
+        _record(span, end_ns)
+
+
+def record_span(name: str, ended: float, seconds: float, message_id: Optional[str] = None):
+    """Records a finished child of the current span, e.g. a stage that ran
+    in an executor worker."""
+    parent = _current.get()
+    if parent is None or not parent.sampled or _writer is None:
+        return
+    span = Span(parent.trace_id, _new_id(64), parent.span_id, True, name, message_id)
+    end_ns = int(ended * 1e9)
+    span.start_ns = end_ns - int(seconds * 1e9)
+    _record(span, end_ns)
+
+
+def annotate(message_id: Optional[str]):
+    """Names the message the current span handles, unless already named."""
+    span = _current.get()
+    if span is not None and span.name is not None and not span.message_id:
+        span.message_id = message_id
+
+
+class TraceMiddleware:
+    """ASGI middleware running each request in a span named after the
+    service and route."""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+        set_service(service)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        header = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                header = value.decode("latin-1")
+                break
+        span = start_trace(f"{self.service} {scope['method']} {scope['path']}", header)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            end_span(span)
+
+
+@atexit.register
+def _flush():
+    if _writer is not None:
+        _writer.flush()
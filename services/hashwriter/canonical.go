@@ -0,0 +1,207 @@
+package main
+
+import (
+	"bufio"
+	"crypto/sha256"
+	"encoding/hex"
+	"fmt"
+	"math"
+	"sort"
+	"strconv"
+	"strings"
+	"unicode/utf16"
+	"unicode/utf8"
+)
+
+// Payload digests are the SHA-256 of the canonical JSON of the parsed data
+// (RFC 8785, JCS), or of the raw message bytes when the sender says so.
+// common/canonical_json.py implements the same canonical form for the
+// Python services; tests/canonical_json_vectors.json is checked by both.
+const (
+	PayloadEncodingCanonical = "jcs"
+	PayloadEncodingRaw       = "raw"
+)
+
+// canonicalSHA256 streams the canonical JSON of v into SHA-256, without
+// building the serialized text. v holds what encoding/json decodes into
+// an interface{}: maps, slices, strings, float64, bool and nil.
+func canonicalSHA256(v interface{}) (string, error) {
+	h := sha256.New()
+	w := bufio.NewWriterSize(h, 32<<10)
+	if err := writeCanonical(w, v); err != nil {
+		return "", err
+	}
+	if err := w.Flush(); err != nil {
+		return "", err
+	}
+	return hex.EncodeToString(h.Sum(nil)), nil
+}
+
+func writeCanonical(w *bufio.Writer, v interface{}) error {
+	switch v := v.(type) {
+	case nil:
+		w.WriteString("null")
+	case bool:
+		if v {
+			w.WriteString("true")
+		} else {
+			w.WriteString("false")
+		}
+	case string:
+		writeCanonicalString(w, v)
+	case float64:
+		s, err := formatNumber(v)
+		if err != nil {
+			return err
+		}
+		w.WriteString(s)
+	case int:
+		return writeCanonical(w, float64(v))
+	case int64:
+		return writeCanonical(w, float64(v))
+	case map[string]interface{}:
+		keys := make([]string, 0, len(v))
+		for key := range v {
+			keys = append(keys, key)
+		}
+		sortUTF16(keys)
+		w.WriteByte('{')
+		for i, key := range keys {
+			if i > 0 {
+				w.WriteByte(',')
+			}
+			writeCanonicalString(w, key)
+			w.WriteByte(':')
+			if err := writeCanonical(w, v[key]); err != nil {
+				return err
+			}
+		}
+		w.WriteByte('}')
+	case []interface{}:
+		w.WriteByte('[')
+		for i, item := range v {
+			if i > 0 {
+				w.WriteByte(',')
+			}
+			if err := writeCanonical(w, item); err != nil {
+				return err
+			}
+		}
+		w.WriteByte(']')
+	default:
+		return fmt.Errorf("%T is not a JSON value", v)
+	}
+	return nil
+}
+
+const hexDigits = "0123456789abcdef"
+
+// writeCanonicalString escapes as ECMAScript's JSON.stringify: quote,
+// backslash and control characters only, everything else as UTF-8.
+func writeCanonicalString(w *bufio.Writer, s string) {
+	w.WriteByte('"')
+	start := 0
+	for i := 0; i < len(s); i++ {
+		c := s[i]
+		if c >= 0x20 && c != '"' && c != '\\' {
+			continue
+		}
+		w.WriteString(s[start:i])
+		switch c {
+		case '"', '\\':
+			w.WriteByte('\\')
+			w.WriteByte(c)
+		case '\b':
+			w.WriteString(`\b`)
+		case '\f':
+			w.WriteString(`\f`)
+		case '\n':
+			w.WriteString(`\n`)
+		case '\r':
+			w.WriteString(`\r`)
+		case '\t':
+			w.WriteString(`\t`)
+		default:
+			w.WriteString(`\u00`)
+			w.WriteByte(hexDigits[c>>4])
+			w.WriteByte(hexDigits[c&0xf])
+		}
+		start = i + 1
+	}
+	w.WriteString(s[start:])
+	w.WriteByte('"')
+}
+
+// sortUTF16 orders keys by their UTF-16 code units, which differs from
+// byte order only for characters above U+FFFF.
+func sortUTF16(keys []string) {
+	sort.Slice(keys, func(i, j int) bool { return lessUTF16(keys[i], keys[j]) })
+}
+
+func lessUTF16(a, b string) bool {
+	for a != "" && b != "" {
+		ra, na := utf8.DecodeRuneInString(a)
+		rb, nb := utf8.DecodeRuneInString(b)
+		if ra != rb {
+			return utf16Unit(ra) < utf16Unit(rb) || (utf16Unit(ra) == utf16Unit(rb) && ra < rb)
+		}
+		a, b = a[na:], b[nb:]
+	}
+	return len(a) < len(b)
+}
+
+// utf16Unit is the first UTF-16 code unit of r.
+func utf16Unit(r rune) rune {
+	if r >= 0x10000 {
+		high, _ := utf16.EncodeRune(r)
+		return high
+	}
+	return r
+}
+
+// formatNumber formats f as ECMAScript's Number.prototype.toString.
+func formatNumber(f float64) (string, error) {
+	if math.IsNaN(f) || math.IsInf(f, 0) {
+		return "", fmt.Errorf("%v is not a valid JSON number", f)
+	}
+	if f == 0 {
+		return "0", nil
+	}
+	sign := ""
+	if f < 0 {
+		sign, f = "-", -f
+	}
+	// Shortest round-trip digits as d.ddde±x
+	mantissa, exponent, _ := strings.Cut(strconv.FormatFloat(f, 'e', -1, 64), "e")
+	digits := strings.Replace(mantissa, ".", "", 1)
+	exp, _ := strconv.Atoi(exponent)
+	// The value is 0.digits * 10^n
+	n := exp + 1
+	k := len(digits)
+	switch {
+	case k <= n && n <= 21:
+		return sign + digits + strings.Repeat("0", n-k), nil
+	case 0 < n && n <= 21:
+		return sign + digits[:n] + "." + digits[n:], nil
+	case -6 < n && n <= 0:
+		return sign + "0." + strings.Repeat("0", -n) + digits, nil
+	}
+	e := n - 1
+	expPart := "e+" + strconv.Itoa(e)
+	if e < 0 {
+		expPart = "e-" + strconv.Itoa(-e)
+	}
+	if k == 1 {
+		return sign + digits + expPart, nil
+	}
+	return sign + digits[:1] + "." + digits[1:] + expPart, nil
+}
+
+// validDigest reports whether s is a hex SHA-256 digest.
+func validDigest(s string) bool {
+	if len(s) != sha256.Size*2 {
+		return false
+	}
+	_, err := hex.DecodeString(s)
+	return err == nil
+}
@@ -0,0 +1,80 @@
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"encoding/json"
+	"os"
+	"testing"
+	"time"
+)
+
+// The vectors shared with the Python implementation
+const canonicalVectorsPath = "../../tests/canonical_json_vectors.json"
+
+func TestCanonicalJSONMatchesSharedVectors(t *testing.T) {
+	data, err := os.ReadFile(canonicalVectorsPath)
+	if err != nil {
+		t.Fatal(err)
+	}
+	var file struct {
+		Vectors []struct {
+			Name      string `json:"name"`
+			Input     string `json:"input"`
+			Canonical string `json:"canonical"`
+			SHA256    string `json:"sha256"`
+		} `json:"vectors"`
+	}
+	if err := json.Unmarshal(data, &file); err != nil {
+		t.Fatal(err)
+	}
+	if len(file.Vectors) == 0 {
+		t.Fatal("no vectors")
+	}
+	for _, vector := range file.Vectors {
+		var value interface{}
+		if err := json.Unmarshal([]byte(vector.Input), &value); err != nil {
+			t.Fatalf("%s: %v", vector.Name, err)
+		}
+		var buf bytes.Buffer
+		w := bufio.NewWriter(&buf)
+		if err := writeCanonical(w, value); err != nil {
+			t.Fatalf("%s: %v", vector.Name, err)
+		}
+		w.Flush()
+		if buf.String() != vector.Canonical {
+			t.Errorf("%s: got %s, want %s", vector.Name, buf.String(), vector.Canonical)
+		}
+		if digest, _ := canonicalSHA256(value); digest != vector.SHA256 {
+			t.Errorf("%s: digest %s, want %s", vector.Name, digest, vector.SHA256)
+		}
+	}
+}
+
+func TestNewEntryPayloadDigest(t *testing.T) {
+	req := HashRequest{
+		MessageID:  "m1",
+		Timestamp:  time.Date(2023, 12, 1, 12, 0, 0, 0, time.UTC),
+		ParsedData: map[string]interface{}{"b": 1.0, "a": "x"},
+	}
+	entry, err := newEntry(req)
+	if err != nil || entry.SHA256Payload != sha256Hex([]byte(`{"a":"x","b":1}`)) ||
+		entry.PayloadEncoding != PayloadEncodingCanonical {
+		t.Fatalf("canonical digest: %+v (%v)", entry, err)
+	}
+
+	req.PayloadSHA256, req.PayloadEncoding = sha256Hex([]byte("MSH|...")), PayloadEncodingRaw
+	entry, err = newEntry(req)
+	if err != nil || entry.SHA256Payload != req.PayloadSHA256 || entry.PayloadEncoding != PayloadEncodingRaw {
+		t.Fatalf("sender digest not used: %+v (%v)", entry, err)
+	}
+
+	req.PayloadSHA256 = "not a digest"
+	if _, err := newEntry(req); err == nil {
+		t.Fatal("invalid digest accepted")
+	}
+	req.PayloadSHA256 = ""
+	if _, err := newEntry(req); err == nil {
+		t.Fatal("raw encoding without a digest accepted")
+	}
+}
@@ -0,0 +1,390 @@
+package main
+
+import (
+	"context"
+	"crypto/sha256"
+	"encoding/hex"
+	"errors"
+	"fmt"
+	"log"
+	"strings"
+	"sync"
+	"time"
+)
+
+// GenesisHash is the prevHash of the first entry in a chain.
+const GenesisHash = "0000000000000000000000000000000000000000000000000000000000000000"
+
+// EntryStore persists committed chain entries.
+type EntryStore interface {
+	// WriteEntries stores entries in one round trip, without waiting for
+	// them to become searchable. It returns one error per entry (nil on
+	// success), or a single error when nothing was stored. An entry whose
+	// message id is already stored fails with a *DuplicateEntryError and
+	// leaves the stored entry as it is, unless its id is in overwrite.
+	WriteEntries(ctx context.Context, entries []HashEntry, overwrite map[string]bool) ([]error, error)
+}
+
+// DuplicateEntryError reports a message id that is already committed,
+// e.g. a message redelivered after a crash between commit and ack.
+type DuplicateEntryError struct {
+	Entry HashEntry
+}
+
+func (e *DuplicateEntryError) Error() string {
+	return fmt.Sprintf("message %s is already committed at seq %d", e.Entry.MessageID, e.Entry.Seq)
+}
+
+// Archiver receives entries after they are committed, off the commit path.
+type Archiver interface {
+	Archive(entries []HashEntry)
+}
+
+// multiArchiver hands committed entries to each archiver in turn.
+type multiArchiver []Archiver
+
+func (m multiArchiver) Archive(entries []HashEntry) {
+	for _, archiver := range m {
+		archiver.Archive(entries)
+	}
+}
+
+// CommitResult is the outcome of one submitted request.
+type CommitResult struct {
+	Entry HashEntry
+	Err   error
+}
+
+type commitGroup struct {
+	entries []HashEntry
+	results []CommitResult
+	done    chan struct{}
+	queued  time.Time
+	trace   SpanContext
+}
+
+// Committer appends entries to the hash chain in group commits.
+//
+// Submitters queue groups of entries whose payload hashes are already
+// computed. One goroutine takes queued groups in arrival order until
+// maxBatch entries or the linger time is reached, chains them in memory
+// and stores the batch with one WriteEntries call. A group is never split
+// across batches, so a /hash/batch request stays adjacent in the chain.
+// If the store rejects an entry, the entries before it are committed, the
+// rejected one fails and the rest are re-chained onto the last committed
+// hash and written again, so the chain never links to a lost entry. A
+// message id that is already stored is handled the same way, except that
+// its submitter gets the stored entry back: a redelivered message is
+// committed once.
+type Committer struct {
+	store    EntryStore
+	archiver Archiver
+	headLog  HeadLog
+	maxBatch int
+	linger   time.Duration
+	queue    chan *commitGroup
+	carry    *commitGroup
+
+	headMu sync.RWMutex
+	head   ChainHead
+}
+
+func NewCommitter(store EntryStore, archiver Archiver, headLog HeadLog, head ChainHead, maxBatch int, linger time.Duration) *Committer {
+	if maxBatch < 1 {
+		maxBatch = 1
+	}
+	return &Committer{
+		store:    store,
+		archiver: archiver,
+		headLog:  headLog,
+		maxBatch: maxBatch,
+		linger:   linger,
+		queue:    make(chan *commitGroup, maxBatch*4),
+		head:     head,
+	}
+}
+
+// Head returns the last committed entry.
+func (c *Committer) Head() ChainHead {
+	c.headMu.RLock()
+	defer c.headMu.RUnlock()
+	return c.head
+}
+
+// Run commits queued groups until ctx is cancelled.
+func (c *Committer) Run(ctx context.Context) {
+	for {
+		batch, ok := c.collect(ctx)
+		if !ok {
+			return
+		}
+		c.commit(ctx, batch)
+	}
+}
+
+// Submit queues entries as one group and waits until they are committed.
+func (c *Committer) Submit(ctx context.Context, entries []HashEntry) ([]CommitResult, error) {
+	group := &commitGroup{entries: entries, done: make(chan struct{}), queued: time.Now(), trace: spanFromContext(ctx)}
+	select {
+	case c.queue <- group:
+	case <-ctx.Done():
+		return nil, ctx.Err()
+	}
+	// Once queued the group is committed even if the caller goes away
+	<-group.done
+	return group.results, nil
+}
+
+func (c *Committer) collect(ctx context.Context) ([]*commitGroup, bool) {
+	var batch []*commitGroup
+	size := 0
+	add := func(g *commitGroup) bool {
+		if size > 0 && size+len(g.entries) > c.maxBatch {
+			c.carry = g
+			return false
+		}
+		batch = append(batch, g)
+		size += len(g.entries)
+		return true
+	}
+
+	if c.carry != nil {
+		g := c.carry
+		c.carry = nil
+		add(g)
+	} else {
+		select {
+		case g := <-c.queue:
+			add(g)
+		case <-ctx.Done():
+			return nil, false
+		}
+	}
+
+	var timer *time.Timer
+	defer func() {
+		if timer != nil {
+			timer.Stop()
+		}
+	}()
+	for size < c.maxBatch {
+		// Take whatever is already queued before lingering
+		select {
+		case g := <-c.queue:
+			if !add(g) {
+				return batch, true
+			}
+			continue
+		default:
+		}
+		if c.linger <= 0 {
+			break
+		}
+		if timer == nil {
+			timer = time.NewTimer(c.linger)
+		}
+		select {
+		case g := <-c.queue:
+			if !add(g) {
+				return batch, true
+			}
+		case <-timer.C:
+			return batch, true
+		case <-ctx.Done():
+			return batch, true
+		}
+	}
+	return batch, true
+}
+
+func (c *Committer) commit(ctx context.Context, batch []*commitGroup) {
+	type slot struct {
+		group *commitGroup
+		index int
+	}
+	var entries []HashEntry
+	var slots []slot
+	traces := make([]SpanContext, 0, len(batch))
+	for _, g := range batch {
+		if len(g.entries) > 0 {
+			// Time from Submit until the committer takes the group
+			observeStage("commit.queue", g.queued, g.entries[0].MessageID, g.trace)
+		}
+		traces = append(traces, g.trace)
+		g.results = make([]CommitResult, len(g.entries))
+		for i, entry := range g.entries {
+			entries = append(entries, entry)
+			slots = append(slots, slot{g, i})
+		}
+	}
+
+	if len(entries) > 0 {
+		commitBatchEntries.Observe(float64(len(entries)))
+	}
+	head := c.Head()
+	var committed []HashEntry
+	// Ids stored after a rejected entry, which the re-chain overwrites
+	written := map[string]bool{}
+	for len(entries) > 0 {
+		started := time.Now()
+		chained := chainEntries(entries, head)
+		observeStage("commit.chain", started, entries[0].MessageID, traces...)
+		started = time.Now()
+		errs, err := c.store.WriteEntries(ctx, chained, written)
+		observeStage("es.write", started, entries[0].MessageID, traces...)
+		if err != nil {
+			for _, s := range slots {
+				s.group.results[s.index] = CommitResult{Err: err}
+			}
+			break
+		}
+		failed := len(chained)
+		for i, entryErr := range errs {
+			if entryErr != nil {
+				failed = i
+				break
+			}
+		}
+		for i := 0; i < failed; i++ {
+			slots[i].group.results[slots[i].index] = CommitResult{Entry: chained[i]}
+			delete(written, chained[i].MessageID)
+		}
+		for i := failed + 1; i < len(chained); i++ {
+			if errs[i] == nil {
+				written[chained[i].MessageID] = true
+			}
+		}
+		committed = append(committed, chained[:failed]...)
+		if failed > 0 {
+			head = headOf(chained[failed-1])
+		}
+		if failed == len(chained) {
+			break
+		}
+		// Drop the rejected entry; the rest are re-chained and overwritten
+		var duplicate *DuplicateEntryError
+		if errors.As(errs[failed], &duplicate) {
+			log.Printf("Entry %s already committed at seq %d, re-chaining %d entries",
+				chained[failed].MessageID, duplicate.Entry.Seq, len(chained)-failed-1)
+			slots[failed].group.results[slots[failed].index] = CommitResult{Entry: duplicate.Entry}
+		} else {
+			log.Printf("Entry %s rejected by store, re-chaining %d entries: %v",
+				chained[failed].MessageID, len(chained)-failed-1, errs[failed])
+			slots[failed].group.results[slots[failed].index] = CommitResult{Err: errs[failed]}
+		}
+		entries = entries[failed+1:]
+		slots = slots[failed+1:]
+	}
+
+	c.headMu.Lock()
+	c.head = head
+	c.headMu.Unlock()
+
+	// The head is durable before any submitter hears of the commit. If it
+	// cannot be logged, the entries are stored but their submitters get an
+	// error: a retry finds them already committed, and after a restart
+	// reconcileHead resumes from the store, which is ahead of the log.
+	if c.headLog != nil && len(committed) > 0 {
+		started := time.Now()
+		if err := c.headLog.Append(head); err != nil {
+			log.Printf("Error: Failed to persist chain head %d: %v", head.Seq, err)
+			err = fmt.Errorf("chain head %d not persisted: %v", head.Seq, err)
+			for _, g := range batch {
+				for i := range g.results {
+					if g.results[i].Err == nil {
+						g.results[i] = CommitResult{Err: err}
+					}
+				}
+			}
+		}
+		observeStage("headlog.append", started, head.MessageID, traces...)
+	}
+
+	if c.archiver != nil && len(committed) > 0 {
+		c.archiver.Archive(committed)
+	}
+	for _, g := range batch {
+		close(g.done)
+	}
+}
+
+// chainEntries links entries onto head in order and numbers them after
+// head.Seq. The inputs are not modified.
+func chainEntries(entries []HashEntry, head ChainHead) []HashEntry {
+	chained := make([]HashEntry, len(entries))
+	prev, seq := head.Hash, head.Seq
+	for i, entry := range entries {
+		seq++
+		entry.Seq = seq
+		entry.PrevHash = prev
+		entry.ChainHash = chainHash(entry, prev)
+		chained[i] = entry
+		prev = entry.ChainHash
+	}
+	return chained
+}
+
+func headOf(entry HashEntry) ChainHead {
+	return ChainHead{
+		Hash:      entry.ChainHash,
+		Seq:       entry.Seq,
+		MessageID: entry.MessageID,
+		Timestamp: entry.Timestamp,
+	}
+}
+
+func chainHash(entry HashEntry, prevHash string) string {
+	chainData := fmt.Sprintf("%s|%s|%s|%s",
+		entry.Timestamp.Format(time.RFC3339),
+		entry.MessageID,
+		entry.SHA256Payload,
+		prevHash)
+	return sha256Hex([]byte(chainData))
+}
+
+func sha256Hex(data []byte) string {
+	hash := sha256.Sum256(data)
+	return hex.EncodeToString(hash[:])
+}
+
+// newEntry builds the chain entry for a request, minus the chain links.
+// It hashes the payload, so it runs on the request goroutine. A digest
+// computed by the sender is taken as is; otherwise the parsed data is
+// hashed in canonical form.
+func newEntry(req HashRequest) (HashEntry, error) {
+	digest, encoding := strings.ToLower(req.PayloadSHA256), req.PayloadEncoding
+	if encoding == "" {
+		encoding = PayloadEncodingCanonical
+	}
+	if encoding != PayloadEncodingCanonical && encoding != PayloadEncodingRaw {
+		return HashEntry{}, fmt.Errorf("message %s: unknown payload encoding %q", req.MessageID, encoding)
+	}
+	switch {
+	case digest != "" && !validDigest(digest):
+		return HashEntry{}, fmt.Errorf("message %s: payload_sha256 is not a SHA-256 digest", req.MessageID)
+	case digest == "" && encoding == PayloadEncodingRaw:
+		return HashEntry{}, fmt.Errorf("message %s: raw payload encoding needs payload_sha256", req.MessageID)
+	case digest == "":
+		var parsed interface{}
+		if req.ParsedData != nil {
+			parsed = req.ParsedData
+		}
+		var err error
+		if digest, err = canonicalSHA256(parsed); err != nil {
+			return HashEntry{}, fmt.Errorf("message %s: %v", req.MessageID, err)
+		}
+	}
+	return HashEntry{
+		Timestamp:       req.Timestamp,
+		MessageID:       req.MessageID,
+		MessageType:     req.MessageType,
+		SHA256Payload:   digest,
+		PayloadEncoding: encoding,
+		ChannelID:       req.ChannelID,
+		ValidationData: map[string]interface{}{
+			"results": req.ValidationResults,
+			"status":  req.OverallStatus,
+		},
+		Severity: req.OverallStatus,
+	}, nil
+}
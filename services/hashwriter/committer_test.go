@@ -0,0 +1,290 @@
+package main
+
+import (
+	"context"
+	"errors"
+	"fmt"
+	"sync"
+	"testing"
+	"time"
+)
+
+type fakeStore struct {
+	mu      sync.Mutex
+	batches [][]HashEntry
+	stored  map[string]HashEntry
+	reject  map[string]bool
+	fail    error
+}
+
+func (s *fakeStore) WriteEntries(ctx context.Context, entries []HashEntry, overwrite map[string]bool) ([]error, error) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	if s.fail != nil {
+		return nil, s.fail
+	}
+	if s.stored == nil {
+		s.stored = map[string]HashEntry{}
+	}
+	s.batches = append(s.batches, entries)
+	errs := make([]error, len(entries))
+	indexed := map[string]bool{}
+	for i, entry := range entries {
+		if s.reject[entry.MessageID] {
+			errs[i] = errors.New("mapping conflict")
+			continue
+		}
+		stored, exists := s.stored[entry.MessageID]
+		if exists && !(overwrite[entry.MessageID] && !indexed[entry.MessageID]) {
+			errs[i] = &DuplicateEntryError{Entry: stored}
+			continue
+		}
+		indexed[entry.MessageID] = true
+		s.stored[entry.MessageID] = entry
+	}
+	return errs, nil
+}
+
+type fakeArchiver struct {
+	mu      sync.Mutex
+	entries []HashEntry
+}
+
+func (a *fakeArchiver) Archive(entries []HashEntry) {
+	a.mu.Lock()
+	defer a.mu.Unlock()
+	a.entries = append(a.entries, entries...)
+}
+
+func testEntry(id string) HashEntry {
+	entry, _ := newEntry(HashRequest{
+		MessageID:  id,
+		ChannelID:  "LAB",
+		Timestamp:  time.Date(2023, 12, 1, 12, 0, 0, 0, time.UTC),
+		ParsedData: map[string]interface{}{"id": id},
+	})
+	return entry
+}
+
+func startCommitter(t *testing.T, store EntryStore, archiver Archiver, maxBatch int, linger time.Duration) *Committer {
+	ctx, cancel := context.WithCancel(context.Background())
+	t.Cleanup(cancel)
+	c := NewCommitter(store, archiver, nil, GenesisHead, maxBatch, linger)
+	go c.Run(ctx)
+	return c
+}
+
+// verifyChain checks that entries link from GenesisHash in order.
+func verifyChain(t *testing.T, entries []HashEntry) {
+	t.Helper()
+	prev := GenesisHash
+	for i, entry := range entries {
+		if entry.Seq != uint64(i+1) {
+			t.Fatalf("entry %d (%s) has seq %d", i, entry.MessageID, entry.Seq)
+		}
+		if entry.PrevHash != prev {
+			t.Fatalf("entry %d (%s) links to %s, want %s", i, entry.MessageID, entry.PrevHash, prev)
+		}
+		if entry.ChainHash != chainHash(entry, prev) {
+			t.Fatalf("entry %d (%s) has a wrong chain hash", i, entry.MessageID)
+		}
+		prev = entry.ChainHash
+	}
+}
+
+func TestChainHashMatchesLegacyFormat(t *testing.T) {
+	entry := testEntry("m1")
+	chained := chainEntries([]HashEntry{entry}, GenesisHead)
+	legacy := sha256Hex([]byte(fmt.Sprintf("%s|%s|%s|%s",
+		entry.Timestamp.Format(time.RFC3339), entry.MessageID, entry.SHA256Payload, GenesisHash)))
+	if chained[0].ChainHash != legacy {
+		t.Fatalf("chain hash %s, want %s", chained[0].ChainHash, legacy)
+	}
+}
+
+func TestConcurrentSubmitsShareBatches(t *testing.T) {
+	store := &fakeStore{}
+	archiver := &fakeArchiver{}
+	c := startCommitter(t, store, archiver, 16, 20*time.Millisecond)
+
+	var wg sync.WaitGroup
+	results := make([]CommitResult, 64)
+	for i := range results {
+		wg.Add(1)
+		go func(i int) {
+			defer wg.Done()
+			committed, err := c.Submit(context.Background(), []HashEntry{testEntry(fmt.Sprintf("m%d", i))})
+			if err != nil {
+				t.Error(err)
+				return
+			}
+			results[i] = committed[0]
+		}(i)
+	}
+	wg.Wait()
+
+	var stored []HashEntry
+	for _, batch := range store.batches {
+		if len(batch) > 16 {
+			t.Fatalf("batch of %d exceeds max batch", len(batch))
+		}
+		stored = append(stored, batch...)
+	}
+	if len(stored) != 64 || len(store.batches) >= 64 {
+		t.Fatalf("%d entries in %d batches", len(stored), len(store.batches))
+	}
+	verifyChain(t, stored)
+	if c.Head().Hash != stored[len(stored)-1].ChainHash || c.Head().Seq != 64 {
+		t.Fatal("head is not the last stored entry")
+	}
+	for _, result := range results {
+		if result.Err != nil || result.Entry.ChainHash == "" {
+			t.Fatalf("unexpected result %+v", result)
+		}
+	}
+	if len(archiver.entries) != 64 {
+		t.Fatalf("archived %d entries", len(archiver.entries))
+	}
+}
+
+func TestGroupsStayAdjacent(t *testing.T) {
+	store := &fakeStore{}
+	c := startCommitter(t, store, nil, 4, 5*time.Millisecond)
+
+	var wg sync.WaitGroup
+	for g := 0; g < 10; g++ {
+		wg.Add(1)
+		go func(g int) {
+			defer wg.Done()
+			group := []HashEntry{testEntry(fmt.Sprintf("g%d-0", g)), testEntry(fmt.Sprintf("g%d-1", g)),
+				testEntry(fmt.Sprintf("g%d-2", g))}
+			if _, err := c.Submit(context.Background(), group); err != nil {
+				t.Error(err)
+			}
+		}(g)
+	}
+	wg.Wait()
+
+	var stored []HashEntry
+	for _, batch := range store.batches {
+		if len(batch) != 3 {
+			t.Fatalf("groups of 3 with max batch 4 should commit alone, got %d", len(batch))
+		}
+		stored = append(stored, batch...)
+	}
+	verifyChain(t, stored)
+	for i := 0; i < len(stored); i += 3 {
+		prefix := stored[i].MessageID[:len(stored[i].MessageID)-1]
+		for j := 1; j < 3; j++ {
+			if stored[i+j].MessageID != fmt.Sprintf("%s%d", prefix, j) {
+				t.Fatalf("group %s split: %s", prefix, stored[i+j].MessageID)
+			}
+		}
+	}
+}
+
+func TestRejectedEntryIsLeftOutOfTheChain(t *testing.T) {
+	store := &fakeStore{reject: map[string]bool{"bad": true}}
+	archiver := &fakeArchiver{}
+	c := startCommitter(t, store, archiver, 16, 0)
+
+	entries := []HashEntry{testEntry("a"), testEntry("bad"), testEntry("b"), testEntry("c")}
+	results, err := c.Submit(context.Background(), entries)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if results[1].Err == nil {
+		t.Fatal("rejected entry reported as committed")
+	}
+	chain := []HashEntry{results[0].Entry, results[2].Entry, results[3].Entry}
+	verifyChain(t, chain)
+	if c.Head().Hash != results[3].Entry.ChainHash {
+		t.Fatal("head does not follow the re-chained entries")
+	}
+	// Second write re-chains b and c onto a; doc ids overwrite the first attempt
+	if len(store.batches) != 2 || len(store.batches[1]) != 2 {
+		t.Fatalf("unexpected writes %d", len(store.batches))
+	}
+	verifyChain(t, archiver.entries)
+}
+
+func TestRedeliveredEntryIsCommittedOnce(t *testing.T) {
+	store := &fakeStore{}
+	archiver := &fakeArchiver{}
+	c := startCommitter(t, store, archiver, 16, 0)
+
+	first, err := c.Submit(context.Background(), []HashEntry{testEntry("a"), testEntry("b")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	// b is redelivered between c and d, and d repeats c's id in the same batch
+	again, err := c.Submit(context.Background(), []HashEntry{testEntry("c"), testEntry("b"), testEntry("d"), testEntry("c")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	for _, result := range again {
+		if result.Err != nil {
+			t.Fatalf("entry %s failed: %v", result.Entry.MessageID, result.Err)
+		}
+	}
+	if headOf(again[1].Entry) != headOf(first[1].Entry) {
+		t.Fatalf("redelivered b got seq %d, want the stored seq %d", again[1].Entry.Seq, first[1].Entry.Seq)
+	}
+	if headOf(again[3].Entry) != headOf(again[0].Entry) {
+		t.Fatal("repeated id in a batch did not get the entry stored first")
+	}
+	chain := []HashEntry{first[0].Entry, first[1].Entry, again[0].Entry, again[2].Entry}
+	verifyChain(t, chain)
+	verifyChain(t, archiver.entries)
+	for _, entry := range chain {
+		if headOf(store.stored[entry.MessageID]) != headOf(entry) {
+			t.Fatalf("stored %s is not the committed entry", entry.MessageID)
+		}
+	}
+	if c.Head().Hash != again[2].Entry.ChainHash {
+		t.Fatal("head does not follow the last new entry")
+	}
+}
+
+func TestRechainDoesNotOverwriteDuplicates(t *testing.T) {
+	store := &fakeStore{reject: map[string]bool{"bad": true}}
+	c := startCommitter(t, store, nil, 16, 0)
+
+	first, err := c.Submit(context.Background(), []HashEntry{testEntry("a")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	// The re-chain after bad rewrites b and c, but not the stored a
+	results, err := c.Submit(context.Background(), []HashEntry{testEntry("bad"), testEntry("b"), testEntry("a"), testEntry("c")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if results[0].Err == nil || results[2].Err != nil || headOf(results[2].Entry) != headOf(first[0].Entry) {
+		t.Fatalf("unexpected results %+v", results)
+	}
+	verifyChain(t, []HashEntry{first[0].Entry, results[1].Entry, results[3].Entry})
+	if headOf(store.stored["a"]) != headOf(first[0].Entry) {
+		t.Fatal("re-chain overwrote the stored a")
+	}
+	if headOf(store.stored["c"]) != headOf(results[3].Entry) {
+		t.Fatal("re-chain did not rewrite c")
+	}
+}
+
+func TestStoreFailureLeavesHeadUnchanged(t *testing.T) {
+	store := &fakeStore{fail: errors.New("cluster unavailable")}
+	c := startCommitter(t, store, nil, 16, 0)
+
+	results, err := c.Submit(context.Background(), []HashEntry{testEntry("a"), testEntry("b")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	for _, result := range results {
+		if result.Err == nil {
+			t.Fatal("entry reported as committed")
+		}
+	}
+	if c.Head() != GenesisHead {
+		t.Fatal("head moved without a write")
+	}
+}
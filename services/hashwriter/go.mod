@@ -6,6 +6,7 @@ require (
     github.com/aws/aws-sdk-go v1.49.13
     github.com/elastic/go-elasticsearch/v7 v7.17.10
     github.com/gin-gonic/gin v1.9.1
+    github.com/prometheus/client_golang v1.17.0
 )
 
 require (
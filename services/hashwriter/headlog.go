@@ -0,0 +1,222 @@
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"context"
+	"encoding/json"
+	"fmt"
+	"hash/crc32"
+	"log"
+	"os"
+	"path/filepath"
+	"strconv"
+	"time"
+)
+
+// ChainHead identifies the last committed entry of the chain.
+type ChainHead struct {
+	Hash      string    `json:"hash"`
+	Seq       uint64    `json:"seq"`
+	MessageID string    `json:"message_id"`
+	Timestamp time.Time `json:"ts"`
+}
+
+// GenesisHead is the head of an empty unsharded chain.
+var GenesisHead = ChainHead{Hash: GenesisHash}
+
+// HeadLog durably records the chain head after each commit.
+type HeadLog interface {
+	Append(head ChainHead) error
+}
+
+// headLogCompactBytes is the size after which the log is rewritten with
+// only its last record.
+const headLogCompactBytes = 4 << 20
+
+// FileHeadLog is an append-only file of chain heads, one line per group
+// commit: an IEEE CRC-32 of the JSON record, a space and the record. Every
+// append is fsync'd before the commit is acknowledged. A torn or corrupt
+// tail is ignored on open, so the last intact line is the recovered head.
+type FileHeadLog struct {
+	path string
+	file *os.File
+	size int64
+}
+
+// OpenHeadLog opens or creates the log and returns the last head it holds.
+func OpenHeadLog(path string) (*FileHeadLog, ChainHead, bool, error) {
+	if err := os.MkdirAll(filepath.Dir(path), 0o755); err != nil {
+		return nil, ChainHead{}, false, err
+	}
+	head, found, err := readHeadLog(path)
+	if err != nil {
+		return nil, ChainHead{}, false, err
+	}
+	l := &FileHeadLog{path: path}
+	// Start from a compacted file so a torn tail is never appended to
+	if found {
+		err = l.rewrite(head)
+	} else {
+		err = l.reopen()
+	}
+	if err != nil {
+		return nil, ChainHead{}, false, err
+	}
+	return l, head, found, nil
+}
+
+func readHeadLog(path string) (ChainHead, bool, error) {
+	f, err := os.Open(path)
+	if os.IsNotExist(err) {
+		return ChainHead{}, false, nil
+	}
+	if err != nil {
+		return ChainHead{}, false, err
+	}
+	defer f.Close()
+
+	var head ChainHead
+	found := false
+	scanner := bufio.NewScanner(f)
+	for scanner.Scan() {
+		record, ok := decodeHeadRecord(scanner.Bytes())
+		if !ok {
+			break
+		}
+		head, found = record, true
+	}
+	return head, found, nil
+}
+
+func encodeHeadRecord(head ChainHead) []byte {
+	data, _ := json.Marshal(head)
+	return []byte(fmt.Sprintf("%08x %s\n", crc32.ChecksumIEEE(data), data))
+}
+
+func decodeHeadRecord(line []byte) (ChainHead, bool) {
+	sum, data, ok := bytes.Cut(line, []byte(" "))
+	if !ok {
+		return ChainHead{}, false
+	}
+	want, err := strconv.ParseUint(string(sum), 16, 32)
+	if err != nil || crc32.ChecksumIEEE(data) != uint32(want) {
+		return ChainHead{}, false
+	}
+	var head ChainHead
+	if err := json.Unmarshal(data, &head); err != nil {
+		return ChainHead{}, false
+	}
+	return head, true
+}
+
+func (l *FileHeadLog) reopen() error {
+	f, err := os.OpenFile(l.path, os.O_CREATE|os.O_WRONLY|os.O_APPEND, 0o644)
+	if err != nil {
+		return err
+	}
+	info, err := f.Stat()
+	if err != nil {
+		f.Close()
+		return err
+	}
+	l.file, l.size = f, info.Size()
+	return nil
+}
+
+// rewrite replaces the log with a single record via fsync'd rename.
+func (l *FileHeadLog) rewrite(head ChainHead) error {
+	tmp := l.path + ".tmp"
+	f, err := os.OpenFile(tmp, os.O_CREATE|os.O_WRONLY|os.O_TRUNC, 0o644)
+	if err != nil {
+		return err
+	}
+	if _, err := f.Write(encodeHeadRecord(head)); err != nil {
+		f.Close()
+		return err
+	}
+	if err := f.Sync(); err != nil {
+		f.Close()
+		return err
+	}
+	f.Close()
+	if err := os.Rename(tmp, l.path); err != nil {
+		return err
+	}
+	if dir, err := os.Open(filepath.Dir(l.path)); err == nil {
+		dir.Sync()
+		dir.Close()
+	}
+	if l.file != nil {
+		l.file.Close()
+	}
+	return l.reopen()
+}
+
+// Append records head and fsyncs it.
+func (l *FileHeadLog) Append(head ChainHead) error {
+	if l.size >= headLogCompactBytes {
+		return l.rewrite(head)
+	}
+	record := encodeHeadRecord(head)
+	n, err := l.file.Write(record)
+	l.size += int64(n)
+	if err != nil {
+		return err
+	}
+	return l.file.Sync()
+}
+
+func (l *FileHeadLog) Close() error {
+	return l.file.Close()
+}
+
+// HeadSource reads chain heads back from the entry store.
+type HeadSource interface {
+	// LatestHead returns the stored entry of shard with the highest
+	// sequence number.
+	LatestHead(ctx context.Context, shard string) (ChainHead, bool, error)
+	// HasHead reports whether the entry for head is stored with its hash.
+	HasHead(ctx context.Context, head ChainHead) (bool, error)
+}
+
+// reconcileHead picks the head of shard to resume from, given the head
+// recovered from its log (if any) and the entry store.
+//
+// The store is searched for its highest sequence number, which is cheap
+// with a sort on a doc-values field. If the store is ahead of the log, or
+// holds a different entry at the same position, the store wins: the chain
+// continues from what was actually stored. If the log is ahead, its entry
+// may simply not be searchable yet, so it is fetched by id; the log wins
+// either way, but a missing entry is reported.
+func reconcileHead(ctx context.Context, shard string, logged ChainHead, found bool, source HeadSource) (ChainHead, error) {
+	stored, storedFound, err := source.LatestHead(ctx, shard)
+	if err != nil {
+		return ChainHead{}, err
+	}
+	switch {
+	case !found && !storedFound:
+		return ChainHead{Hash: shardGenesis(shard)}, nil
+	case !found:
+		log.Printf("Chain head log empty, resuming from stored entry %d (%s)", stored.Seq, stored.MessageID)
+		return stored, nil
+	case !storedFound || logged.Seq > stored.Seq:
+		ok, err := source.HasHead(ctx, logged)
+		if err != nil {
+			return ChainHead{}, err
+		}
+		if !ok && logged.Seq > 0 {
+			log.Printf("Error: chain head %d (%s) from the log is not in the entry store", logged.Seq, logged.MessageID)
+		}
+		return logged, nil
+	case stored.Seq > logged.Seq:
+		log.Printf("Chain head log at %d is behind the entry store at %d, resuming from the store",
+			logged.Seq, stored.Seq)
+		return stored, nil
+	case stored.Hash != logged.Hash:
+		log.Printf("Error: chain head %d differs between log (%s) and entry store (%s), resuming from the store",
+			stored.Seq, logged.Hash, stored.Hash)
+		return stored, nil
+	}
+	return logged, nil
+}
@@ -0,0 +1,146 @@
+package main
+
+import (
+	"context"
+	"errors"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+)
+
+func testHead(seq uint64) ChainHead {
+	return ChainHead{
+		Hash:      sha256Hex([]byte{byte(seq)}),
+		Seq:       seq,
+		MessageID: "m" + string(rune('0'+seq)),
+		Timestamp: time.Date(2023, 12, 1, 12, 0, 0, 0, time.UTC),
+	}
+}
+
+func TestHeadLogRecoversLastIntactRecord(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "chain-head.wal")
+	l, _, found, err := OpenHeadLog(path)
+	if err != nil || found {
+		t.Fatalf("new log: found %v, %v", found, err)
+	}
+	for seq := uint64(1); seq <= 3; seq++ {
+		if err := l.Append(testHead(seq)); err != nil {
+			t.Fatal(err)
+		}
+	}
+	l.Close()
+
+	// A record torn by a crash, then a record whose checksum is wrong
+	f, _ := os.OpenFile(path, os.O_APPEND|os.O_WRONLY, 0o644)
+	f.Write(encodeHeadRecord(testHead(4))[:20])
+	f.Close()
+
+	l, head, found, err := OpenHeadLog(path)
+	if err != nil || !found || head != testHead(3) {
+		t.Fatalf("recovered %+v (found %v, %v)", head, found, err)
+	}
+	if err := l.Append(testHead(4)); err != nil {
+		t.Fatal(err)
+	}
+	l.Close()
+	if _, head, _, _ := OpenHeadLog(path); head != testHead(4) {
+		t.Fatalf("append after recovery lost: %+v", head)
+	}
+
+	record := encodeHeadRecord(testHead(5))
+	record[0] ^= 1
+	if _, ok := decodeHeadRecord(record[:len(record)-1]); ok {
+		t.Fatal("corrupt record accepted")
+	}
+}
+
+type fakeHeadSource struct {
+	latest ChainHead
+	found  bool
+	stored map[string]string
+}
+
+func (s *fakeHeadSource) LatestHead(ctx context.Context, shard string) (ChainHead, bool, error) {
+	return s.latest, s.found, nil
+}
+
+func (s *fakeHeadSource) HasHead(ctx context.Context, head ChainHead) (bool, error) {
+	return s.stored[head.MessageID] == head.Hash, nil
+}
+
+func TestReconcileHead(t *testing.T) {
+	forked := testHead(3)
+	forked.Hash = "other"
+	cases := []struct {
+		name   string
+		logged ChainHead
+		found  bool
+		source *fakeHeadSource
+		want   ChainHead
+	}{
+		{"empty", ChainHead{}, false, &fakeHeadSource{}, GenesisHead},
+		{"log lost", ChainHead{}, false, &fakeHeadSource{latest: testHead(7), found: true}, testHead(7)},
+		{"in step", testHead(3), true, &fakeHeadSource{latest: testHead(3), found: true}, testHead(3)},
+		{"store ahead", testHead(3), true, &fakeHeadSource{latest: testHead(5), found: true}, testHead(5)},
+		{"store forked", testHead(3), true, &fakeHeadSource{latest: forked, found: true}, forked},
+		// The last entries are not searchable until the next refresh
+		{"not refreshed", testHead(5), true, &fakeHeadSource{latest: testHead(3), found: true,
+			stored: map[string]string{testHead(5).MessageID: testHead(5).Hash}}, testHead(5)},
+	}
+	for _, tc := range cases {
+		got, err := reconcileHead(context.Background(), "", tc.logged, tc.found, tc.source)
+		if err != nil || got != tc.want {
+			t.Errorf("%s: got %+v (%v), want %+v", tc.name, got, err, tc.want)
+		}
+	}
+}
+
+func TestCommitterPersistsHead(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "chain-head.wal")
+	l, _, _, err := OpenHeadLog(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	ctx, cancel := context.WithCancel(context.Background())
+	defer cancel()
+	c := NewCommitter(&fakeStore{}, nil, l, GenesisHead, 16, 0)
+	go c.Run(ctx)
+	results, err := c.Submit(context.Background(), []HashEntry{testEntry("a"), testEntry("b")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if _, head, _, _ := OpenHeadLog(path); head != headOf(results[1].Entry) || head.Seq != 2 {
+		t.Fatalf("logged head %+v", head)
+	}
+}
+
+type failingHeadLog struct{}
+
+func (failingHeadLog) Append(head ChainHead) error {
+	return errors.New("disk full")
+}
+
+func TestUnloggedHeadFailsTheCommit(t *testing.T) {
+	ctx, cancel := context.WithCancel(context.Background())
+	defer cancel()
+	c := NewCommitter(&fakeStore{}, nil, failingHeadLog{}, GenesisHead, 16, 0)
+	go c.Run(ctx)
+	results, err := c.Submit(context.Background(), []HashEntry{testEntry("a"), testEntry("b")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	for _, result := range results {
+		if result.Err == nil {
+			t.Fatal("entry acknowledged without a durable head")
+		}
+	}
+	// The entries are stored, so a retry gets them back as committed
+	again, err := c.Submit(context.Background(), []HashEntry{testEntry("a")})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if again[0].Err != nil || again[0].Entry.Seq != 1 {
+		t.Fatalf("retry got %+v", again[0])
+	}
+}
@@ -2,14 +2,14 @@ package main
 
 import (
 	"bytes"
-	"crypto/sha256"
-	"encoding/hex"
+	"context"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"log"
 	"net/http"
 	"os"
-	"sync"
+	"strconv"
 	"time"
 
 	"github.com/aws/aws-sdk-go/aws"
@@ -18,6 +18,8 @@ import (
 	"github.com/aws/aws-sdk-go/service/s3"
 	"github.com/elastic/go-elasticsearch/v7"
 	"github.com/gin-gonic/gin"
+	"github.com/prometheus/client_golang/prometheus"
+	"github.com/prometheus/client_golang/prometheus/promhttp"
 )
 
 type HashRequest struct {
@@ -28,6 +30,14 @@ type HashRequest struct {
 	ValidationResults []ValidationResult     `json:"validation_results"`
 	OverallStatus     string                 `json:"overall_status"`
 	ParsedData        map[string]interface{} `json:"parsed_data"`
+	// Optional digest computed by the sender, of the canonical parsed data
+	// ("jcs", the default) or of the raw message bytes ("raw")
+	PayloadSHA256   string `json:"payload_sha256"`
+	PayloadEncoding string `json:"payload_encoding"`
+}
+
+type HashBatchRequest struct {
+	Messages []HashRequest `json:"messages"`
 }
 
 type ValidationResult struct {
@@ -38,15 +48,18 @@ type ValidationResult struct {
 }
 
 type HashEntry struct {
-	Timestamp      time.Time              `json:"ts"`
-	MessageID      string                 `json:"message_id"`
-	MessageType    string                 `json:"msgType"`
-	SHA256Payload  string                 `json:"sha256_payload"`
-	PrevHash       string                 `json:"prevHash"`
-	ChainHash      string                 `json:"chainHash"`
-	ChannelID      string                 `json:"channel_id"`
-	ValidationData map[string]interface{} `json:"validation_data"`
-	Severity       string                 `json:"severity"`
+	Timestamp       time.Time              `json:"ts"`
+	MessageID       string                 `json:"message_id"`
+	MessageType     string                 `json:"msgType"`
+	SHA256Payload   string                 `json:"sha256_payload"`
+	PayloadEncoding string                 `json:"payload_encoding,omitempty"`
+	PrevHash        string                 `json:"prevHash"`
+	ChainHash       string                 `json:"chainHash"`
+	Seq             uint64                 `json:"seq"`
+	Shard           string                 `json:"shard,omitempty"`
+	ChannelID       string                 `json:"channel_id"`
+	ValidationData  map[string]interface{} `json:"validation_data"`
+	Severity        string                 `json:"severity"`
 }
 
 type HashWriter struct {
@@ -54,8 +67,13 @@ type HashWriter struct {
 	s3Client    *s3.S3
 	bucketName  string
 	indexPrefix string
-	prevHash    string
-	mutex       sync.Mutex
+	chain       *ShardedChain
+	anchorEvery time.Duration
+	store       *esStore
+	segments    *s3SegmentStore
+	archiver    *SegmentArchiver
+	stats       *StatsAggregator
+	statsEvery  time.Duration
 }
 
 func NewHashWriter() (*HashWriter, error) {
@@ -89,18 +107,73 @@ func NewHashWriter() (*HashWriter, error) {
 		return nil, fmt.Errorf("error creating S3 session: %s", err)
 	}
 
-	return &HashWriter{
+	hw := &HashWriter{
 		esClient:    esClient,
 		s3Client:    s3.New(sess),
 		bucketName:  getEnv("S3_BUCKET", "compliance-audit"),
 		indexPrefix: getEnv("ES_INDEX_PREFIX", "audit"),
-		prevHash:    "0000000000000000000000000000000000000000000000000000000000000000",
-	}, nil
+	}
+
+	// Group commit: one _bulk call per batch of queued requests
+	maxBatch := getEnvInt("GROUP_COMMIT_MAX_BATCH", 256)
+	linger := getEnvDuration("GROUP_COMMIT_LINGER", 2*time.Millisecond)
+	hw.store = &esStore{
+		client:      esClient,
+		indexPrefix: hw.indexPrefix,
+		statsPrefix: getEnv("STATS_INDEX_PREFIX", "compliance-stats"),
+	}
+	hw.segments = &s3SegmentStore{client: hw.s3Client, bucket: hw.bucketName}
+
+	// Committed entries go to local segments, uploaded once sealed
+	segmentCfg := SegmentConfig{
+		Dir:           getEnv("ARCHIVE_DIR", "/var/lib/hashwriter/segments"),
+		MaxBytes:      int64(getEnvInt("ARCHIVE_SEGMENT_BYTES", 64<<20)),
+		MaxAge:        getEnvDuration("ARCHIVE_SEGMENT_MAX_AGE", 15*time.Minute),
+		BlockBytes:    getEnvInt("ARCHIVE_BLOCK_BYTES", 64<<10),
+		FlushInterval: getEnvDuration("ARCHIVE_FLUSH_INTERVAL", time.Second),
+		QueueSize:     maxBatch * 4,
+	}
+	hw.archiver = NewSegmentArchiver(segmentCfg, hw.segments, hw.store)
+
+	// One chain per shard key, or a single global chain when CHAIN_SHARD_BY
+	// is empty; each resumes from its head log, checked against Elasticsearch
+	shardCfg := ShardConfig{
+		By:       getEnv("CHAIN_SHARD_BY", ""),
+		Count:    getEnvInt("CHAIN_SHARD_COUNT", 0),
+		HeadFile: getEnv("CHAIN_HEAD_FILE", "/var/lib/hashwriter/chain-head.wal"),
+		MaxBatch: maxBatch,
+		Linger:   linger,
+	}
+	switch shardCfg.By {
+	case "", "channel_id", "message_type":
+	default:
+		return nil, fmt.Errorf("CHAIN_SHARD_BY must be channel_id or message_type, got %q", shardCfg.By)
+	}
+	// Daily message counters for the reporter, flushed every interval;
+	// STATS_FLUSH_INTERVAL=0 turns them off
+	var archiver Archiver = hw.archiver
+	hw.statsEvery = getEnvDuration("STATS_FLUSH_INTERVAL", 10*time.Second)
+	if hw.statsEvery > 0 {
+		hw.stats = NewStatsAggregator(hw.store)
+		archiver = multiArchiver{hw.archiver, hw.stats}
+	}
+	hw.chain = NewShardedChain(shardCfg, hw.store, archiver, hw.store)
+	hw.anchorEvery = getEnvDuration("CHAIN_ANCHOR_INTERVAL", time.Minute)
+	log.Printf("Group commit: max batch %d, linger %s", maxBatch, linger)
+	log.Printf("Archive segments in %s: %d bytes or %s", segmentCfg.Dir, segmentCfg.MaxBytes, segmentCfg.MaxAge)
+
+	return hw, nil
 }
 
-func (hw *HashWriter) generateHash(data []byte) string {
-	hash := sha256.Sum256(data)
-	return hex.EncodeToString(hash[:])
+func (hw *HashWriter) entryResult(entry HashEntry) gin.H {
+	return gin.H{
+		"message_id":    entry.MessageID,
+		"chain_hash":    entry.ChainHash,
+		"payload_hash":  entry.SHA256Payload,
+		"prev_hash":     entry.PrevHash,
+		"seq":           entry.Seq,
+		"es_index":      indexName(hw.indexPrefix, entry.Timestamp),
+	}
 }
 
 func (hw *HashWriter) processHash(c *gin.Context) {
@@ -110,90 +183,160 @@ func (hw *HashWriter) processHash(c *gin.Context) {
 		return
 	}
 
-	// Lock for chain consistency
-	hw.mutex.Lock()
-	defer hw.mutex.Unlock()
-
-	// Create payload hash
-	payloadData, _ := json.Marshal(req.ParsedData)
-	payloadHash := hw.generateHash(payloadData)
-
-	// Create chain hash
-	chainData := fmt.Sprintf("%s|%s|%s|%s", 
-		req.Timestamp.Format(time.RFC3339),
-		req.MessageID,
-		payloadHash,
-		hw.prevHash)
-	chainHash := hw.generateHash([]byte(chainData))
-
-	// Create hash entry
-	entry := HashEntry{
-		Timestamp:      req.Timestamp,
-		MessageID:      req.MessageID,
-		MessageType:    req.MessageType,
-		SHA256Payload:  payloadHash,
-		PrevHash:       hw.prevHash,
-		ChainHash:      chainHash,
-		ChannelID:      req.ChannelID,
-		ValidationData: map[string]interface{}{
-			"results": req.ValidationResults,
-			"status":  req.OverallStatus,
-		},
-		Severity: req.OverallStatus,
+	c.Set(traceMessageKey, req.MessageID)
+	// Payload hashing happens here; the committer only links the chain
+	started := time.Now()
+	entry, err := newEntry(req)
+	observeStage("payload.hash", started, req.MessageID, spanFromContext(c.Request.Context()))
+	if err != nil {
+		c.JSON(http.StatusBadRequest, gin.H{"error": err.Error()})
+		return
 	}
-
-	// Store in Elasticsearch
-	indexName := fmt.Sprintf("%s-%s", hw.indexPrefix, req.Timestamp.Format("2006.01.02"))
-	entryJSON, _ := json.Marshal(entry)
-	
-	res, err := hw.esClient.Index(
-		indexName,
-		bytes.NewReader(entryJSON),
-		hw.esClient.Index.WithDocumentID(req.MessageID),
-		hw.esClient.Index.WithRefresh("true"),
-	)
+	results, err := hw.chain.Submit(c.Request.Context(), []HashEntry{entry})
 	if err != nil {
-		c.JSON(http.StatusInternalServerError, gin.H{"error": fmt.Sprintf("Error indexing document: %s", err)})
+		c.JSON(http.StatusServiceUnavailable, gin.H{"error": err.Error()})
+		return
+	}
+	if results[0].Err != nil {
+		c.JSON(http.StatusInternalServerError, gin.H{"error": results[0].Err.Error()})
 		return
 	}
-	defer res.Body.Close()
 
-	// Store in S3 with object lock
-	objectKey := fmt.Sprintf("%s/%s/%s.json",
-		req.Timestamp.Format("2006/01/02"),
-		req.ChannelID,
-		req.MessageID)
-	
-	_, err = hw.s3Client.PutObject(&s3.PutObjectInput{
-		Bucket:               aws.String(hw.bucketName),
-		Key:                  aws.String(objectKey),
-		Body:                 bytes.NewReader(entryJSON),
-		ContentType:          aws.String("application/json"),
-		ServerSideEncryption: aws.String("AES256"),
-		ObjectLockMode:       aws.String("COMPLIANCE"),
-		ObjectLockRetainUntilDate: aws.Time(time.Now().AddDate(10, 0, 0)), // 10 years
+	c.JSON(http.StatusOK, hw.entryResult(results[0].Entry))
+}
+
+func (hw *HashWriter) processBatch(c *gin.Context) {
+	var batch HashBatchRequest
+	if err := c.ShouldBindJSON(&batch); err != nil {
+		c.JSON(http.StatusBadRequest, gin.H{"error": err.Error()})
+		return
+	}
+
+	// A message that cannot be hashed fails alone; the rest are chained
+	results := make([]gin.H, len(batch.Messages))
+	entries := make([]HashEntry, 0, len(batch.Messages))
+	positions := make([]int, 0, len(batch.Messages))
+	for i, req := range batch.Messages {
+		started := time.Now()
+		entry, err := newEntry(req)
+		observeStage("payload.hash", started, req.MessageID, spanFromContext(c.Request.Context()))
+		if err != nil {
+			results[i] = gin.H{"message_id": req.MessageID, "error": err.Error()}
+			continue
+		}
+		entries = append(entries, entry)
+		positions = append(positions, i)
+	}
+	if len(entries) > 0 {
+		// Submitted as one group, so the batch stays adjacent in each chain
+		committed, err := hw.chain.Submit(c.Request.Context(), entries)
+		if err != nil {
+			c.JSON(http.StatusServiceUnavailable, gin.H{"error": err.Error()})
+			return
+		}
+		for j, result := range committed {
+			i := positions[j]
+			if result.Err != nil {
+				results[i] = gin.H{"message_id": batch.Messages[i].MessageID, "error": result.Err.Error()}
+				continue
+			}
+			results[i] = hw.entryResult(result.Entry)
+		}
+	}
+
+	c.JSON(http.StatusOK, gin.H{"results": results})
+}
+
+func (hw *HashWriter) getChainStatus(c *gin.Context) {
+	heads := hw.chain.Heads()
+	shards := gin.H{}
+	for shard, head := range heads {
+		shards[shard] = gin.H{"hash": head.Hash, "seq": head.Seq, "message_id": head.MessageID}
+	}
+	// The global chain head, or the anchor chain head when sharded
+	head := heads[""]
+	if hw.chain.cfg.By != "" {
+		head = heads[anchorShard]
+	}
+	c.JSON(http.StatusOK, gin.H{
+		"current_hash":             head.Hash,
+		"seq":                      head.Seq,
+		"last_message_id":          head.MessageID,
+		"sharded_by":               hw.chain.cfg.By,
+		"shards":                   shards,
+		"archive_pending_segments": hw.archiver.Pending(),
+		"timestamp":                time.Now(),
+		"status":                   "active",
 	})
+}
+
+// getArchivedEntry reads one entry back from its segment with a ranged GET.
+func (hw *HashWriter) getArchivedEntry(c *gin.Context) {
+	messageID := c.Param("message_id")
+	loc, err := hw.store.Locate(c.Request.Context(), messageID)
+	if errors.Is(err, errEntryNotFound) || errors.Is(err, errNotArchived) {
+		c.JSON(http.StatusNotFound, gin.H{"error": err.Error()})
+		return
+	}
 	if err != nil {
-		log.Printf("Warning: Failed to store in S3: %v", err)
+		c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
+		return
 	}
 
-	// Update previous hash for next entry
-	hw.prevHash = chainHash
+	block, err := hw.segments.ReadRange(loc.Key, loc.Offset, loc.Length)
+	if err != nil {
+		c.JSON(http.StatusBadGateway, gin.H{"error": err.Error()})
+		return
+	}
+	line, err := readBlockLine(bytes.NewReader(block), loc.Line)
+	if err != nil {
+		c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
+		return
+	}
 
 	c.JSON(http.StatusOK, gin.H{
-		"chain_hash":    chainHash,
-		"payload_hash":  payloadHash,
-		"prev_hash":     entry.PrevHash,
-		"es_index":      indexName,
-		"s3_key":        objectKey,
+		"message_id":  messageID,
+		"segment_id":  loc.SegmentID,
+		"key":         loc.Key,
+		"leaf":        loc.Leaf,
+		"leaf_hash":   fmt.Sprintf("%x", merkleLeaf(line)),
+		"merkle_root": loc.MerkleRoot,
+		"entry":       json.RawMessage(line),
 	})
 }
 
-func (hw *HashWriter) getChainStatus(c *gin.Context) {
+// getInclusionProof returns the Merkle inclusion proof of an archived entry
+// in its segment, and the seal entry that committed the segment root to the
+// chain. It is served from the entry store alone.
+func (hw *HashWriter) getInclusionProof(c *gin.Context) {
+	messageID := c.Param("message_id")
+	loc, err := hw.store.Locate(c.Request.Context(), messageID)
+	// Entries archived before proofs were recorded have no tree size
+	if err == nil && loc.Size == 0 {
+		err = errNoProof
+	}
+	if errors.Is(err, errEntryNotFound) || errors.Is(err, errNotArchived) || errors.Is(err, errNoProof) {
+		c.JSON(http.StatusNotFound, gin.H{"error": err.Error()})
+		return
+	}
+	if err != nil {
+		c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
+		return
+	}
+
 	c.JSON(http.StatusOK, gin.H{
-		"current_hash": hw.prevHash,
-		"timestamp":    time.Now(),
-		"status":       "active",
+		"message_id":  messageID,
+		"segment_id":  loc.SegmentID,
+		"leaf_index":  loc.Leaf,
+		"tree_size":   loc.Size,
+		"leaf_hash":   loc.LeafHash,
+		"audit_path":  loc.Proof,
+		"merkle_root": loc.MerkleRoot,
+		"seal": gin.H{
+			"message_id": "segment-" + loc.SegmentID,
+			"chain_hash": loc.SealChainHash,
+		},
+		"verified": loc.verifyProof(),
 	})
 }
 
@@ -204,6 +347,20 @@ func getEnv(key, defaultValue string) string {
 	return defaultValue
 }
 
+func getEnvInt(key string, defaultValue int) int {
+	if value, err := strconv.Atoi(os.Getenv(key)); err == nil {
+		return value
+	}
+	return defaultValue
+}
+
+func getEnvDuration(key string, defaultValue time.Duration) time.Duration {
+	if value, err := time.ParseDuration(os.Getenv(key)); err == nil {
+		return value
+	}
+	return defaultValue
+}
+
 func main() {
 	gin.SetMode(gin.ReleaseMode)
 	
@@ -211,11 +368,44 @@ func main() {
 	if err != nil {
 		log.Fatalf("Failed to initialize hash writer: %v", err)
 	}
+	if err := hw.chain.Open(context.Background()); err != nil {
+		log.Fatalf("Failed to recover chain heads: %v", err)
+	}
+	if hw.chain.cfg.By != "" {
+		go hw.chain.RunAnchors(context.Background(), hw.anchorEvery)
+	}
+	if hw.stats != nil {
+		if err := hw.store.EnsureStatsTemplate(context.Background()); err != nil {
+			log.Printf("Warning: Failed to install message stats template: %v", err)
+		}
+		go hw.stats.Run(context.Background(), hw.statsEvery)
+	}
+	go func() {
+		if err := hw.archiver.Run(context.Background(), hw.chain); err != nil {
+			log.Fatalf("Archive segments unavailable: %v", err)
+		}
+	}()
+
+	if traceFile := getEnv("TRACE_FILE", ""); traceFile != "" {
+		spans = NewSpanWriter(traceFile, "hashwriter", 256)
+		go spans.Run(context.Background(), time.Second)
+	}
+	sampleRate, err := strconv.ParseFloat(getEnv("TRACE_SAMPLE_RATE", "1.0"), 64)
+	if err != nil {
+		log.Fatalf("Invalid TRACE_SAMPLE_RATE: %v", err)
+	}
 
 	router := gin.Default()
+	router.Use(traceMiddleware("hashwriter", sampleRate))
 	
 	router.POST("/hash", hw.processHash)
+	router.POST("/hash/batch", hw.processBatch)
 	router.GET("/status", hw.getChainStatus)
+	router.GET("/archive/:message_id", hw.getArchivedEntry)
+	router.GET("/proof/:message_id", hw.getInclusionProof)
+	// OpenMetrics, with message id exemplars, when the scraper accepts it
+	router.GET("/metrics", gin.WrapH(promhttp.HandlerFor(prometheus.DefaultGatherer,
+		promhttp.HandlerOpts{EnableOpenMetrics: true})))
 	router.GET("/health", func(c *gin.Context) {
 		c.JSON(http.StatusOK, gin.H{
 			"status":    "healthy",
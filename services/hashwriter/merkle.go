@@ -0,0 +1,117 @@
+package main
+
+import (
+	"crypto/sha256"
+	"encoding/hex"
+	"fmt"
+)
+
+// Merkle trees follow RFC 6962: leaves are hashed as H(0x00 || data),
+// interior nodes as H(0x01 || left || right), and a tree of n leaves is
+// split after the largest power of two below n. Distinct prefixes keep a
+// leaf from being passed off as a node.
+
+func merkleLeaf(data []byte) [32]byte {
+	h := sha256.New()
+	h.Write([]byte{0})
+	h.Write(data)
+	var sum [32]byte
+	copy(sum[:], h.Sum(nil))
+	return sum
+}
+
+func merkleNode(left, right [32]byte) [32]byte {
+	h := sha256.New()
+	h.Write([]byte{1})
+	h.Write(left[:])
+	h.Write(right[:])
+	var sum [32]byte
+	copy(sum[:], h.Sum(nil))
+	return sum
+}
+
+// merkleRoot returns the hex root over leaf hashes; an empty tree hashes
+// the empty string.
+func merkleRoot(leaves [][32]byte) string {
+	if len(leaves) == 0 {
+		return sha256Hex(nil)
+	}
+	root := merkleSubtree(leaves)
+	return hex.EncodeToString(root[:])
+}
+
+func merkleSubtree(leaves [][32]byte) [32]byte {
+	if len(leaves) == 1 {
+		return leaves[0]
+	}
+	k := 1
+	for k*2 < len(leaves) {
+		k *= 2
+	}
+	return merkleNode(merkleSubtree(leaves[:k]), merkleSubtree(leaves[k:]))
+}
+
+// merkleAuditPaths returns the root over leaves and fills paths[i] with the
+// inclusion proof of leaf i: the sibling subtree hashes from the leaf up
+// to the root, as defined by RFC 6962. All paths are built in one pass
+// over the tree.
+func merkleAuditPaths(leaves [][32]byte, paths [][][32]byte) [32]byte {
+	if len(leaves) == 1 {
+		return leaves[0]
+	}
+	k := 1
+	for k*2 < len(leaves) {
+		k *= 2
+	}
+	left := merkleAuditPaths(leaves[:k], paths[:k])
+	right := merkleAuditPaths(leaves[k:], paths[k:])
+	for i := range paths[:k] {
+		paths[i] = append(paths[i], right)
+	}
+	for i := k; i < len(paths); i++ {
+		paths[i] = append(paths[i], left)
+	}
+	return merkleNode(left, right)
+}
+
+// verifyInclusion checks that leaf is at index in a tree of size leaves
+// with the given root, using the verification algorithm of RFC 9162
+// section 2.1.3.2.
+func verifyInclusion(leaf [32]byte, index, size uint64, path [][32]byte, root [32]byte) bool {
+	if index >= size {
+		return false
+	}
+	fn, sn := index, size-1
+	r := leaf
+	for _, p := range path {
+		if sn == 0 {
+			return false
+		}
+		if fn&1 == 1 || fn == sn {
+			r = merkleNode(p, r)
+			for fn&1 == 0 && fn != 0 {
+				fn >>= 1
+				sn >>= 1
+			}
+		} else {
+			r = merkleNode(r, p)
+		}
+		fn >>= 1
+		sn >>= 1
+	}
+	return sn == 0 && r == root
+}
+
+// decodeHash parses a hex SHA-256 hash.
+func decodeHash(s string) ([32]byte, error) {
+	var sum [32]byte
+	b, err := hex.DecodeString(s)
+	if err != nil {
+		return sum, err
+	}
+	if len(b) != len(sum) {
+		return sum, fmt.Errorf("hash has %d bytes", len(b))
+	}
+	copy(sum[:], b)
+	return sum, nil
+}
@@ -0,0 +1,54 @@
+package main
+
+import (
+	"time"
+
+	"github.com/prometheus/client_golang/prometheus"
+)
+
+// Stage timings of the hash writer, in the stage_seconds histogram the
+// Python services share. Each observation carries a message id of the
+// request or batch as an exemplar, so a slow bucket links to a message
+// whose stages can be looked up in every service.
+var (
+	stageBuckets = []float64{0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+		0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10}
+
+	stageSeconds = prometheus.NewHistogramVec(prometheus.HistogramOpts{
+		Name:    "stage_seconds",
+		Help:    "Time spent in one stage of handling a message",
+		Buckets: stageBuckets,
+	}, []string{"stage"})
+
+	commitBatchEntries = prometheus.NewHistogram(prometheus.HistogramOpts{
+		Name:    "hashwriter_commit_batch_entries",
+		Help:    "Entries written per group commit",
+		Buckets: prometheus.ExponentialBuckets(1, 2, 12),
+	})
+)
+
+// OpenMetrics limits an exemplar's labels to 128 characters.
+const maxExemplarID = 100
+
+func init() {
+	prometheus.MustRegister(stageSeconds, commitBatchEntries)
+}
+
+// observeStage records the time since started in stage, and as a span of
+// each trace in traces.
+func observeStage(stage string, started time.Time, messageID string, traces ...SpanContext) {
+	end := time.Now()
+	recordStage(stage, started, end, messageID, traces)
+	elapsed := end.Sub(started).Seconds()
+	observer := stageSeconds.WithLabelValues(stage)
+	if messageID != "" {
+		if len(messageID) > maxExemplarID {
+			messageID = messageID[:maxExemplarID]
+		}
+		if exemplars, ok := observer.(prometheus.ExemplarObserver); ok {
+			exemplars.ObserveWithExemplar(elapsed, prometheus.Labels{"message_id": messageID})
+			return
+		}
+	}
+	observer.Observe(elapsed)
+}
@@ -0,0 +1,744 @@
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"compress/gzip"
+	"context"
+	"encoding/hex"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"log"
+	"os"
+	"path/filepath"
+	"sort"
+	"strings"
+	"sync"
+	"time"
+)
+
+// SegmentMessageType marks the chain entry that records a sealed segment.
+const SegmentMessageType = "ARCHIVE_SEGMENT"
+
+const segmentIDLayout = "20060102T150405.000000000Z"
+
+var (
+	errEntryNotFound = errors.New("entry not found")
+	errNotArchived   = errors.New("entry not archived yet")
+	errNoProof       = errors.New("entry archived without an inclusion proof")
+)
+
+// SegmentMeta describes a sealed segment. It is kept next to the segment
+// file until the segment is uploaded and its locations are recorded.
+type SegmentMeta struct {
+	SegmentID      string    `json:"segment_id"`
+	Key            string    `json:"key"`
+	IndexKey       string    `json:"index_key"`
+	Entries        int       `json:"entries"`
+	Bytes          int64     `json:"bytes"`
+	MerkleRoot     string    `json:"merkle_root"`
+	FirstMessageID string    `json:"first_message_id"`
+	LastMessageID  string    `json:"last_message_id"`
+	OpenedAt       time.Time `json:"opened_at"`
+	SealedAt       time.Time `json:"sealed_at"`
+	// Chain hash of the entry that recorded MerkleRoot
+	SealChainHash string `json:"seal_chain_hash,omitempty"`
+	Uploaded      bool   `json:"uploaded,omitempty"`
+}
+
+// segmentRecord locates one entry inside a segment: the gzip block at
+// [Offset, Offset+Length) and the line within that block.
+type segmentRecord struct {
+	MessageID string    `json:"message_id"`
+	Timestamp time.Time `json:"ts"`
+	Offset    int64     `json:"offset"`
+	Length    int64     `json:"length"`
+	Line      int       `json:"line"`
+}
+
+// ArchiveLocation is what the entry store keeps per message to find its
+// archived copy. Leaf is the entry's position in the segment Merkle tree
+// of Size leaves, and Proof its inclusion path (hex, leaf to root), so a
+// single lookup proves the entry is covered by the root that the seal
+// entry with SealChainHash committed to the chain.
+type ArchiveLocation struct {
+	MessageID     string    `json:"-"`
+	Timestamp     time.Time `json:"-"`
+	SegmentID     string    `json:"segment_id"`
+	Key           string    `json:"key"`
+	Offset        int64     `json:"offset"`
+	Length        int64     `json:"length"`
+	Line          int       `json:"line"`
+	Leaf          int       `json:"leaf"`
+	Size          int       `json:"size"`
+	LeafHash      string    `json:"leaf_hash"`
+	Proof         []string  `json:"proof"`
+	MerkleRoot    string    `json:"merkle_root"`
+	SealChainHash string    `json:"seal_chain_hash"`
+}
+
+// verifyProof checks the recorded inclusion proof against the root.
+func (loc ArchiveLocation) verifyProof() bool {
+	leaf, err := decodeHash(loc.LeafHash)
+	if err != nil {
+		return false
+	}
+	root, err := decodeHash(loc.MerkleRoot)
+	if err != nil {
+		return false
+	}
+	path := make([][32]byte, len(loc.Proof))
+	for i, node := range loc.Proof {
+		if path[i], err = decodeHash(node); err != nil {
+			return false
+		}
+	}
+	return verifyInclusion(leaf, uint64(loc.Leaf), uint64(loc.Size), path, root)
+}
+
+// SegmentStore uploads sealed segments.
+type SegmentStore interface {
+	// PutSegment stores the segment data and its index, both write-once.
+	PutSegment(meta SegmentMeta, data io.ReadSeeker, index []byte) error
+}
+
+// LocationIndex records where archived entries can be read back.
+type LocationIndex interface {
+	RecordLocations(ctx context.Context, locations []ArchiveLocation) error
+}
+
+// Chain appends entries to the hash chain; *Committer implements it.
+type Chain interface {
+	Submit(ctx context.Context, entries []HashEntry) ([]CommitResult, error)
+}
+
+// SegmentConfig sizes segments and blocks.
+type SegmentConfig struct {
+	Dir           string
+	MaxBytes      int64
+	MaxAge        time.Duration
+	BlockBytes    int
+	FlushInterval time.Duration
+	QueueSize     int
+}
+
+// SegmentArchiver appends committed entries to a local rolling segment
+// instead of uploading one object per entry.
+//
+// Entries are written as JSON lines, grouped into blocks; each block is an
+// independent gzip member, so the segment is an ordinary .jsonl.gz file and
+// a single entry can be read with one ranged GET of its block. A sidecar
+// .idx file lists the block offset and line of every entry and is appended
+// only after the block is written, so it never points past the data.
+//
+// A segment is sealed when it reaches MaxBytes or MaxAge. Sealing computes
+// the Merkle root over the segment's lines; an uploader goroutine then
+// appends an ARCHIVE_SEGMENT entry carrying that root to the chain, uploads
+// the segment and its index once, records each entry's location in the
+// entry store and deletes the local files. Segments left open by a crash
+// are truncated to their last indexed block and sealed on the next start.
+type SegmentArchiver struct {
+	cfg     SegmentConfig
+	store   SegmentStore
+	index   LocationIndex
+	input   chan []HashEntry
+	current *openSegment
+
+	mu     sync.Mutex
+	sealed []SegmentMeta
+	wake   chan struct{}
+}
+
+type openSegment struct {
+	meta    SegmentMeta
+	data    *os.File
+	idx     *os.File
+	size    int64
+	block   bytes.Buffer
+	pending []segmentRecord
+	// entries other than seal records of earlier segments
+	messages int
+}
+
+func NewSegmentArchiver(cfg SegmentConfig, store SegmentStore, index LocationIndex) *SegmentArchiver {
+	if cfg.QueueSize < 1 {
+		cfg.QueueSize = 64
+	}
+	if cfg.FlushInterval <= 0 {
+		cfg.FlushInterval = time.Second
+	}
+	return &SegmentArchiver{
+		cfg:   cfg,
+		store: store,
+		index: index,
+		input: make(chan []HashEntry, cfg.QueueSize),
+		wake:  make(chan struct{}, 1),
+	}
+}
+
+// Archive queues committed entries. It blocks only when the segment writer
+// falls QueueSize batches behind; the writer never waits on the chain.
+func (a *SegmentArchiver) Archive(entries []HashEntry) {
+	a.input <- entries
+}
+
+// Pending returns the number of sealed segments not yet uploaded.
+func (a *SegmentArchiver) Pending() int {
+	a.mu.Lock()
+	defer a.mu.Unlock()
+	return len(a.sealed)
+}
+
+// Run writes segments until ctx is cancelled. Sealed segments are handed
+// to an uploader that records them in chain.
+func (a *SegmentArchiver) Run(ctx context.Context, chain Chain) error {
+	if err := os.MkdirAll(a.cfg.Dir, 0o755); err != nil {
+		return err
+	}
+	if err := a.recover(); err != nil {
+		return err
+	}
+
+	var wg sync.WaitGroup
+	wg.Add(1)
+	go func() {
+		defer wg.Done()
+		a.upload(ctx, chain)
+	}()
+	defer wg.Wait()
+
+	ticker := time.NewTicker(a.cfg.FlushInterval)
+	defer ticker.Stop()
+	for {
+		select {
+		case entries := <-a.input:
+			for _, entry := range entries {
+				if err := a.append(entry); err != nil {
+					log.Printf("Warning: Failed to archive entry %s: %v", entry.MessageID, err)
+				}
+			}
+		case <-ticker.C:
+			if err := a.tick(); err != nil {
+				log.Printf("Warning: Failed to flush archive segment: %v", err)
+			}
+		case <-ctx.Done():
+			// Keep what was written; the segment is sealed on the next start
+			if a.current != nil {
+				a.flushBlock()
+				a.current.data.Close()
+				a.current.idx.Close()
+				a.current = nil
+			}
+			return nil
+		}
+	}
+}
+
+func (a *SegmentArchiver) path(segmentID, ext string) string {
+	return filepath.Join(a.cfg.Dir, segmentID+ext)
+}
+
+func (a *SegmentArchiver) open(now time.Time) error {
+	now = now.UTC()
+	id := now.Format(segmentIDLayout)
+	data, err := os.OpenFile(a.path(id, ".jsonl.gz"), os.O_CREATE|os.O_EXCL|os.O_WRONLY, 0o644)
+	if err != nil {
+		return err
+	}
+	idx, err := os.OpenFile(a.path(id, ".idx"), os.O_CREATE|os.O_TRUNC|os.O_WRONLY, 0o644)
+	if err != nil {
+		data.Close()
+		return err
+	}
+	a.current = &openSegment{meta: newSegmentMeta(id, now), data: data, idx: idx}
+	return nil
+}
+
+func newSegmentMeta(id string, openedAt time.Time) SegmentMeta {
+	prefix := "segments/" + openedAt.Format("2006/01/02") + "/" + id
+	return SegmentMeta{
+		SegmentID: id,
+		Key:       prefix + ".jsonl.gz",
+		IndexKey:  prefix + ".index.json",
+		OpenedAt:  openedAt,
+	}
+}
+
+func (a *SegmentArchiver) append(entry HashEntry) error {
+	if a.current == nil {
+		if err := a.open(time.Now()); err != nil {
+			return err
+		}
+	}
+	line, err := json.Marshal(entry)
+	if err != nil {
+		return err
+	}
+	seg := a.current
+	if entry.MessageType != SegmentMessageType {
+		seg.messages++
+	}
+	seg.pending = append(seg.pending, segmentRecord{
+		MessageID: entry.MessageID,
+		Timestamp: entry.Timestamp,
+		Line:      len(seg.pending),
+	})
+	seg.block.Write(line)
+	seg.block.WriteByte('\n')
+	if seg.block.Len() < a.cfg.BlockBytes {
+		return nil
+	}
+	if err := a.flushBlock(); err != nil {
+		return err
+	}
+	if seg.size >= a.cfg.MaxBytes {
+		return a.seal()
+	}
+	return nil
+}
+
+func (a *SegmentArchiver) tick() error {
+	seg := a.current
+	if seg == nil {
+		return nil
+	}
+	if err := a.flushBlock(); err != nil {
+		return err
+	}
+	// A segment holding only the previous seal record waits for traffic,
+	// otherwise an idle writer would seal one segment per MaxAge forever
+	if seg.messages > 0 && (seg.size >= a.cfg.MaxBytes || time.Since(seg.meta.OpenedAt) >= a.cfg.MaxAge) {
+		return a.seal()
+	}
+	return nil
+}
+
+// flushBlock compresses the buffered lines as one gzip member and indexes them.
+func (a *SegmentArchiver) flushBlock() error {
+	seg := a.current
+	if len(seg.pending) == 0 {
+		return nil
+	}
+	var compressed bytes.Buffer
+	zw := gzip.NewWriter(&compressed)
+	zw.Write(seg.block.Bytes())
+	if err := zw.Close(); err != nil {
+		return err
+	}
+	if _, err := seg.data.Write(compressed.Bytes()); err != nil {
+		// A partial block is cut off again when the segment is recovered
+		return err
+	}
+
+	var records bytes.Buffer
+	enc := json.NewEncoder(&records)
+	for _, record := range seg.pending {
+		record.Offset = seg.size
+		record.Length = int64(compressed.Len())
+		enc.Encode(record)
+	}
+	if _, err := seg.idx.Write(records.Bytes()); err != nil {
+		return err
+	}
+	if seg.meta.FirstMessageID == "" {
+		seg.meta.FirstMessageID = seg.pending[0].MessageID
+	}
+	seg.meta.LastMessageID = seg.pending[len(seg.pending)-1].MessageID
+	seg.meta.Entries += len(seg.pending)
+	seg.size += int64(compressed.Len())
+	seg.block.Reset()
+	seg.pending = seg.pending[:0]
+	return nil
+}
+
+func (a *SegmentArchiver) seal() error {
+	seg := a.current
+	if err := a.flushBlock(); err != nil {
+		return err
+	}
+	a.current = nil
+	syncErr := seg.data.Sync()
+	seg.data.Close()
+	seg.idx.Close()
+	if syncErr != nil {
+		return syncErr
+	}
+	if seg.meta.Entries == 0 {
+		a.remove(seg.meta.SegmentID)
+		return nil
+	}
+	return a.finishSeal(seg.meta)
+}
+
+// finishSeal computes the Merkle root from the data on disk and queues the
+// segment for upload.
+func (a *SegmentArchiver) finishSeal(meta SegmentMeta) error {
+	f, err := os.Open(a.path(meta.SegmentID, ".jsonl.gz"))
+	if err != nil {
+		return err
+	}
+	defer f.Close()
+	root, lines, err := segmentRoot(f)
+	if err != nil {
+		return err
+	}
+	if lines != meta.Entries {
+		return fmt.Errorf("segment %s has %d lines, index has %d", meta.SegmentID, lines, meta.Entries)
+	}
+	info, err := f.Stat()
+	if err != nil {
+		return err
+	}
+	meta.Bytes = info.Size()
+	meta.MerkleRoot = root
+	meta.SealedAt = time.Now().UTC()
+	if err := a.writeMeta(meta); err != nil {
+		return err
+	}
+	log.Printf("Sealed archive segment %s: %d entries, %d bytes, root %s",
+		meta.SegmentID, meta.Entries, meta.Bytes, meta.MerkleRoot)
+	a.enqueue(meta)
+	return nil
+}
+
+func (a *SegmentArchiver) writeMeta(meta SegmentMeta) error {
+	data, err := json.Marshal(meta)
+	if err != nil {
+		return err
+	}
+	tmp := a.path(meta.SegmentID, ".sealed.tmp")
+	if err := os.WriteFile(tmp, data, 0o644); err != nil {
+		return err
+	}
+	return os.Rename(tmp, a.path(meta.SegmentID, ".sealed"))
+}
+
+func (a *SegmentArchiver) enqueue(meta SegmentMeta) {
+	a.mu.Lock()
+	a.sealed = append(a.sealed, meta)
+	a.mu.Unlock()
+	select {
+	case a.wake <- struct{}{}:
+	default:
+	}
+}
+
+func (a *SegmentArchiver) remove(segmentID string) {
+	for _, ext := range []string{".jsonl.gz", ".idx", ".sealed"} {
+		if err := os.Remove(a.path(segmentID, ext)); err != nil && !os.IsNotExist(err) {
+			log.Printf("Warning: Failed to remove %s: %v", a.path(segmentID, ext), err)
+		}
+	}
+}
+
+// recover queues sealed segments and seals segments a previous run left open.
+func (a *SegmentArchiver) recover() error {
+	names, err := filepath.Glob(filepath.Join(a.cfg.Dir, "*.jsonl.gz"))
+	if err != nil {
+		return err
+	}
+	sort.Strings(names)
+	for _, name := range names {
+		id := strings.TrimSuffix(filepath.Base(name), ".jsonl.gz")
+		if data, err := os.ReadFile(a.path(id, ".sealed")); err == nil {
+			var meta SegmentMeta
+			if err := json.Unmarshal(data, &meta); err != nil {
+				return fmt.Errorf("segment %s: %v", id, err)
+			}
+			a.enqueue(meta)
+			continue
+		}
+		meta, err := a.truncate(id)
+		if err != nil {
+			return fmt.Errorf("segment %s: %v", id, err)
+		}
+		if meta.Entries == 0 {
+			a.remove(id)
+			continue
+		}
+		log.Printf("Recovered archive segment %s with %d entries", id, meta.Entries)
+		if err := a.finishSeal(meta); err != nil {
+			return fmt.Errorf("segment %s: %v", id, err)
+		}
+	}
+	return nil
+}
+
+// truncate cuts an unsealed segment back to its last indexed block.
+func (a *SegmentArchiver) truncate(id string) (SegmentMeta, error) {
+	openedAt, err := time.Parse(segmentIDLayout, id)
+	if err != nil {
+		return SegmentMeta{}, err
+	}
+	meta := newSegmentMeta(id, openedAt)
+	records, err := readRecords(a.path(id, ".idx"))
+	if err != nil && !os.IsNotExist(err) {
+		return meta, err
+	}
+	info, err := os.Stat(a.path(id, ".jsonl.gz"))
+	if err != nil {
+		return meta, err
+	}
+	var end int64
+	var kept []segmentRecord
+	for _, record := range records {
+		if record.Offset+record.Length > info.Size() {
+			break
+		}
+		kept = append(kept, record)
+		end = record.Offset + record.Length
+	}
+	if err := os.Truncate(a.path(id, ".jsonl.gz"), end); err != nil {
+		return meta, err
+	}
+	if err := writeRecords(a.path(id, ".idx"), kept); err != nil {
+		return meta, err
+	}
+	meta.Entries = len(kept)
+	if len(kept) > 0 {
+		meta.FirstMessageID = kept[0].MessageID
+		meta.LastMessageID = kept[len(kept)-1].MessageID
+	}
+	return meta, nil
+}
+
+// readRecords reads an index file, stopping at a torn last line.
+func readRecords(path string) ([]segmentRecord, error) {
+	f, err := os.Open(path)
+	if err != nil {
+		return nil, err
+	}
+	defer f.Close()
+	var records []segmentRecord
+	dec := json.NewDecoder(bufio.NewReader(f))
+	for {
+		var record segmentRecord
+		if err := dec.Decode(&record); err != nil {
+			break
+		}
+		records = append(records, record)
+	}
+	return records, nil
+}
+
+func writeRecords(path string, records []segmentRecord) error {
+	var buf bytes.Buffer
+	enc := json.NewEncoder(&buf)
+	for _, record := range records {
+		enc.Encode(record)
+	}
+	return os.WriteFile(path, buf.Bytes(), 0o644)
+}
+
+// segmentRoot returns the Merkle root over the lines of a segment, each
+// line being one archived entry without its newline.
+func segmentRoot(r io.Reader) (string, int, error) {
+	leaves, err := segmentLeaves(r)
+	if err != nil {
+		return "", 0, err
+	}
+	return merkleRoot(leaves), len(leaves), nil
+}
+
+// segmentLeaves returns the Merkle leaf hash of every line of a segment.
+func segmentLeaves(r io.Reader) ([][32]byte, error) {
+	zr, err := gzip.NewReader(r)
+	if err != nil {
+		return nil, err
+	}
+	defer zr.Close()
+	var leaves [][32]byte
+	br := bufio.NewReader(zr)
+	for {
+		line, err := br.ReadBytes('\n')
+		if len(line) > 0 {
+			leaves = append(leaves, merkleLeaf(bytes.TrimSuffix(line, []byte("\n"))))
+		}
+		if err == io.EOF {
+			return leaves, nil
+		}
+		if err != nil {
+			return nil, err
+		}
+	}
+}
+
+// readBlockLine returns line n of one gzip block, as read by a ranged GET.
+func readBlockLine(block io.Reader, n int) ([]byte, error) {
+	zr, err := gzip.NewReader(block)
+	if err != nil {
+		return nil, err
+	}
+	defer zr.Close()
+	zr.Multistream(false)
+	br := bufio.NewReader(zr)
+	for i := 0; ; i++ {
+		line, err := br.ReadBytes('\n')
+		if i == n && len(line) > 0 {
+			return bytes.TrimSuffix(line, []byte("\n")), nil
+		}
+		if err != nil {
+			if err == io.EOF {
+				return nil, fmt.Errorf("block has no line %d", n)
+			}
+			return nil, err
+		}
+	}
+}
+
+// sealEntry is the chain entry that commits a segment's Merkle root.
+func sealEntry(meta SegmentMeta) HashEntry {
+	return HashEntry{
+		Timestamp:     meta.SealedAt,
+		MessageID:     "segment-" + meta.SegmentID,
+		MessageType:   SegmentMessageType,
+		SHA256Payload: meta.MerkleRoot,
+		ChannelID:     "_archive",
+		ValidationData: map[string]interface{}{
+			"segment_id":       meta.SegmentID,
+			"key":              meta.Key,
+			"entries":          meta.Entries,
+			"first_message_id": meta.FirstMessageID,
+			"last_message_id":  meta.LastMessageID,
+			"merkle_root":      meta.MerkleRoot,
+		},
+		Severity: "INFO",
+	}
+}
+
+// upload works through sealed segments in order, retrying each step with
+// backoff until it succeeds or ctx is cancelled.
+func (a *SegmentArchiver) upload(ctx context.Context, chain Chain) {
+	backoff := time.Second
+	for {
+		a.mu.Lock()
+		if len(a.sealed) == 0 {
+			a.mu.Unlock()
+			select {
+			case <-a.wake:
+				continue
+			case <-ctx.Done():
+				return
+			}
+		}
+		meta := a.sealed[0]
+		a.mu.Unlock()
+
+		err := a.publish(ctx, chain, &meta)
+		a.mu.Lock()
+		a.sealed[0] = meta
+		a.mu.Unlock()
+		if err != nil {
+			log.Printf("Warning: Failed to upload archive segment %s, retrying in %s: %v",
+				meta.SegmentID, backoff, err)
+			select {
+			case <-time.After(backoff):
+			case <-ctx.Done():
+				return
+			}
+			if backoff < time.Minute {
+				backoff *= 2
+			}
+			continue
+		}
+		backoff = time.Second
+		a.mu.Lock()
+		a.sealed = a.sealed[1:]
+		a.mu.Unlock()
+		a.remove(meta.SegmentID)
+	}
+}
+
+func (a *SegmentArchiver) publish(ctx context.Context, chain Chain, meta *SegmentMeta) error {
+	if meta.SealChainHash == "" {
+		results, err := chain.Submit(ctx, []HashEntry{sealEntry(*meta)})
+		if err != nil {
+			return err
+		}
+		if results[0].Err != nil {
+			return results[0].Err
+		}
+		meta.SealChainHash = results[0].Entry.ChainHash
+		// Persisted so a restart does not record the root twice
+		if err := a.writeMeta(*meta); err != nil {
+			return err
+		}
+	}
+
+	records, err := readRecords(a.path(meta.SegmentID, ".idx"))
+	if err != nil {
+		return err
+	}
+	if len(records) != meta.Entries {
+		return fmt.Errorf("index has %d of %d entries", len(records), meta.Entries)
+	}
+	indexDoc, err := json.Marshal(struct {
+		SegmentMeta
+		Records []segmentRecord `json:"entries_index"`
+	}{*meta, records})
+	if err != nil {
+		return err
+	}
+	if !meta.Uploaded {
+		data, err := os.Open(a.path(meta.SegmentID, ".jsonl.gz"))
+		if err != nil {
+			return err
+		}
+		started := time.Now()
+		err = a.store.PutSegment(*meta, data, indexDoc)
+		observeStage("s3.write", started, meta.FirstMessageID)
+		data.Close()
+		if err != nil {
+			return err
+		}
+		// Locked objects cannot be replaced, so never upload twice
+		meta.Uploaded = true
+		if err := a.writeMeta(*meta); err != nil {
+			return err
+		}
+	}
+
+	data, err := os.Open(a.path(meta.SegmentID, ".jsonl.gz"))
+	if err != nil {
+		return err
+	}
+	leaves, err := segmentLeaves(data)
+	data.Close()
+	if err != nil {
+		return err
+	}
+	if len(leaves) != len(records) {
+		return fmt.Errorf("segment has %d of %d entries", len(leaves), len(records))
+	}
+	paths := make([][][32]byte, len(leaves))
+	merkleAuditPaths(leaves, paths)
+
+	locations := make([]ArchiveLocation, len(records))
+	for i, record := range records {
+		proof := make([]string, len(paths[i]))
+		for j, node := range paths[i] {
+			proof[j] = hex.EncodeToString(node[:])
+		}
+		locations[i] = ArchiveLocation{
+			MessageID:     record.MessageID,
+			Timestamp:     record.Timestamp,
+			SegmentID:     meta.SegmentID,
+			Key:           meta.Key,
+			Offset:        record.Offset,
+			Length:        record.Length,
+			Line:          record.Line,
+			Leaf:          i,
+			Size:          len(leaves),
+			LeafHash:      hex.EncodeToString(leaves[i][:]),
+			Proof:         proof,
+			MerkleRoot:    meta.MerkleRoot,
+			SealChainHash: meta.SealChainHash,
+		}
+	}
+	if a.index != nil {
+		return a.index.RecordLocations(ctx, locations)
+	}
+	return nil
+}
@@ -0,0 +1,259 @@
+package main
+
+import (
+	"bytes"
+	"context"
+	"encoding/json"
+	"fmt"
+	"io"
+	"os"
+	"path/filepath"
+	"sync"
+	"testing"
+	"time"
+)
+
+type fakeSegmentStore struct {
+	mu      sync.Mutex
+	objects map[string][]byte
+	metas   []SegmentMeta
+}
+
+func (s *fakeSegmentStore) PutSegment(meta SegmentMeta, data io.ReadSeeker, index []byte) error {
+	body, err := io.ReadAll(data)
+	if err != nil {
+		return err
+	}
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	if s.objects == nil {
+		s.objects = map[string][]byte{}
+	}
+	if _, ok := s.objects[meta.Key]; ok {
+		return fmt.Errorf("%s is locked", meta.Key)
+	}
+	s.objects[meta.Key] = body
+	s.objects[meta.IndexKey] = index
+	s.metas = append(s.metas, meta)
+	return nil
+}
+
+func (s *fakeSegmentStore) object(key string) []byte {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	return s.objects[key]
+}
+
+func (s *fakeSegmentStore) segments() []SegmentMeta {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	return append([]SegmentMeta(nil), s.metas...)
+}
+
+type fakeLocationIndex struct {
+	mu        sync.Mutex
+	locations map[string]ArchiveLocation
+}
+
+func (x *fakeLocationIndex) RecordLocations(ctx context.Context, locations []ArchiveLocation) error {
+	x.mu.Lock()
+	defer x.mu.Unlock()
+	if x.locations == nil {
+		x.locations = map[string]ArchiveLocation{}
+	}
+	for _, loc := range locations {
+		x.locations[loc.MessageID] = loc
+	}
+	return nil
+}
+
+func (x *fakeLocationIndex) get(id string) (ArchiveLocation, bool) {
+	x.mu.Lock()
+	defer x.mu.Unlock()
+	loc, ok := x.locations[id]
+	return loc, ok
+}
+
+func waitFor(t *testing.T, what string, cond func() bool) {
+	t.Helper()
+	deadline := time.Now().Add(5 * time.Second)
+	for !cond() {
+		if time.Now().After(deadline) {
+			t.Fatalf("timed out waiting for %s", what)
+		}
+		time.Sleep(5 * time.Millisecond)
+	}
+}
+
+func startArchiver(t *testing.T, cfg SegmentConfig, segments SegmentStore, index LocationIndex) (*SegmentArchiver, *Committer, *fakeStore, context.CancelFunc) {
+	ctx, cancel := context.WithCancel(context.Background())
+	// The committer outlives the archiver so a pending seal can finish
+	chainCtx, cancelChain := context.WithCancel(context.Background())
+	archiver := NewSegmentArchiver(cfg, segments, index)
+	store := &fakeStore{}
+	c := NewCommitter(store, archiver, nil, GenesisHead, 16, 0)
+	go c.Run(chainCtx)
+	done := make(chan struct{})
+	go func() {
+		defer close(done)
+		if err := archiver.Run(ctx, c); err != nil {
+			t.Error(err)
+		}
+	}()
+	stop := func() {
+		cancel()
+		<-done
+		cancelChain()
+	}
+	t.Cleanup(stop)
+	return archiver, c, store, stop
+}
+
+func TestMerkleRootMatchesRFC6962Shape(t *testing.T) {
+	a, b, c := merkleLeaf([]byte("a")), merkleLeaf([]byte("b")), merkleLeaf([]byte("c"))
+	want := merkleNode(merkleNode(a, b), c)
+	if merkleRoot([][32]byte{a, b, c}) != fmt.Sprintf("%x", want) {
+		t.Fatal("three leaves should split after the first two")
+	}
+	if merkleRoot([][32]byte{a}) != fmt.Sprintf("%x", a) {
+		t.Fatal("a single leaf is its own root")
+	}
+}
+
+func TestInclusionProofsVerifyForEveryLeaf(t *testing.T) {
+	for size := 1; size <= 33; size++ {
+		leaves := make([][32]byte, size)
+		for i := range leaves {
+			leaves[i] = merkleLeaf([]byte(fmt.Sprint(i)))
+		}
+		paths := make([][][32]byte, size)
+		root := merkleAuditPaths(leaves, paths)
+		if fmt.Sprintf("%x", root) != merkleRoot(leaves) {
+			t.Fatalf("size %d: audit paths built a different root", size)
+		}
+		for i := range leaves {
+			if !verifyInclusion(leaves[i], uint64(i), uint64(size), paths[i], root) {
+				t.Fatalf("size %d: proof of leaf %d rejected", size, i)
+			}
+			if size > 1 && verifyInclusion(leaves[(i+1)%size], uint64(i), uint64(size), paths[i], root) {
+				t.Fatalf("size %d: proof of leaf %d accepted for another leaf", size, i)
+			}
+			if size > 1 && verifyInclusion(leaves[i], uint64((i+1)%size), uint64(size), paths[i], root) {
+				t.Fatalf("size %d: proof of leaf %d accepted at another position", size, i)
+			}
+		}
+	}
+}
+
+func TestSegmentsSealUploadAndRecordRoot(t *testing.T) {
+	segments := &fakeSegmentStore{}
+	index := &fakeLocationIndex{}
+	cfg := SegmentConfig{Dir: t.TempDir(), MaxBytes: 1, MaxAge: 10 * time.Millisecond, BlockBytes: 512,
+		FlushInterval: 5 * time.Millisecond}
+	_, c, store, _ := startArchiver(t, cfg, segments, index)
+
+	var ids []string
+	for i := 0; i < 40; i++ {
+		ids = append(ids, fmt.Sprintf("m%d", i))
+		if _, err := c.Submit(context.Background(), []HashEntry{testEntry(ids[i])}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	waitFor(t, "locations", func() bool {
+		_, ok := index.get(ids[len(ids)-1])
+		return ok
+	})
+
+	for _, id := range ids {
+		loc, _ := index.get(id)
+		data := segments.object(loc.Key)
+		line, err := readBlockLine(bytes.NewReader(data[loc.Offset:loc.Offset+loc.Length]), loc.Line)
+		if err != nil {
+			t.Fatal(err)
+		}
+		var entry HashEntry
+		if err := json.Unmarshal(line, &entry); err != nil || entry.MessageID != id {
+			t.Fatalf("%s read back as %s (%v)", id, entry.MessageID, err)
+		}
+		if loc.LeafHash != fmt.Sprintf("%x", merkleLeaf(line)) || !loc.verifyProof() || loc.SealChainHash == "" {
+			t.Fatalf("%s: no valid inclusion proof recorded: %+v", id, loc)
+		}
+	}
+
+	// Every uploaded segment's root is in the chain and matches its data.
+	// Seals are committed before their segment is uploaded, so the chain
+	// read after the segments holds the seal of each.
+	uploaded := segments.segments()
+	seals := map[string]HashEntry{}
+	store.mu.Lock()
+	var chain []HashEntry
+	for _, batch := range store.batches {
+		chain = append(chain, batch...)
+	}
+	store.mu.Unlock()
+	verifyChain(t, chain)
+	for _, entry := range chain {
+		if entry.MessageType == SegmentMessageType {
+			seals[entry.ValidationData["segment_id"].(string)] = entry
+		}
+	}
+	for _, meta := range uploaded {
+		root, lines, err := segmentRoot(bytes.NewReader(segments.object(meta.Key)))
+		if err != nil || lines != meta.Entries {
+			t.Fatalf("segment %s: %d lines (%v)", meta.SegmentID, lines, err)
+		}
+		seal, ok := seals[meta.SegmentID]
+		if !ok || seal.SHA256Payload != root || meta.SealChainHash != seal.ChainHash {
+			t.Fatalf("segment %s root %s not recorded in the chain", meta.SegmentID, root)
+		}
+	}
+}
+
+func TestOpenSegmentIsRecoveredOnRestart(t *testing.T) {
+	dir := t.TempDir()
+	cfg := SegmentConfig{Dir: dir, MaxBytes: 1 << 20, MaxAge: time.Hour, BlockBytes: 1, FlushInterval: time.Hour}
+	first := &fakeSegmentStore{}
+	_, c, _, stop := startArchiver(t, cfg, first, nil)
+	for _, id := range []string{"a", "b", "c"} {
+		if _, err := c.Submit(context.Background(), []HashEntry{testEntry(id)}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	names, _ := filepath.Glob(filepath.Join(dir, "*.jsonl.gz"))
+	waitFor(t, "three indexed blocks", func() bool {
+		if len(names) != 1 {
+			names, _ = filepath.Glob(filepath.Join(dir, "*.jsonl.gz"))
+			return false
+		}
+		records, _ := readRecords(names[0][:len(names[0])-len(".jsonl.gz")] + ".idx")
+		return len(records) == 3
+	})
+	stop()
+	if len(first.segments()) != 0 {
+		t.Fatal("segment uploaded before it was sealed")
+	}
+
+	// A torn block after the last indexed one is cut off
+	f, err := os.OpenFile(names[0], os.O_APPEND|os.O_WRONLY, 0o644)
+	if err != nil {
+		t.Fatal(err)
+	}
+	f.Write([]byte{0x1f, 0x8b, 0x08})
+	f.Close()
+
+	second := &fakeSegmentStore{}
+	index := &fakeLocationIndex{}
+	startArchiver(t, cfg, second, index)
+	waitFor(t, "recovered segment", func() bool { return len(second.segments()) == 1 })
+	meta := second.segments()[0]
+	if meta.Entries != 3 || meta.FirstMessageID != "a" || meta.LastMessageID != "c" || meta.SealChainHash == "" {
+		t.Fatalf("unexpected recovered segment %+v", meta)
+	}
+	if _, _, err := segmentRoot(bytes.NewReader(second.object(meta.Key))); err != nil {
+		t.Fatalf("recovered segment unreadable: %v", err)
+	}
+	waitFor(t, "local files removed", func() bool {
+		_, err := os.Stat(names[0])
+		return os.IsNotExist(err)
+	})
+}
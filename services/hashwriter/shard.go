@@ -0,0 +1,327 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"hash/fnv"
+	"log"
+	"net/url"
+	"path/filepath"
+	"sort"
+	"strings"
+	"sync"
+	"time"
+)
+
+// AnchorMessageType marks the entry that folds all shard heads into one root.
+const AnchorMessageType = "CHAIN_ANCHOR"
+
+// anchorShard holds the chain of anchor entries.
+const anchorShard = "_anchor"
+
+// noneShard holds the entries without a shard key.
+const noneShard = "_none"
+
+// shardGenesis is the prevHash of the first entry of a shard. Binding it to
+// the shard name keeps entries from being replayed into another shard; the
+// unsharded chain keeps GenesisHash.
+func shardGenesis(shard string) string {
+	if shard == "" {
+		return GenesisHash
+	}
+	return sha256Hex([]byte("genesis|" + shard))
+}
+
+// ShardConfig selects how entries are spread over independent chains.
+type ShardConfig struct {
+	// By is "" for one global chain, or "channel_id" / "message_type"
+	By string
+	// Count hashes shard keys into that many chains; 0 keeps one per key
+	Count    int
+	HeadFile string
+	MaxBatch int
+	Linger   time.Duration
+}
+
+// ShardedChain keeps one Committer, head and head log per shard, so
+// channels no longer queue behind each other. Shards are opened on first
+// use, resuming from their head log reconciled against the entry store.
+// With sharding off every entry goes to the shard "" and the chain is
+// exactly the single global chain.
+type ShardedChain struct {
+	cfg      ShardConfig
+	store    EntryStore
+	archiver Archiver
+	source   HeadSource
+	ctx      context.Context
+	shards   sync.Map // shard name -> *shardSlot
+
+	openMu sync.RWMutex
+	opened map[string]*Committer
+
+	anchorMu     sync.Mutex
+	lastAnchored map[string]uint64
+}
+
+type shardSlot struct {
+	once      sync.Once
+	committer *Committer
+	err       error
+}
+
+func NewShardedChain(cfg ShardConfig, store EntryStore, archiver Archiver, source HeadSource) *ShardedChain {
+	return &ShardedChain{
+		cfg:      cfg,
+		store:    store,
+		archiver: archiver,
+		source:   source,
+		opened:   map[string]*Committer{},
+	}
+}
+
+// Open resumes the shards that have a head log and runs their committers
+// until ctx is cancelled.
+func (s *ShardedChain) Open(ctx context.Context) error {
+	s.ctx = ctx
+	shards := []string{""}
+	if s.cfg.By != "" {
+		names, err := filepath.Glob(filepath.Join(s.headDir(), "*.wal"))
+		if err != nil {
+			return err
+		}
+		shards = shards[:0]
+		for _, name := range names {
+			shard, err := url.PathUnescape(strings.TrimSuffix(filepath.Base(name), ".wal"))
+			if err == nil {
+				shards = append(shards, shard)
+			}
+		}
+	}
+	for _, shard := range shards {
+		if _, err := s.committer(ctx, shard); err != nil {
+			return fmt.Errorf("shard %q: %v", shard, err)
+		}
+	}
+	return nil
+}
+
+func (s *ShardedChain) headDir() string {
+	return filepath.Join(filepath.Dir(s.cfg.HeadFile), "chain-heads")
+}
+
+func (s *ShardedChain) headPath(shard string) string {
+	if shard == "" {
+		return s.cfg.HeadFile
+	}
+	return filepath.Join(s.headDir(), url.PathEscape(shard)+".wal")
+}
+
+func (s *ShardedChain) shardFor(entry HashEntry) string {
+	var key string
+	switch s.cfg.By {
+	case "":
+		return ""
+	case "message_type":
+		key = entry.MessageType
+	default:
+		key = entry.ChannelID
+	}
+	if s.cfg.Count > 0 {
+		h := fnv.New32a()
+		h.Write([]byte(key))
+		return fmt.Sprintf("%03d", h.Sum32()%uint32(s.cfg.Count))
+	}
+	if key == "" {
+		return noneShard
+	}
+	// Names starting with "_" are internal; a user key starting with one
+	// gets another, so no channel can land in the anchor chain
+	if strings.HasPrefix(key, "_") {
+		return "_" + key
+	}
+	return key
+}
+
+func (s *ShardedChain) committer(ctx context.Context, shard string) (*Committer, error) {
+	value, _ := s.shards.LoadOrStore(shard, &shardSlot{})
+	slot := value.(*shardSlot)
+	slot.once.Do(func() {
+		slot.committer, slot.err = s.open(ctx, shard)
+		if slot.err != nil {
+			// Let the next request try again
+			s.shards.Delete(shard)
+		}
+	})
+	return slot.committer, slot.err
+}
+
+func (s *ShardedChain) open(ctx context.Context, shard string) (*Committer, error) {
+	headLog, logged, found, err := OpenHeadLog(s.headPath(shard))
+	if err != nil {
+		return nil, err
+	}
+	head, err := reconcileHead(ctx, shard, logged, found, s.source)
+	if err != nil {
+		headLog.Close()
+		return nil, err
+	}
+	c := NewCommitter(s.store, s.archiver, headLog, head, s.cfg.MaxBatch, s.cfg.Linger)
+	go c.Run(s.ctx)
+	s.openMu.Lock()
+	s.opened[shard] = c
+	s.openMu.Unlock()
+	log.Printf("Chain shard %q: entry %d (%s) %s", shard, head.Seq, head.MessageID, head.Hash)
+	return c, nil
+}
+
+// Submit commits entries on their shards. Entries of one shard stay
+// adjacent and in order; different shards commit concurrently.
+func (s *ShardedChain) Submit(ctx context.Context, entries []HashEntry) ([]CommitResult, error) {
+	var order []string
+	byShard := map[string][]int{}
+	for i := range entries {
+		shard := s.shardFor(entries[i])
+		if _, ok := byShard[shard]; !ok {
+			order = append(order, shard)
+		}
+		byShard[shard] = append(byShard[shard], i)
+	}
+	if len(order) == 1 {
+		return s.submitShard(ctx, order[0], entries)
+	}
+
+	results := make([]CommitResult, len(entries))
+	var wg sync.WaitGroup
+	for _, shard := range order {
+		wg.Add(1)
+		go func(shard string, indexes []int) {
+			defer wg.Done()
+			group := make([]HashEntry, len(indexes))
+			for j, i := range indexes {
+				group[j] = entries[i]
+			}
+			committed, err := s.submitShard(ctx, shard, group)
+			for j, i := range indexes {
+				if err != nil {
+					results[i] = CommitResult{Err: err}
+				} else {
+					results[i] = committed[j]
+				}
+			}
+		}(shard, byShard[shard])
+	}
+	wg.Wait()
+	return results, nil
+}
+
+func (s *ShardedChain) submitShard(ctx context.Context, shard string, entries []HashEntry) ([]CommitResult, error) {
+	c, err := s.committer(ctx, shard)
+	if err != nil {
+		return nil, err
+	}
+	if shard != "" {
+		stamped := make([]HashEntry, len(entries))
+		for i, entry := range entries {
+			entry.Shard = shard
+			stamped[i] = entry
+		}
+		entries = stamped
+	}
+	return c.Submit(ctx, entries)
+}
+
+// Heads returns the head of every open shard.
+func (s *ShardedChain) Heads() map[string]ChainHead {
+	s.openMu.RLock()
+	defer s.openMu.RUnlock()
+	heads := make(map[string]ChainHead, len(s.opened))
+	for shard, c := range s.opened {
+		heads[shard] = c.Head()
+	}
+	return heads
+}
+
+// anchorHead is one shard head as recorded in an anchor entry.
+type anchorHead struct {
+	Shard string `json:"shard"`
+	Seq   uint64 `json:"seq"`
+	Hash  string `json:"hash"`
+}
+
+// anchorRoot is the Merkle root over heads sorted by shard name.
+func anchorRoot(heads []anchorHead) string {
+	leaves := make([][32]byte, len(heads))
+	for i, head := range heads {
+		leaves[i] = merkleLeaf([]byte(fmt.Sprintf("%s|%d|%s", head.Shard, head.Seq, head.Hash)))
+	}
+	return merkleRoot(leaves)
+}
+
+// Anchor appends an entry to the anchor chain that folds the current head
+// of every shard into one Merkle root. Nothing is written when no shard
+// has moved since the last anchor.
+func (s *ShardedChain) Anchor(ctx context.Context) (*HashEntry, error) {
+	s.anchorMu.Lock()
+	defer s.anchorMu.Unlock()
+
+	current := s.Heads()
+	var heads []anchorHead
+	changed := false
+	for shard, head := range current {
+		if shard == anchorShard || head.Seq == 0 {
+			continue
+		}
+		heads = append(heads, anchorHead{Shard: shard, Seq: head.Seq, Hash: head.Hash})
+		if s.lastAnchored[shard] != head.Seq {
+			changed = true
+		}
+	}
+	if !changed {
+		return nil, nil
+	}
+	sort.Slice(heads, func(i, j int) bool { return heads[i].Shard < heads[j].Shard })
+
+	now := time.Now().UTC()
+	root := anchorRoot(heads)
+	entry := HashEntry{
+		Timestamp:     now,
+		MessageID:     fmt.Sprintf("anchor-%d", now.UnixNano()),
+		MessageType:   AnchorMessageType,
+		SHA256Payload: root,
+		ChannelID:     anchorShard,
+		ValidationData: map[string]interface{}{
+			"heads": heads,
+			"root":  root,
+		},
+		Severity: "INFO",
+	}
+	results, err := s.submitShard(ctx, anchorShard, []HashEntry{entry})
+	if err != nil {
+		return nil, err
+	}
+	if results[0].Err != nil {
+		return nil, results[0].Err
+	}
+	anchored := make(map[string]uint64, len(heads))
+	for _, head := range heads {
+		anchored[head.Shard] = head.Seq
+	}
+	s.lastAnchored = anchored
+	return &results[0].Entry, nil
+}
+
+// RunAnchors anchors the shard heads every interval until ctx is cancelled.
+func (s *ShardedChain) RunAnchors(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-ticker.C:
+			if _, err := s.Anchor(ctx); err != nil {
+				log.Printf("Warning: Failed to anchor chain shards: %v", err)
+			}
+		case <-ctx.Done():
+			return
+		}
+	}
+}
@@ -0,0 +1,173 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"path/filepath"
+	"sync"
+	"testing"
+	"time"
+)
+
+func channelEntry(channel, id string) HashEntry {
+	entry := testEntry(id)
+	entry.ChannelID = channel
+	return entry
+}
+
+func openShardedChain(t *testing.T, cfg ShardConfig, store *fakeStore) *ShardedChain {
+	ctx, cancel := context.WithCancel(context.Background())
+	t.Cleanup(cancel)
+	if cfg.HeadFile == "" {
+		cfg.HeadFile = filepath.Join(t.TempDir(), "chain-head.wal")
+	}
+	cfg.MaxBatch = 16
+	chain := NewShardedChain(cfg, store, nil, &fakeHeadSource{})
+	if err := chain.Open(ctx); err != nil {
+		t.Fatal(err)
+	}
+	return chain
+}
+
+func storedEntries(store *fakeStore) []HashEntry {
+	store.mu.Lock()
+	defer store.mu.Unlock()
+	var entries []HashEntry
+	for _, batch := range store.batches {
+		entries = append(entries, batch...)
+	}
+	return entries
+}
+
+func TestChannelsGetIndependentChains(t *testing.T) {
+	store := &fakeStore{}
+	chain := openShardedChain(t, ShardConfig{By: "channel_id"}, store)
+
+	var wg sync.WaitGroup
+	for _, channel := range []string{"LAB", "RAD", "ADT"} {
+		for i := 0; i < 20; i++ {
+			wg.Add(1)
+			go func(channel string, i int) {
+				defer wg.Done()
+				if _, err := chain.Submit(context.Background(),
+					[]HashEntry{channelEntry(channel, fmt.Sprintf("%s-%d", channel, i))}); err != nil {
+					t.Error(err)
+				}
+			}(channel, i)
+		}
+	}
+	// A batch spanning channels is split by shard and keeps its order
+	batch := []HashEntry{channelEntry("LAB", "b0"), channelEntry("RAD", "b1"), channelEntry("LAB", "b2")}
+	results, err := chain.Submit(context.Background(), batch)
+	wg.Wait()
+	if err != nil {
+		t.Fatal(err)
+	}
+	for i, result := range results {
+		if result.Err != nil || result.Entry.MessageID != batch[i].MessageID {
+			t.Fatalf("result %d: %+v", i, result)
+		}
+	}
+	if results[2].Entry.Seq != results[0].Entry.Seq+1 || results[2].Entry.PrevHash != results[0].Entry.ChainHash {
+		t.Fatal("batch entries of one shard are not adjacent")
+	}
+
+	anchor, err := chain.Anchor(context.Background())
+	if err != nil || anchor == nil {
+		t.Fatalf("anchor: %v", err)
+	}
+	if again, _ := chain.Anchor(context.Background()); again != nil {
+		t.Fatal("anchored again without new entries")
+	}
+
+	entries := storedEntries(store)
+	if problems := verifyChains(entries); len(problems) > 0 {
+		t.Fatal(problems)
+	}
+	heads := chain.Heads()
+	if heads["LAB"].Seq != 22 || heads["RAD"].Seq != 21 || heads["ADT"].Seq != 20 || heads[anchorShard].Seq != 1 {
+		t.Fatalf("unexpected heads %+v", heads)
+	}
+	for _, entry := range entries {
+		if entry.Shard != entry.ChannelID {
+			t.Fatalf("entry %s in shard %q", entry.MessageID, entry.Shard)
+		}
+	}
+}
+
+func TestVerifierDetectsTamperingAcrossShards(t *testing.T) {
+	store := &fakeStore{}
+	chain := openShardedChain(t, ShardConfig{By: "channel_id", Count: 4}, store)
+	for i := 0; i < 30; i++ {
+		entry := channelEntry(fmt.Sprintf("CH%d", i%7), fmt.Sprintf("m%d", i))
+		if _, err := chain.Submit(context.Background(), []HashEntry{entry}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if _, err := chain.Anchor(context.Background()); err != nil {
+		t.Fatal(err)
+	}
+	entries := storedEntries(store)
+	if problems := verifyChains(entries); len(problems) > 0 {
+		t.Fatal(problems)
+	}
+	if len(chain.Heads()) > 5 {
+		t.Fatalf("%d shards for a count of 4", len(chain.Heads()))
+	}
+
+	// Rewriting the newest entry of a shard keeps its chain consistent, but
+	// not the anchor
+	var last HashEntry
+	for _, entry := range entries {
+		if entry.Shard != anchorShard && entry.Seq > last.Seq {
+			last = entry
+		}
+	}
+	tampered := append([]HashEntry(nil), entries...)
+	for i, entry := range tampered {
+		if entry.MessageID == last.MessageID {
+			entry.SHA256Payload = sha256Hex([]byte("forged"))
+			entry.ChainHash = chainHash(entry, entry.PrevHash)
+			tampered[i] = entry
+		}
+	}
+	if problems := verifyChains(tampered); len(problems) != 1 {
+		t.Fatalf("expected the anchor mismatch only, got %v", problems)
+	}
+}
+
+func TestShardsResumeFromTheirHeadLogs(t *testing.T) {
+	headFile := filepath.Join(t.TempDir(), "chain-head.wal")
+	cfg := ShardConfig{By: "channel_id", HeadFile: headFile, Linger: time.Millisecond}
+	first := openShardedChain(t, cfg, &fakeStore{})
+	for _, channel := range []string{"LAB", "RAD"} {
+		if _, err := first.Submit(context.Background(), []HashEntry{channelEntry(channel, channel+"-1")}); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	second := openShardedChain(t, cfg, &fakeStore{})
+	heads := second.Heads()
+	if len(heads) != 2 || heads["LAB"] != first.Heads()["LAB"] || heads["RAD"].Seq != 1 {
+		t.Fatalf("shards not resumed: %+v", heads)
+	}
+	results, _ := second.Submit(context.Background(), []HashEntry{channelEntry("LAB", "LAB-2")})
+	if results[0].Entry.PrevHash != heads["LAB"].Hash || results[0].Entry.Seq != 2 {
+		t.Fatal("resumed shard does not continue its chain")
+	}
+}
+
+func TestUserKeysNeverNameInternalShards(t *testing.T) {
+	chain := NewShardedChain(ShardConfig{By: "channel_id"}, &fakeStore{}, nil, &fakeHeadSource{})
+	for key, want := range map[string]string{
+		"LAB":     "LAB",
+		"":        noneShard,
+		"_anchor": "__anchor",
+		"_none":   "__none",
+		"__x":     "___x",
+	} {
+		if got := chain.shardFor(channelEntry(key, "A")); got != want {
+			t.Errorf("shard of %q is %q, want %q", key, got, want)
+		}
+	}
+}
@@ -0,0 +1,214 @@
+package main
+
+import (
+	"bytes"
+	"context"
+	"encoding/json"
+	"fmt"
+	"log"
+	"strings"
+	"sync"
+	"time"
+)
+
+// StatsKey identifies one message counter: the day of the entry's audit
+// index, its channel, message type and overall severity.
+type StatsKey struct {
+	Day         string `json:"day"`
+	ChannelID   string `json:"channel_id"`
+	MessageType string `json:"msgType"`
+	Severity    string `json:"severity"`
+}
+
+// StatsCount is a number of messages to add to a counter.
+type StatsCount struct {
+	StatsKey
+	Count int64 `json:"count"`
+}
+
+// id is the counter's document id; the reporter's backfill uses the same.
+func (k StatsKey) id() string {
+	return strings.Join([]string{k.Day, k.ChannelID, k.MessageType, k.Severity}, "|")
+}
+
+// StatsStore adds counts to the persisted counters.
+type StatsStore interface {
+	// AddCounts returns the counts it could not apply, or an error when
+	// none were applied.
+	AddCounts(ctx context.Context, counts []StatsCount) ([]StatsCount, error)
+}
+
+// StatsAggregator keeps per day × channel × message type × severity
+// counters of committed messages. It is fed as an Archiver, so counting
+// costs the committer one map update per entry; the counts accumulated
+// since the last flush are added to the store every interval. Counts that
+// fail to flush are kept for the next one. A crash loses at most one
+// interval, which the reporter's backfill repairs.
+type StatsAggregator struct {
+	store   StatsStore
+	mu      sync.Mutex
+	pending map[StatsKey]int64
+}
+
+func NewStatsAggregator(store StatsStore) *StatsAggregator {
+	return &StatsAggregator{store: store, pending: map[StatsKey]int64{}}
+}
+
+// Archive counts committed messages; seal and anchor entries are not
+// messages and are left out.
+func (s *StatsAggregator) Archive(entries []HashEntry) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	for _, entry := range entries {
+		if entry.MessageType == SegmentMessageType || entry.MessageType == AnchorMessageType {
+			continue
+		}
+		s.pending[StatsKey{
+			Day:         entry.Timestamp.Format("2006-01-02"),
+			ChannelID:   entry.ChannelID,
+			MessageType: entry.MessageType,
+			Severity:    entry.Severity,
+		}]++
+	}
+}
+
+// Flush adds the pending counts to the store.
+func (s *StatsAggregator) Flush(ctx context.Context) error {
+	s.mu.Lock()
+	pending := s.pending
+	s.pending = map[StatsKey]int64{}
+	s.mu.Unlock()
+	if len(pending) == 0 {
+		return nil
+	}
+
+	counts := make([]StatsCount, 0, len(pending))
+	for key, n := range pending {
+		counts = append(counts, StatsCount{StatsKey: key, Count: n})
+	}
+	failed, err := s.store.AddCounts(ctx, counts)
+	if err != nil {
+		failed = counts
+	}
+	if len(failed) > 0 {
+		s.mu.Lock()
+		for _, count := range failed {
+			s.pending[count.StatsKey] += count.Count
+		}
+		s.mu.Unlock()
+	}
+	if err == nil && len(failed) > 0 {
+		err = fmt.Errorf("%d of %d counters not updated", len(failed), len(counts))
+	}
+	return err
+}
+
+// Run flushes every interval until ctx is cancelled, then once more.
+func (s *StatsAggregator) Run(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-ticker.C:
+			if err := s.Flush(ctx); err != nil {
+				log.Printf("Warning: Failed to flush message stats, retrying: %v", err)
+			}
+		case <-ctx.Done():
+			flushCtx, cancel := context.WithTimeout(context.Background(), 10*time.Second)
+			if err := s.Flush(flushCtx); err != nil {
+				log.Printf("Warning: Message stats not flushed on shutdown: %v", err)
+			}
+			cancel()
+			return
+		}
+	}
+}
+
+// statsIndexName is the monthly index of a counter, "<prefix>-YYYY.MM".
+func statsIndexName(prefix, day string) string {
+	return fmt.Sprintf("%s-%s", prefix, strings.ReplaceAll(day[:7], "-", "."))
+}
+
+// statsTemplate maps the counter documents; without it the dimensions
+// would be mapped as text.
+const statsTemplate = `{
+  "index_patterns": ["%s-*"],
+  "settings": {"number_of_shards": 1, "number_of_replicas": 1},
+  "mappings": {
+    "properties": {
+      "day": {"type": "date", "format": "strict_date"},
+      "channel_id": {"type": "keyword"},
+      "msgType": {"type": "keyword"},
+      "severity": {"type": "keyword"},
+      "count": {"type": "long"}
+    }
+  }
+}`
+
+// EnsureStatsTemplate installs the index template of the counters.
+func (s *esStore) EnsureStatsTemplate(ctx context.Context) error {
+	body := fmt.Sprintf(statsTemplate, s.statsPrefix)
+	res, err := s.client.Indices.PutTemplate(s.statsPrefix, strings.NewReader(body),
+		s.client.Indices.PutTemplate.WithContext(ctx))
+	if err != nil {
+		return err
+	}
+	defer res.Body.Close()
+	if res.IsError() {
+		return fmt.Errorf("put template failed: %s", res.String())
+	}
+	return nil
+}
+
+// AddCounts increments the counter documents with one _bulk request of
+// scripted upserts.
+func (s *esStore) AddCounts(ctx context.Context, counts []StatsCount) ([]StatsCount, error) {
+	var body bytes.Buffer
+	enc := json.NewEncoder(&body)
+	for _, count := range counts {
+		action := map[string]map[string]interface{}{
+			"update": {"_index": statsIndexName(s.statsPrefix, count.Day), "_id": count.id(), "retry_on_conflict": 3},
+		}
+		if err := enc.Encode(action); err != nil {
+			return nil, err
+		}
+		update := map[string]interface{}{
+			"script": map[string]interface{}{
+				"source": "ctx._source.count += params.n",
+				"lang":   "painless",
+				"params": map[string]int64{"n": count.Count},
+			},
+			"upsert": count,
+		}
+		if err := enc.Encode(update); err != nil {
+			return nil, err
+		}
+	}
+
+	res, err := s.client.Bulk(bytes.NewReader(body.Bytes()), s.client.Bulk.WithContext(ctx))
+	if err != nil {
+		return nil, fmt.Errorf("Error updating message stats: %s", err)
+	}
+	defer res.Body.Close()
+	if res.IsError() {
+		return nil, fmt.Errorf("Error updating message stats: %s", res.String())
+	}
+	var parsed bulkResponse
+	if err := json.NewDecoder(res.Body).Decode(&parsed); err != nil {
+		return nil, fmt.Errorf("Error reading bulk response: %s", err)
+	}
+	if len(parsed.Items) != len(counts) {
+		return nil, fmt.Errorf("bulk response has %d items for %d counters", len(parsed.Items), len(counts))
+	}
+	var failed []StatsCount
+	if parsed.Errors {
+		for i, item := range parsed.Items {
+			for _, result := range item {
+				if result.Status > 299 {
+					failed = append(failed, counts[i])
+				}
+			}
+		}
+	}
+	return failed, nil
+}
@@ -0,0 +1,112 @@
+package main
+
+import (
+	"context"
+	"errors"
+	"sync"
+	"testing"
+	"time"
+)
+
+type fakeStatsStore struct {
+	mu     sync.Mutex
+	counts map[StatsKey]int64
+	reject map[string]bool
+	fail   error
+}
+
+func (s *fakeStatsStore) AddCounts(ctx context.Context, counts []StatsCount) ([]StatsCount, error) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	if s.fail != nil {
+		return nil, s.fail
+	}
+	var failed []StatsCount
+	for _, count := range counts {
+		if s.reject[count.ChannelID] {
+			failed = append(failed, count)
+			continue
+		}
+		s.counts[count.StatsKey] += count.Count
+	}
+	return failed, nil
+}
+
+func statsEntry(channel, severity string, ts time.Time) HashEntry {
+	return HashEntry{Timestamp: ts, ChannelID: channel, MessageType: "ADT^A01", Severity: severity}
+}
+
+func TestStatsAggregatorCountsMessages(t *testing.T) {
+	store := &fakeStatsStore{counts: map[StatsKey]int64{}}
+	stats := NewStatsAggregator(store)
+	day := time.Date(2023, 12, 1, 23, 0, 0, 0, time.UTC)
+	stats.Archive([]HashEntry{
+		statsEntry("LAB", "INFO", day),
+		statsEntry("LAB", "INFO", day),
+		statsEntry("LAB", "ERROR", day.Add(2*time.Hour)),
+		{Timestamp: day, ChannelID: "_archive", MessageType: SegmentMessageType},
+		{Timestamp: day, ChannelID: anchorShard, MessageType: AnchorMessageType},
+	})
+	stats.Archive([]HashEntry{statsEntry("LAB", "INFO", day)})
+	if err := stats.Flush(context.Background()); err != nil {
+		t.Fatal(err)
+	}
+
+	want := map[StatsKey]int64{
+		{Day: "2023-12-01", ChannelID: "LAB", MessageType: "ADT^A01", Severity: "INFO"}:  3,
+		{Day: "2023-12-02", ChannelID: "LAB", MessageType: "ADT^A01", Severity: "ERROR"}: 1,
+	}
+	if len(store.counts) != len(want) {
+		t.Fatalf("got %v, want %v", store.counts, want)
+	}
+	for key, n := range want {
+		if store.counts[key] != n {
+			t.Fatalf("%v: got %d, want %d", key, store.counts[key], n)
+		}
+	}
+
+	// Nothing is added twice
+	if err := stats.Flush(context.Background()); err != nil {
+		t.Fatal(err)
+	}
+	if store.counts[StatsKey{Day: "2023-12-01", ChannelID: "LAB", MessageType: "ADT^A01", Severity: "INFO"}] != 3 {
+		t.Fatalf("counts flushed twice: %v", store.counts)
+	}
+}
+
+func TestStatsAggregatorKeepsFailedCounts(t *testing.T) {
+	store := &fakeStatsStore{counts: map[StatsKey]int64{}, reject: map[string]bool{"RAD": true}}
+	stats := NewStatsAggregator(store)
+	day := time.Date(2023, 12, 1, 12, 0, 0, 0, time.UTC)
+	stats.Archive([]HashEntry{statsEntry("LAB", "INFO", day), statsEntry("RAD", "INFO", day)})
+	if err := stats.Flush(context.Background()); err == nil {
+		t.Fatal("expected an error for the rejected counter")
+	}
+
+	store.fail = errors.New("cluster unavailable")
+	stats.Archive([]HashEntry{statsEntry("RAD", "INFO", day)})
+	if err := stats.Flush(context.Background()); err == nil {
+		t.Fatal("expected the store error")
+	}
+
+	store.fail = nil
+	store.reject = nil
+	if err := stats.Flush(context.Background()); err != nil {
+		t.Fatal(err)
+	}
+	rad := StatsKey{Day: "2023-12-01", ChannelID: "RAD", MessageType: "ADT^A01", Severity: "INFO"}
+	lab := StatsKey{Day: "2023-12-01", ChannelID: "LAB", MessageType: "ADT^A01", Severity: "INFO"}
+	if store.counts[rad] != 2 || store.counts[lab] != 1 {
+		t.Fatalf("got %v", store.counts)
+	}
+}
+
+func TestStatsIndexName(t *testing.T) {
+	if got := statsIndexName("compliance-stats", "2023-12-01"); got != "compliance-stats-2023.12" {
+		t.Fatalf("got %s", got)
+	}
+	key := StatsKey{Day: "2023-12-01", ChannelID: "LAB", MessageType: "ORU^R01", Severity: "WARNING"}
+	if key.id() != "2023-12-01|LAB|ORU^R01|WARNING" {
+		t.Fatalf("got %s", key.id())
+	}
+}
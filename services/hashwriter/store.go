@@ -0,0 +1,326 @@
+package main
+
+import (
+	"bytes"
+	"context"
+	"encoding/json"
+	"fmt"
+	"io"
+	"log"
+	"net/http"
+	"time"
+
+	"github.com/aws/aws-sdk-go/aws"
+	"github.com/aws/aws-sdk-go/service/s3"
+	"github.com/elastic/go-elasticsearch/v7"
+)
+
+func indexName(prefix string, ts time.Time) string {
+	return fmt.Sprintf("%s-%s", prefix, ts.Format("2006.01.02"))
+}
+
+// esStore writes entries with one _bulk request. Entries become
+// searchable on the next index refresh; nothing forces one.
+type esStore struct {
+	client      *elasticsearch.Client
+	indexPrefix string
+	statsPrefix string
+}
+
+type bulkResponse struct {
+	Errors bool `json:"errors"`
+	Items  []map[string]struct {
+		Status int             `json:"status"`
+		Error  json.RawMessage `json:"error"`
+	} `json:"items"`
+}
+
+// WriteEntries creates each entry's document, so a message id that is
+// already stored comes back as a conflict instead of being overwritten.
+// Only ids in overwrite, the first time each appears, are indexed over.
+func (s *esStore) WriteEntries(ctx context.Context, entries []HashEntry, overwrite map[string]bool) ([]error, error) {
+	var body bytes.Buffer
+	enc := json.NewEncoder(&body)
+	indexed := map[string]bool{}
+	for _, entry := range entries {
+		op := "create"
+		if overwrite[entry.MessageID] && !indexed[entry.MessageID] {
+			op = "index"
+			indexed[entry.MessageID] = true
+		}
+		action := map[string]map[string]string{
+			op: {"_index": indexName(s.indexPrefix, entry.Timestamp), "_id": entry.MessageID},
+		}
+		if err := enc.Encode(action); err != nil {
+			return nil, err
+		}
+		if err := enc.Encode(entry); err != nil {
+			return nil, err
+		}
+	}
+
+	res, err := s.client.Bulk(bytes.NewReader(body.Bytes()), s.client.Bulk.WithContext(ctx))
+	if err != nil {
+		return nil, fmt.Errorf("Error indexing documents: %s", err)
+	}
+	defer res.Body.Close()
+	if res.IsError() {
+		return nil, fmt.Errorf("Error indexing documents: %s", res.String())
+	}
+
+	var parsed bulkResponse
+	if err := json.NewDecoder(res.Body).Decode(&parsed); err != nil {
+		return nil, fmt.Errorf("Error reading bulk response: %s", err)
+	}
+	if len(parsed.Items) != len(entries) {
+		return nil, fmt.Errorf("bulk response has %d items for %d entries", len(parsed.Items), len(entries))
+	}
+	errs := make([]error, len(entries))
+	if parsed.Errors {
+		for i, item := range parsed.Items {
+			for _, result := range item {
+				switch {
+				case result.Status == http.StatusConflict:
+					errs[i] = s.duplicate(ctx, entries[i])
+				case result.Status > 299:
+					errs[i] = fmt.Errorf("Error indexing document: status %d: %s", result.Status, result.Error)
+				}
+			}
+		}
+	}
+	return errs, nil
+}
+
+// duplicate reads back the stored entry of a message id that already
+// exists; the read is realtime, so it sees a document created in the
+// same bulk request.
+func (s *esStore) duplicate(ctx context.Context, entry HashEntry) error {
+	res, err := s.client.Get(indexName(s.indexPrefix, entry.Timestamp), entry.MessageID, s.client.Get.WithContext(ctx))
+	if err != nil {
+		return fmt.Errorf("message %s already exists, reading it failed: %s", entry.MessageID, err)
+	}
+	defer res.Body.Close()
+	if res.IsError() {
+		return fmt.Errorf("message %s already exists, reading it failed: %s", entry.MessageID, res.String())
+	}
+	var parsed struct {
+		Source HashEntry `json:"_source"`
+	}
+	if err := json.NewDecoder(res.Body).Decode(&parsed); err != nil {
+		return fmt.Errorf("message %s already exists, reading it failed: %s", entry.MessageID, err)
+	}
+	return &DuplicateEntryError{Entry: parsed.Source}
+}
+
+// LatestHead returns the shard's stored entry with the highest seq.
+// Entries written before seq existed are not considered.
+func (s *esStore) LatestHead(ctx context.Context, shard string) (ChainHead, bool, error) {
+	filter := map[string]interface{}{
+		"must": []interface{}{map[string]interface{}{"exists": map[string]interface{}{"field": "seq"}}},
+	}
+	if shard == "" {
+		filter["must_not"] = map[string]interface{}{"exists": map[string]interface{}{"field": "shard"}}
+	} else {
+		filter["filter"] = map[string]interface{}{"term": map[string]interface{}{"shard": shard}}
+	}
+	query, _ := json.Marshal(map[string]interface{}{
+		"sort": []interface{}{
+			map[string]interface{}{"seq": map[string]interface{}{"order": "desc", "unmapped_type": "long"}},
+		},
+		"query":   map[string]interface{}{"bool": filter},
+		"_source": []string{"chainHash", "seq", "message_id", "ts"},
+	})
+	res, err := s.client.Search(
+		s.client.Search.WithContext(ctx),
+		s.client.Search.WithIndex(s.indexPrefix+"-*"),
+		s.client.Search.WithBody(bytes.NewReader(query)),
+		s.client.Search.WithSize(1),
+		s.client.Search.WithIgnoreUnavailable(true),
+		s.client.Search.WithAllowNoIndices(true),
+	)
+	if err != nil {
+		return ChainHead{}, false, err
+	}
+	defer res.Body.Close()
+	if res.IsError() {
+		return ChainHead{}, false, fmt.Errorf("search failed: %s", res.String())
+	}
+	var parsed struct {
+		Hits struct {
+			Hits []struct {
+				Source HashEntry `json:"_source"`
+			} `json:"hits"`
+		} `json:"hits"`
+	}
+	if err := json.NewDecoder(res.Body).Decode(&parsed); err != nil {
+		return ChainHead{}, false, err
+	}
+	if len(parsed.Hits.Hits) == 0 {
+		return ChainHead{}, false, nil
+	}
+	return headOf(parsed.Hits.Hits[0].Source), true, nil
+}
+
+// HasHead fetches the head's entry by id, which does not wait for a refresh.
+func (s *esStore) HasHead(ctx context.Context, head ChainHead) (bool, error) {
+	res, err := s.client.Get(indexName(s.indexPrefix, head.Timestamp), head.MessageID, s.client.Get.WithContext(ctx))
+	if err != nil {
+		return false, err
+	}
+	defer res.Body.Close()
+	if res.StatusCode == 404 {
+		return false, nil
+	}
+	if res.IsError() {
+		return false, fmt.Errorf("get failed: %s", res.String())
+	}
+	var parsed struct {
+		Source HashEntry `json:"_source"`
+	}
+	if err := json.NewDecoder(res.Body).Decode(&parsed); err != nil {
+		return false, err
+	}
+	return parsed.Source.ChainHash == head.Hash, nil
+}
+
+// RecordLocations adds each entry's archive location to its document.
+func (s *esStore) RecordLocations(ctx context.Context, locations []ArchiveLocation) error {
+	const chunk = 1000
+	for start := 0; start < len(locations); start += chunk {
+		end := start + chunk
+		if end > len(locations) {
+			end = len(locations)
+		}
+		var body bytes.Buffer
+		enc := json.NewEncoder(&body)
+		for _, loc := range locations[start:end] {
+			action := map[string]map[string]string{
+				"update": {"_index": indexName(s.indexPrefix, loc.Timestamp), "_id": loc.MessageID},
+			}
+			if err := enc.Encode(action); err != nil {
+				return err
+			}
+			if err := enc.Encode(map[string]interface{}{"doc": map[string]interface{}{"archive": loc}}); err != nil {
+				return err
+			}
+		}
+
+		res, err := s.client.Bulk(bytes.NewReader(body.Bytes()), s.client.Bulk.WithContext(ctx))
+		if err != nil {
+			return fmt.Errorf("Error recording archive locations: %s", err)
+		}
+		var parsed bulkResponse
+		err = json.NewDecoder(res.Body).Decode(&parsed)
+		res.Body.Close()
+		if res.IsError() {
+			return fmt.Errorf("Error recording archive locations: %s", res.String())
+		}
+		if err != nil {
+			return fmt.Errorf("Error reading bulk response: %s", err)
+		}
+		if parsed.Errors {
+			// Retrying does not help a missing document; report and move on
+			failed := 0
+			for _, item := range parsed.Items {
+				for _, result := range item {
+					if result.Status > 299 {
+						failed++
+					}
+				}
+			}
+			log.Printf("Warning: %d archive locations not recorded", failed)
+		}
+	}
+	return nil
+}
+
+// Locate finds the archive location recorded for a message.
+func (s *esStore) Locate(ctx context.Context, messageID string) (ArchiveLocation, error) {
+	query, _ := json.Marshal(map[string]interface{}{
+		"query":   map[string]interface{}{"ids": map[string]interface{}{"values": []string{messageID}}},
+		"_source": []string{"archive"},
+	})
+	res, err := s.client.Search(
+		s.client.Search.WithContext(ctx),
+		s.client.Search.WithIndex(s.indexPrefix+"-*"),
+		s.client.Search.WithBody(bytes.NewReader(query)),
+		s.client.Search.WithSize(1),
+	)
+	if err != nil {
+		return ArchiveLocation{}, err
+	}
+	defer res.Body.Close()
+	if res.IsError() {
+		return ArchiveLocation{}, fmt.Errorf("search failed: %s", res.String())
+	}
+	var parsed struct {
+		Hits struct {
+			Hits []struct {
+				Source struct {
+					Archive *ArchiveLocation `json:"archive"`
+				} `json:"_source"`
+			} `json:"hits"`
+		} `json:"hits"`
+	}
+	if err := json.NewDecoder(res.Body).Decode(&parsed); err != nil {
+		return ArchiveLocation{}, err
+	}
+	if len(parsed.Hits.Hits) == 0 {
+		return ArchiveLocation{}, errEntryNotFound
+	}
+	loc := parsed.Hits.Hits[0].Source.Archive
+	if loc == nil {
+		return ArchiveLocation{}, errNotArchived
+	}
+	loc.MessageID = messageID
+	return *loc, nil
+}
+
+// s3SegmentStore uploads sealed segments with object lock. Each segment is
+// two objects, written once: the gzip data and its JSON index.
+type s3SegmentStore struct {
+	client *s3.S3
+	bucket string
+}
+
+func (s *s3SegmentStore) PutSegment(meta SegmentMeta, data io.ReadSeeker, index []byte) error {
+	metadata := map[string]*string{
+		"merkle-root": aws.String(meta.MerkleRoot),
+		"entries":     aws.String(fmt.Sprint(meta.Entries)),
+	}
+	if err := s.put(meta.Key, data, "application/gzip", metadata); err != nil {
+		return err
+	}
+	return s.put(meta.IndexKey, bytes.NewReader(index), "application/json", metadata)
+}
+
+func (s *s3SegmentStore) put(key string, body io.ReadSeeker, contentType string, metadata map[string]*string) error {
+	_, err := s.client.PutObject(&s3.PutObjectInput{
+		Bucket:                    aws.String(s.bucket),
+		Key:                       aws.String(key),
+		Body:                      body,
+		ContentType:               aws.String(contentType),
+		Metadata:                  metadata,
+		ServerSideEncryption:      aws.String("AES256"),
+		ObjectLockMode:            aws.String("COMPLIANCE"),
+		ObjectLockRetainUntilDate: aws.Time(time.Now().AddDate(10, 0, 0)), // 10 years
+	})
+	if err != nil {
+		return fmt.Errorf("Error storing %s in S3: %s", key, err)
+	}
+	return nil
+}
+
+// ReadRange reads length bytes at offset of an object.
+func (s *s3SegmentStore) ReadRange(key string, offset, length int64) ([]byte, error) {
+	out, err := s.client.GetObject(&s3.GetObjectInput{
+		Bucket: aws.String(s.bucket),
+		Key:    aws.String(key),
+		Range:  aws.String(fmt.Sprintf("bytes=%d-%d", offset, offset+length-1)),
+	})
+	if err != nil {
+		return nil, err
+	}
+	defer out.Body.Close()
+	return io.ReadAll(out.Body)
+}
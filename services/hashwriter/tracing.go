@@ -0,0 +1,220 @@
+package main
+
+import (
+	"context"
+	"encoding/hex"
+	"encoding/json"
+	"log"
+	"math/rand"
+	"os"
+	"strconv"
+	"strings"
+	"sync"
+	"time"
+
+	"github.com/gin-gonic/gin"
+)
+
+// SpanContext identifies a span of a W3C trace context.
+type SpanContext struct {
+	TraceID string
+	SpanID  string
+	Sampled bool
+}
+
+// spanRecord is one line of the span file, as the Python services write
+// it (common/tracing.py).
+type spanRecord struct {
+	TraceID    string `json:"trace_id"`
+	SpanID     string `json:"span_id"`
+	ParentID   string `json:"parent_id,omitempty"`
+	Service    string `json:"service"`
+	Name       string `json:"name"`
+	StartUS    int64  `json:"start_us"`
+	DurationUS int64  `json:"duration_us"`
+	MessageID  string `json:"message_id,omitempty"`
+}
+
+// traceMessageKey is the gin context key naming the message of a request.
+const traceMessageKey = "trace_message_id"
+
+type spanContextKey struct{}
+
+func contextWithSpan(ctx context.Context, span SpanContext) context.Context {
+	return context.WithValue(ctx, spanContextKey{}, span)
+}
+
+// spanFromContext returns the span of the request ctx belongs to, or the
+// zero SpanContext, which is never recorded.
+func spanFromContext(ctx context.Context) SpanContext {
+	span, _ := ctx.Value(spanContextKey{}).(SpanContext)
+	return span
+}
+
+func isTraceHex(value string, length int) bool {
+	if len(value) != length || strings.Trim(value, "0") == "" {
+		return false
+	}
+	_, err := hex.DecodeString(value)
+	return err == nil && strings.ToLower(value) == value
+}
+
+// parseTraceparent reads a W3C traceparent header.
+func parseTraceparent(header string) (SpanContext, bool) {
+	parts := strings.Split(strings.TrimSpace(header), "-")
+	if len(parts) < 4 || len(parts[0]) != 2 || parts[0] == "ff" || (parts[0] == "00" && len(parts) != 4) {
+		return SpanContext{}, false
+	}
+	if !isTraceHex(parts[1], 32) || !isTraceHex(parts[2], 16) || len(parts[3]) != 2 {
+		return SpanContext{}, false
+	}
+	flags, err := strconv.ParseUint(parts[3], 16, 8)
+	if err != nil {
+		return SpanContext{}, false
+	}
+	return SpanContext{TraceID: parts[1], SpanID: parts[2], Sampled: flags&1 == 1}, true
+}
+
+func newTraceID(bytes int) string {
+	id := make([]byte, bytes)
+	for {
+		rand.Read(id)
+		for _, b := range id {
+			if b != 0 {
+				return hex.EncodeToString(id)
+			}
+		}
+	}
+}
+
+// SpanWriter appends spans to a JSON lines file in batches. Each flush is
+// one write to a file opened for appending, so lines from the processes
+// sharing a file stay whole.
+type SpanWriter struct {
+	path     string
+	service  string
+	maxSpans int
+
+	mu      sync.Mutex
+	pending []byte
+	count   int
+}
+
+func NewSpanWriter(path, service string, maxSpans int) *SpanWriter {
+	return &SpanWriter{path: path, service: service, maxSpans: maxSpans}
+}
+
+// Record adds a finished span to the file.
+func (w *SpanWriter) Record(span SpanContext, parentID, name string, start, end time.Time, messageID string) {
+	line, err := json.Marshal(spanRecord{
+		TraceID:    span.TraceID,
+		SpanID:     span.SpanID,
+		ParentID:   parentID,
+		Service:    w.service,
+		Name:       name,
+		StartUS:    start.UnixMicro(),
+		DurationUS: end.Sub(start).Microseconds(),
+		MessageID:  messageID,
+	})
+	if err != nil {
+		return
+	}
+	w.mu.Lock()
+	w.pending = append(append(w.pending, line...), '\n')
+	w.count++
+	if w.count < w.maxSpans {
+		w.mu.Unlock()
+		return
+	}
+	data := w.take()
+	w.mu.Unlock()
+	w.write(data)
+}
+
+func (w *SpanWriter) take() []byte {
+	data := w.pending
+	w.pending, w.count = nil, 0
+	return data
+}
+
+// Flush writes the pending spans.
+func (w *SpanWriter) Flush() {
+	w.mu.Lock()
+	data := w.take()
+	w.mu.Unlock()
+	w.write(data)
+}
+
+func (w *SpanWriter) write(data []byte) {
+	if len(data) == 0 {
+		return
+	}
+	f, err := os.OpenFile(w.path, os.O_WRONLY|os.O_APPEND|os.O_CREATE, 0o644)
+	if err == nil {
+		_, err = f.Write(data)
+		if closeErr := f.Close(); err == nil {
+			err = closeErr
+		}
+	}
+	if err != nil {
+		log.Printf("Warning: Failed to write spans to %s: %v", w.path, err)
+	}
+}
+
+// Run flushes every interval until ctx is cancelled, then once more.
+func (w *SpanWriter) Run(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-ticker.C:
+			w.Flush()
+		case <-ctx.Done():
+			w.Flush()
+			return
+		}
+	}
+}
+
+// spans records the spans of sampled traces; nil without TRACE_FILE.
+var spans *SpanWriter
+
+// recordStage records a stage as a child span in each sampled trace. A
+// stage done for a whole commit batch appears in the trace of every
+// request in the batch.
+func recordStage(stage string, start, end time.Time, messageID string, traces []SpanContext) {
+	if spans == nil {
+		return
+	}
+	for _, parent := range traces {
+		if !parent.Sampled {
+			continue
+		}
+		span := SpanContext{TraceID: parent.TraceID, SpanID: newTraceID(8), Sampled: true}
+		spans.Record(span, parent.SpanID, stage, start, end, messageID)
+	}
+}
+
+// traceMiddleware runs each request in a span that continues the trace of
+// its traceparent header, or starts a new trace, sampled with sampleRate.
+func traceMiddleware(service string, sampleRate float64) gin.HandlerFunc {
+	return func(c *gin.Context) {
+		route := c.FullPath()
+		if spans == nil || route == "/health" || route == "/metrics" {
+			c.Next()
+			return
+		}
+		parent, ok := parseTraceparent(c.GetHeader("traceparent"))
+		if !ok {
+			parent = SpanContext{TraceID: newTraceID(16), Sampled: rand.Float64() < sampleRate}
+		}
+		span := SpanContext{TraceID: parent.TraceID, SpanID: newTraceID(8), Sampled: parent.Sampled}
+		c.Request = c.Request.WithContext(contextWithSpan(c.Request.Context(), span))
+		start := time.Now()
+		c.Next()
+		if span.Sampled {
+			name := service + " " + c.Request.Method + " " + route
+			spans.Record(span, parent.SpanID, name, start, time.Now(), c.GetString(traceMessageKey))
+		}
+	}
+}
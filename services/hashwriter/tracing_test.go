@@ -0,0 +1,91 @@
+package main
+
+import (
+	"bufio"
+	"context"
+	"encoding/json"
+	"os"
+	"path/filepath"
+	"sort"
+	"testing"
+	"time"
+)
+
+func TestParseTraceparent(t *testing.T) {
+	span, ok := parseTraceparent("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01")
+	if !ok || span.TraceID != "4bf92f3577b34da6a3ce929d0e0e4736" || span.SpanID != "00f067aa0ba902b7" || !span.Sampled {
+		t.Fatalf("parsed %+v, %v", span, ok)
+	}
+	for _, header := range []string{
+		"",
+		"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7",
+		"00-00000000000000000000000000000000-00f067aa0ba902b7-01",
+		"00-4bf92f3577b34da6a3ce929d0e0e4736-0000000000000000-01",
+		"00-4BF92F3577B34DA6A3CE929D0E0E4736-00f067aa0ba902b7-01",
+		"ff-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01",
+		"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01-extra",
+	} {
+		if _, ok := parseTraceparent(header); ok {
+			t.Errorf("accepted %q", header)
+		}
+	}
+	if span, ok := parseTraceparent("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00"); !ok || span.Sampled {
+		t.Errorf("unsampled header parsed as %+v, %v", span, ok)
+	}
+}
+
+func readSpans(t *testing.T, path string) []spanRecord {
+	f, err := os.Open(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer f.Close()
+	var records []spanRecord
+	scanner := bufio.NewScanner(f)
+	for scanner.Scan() {
+		var record spanRecord
+		if err := json.Unmarshal(scanner.Bytes(), &record); err != nil {
+			t.Fatal(err)
+		}
+		records = append(records, record)
+	}
+	return records
+}
+
+func TestCommitStagesAreSpansOfEachRequest(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "spans.jsonl")
+	spans = NewSpanWriter(path, "hashwriter", 1000)
+	defer func() { spans = nil }()
+
+	c := startCommitter(t, &fakeStore{}, nil, 10, 20*time.Millisecond)
+	sampled := SpanContext{TraceID: newTraceID(16), SpanID: newTraceID(8), Sampled: true}
+	unsampled := SpanContext{TraceID: newTraceID(16), SpanID: newTraceID(8)}
+	done := make(chan struct{})
+	for i, span := range []SpanContext{sampled, unsampled} {
+		go func(i int, span SpanContext) {
+			c.Submit(contextWithSpan(context.Background(), span), []HashEntry{testEntry(string(rune('A' + i)))})
+			done <- struct{}{}
+		}(i, span)
+	}
+	<-done
+	<-done
+	spans.Flush()
+
+	var names []string
+	for _, record := range readSpans(t, path) {
+		if record.TraceID != sampled.TraceID || record.ParentID != sampled.SpanID || record.Service != "hashwriter" {
+			t.Fatalf("span outside the sampled request: %+v", record)
+		}
+		names = append(names, record.Name)
+	}
+	sort.Strings(names)
+	want := []string{"commit.chain", "commit.queue", "es.write"}
+	if len(names) != len(want) {
+		t.Fatalf("recorded %v, want %v", names, want)
+	}
+	for i := range want {
+		if names[i] != want[i] {
+			t.Fatalf("recorded %v, want %v", names, want)
+		}
+	}
+}
@@ -0,0 +1,96 @@
+package main
+
+import (
+	"encoding/json"
+	"fmt"
+	"sort"
+)
+
+// verifyChains checks entries read back from the store against the
+// sharded layout:
+//
+//   - entries are grouped by shard ("" is the unsharded chain) and ordered
+//     by seq, which must have no gaps
+//   - each entry links to the previous entry's chain hash, or to
+//     shardGenesis(shard) at seq 1, and its chain hash recomputes
+//   - a CHAIN_ANCHOR entry's payload is the Merkle root of the heads it
+//     lists, and each listed head matches the entry at that seq when the
+//     entry is among those given
+//
+// A range that starts after seq 1 is trusted to link to its first entry's
+// prevHash, so a window of entries can be checked on its own. It returns
+// every problem found.
+func verifyChains(entries []HashEntry) []error {
+	shards := map[string][]HashEntry{}
+	for _, entry := range entries {
+		shards[entry.Shard] = append(shards[entry.Shard], entry)
+	}
+	names := make([]string, 0, len(shards))
+	for shard := range shards {
+		names = append(names, shard)
+	}
+	sort.Strings(names)
+
+	var problems []error
+	bySeq := map[string]map[uint64]string{}
+	for _, shard := range names {
+		chain := shards[shard]
+		sort.Slice(chain, func(i, j int) bool { return chain[i].Seq < chain[j].Seq })
+		hashes := make(map[uint64]string, len(chain))
+		prev := chain[0].PrevHash
+		if chain[0].Seq == 1 {
+			prev = shardGenesis(shard)
+		}
+		for i, entry := range chain {
+			if i > 0 && entry.Seq != chain[i-1].Seq+1 {
+				problems = append(problems, fmt.Errorf("shard %q: seq %d follows %d", shard, entry.Seq, chain[i-1].Seq))
+			}
+			if entry.PrevHash != prev {
+				problems = append(problems, fmt.Errorf("shard %q: entry %d (%s) does not link to the previous entry",
+					shard, entry.Seq, entry.MessageID))
+			}
+			if entry.ChainHash != chainHash(entry, entry.PrevHash) {
+				problems = append(problems, fmt.Errorf("shard %q: entry %d (%s) has a wrong chain hash",
+					shard, entry.Seq, entry.MessageID))
+			}
+			hashes[entry.Seq] = entry.ChainHash
+			prev = entry.ChainHash
+		}
+		bySeq[shard] = hashes
+	}
+
+	for _, entry := range shards[anchorShard] {
+		if entry.MessageType != AnchorMessageType {
+			continue
+		}
+		heads, err := anchorHeads(entry)
+		if err != nil {
+			problems = append(problems, fmt.Errorf("anchor %s: %v", entry.MessageID, err))
+			continue
+		}
+		if anchorRoot(heads) != entry.SHA256Payload {
+			problems = append(problems, fmt.Errorf("anchor %s: root does not match its heads", entry.MessageID))
+		}
+		for _, head := range heads {
+			if hash, ok := bySeq[head.Shard][head.Seq]; ok && hash != head.Hash {
+				problems = append(problems, fmt.Errorf("anchor %s: shard %q entry %d differs from the anchored head",
+					entry.MessageID, head.Shard, head.Seq))
+			}
+		}
+	}
+	return problems
+}
+
+// anchorHeads reads the heads of an anchor entry, whether built in process
+// or decoded from a stored document.
+func anchorHeads(entry HashEntry) ([]anchorHead, error) {
+	data, err := json.Marshal(entry.ValidationData["heads"])
+	if err != nil {
+		return nil, err
+	}
+	var heads []anchorHead
+	if err := json.Unmarshal(data, &heads); err != nil {
+		return nil, err
+	}
+	return heads, nil
+}
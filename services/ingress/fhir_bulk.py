@@ -0,0 +1,299 @@
+"""Streaming FHIR bulk ingestion: NDJSON exports and Bundles.
+
+Splitters turn request body chunks into one raw resource at a time, so
+memory stays bounded by the largest resource rather than the upload.
+`BulkJob` groups resources into NDJSON batches, keeps a few batches in
+flight to the parser and writes one OperationOutcome per rejected
+resource to an NDJSON error file, as FHIR Bulk Data export does.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (location, raw resource JSON); None when the entry carries no resource
+Resource = Tuple[str, Optional[bytes]]
+
+
+class BulkFormatError(ValueError):
+    """The upload cannot be split into resources; nothing after it is read."""
+
+
+class NDJSONSplitter:
+    """Splits newline-delimited JSON; blank lines are skipped."""
+
+    def __init__(self, max_resource_bytes: int):
+        self.max_resource_bytes = max_resource_bytes
+        self._buffer = bytearray()
+        self._line = 0
+
+    def feed(self, chunk: bytes) -> List[Resource]:
+        self._buffer += chunk
+        resources = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self._take(self._buffer[start:end], resources)
+            start = end + 1
+        del self._buffer[:start]
+        if len(self._buffer) > self.max_resource_bytes:
+            raise BulkFormatError(f"line {self._line + 1} exceeds {self.max_resource_bytes} bytes")
+        return resources
+
+    def finish(self) -> List[Resource]:
+        resources = []
+        self._take(self._buffer, resources)
+        self._buffer = bytearray()
+        return resources
+
+    def _take(self, line: bytearray, resources: List[Resource]):
+        self._line += 1
+        line = bytes(line).strip()
+        if line:
+            resources.append((f"line {self._line}", line))
+
+
+# Characters that change the scanner state outside / inside strings
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+_IN_STRING = re.compile(rb'["\\]')
+
+
+class BundleSplitter:
+    """Yields `Bundle.entry[i].resource` objects of a streamed Bundle.
+
+    A small JSON scanner tracks nesting depth and string state only, and
+    keeps bytes from the start of the resource being read; everything else
+    is dropped as soon as it has been scanned. The container that follows
+    a string at depth 1 or 3 is that key's value, which is how `entry` and
+    `resource` are recognised without parsing the document.
+    """
+
+    def __init__(self, max_resource_bytes: int):
+        self.max_resource_bytes = max_resource_bytes
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_key = b""
+        self._in_entries = False
+        self._entry = -1
+        self._entry_has_resource = False
+        self._resource_start: Optional[int] = None
+        self._started = False
+
+    def feed(self, chunk: bytes) -> List[Resource]:
+        self._buffer += chunk
+        resources: List[Resource] = []
+        buffer = self._buffer
+        pos = self._pos
+        while True:
+            if self._in_string:
+                match = _IN_STRING.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                pos = match.end()
+                if match.group() == b"\\":
+                    if pos >= len(buffer):
+                        # escaped character not received yet
+                        pos -= 1
+                        break
+                    pos += 1
+                    continue
+                self._in_string = False
+                if self._depth in (1, 3):
+                    self._last_key = bytes(buffer[self._string_start:pos - 1])
+                continue
+
+            match = _STRUCTURE.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char = match.group()
+            pos = match.end()
+            if not self._started:
+                if char != b"{" or buffer[:match.start()].strip():
+                    raise BulkFormatError("a Bundle must be a JSON object")
+                self._started = True
+            if char == b'"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in b"{[":
+                self._depth += 1
+                if self._depth == 2 and char == b"[" and self._last_key == b"entry":
+                    self._in_entries = True
+                elif self._in_entries and self._depth == 3:
+                    self._entry += 1
+                    self._entry_has_resource = False
+                    self._last_key = b""
+                elif self._in_entries and self._depth == 4 and char == b"{" and self._last_key == b"resource":
+                    self._resource_start = match.start()
+                    self._entry_has_resource = True
+            else:
+                if self._depth == 0:
+                    raise BulkFormatError("unbalanced brackets in Bundle")
+                if self._resource_start is not None and self._depth == 4:
+                    self._check_size(pos - self._resource_start)
+                    resources.append((f"Bundle.entry[{self._entry}].resource",
+                                      bytes(buffer[self._resource_start:pos])))
+                    self._resource_start = None
+                elif self._in_entries and self._depth == 3 and not self._entry_has_resource:
+                    resources.append((f"Bundle.entry[{self._entry}]", None))
+                elif self._in_entries and self._depth == 2:
+                    self._in_entries = False
+                self._depth -= 1
+                # keys at depth 1 and 3 only name the next value
+                self._last_key = b""
+
+        # Keep the resource being read and an unfinished key string
+        keep = pos
+        if self._resource_start is not None:
+            keep = self._resource_start
+            self._check_size(pos - keep)
+        elif self._in_string and self._depth in (1, 3):
+            keep = min(pos, self._string_start)
+            if pos - keep > self.max_resource_bytes:
+                raise BulkFormatError(f"string exceeds {self.max_resource_bytes} bytes")
+        del buffer[:keep]
+        self._pos = pos - keep
+        if self._resource_start is not None:
+            self._resource_start -= keep
+        self._string_start -= keep
+        return resources
+
+    def _check_size(self, size: int):
+        if size > self.max_resource_bytes:
+            raise BulkFormatError(f"Bundle.entry[{self._entry}].resource exceeds {self.max_resource_bytes} bytes")
+
+    def finish(self) -> List[Resource]:
+        if not self._started or self._depth != 0 or self._in_string:
+            raise BulkFormatError("Bundle ended before its closing brace")
+        return []
+
+
+def splitter_for(content_type: str, max_resource_bytes: int):
+    if "ndjson" in content_type:
+        return NDJSONSplitter(max_resource_bytes)
+    return BundleSplitter(max_resource_bytes)
+
+
+async def iter_resources(stream: AsyncIterator[bytes], splitter) -> AsyncIterator[Resource]:
+    async for chunk in stream:
+        for resource in splitter.feed(chunk):
+            yield resource
+    for resource in splitter.finish():
+        yield resource
+
+
+def operation_outcome(location: str, diagnostics: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{
+            "severity": "error",
+            "code": "invalid",
+            "diagnostics": diagnostics,
+            "expression": [location]
+        }]
+    }
+
+
+class BulkJob:
+    """Pushes resources to the parser in NDJSON batches and tallies results.
+
+    `forward(content)` sends one batch and returns the parser's per-line
+    results. Up to `concurrency` batches are in flight while the upload is
+    still being read; results are recorded in upload order.
+    """
+
+    def __init__(self, job_id: str, forward: Callable[[bytes], Awaitable[List[Dict[str, Any]]]],
+                 error_path: str, batch_size: int = 500, concurrency: int = 4):
+        self.job_id = job_id
+        self.forward = forward
+        self.error_path = error_path
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.batches = 0
+        self.validation: Counter = Counter()
+        self._errors = None
+        self._pending: Deque[Tuple[List[str], asyncio.Task]] = deque()
+
+    async def run(self, resources: AsyncIterator[Resource]):
+        locations: List[str] = []
+        lines: List[bytes] = []
+        try:
+            async for location, raw in resources:
+                self.total += 1
+                if raw is None:
+                    self._error(location, "entry has no resource")
+                    continue
+                # One resource per line; NDJSON input lines never contain newlines
+                locations.append(location)
+                lines.append(raw.replace(b"\n", b" ").replace(b"\r", b" "))
+                if len(lines) >= self.batch_size:
+                    await self._submit(locations, lines)
+                    locations, lines = [], []
+            if lines:
+                await self._submit(locations, lines)
+        finally:
+            # Record what was sent even if the upload broke off
+            while self._pending:
+                await self._collect()
+            if self._errors is not None:
+                self._errors.close()
+
+    async def _submit(self, locations: List[str], lines: List[bytes]):
+        if len(self._pending) >= self.concurrency:
+            await self._collect()
+        self.batches += 1
+        task = asyncio.ensure_future(self.forward(b"\n".join(lines)))
+        self._pending.append((locations, task))
+
+    async def _collect(self):
+        locations, task = self._pending.popleft()
+        try:
+            results = await task
+        except Exception as e:
+            logger.error(f"FHIR bulk job {self.job_id}: batch failed: {str(e)}")
+            for location in locations:
+                self._error(location, f"batch failed: {str(e)}")
+            return
+        if len(results) != len(locations):
+            logger.error(f"FHIR bulk job {self.job_id}: parser returned {len(results)} results "
+                         f"for {len(locations)} resources")
+        for location, result in zip(locations, results):
+            if result.get("status") == "success":
+                self.succeeded += 1
+                self.validation[str(result.get("validation", {}).get("overall_status"))] += 1
+            else:
+                self._error(location, result.get("error", "rejected"))
+        # Resources the parser gave no result for are not known to be stored
+        for location in locations[len(results):]:
+            self._error(location, "no result from the parser")
+
+    def _error(self, location: str, diagnostics: str):
+        self.failed += 1
+        if self._errors is None:
+            os.makedirs(os.path.dirname(self.error_path), exist_ok=True)
+            self._errors = open(self.error_path, "w")
+        self._errors.write(json.dumps(operation_outcome(location, diagnostics)) + "\n")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "batches": self.batches,
+            "validation": dict(self.validation),
+        }
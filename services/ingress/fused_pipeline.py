@@ -0,0 +1,124 @@
+"""In-process parser and validator for PIPELINE_MODE=fused.
+
+Runs the parser's `parsing` and the validator's `validation` modules in
+the ingress event loop; the ingress image installs them under /opt/parser
+and /opt/validator. Functions return what the corresponding parser
+endpoints return and raise HTTPException with the parser's status codes,
+so ingress treats both modes alike. Only the hash writer is called over
+HTTP.
+"""
+import logging
+from typing import Any, AsyncIterator, Dict, List, Union
+
+from fastapi import HTTPException
+
+import parsing
+import validation
+from dicom_header import HeaderTooLarge
+
+logger = logging.getLogger(__name__)
+
+hashwriter_client = validation.hashwriter_client
+rules_router = validation.rules_router
+
+
+async def start():
+    await hashwriter_client.start()
+
+
+async def stop():
+    await hashwriter_client.close()
+    parsing.parse_executor.shutdown()
+    parsing.dicom_executor.shutdown()
+
+
+async def validate(parsed_message: parsing.ParsedMessage) -> Dict[str, Any]:
+    try:
+        validated_message = validation.evaluate_message(parsed_message.dict())
+        hash_result = await validation.forward_to_hashwriter(validated_message)
+    except Exception as e:
+        logger.error(f"Validation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return validation.validation_response(validated_message, hash_result)
+
+
+def _success(parsed_message: parsing.ParsedMessage, validation_result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "parsed": parsed_message.parsed_data,
+        "validation": validation_result,
+        "status": "success"
+    }
+
+
+async def parse_hl7(record: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        parsed_message = await parsing.parse_executor.run(
+            parsing.build_hl7_parsed_message, parsing.HL7ParseRequest(**record), task="hl7"
+        )
+    except Exception as e:
+        logger.error(f"Error parsing HL7 message: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid HL7 message: {str(e)}")
+    return _success(parsed_message, await validate(parsed_message))
+
+
+async def parse_hl7_batch(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    results, parsed_messages = await parsing.parse_executor.run(
+        parsing.parse_hl7_batch_items, parsing.HL7BatchParseRequest(**body), task="hl7_batch"
+    )
+    await _validate_batch(results, parsed_messages)
+    return results
+
+
+async def _validate_batch(results: List[Dict[str, Any]], parsed_messages: List[parsing.ParsedMessage]):
+    if not parsed_messages:
+        return
+    try:
+        validated_messages = [validation.evaluate_message(m.dict()) for m in parsed_messages]
+        hash_results = await validation.forward_batch_to_hashwriter(validated_messages)
+    except Exception as e:
+        logger.error(f"Error validating batch: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Validation batch failed: {str(e)}")
+    parsing.attach_validations(results, [
+        {"message_id": validated.message_id, **validation.validation_response(validated, hash_result)}
+        for validated, hash_result in zip(validated_messages, hash_results)
+    ])
+
+
+async def _chunks(body: bytes) -> AsyncIterator[bytes]:
+    yield body
+
+
+async def parse_dicom(content: Union[bytes, AsyncIterator[bytes]], channel_id: str, study_uid: str,
+                      series_uid: str, instance_uid: str, modality: str) -> Dict[str, Any]:
+    stream = _chunks(content) if isinstance(content, bytes) else content
+    try:
+        reader = await parsing.read_dicom_header(stream)
+        parsed_message = parsing.build_dicom_parsed_message(
+            reader, channel_id, study_uid, series_uid, instance_uid, modality
+        )
+    except HeaderTooLarge as e:
+        logger.error(f"Error parsing DICOM: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error parsing DICOM: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid DICOM data: {str(e)}")
+    return _success(parsed_message, await validate(parsed_message))
+
+
+async def parse_fhir(content: bytes, channel_id: str, resource_type: str, resource_id: str) -> Dict[str, Any]:
+    try:
+        parsed_message = await parsing.parse_executor.run(
+            parsing.build_fhir_parsed_message, channel_id, resource_type, resource_id, content, task="fhir"
+        )
+    except Exception as e:
+        logger.error(f"Error parsing FHIR resource: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid FHIR resource: {str(e)}")
+    return _success(parsed_message, await validate(parsed_message))
+
+
+async def parse_fhir_batch(content: bytes, channel_id: str) -> List[Dict[str, Any]]:
+    results, parsed_messages = await parsing.parse_executor.run(
+        parsing.parse_fhir_batch_items, channel_id, content, task="fhir_batch"
+    )
+    await _validate_batch(results, parsed_messages)
+    return results
@@ -0,0 +1,304 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# seq, payload length, crc32(payload)
+RECORD_HEADER = struct.Struct(">QII")
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor"
+LOCK_FILE = "lock"
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+
+class QueueSlot:
+    """Append-only segment log in one directory, owned by one process.
+
+    Records are written as header + JSON payload and fsync'd before append
+    returns. Acked sequence numbers advance the cursor over the contiguous
+    acked prefix; segments entirely below the cursor are deleted. Anything
+    at or after the cursor is handed out again by `recover()` after a crash,
+    so delivery is at-least-once.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, fsync: bool = True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._lock_fd: Optional[int] = None
+        self._segments: List[Tuple[int, str]] = []
+        self._active = None
+        self._active_size = 0
+        self._next_seq = 0
+        self._cursor = 0
+        self._acked = set()
+        self._pending = 0
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    def try_lock(self) -> bool:
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def recover(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """Load segments from disk and return every record not yet acked."""
+        self._cursor = self._read_cursor()
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        self._segments = [(int(n[:-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, n)) for n in names]
+        self._next_seq = self._cursor
+
+        pending = []
+        for index, (_, path) in enumerate(self._segments):
+            is_last = index == len(self._segments) - 1
+            for seq, record in self._read_segment(path, truncate_torn=is_last):
+                self._next_seq = max(self._next_seq, seq + 1)
+                if seq >= self._cursor:
+                    pending.append((seq, record))
+        self._pending = len(pending)
+        self._delete_acked_segments()
+        if pending:
+            logger.info(f"Recovered {len(pending)} queued messages from {self.directory}")
+        return pending
+
+    def append(self, record: Dict[str, Any]) -> int:
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            if self._active is None or self._active_size >= self.segment_bytes:
+                self._roll_segment()
+            seq = self._next_seq
+            self._active.write(RECORD_HEADER.pack(seq, len(payload), zlib.crc32(payload)) + payload)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self._active_size += RECORD_HEADER.size + len(payload)
+            self._next_seq += 1
+            self._pending += 1
+            return seq
+
+    def ack(self, seq: int):
+        with self._lock:
+            self._pending -= 1
+            self._acked.add(seq)
+            advanced = False
+            while self._cursor in self._acked:
+                self._acked.remove(self._cursor)
+                self._cursor += 1
+                advanced = True
+            if advanced:
+                self._write_cursor()
+                self._delete_acked_segments()
+
+    def dead_letter(self, record: Dict[str, Any], error: str):
+        with self._lock:
+            with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+                f.write(json.dumps({"record": record, "error": error}) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def _roll_segment(self):
+        if self._active is not None:
+            self._active.close()
+        path = os.path.join(self.directory, f"{self._next_seq:020d}{SEGMENT_SUFFIX}")
+        self._active = open(path, "ab")
+        self._active_size = self._active.tell()
+        if not self._segments or self._segments[-1][1] != path:
+            self._segments.append((self._next_seq, path))
+        if self.fsync:
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def _read_segment(self, path: str, truncate_torn: bool):
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            seq, length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            yield seq, json.loads(payload)
+            offset = start + length
+        if offset < len(data):
+            logger.warning(f"Discarding torn tail of {path} at offset {offset}")
+            if truncate_torn:
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+
+    def _delete_acked_segments(self):
+        # A segment is done once the next segment starts at or below the cursor
+        while len(self._segments) > 1 and self._segments[1][0] <= self._cursor:
+            _, path = self._segments.pop(0)
+            os.remove(path)
+
+    def _read_cursor(self) -> int:
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_cursor(self):
+        # Not fsync'd: a stale cursor only causes acked records to be
+        # redelivered, and segments are deleted only once fully acked.
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._cursor))
+        os.replace(tmp_path, path)
+
+
+def open_slots(root: str, segment_bytes: int, fsync: bool) -> Tuple[QueueSlot, List[QueueSlot]]:
+    """Lock a slot for this process and adopt orphaned slots with backlog.
+
+    Each uvicorn worker appends to its own slot directory. Slots left behind
+    by workers that no longer exist (e.g. after scaling down) are locked by
+    whichever worker finds them first so their backlog is replayed.
+    """
+    os.makedirs(root, exist_ok=True)
+    primary = None
+    adopted = []
+    existing = sorted(n for n in os.listdir(root) if n.startswith("slot-"))
+    for name in existing:
+        slot = QueueSlot(os.path.join(root, name), segment_bytes, fsync)
+        if not slot.try_lock():
+            continue
+        if primary is None:
+            primary = slot
+        else:
+            adopted.append(slot)
+    index = len(existing)
+    while primary is None:
+        slot = QueueSlot(os.path.join(root, f"slot-{index}"), segment_bytes, fsync)
+        if slot.try_lock():
+            primary = slot
+        index += 1
+    return primary, adopted
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PermanentFailure(Exception):
+    """Raised by the processor for records that must not be retried."""
+
+
+class IngestQueue:
+    """Durable acknowledge-then-process queue drained by async workers."""
+
+    def __init__(self, root: str, process: Callable[[Dict[str, Any]], Awaitable[None]],
+                 high_water: int = 10000, workers: int = 8,
+                 segment_bytes: int = 64 * 1024 * 1024, fsync: bool = True,
+                 max_retry_delay: float = 30.0):
+        self.root = root
+        self.process = process
+        self.high_water = high_water
+        self.worker_count = workers
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.max_retry_delay = max_retry_delay
+        self.primary: Optional[QueueSlot] = None
+        self.slots: List[QueueSlot] = []
+        self._work: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return sum(slot.depth for slot in self.slots)
+
+    async def start(self):
+        self._work = asyncio.Queue()
+        self.primary, adopted = await asyncio.to_thread(open_slots, self.root, self.segment_bytes, self.fsync)
+        for slot in [self.primary] + adopted:
+            pending = await asyncio.to_thread(slot.recover)
+            if slot is not self.primary and not pending:
+                slot.close()
+                continue
+            self.slots.append(slot)
+            for seq, record in pending:
+                self._work.put_nowait((slot, seq, record))
+        self._workers = [asyncio.create_task(self._run_worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for slot in self.slots:
+            slot.close()
+        self.slots = []
+
+    async def submit(self, record: Dict[str, Any]) -> int:
+        if self.depth >= self.high_water:
+            raise QueueFull(f"Queue depth {self.depth} reached high-water mark {self.high_water}")
+        seq = await asyncio.to_thread(self.primary.append, record)
+        self._work.put_nowait((self.primary, seq, record))
+        return seq
+
+    async def _run_worker(self):
+        while True:
+            slot, seq, record = await self._work.get()
+            delay = 0.5
+            settled = True
+            while True:
+                try:
+                    await self.process(record)
+                    break
+                except PermanentFailure as e:
+                    logger.error(f"Dropping queued message {record.get('message_id')}: {str(e)}")
+                    try:
+                        await asyncio.to_thread(slot.dead_letter, record, str(e))
+                    except Exception as e:
+                        # Left unacked, so it is replayed after a restart
+                        logger.error(f"Failed to dead-letter queued message {record.get('message_id')}: {str(e)}")
+                        settled = False
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Retrying queued message {record.get('message_id')} in {delay:.1f}s: {str(e)}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+            if not settled:
+                continue
+            try:
+                # Waits for the slot lock, which append holds across fsync
+                await asyncio.to_thread(slot.ack, seq)
+            except Exception as e:
+                logger.error(f"Failed to ack queued message {record.get('message_id')}: {str(e)}")
+                continue
+            # Several workers can see an adopted slot drained once their acks
+            # return; checking membership and removing without yielding lets
+            # exactly one of them retire it. close takes the slot lock, so it
+            # waits for an ack that is still writing the cursor.
+            if slot is not self.primary and slot.depth == 0 and slot in self.slots:
+                self.slots.remove(slot)
+                await asyncio.to_thread(slot.close)
@@ -1,24 +1,145 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
 from datetime import datetime
 import base64
+import json
+import os
 import uuid
-import httpx
 import logging
-from typing import Optional
-from prometheus_client import Counter, Histogram, generate_latest
-from fastapi.responses import PlainTextResponse
+from typing import AsyncIterator, Dict, List, Optional, Union
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+from fastapi.responses import FileResponse, Response
+from common.http_client import ServiceClient
+from common import tracing
+from common.instrumentation import bind_message_id, metrics_payload, stage
+from fhir_bulk import BulkFormatError, BulkJob, iter_resources, splitter_for
+from ingest_queue import IngestQueue, PermanentFailure, QueueFull
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Compliance Agent Ingress", version="0.9.0")
+app.add_middleware(tracing.TraceMiddleware, service="ingress")
 security = HTTPBearer()
 
 message_counter = Counter('ingress_messages_total', 'Total messages received', ['type', 'channel'])
 message_size_histogram = Histogram('ingress_message_size_bytes', 'Message size distribution')
 processing_time_histogram = Histogram('ingress_processing_seconds', 'Processing time distribution')
+batch_size_histogram = Histogram('ingress_batch_size', 'Messages per batch request', buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+
+queue_depth_gauge = Gauge('ingress_queue_depth', 'Messages accepted but not yet processed')
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+FHIR_BULK_BATCH_SIZE = int(os.getenv("FHIR_BULK_BATCH_SIZE", "500"))
+FHIR_BULK_CONCURRENCY = int(os.getenv("FHIR_BULK_CONCURRENCY", "4"))
+FHIR_BULK_MAX_RESOURCE_BYTES = int(os.getenv("FHIR_BULK_MAX_RESOURCE_BYTES", str(16 * 1024 * 1024)))
+FHIR_BULK_ERROR_DIR = os.getenv("FHIR_BULK_ERROR_DIR", "/var/lib/compliance/fhir-bulk-errors")
+ASYNC_MODE = os.getenv("INGRESS_ASYNC_MODE", "false").lower() in ("1", "true", "yes", "on")
+# "distributed" forwards to the parser service; "fused" parses and validates in-process
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "distributed").lower()
+FUSED = PIPELINE_MODE == "fused"
+
+if FUSED:
+    import fused_pipeline
+    app.include_router(fused_pipeline.rules_router)
+
+parser_client = ServiceClient("parser", os.getenv("PARSER_SERVICE_URL", "http://parser-service:8001"))
+
+async def forward_hl7(record: dict) -> dict:
+    if FUSED:
+        return await fused_pipeline.parse_hl7(record)
+    response = await parser_client.post("/parse/hl7", json=record)
+    response.raise_for_status()
+    return response.json()
+
+async def process_queued_hl7(record: dict):
+    # Continues the trace of the request that queued the message
+    span = tracing.start_trace("ingress queue", record.get("traceparent"), record.get("message_id"))
+    bind_message_id(record.get("message_id"))
+    try:
+        await forward_hl7(record)
+    except httpx.HTTPStatusError as e:
+        # The parser rejected the message itself; retrying will not help
+        if 400 <= e.response.status_code < 500:
+            raise PermanentFailure(e.response.text)
+        raise
+    except HTTPException as e:
+        if 400 <= e.status_code < 500:
+            raise PermanentFailure(e.detail)
+        raise
+    finally:
+        tracing.end_span(span)
+
+async def forward_hl7_batch(body: dict) -> List[dict]:
+    if FUSED:
+        return await fused_pipeline.parse_hl7_batch(body)
+    response = await parser_client.post("/parse/hl7/batch", json=body)
+    response.raise_for_status()
+    return response.json()["results"]
+
+async def forward_dicom(content: Union[bytes, AsyncIterator[bytes]], params: dict) -> dict:
+    if FUSED:
+        return await fused_pipeline.parse_dicom(content, **params)
+    response = await parser_client.post(
+        "/parse/dicom",
+        content=content,
+        headers={"Content-Type": "application/dicom"},
+        params=params
+    )
+    response.raise_for_status()
+    return response.json()
+
+async def forward_fhir(content: bytes, params: dict) -> dict:
+    if FUSED:
+        return await fused_pipeline.parse_fhir(content, **params)
+    response = await parser_client.post(
+        "/parse/fhir",
+        content=content,
+        headers={"Content-Type": "application/fhir+json"},
+        params=params
+    )
+    response.raise_for_status()
+    return response.json()
+
+async def forward_fhir_batch(content: bytes, channel_id: str) -> List[dict]:
+    if FUSED:
+        return await fused_pipeline.parse_fhir_batch(content, channel_id)
+    response = await parser_client.post(
+        "/parse/fhir/batch",
+        content=content,
+        headers={"Content-Type": "application/fhir+ndjson"},
+        params={"channel_id": channel_id}
+    )
+    response.raise_for_status()
+    return response.json()["results"]
+
+ingest_queue = IngestQueue(
+    root=os.getenv("INGRESS_QUEUE_DIR", "/var/lib/compliance/ingress-queue"),
+    process=process_queued_hl7,
+    high_water=int(os.getenv("INGRESS_QUEUE_HIGH_WATER", "10000")),
+    workers=int(os.getenv("INGRESS_QUEUE_WORKERS", "8")),
+    segment_bytes=int(os.getenv("INGRESS_QUEUE_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+    fsync=os.getenv("INGRESS_QUEUE_FSYNC", "true").lower() in ("1", "true", "yes", "on"),
+)
+queue_depth_gauge.set_function(lambda: ingest_queue.depth)
+
+@app.on_event("startup")
+async def startup():
+    await parser_client.start()
+    if FUSED:
+        await fused_pipeline.start()
+    if ASYNC_MODE:
+        await ingest_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if ASYNC_MODE:
+        await ingest_queue.stop()
+    await parser_client.close()
+    if FUSED:
+        await fused_pipeline.stop()
 
 class HL7Message(BaseModel):
     channel_id: str = Field(..., description="Source channel identifier")
@@ -26,6 +147,16 @@ class HL7Message(BaseModel):
     message_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))
     timestamp: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
+class HL7BatchItem(BaseModel):
+    payload: str = Field(..., description="Base64 encoded HL7 message")
+    message_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))
+    timestamp: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+class HL7BatchMessage(BaseModel):
+    channel_id: str = Field(..., description="Source channel identifier")
+    messages: List[HL7BatchItem] = Field(default_factory=list)
+    batch_payload: Optional[str] = Field(default=None, description="Base64 encoded FHS/BHS batch file")
+
 class DICOMMessage(BaseModel):
     channel_id: str
     study_uid: str
@@ -46,6 +177,12 @@ class MessageResponse(BaseModel):
     timestamp: datetime
     validation_result: Optional[dict] = None
 
+class BatchResponse(BaseModel):
+    status: str
+    timestamp: datetime
+    count: int
+    results: List[dict]
+
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     # TODO: Implement proper JWT validation
@@ -55,38 +192,128 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
 
 @app.post("/ingest/hl7", response_model=MessageResponse)
 async def ingest_hl7(message: HL7Message, token: str = Depends(verify_token)):
+    bind_message_id(message.message_id)
     with processing_time_histogram.time():
         try:
-            decoded_payload = base64.b64decode(message.payload).decode('utf-8')
+            with stage("ingress.decode"):
+                decoded_payload = base64.b64decode(message.payload).decode('utf-8')
             message_size_histogram.observe(len(decoded_payload))
             message_counter.labels(type='hl7', channel=message.channel_id).inc()
+            record = {
+                "message_id": message.message_id,
+                "channel_id": message.channel_id,
+                "payload": decoded_payload,
+                "timestamp": message.timestamp.isoformat()
+            }
             
-            # Forward to parser service
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://parser-service:8001/parse/hl7",
-                    json={
-                        "message_id": message.message_id,
-                        "channel_id": message.channel_id,
-                        "payload": decoded_payload,
-                        "timestamp": message.timestamp.isoformat()
-                    }
+            # Acknowledge once durably queued; workers forward it later
+            if ASYNC_MODE:
+                record["traceparent"] = tracing.traceparent()
+                await ingest_queue.submit(record)
+                return MessageResponse(
+                    message_id=message.message_id,
+                    status="accepted",
+                    timestamp=datetime.utcnow()
                 )
-                response.raise_for_status()
+            
+            # Forward to parser service
+            validation_result = await forward_hl7(record)
                 
             return MessageResponse(
                 message_id=message.message_id,
                 status="accepted",
                 timestamp=datetime.utcnow(),
-                validation_result=response.json()
+                validation_result=validation_result
             )
             
+        except QueueFull as e:
+            logger.warning(f"Rejecting HL7 message: {str(e)}")
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
         except Exception as e:
             logger.error(f"Error processing HL7 message: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
 
+def count_hl7_messages(payload: str) -> int:
+    """Number of messages in an HL7 batch file: one per MSH segment."""
+    segments = payload.replace("\r\n", "\r").replace("\n", "\r").split("\r")
+    return sum(1 for segment in segments if segment.lstrip("\x0b\x1c").startswith("MSH"))
+
+@app.post("/ingest/hl7/batch", response_model=BatchResponse)
+async def ingest_hl7_batch(batch: HL7BatchMessage, token: str = Depends(verify_token)):
+    if len(batch.messages) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} messages")
+    with processing_time_histogram.time():
+        try:
+            # One result per message in request order; undecodable items
+            # fail alone and are not forwarded
+            decode_errors: Dict[int, dict] = {}
+            messages = []
+            for position, item in enumerate(batch.messages):
+                try:
+                    with stage("ingress.decode", item.message_id):
+                        decoded_payload = base64.b64decode(item.payload).decode('utf-8')
+                except ValueError as e:
+                    decode_errors[position] = {"message_id": item.message_id, "status": "error",
+                                               "error": f"Invalid payload encoding: {str(e)}"}
+                    continue
+                message_size_histogram.observe(len(decoded_payload))
+                messages.append({
+                    "message_id": item.message_id,
+                    "channel_id": batch.channel_id,
+                    "payload": decoded_payload,
+                    "timestamp": item.timestamp.isoformat()
+                })
+            batch_payload = None
+            batch_error = None
+            if batch.batch_payload:
+                try:
+                    batch_payload = base64.b64decode(batch.batch_payload).decode('utf-8')
+                except ValueError as e:
+                    batch_error = {"message_id": None, "status": "error",
+                                   "error": f"Invalid batch payload encoding: {str(e)}"}
+                else:
+                    message_size_histogram.observe(len(batch_payload))
+            # The limit covers the messages of the batch file too
+            total = len(batch.messages) + (count_hl7_messages(batch_payload) if batch_payload else 0)
+            if total > MAX_BATCH_SIZE:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} messages")
+            
+            # Forward the whole batch to the parser in one request
+            parsed_results = []
+            if messages or batch_payload:
+                parsed_results = await forward_hl7_batch({
+                    "channel_id": batch.channel_id,
+                    "messages": messages,
+                    "batch_payload": batch_payload
+                })
+            
+            parsed = iter(parsed_results)
+            results = [decode_errors[position] if position in decode_errors else next(parsed)
+                       for position in range(len(batch.messages))]
+            # Messages split from the batch file follow the listed ones
+            results.extend(parsed)
+            if batch_error is not None:
+                results.append(batch_error)
+            
+            message_counter.labels(type='hl7', channel=batch.channel_id).inc(len(results))
+            batch_size_histogram.observe(len(results))
+            
+            return BatchResponse(
+                status="accepted",
+                timestamp=datetime.utcnow(),
+                count=len(results),
+                results=results
+            )
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing HL7 batch: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/ingest/dicom", response_model=MessageResponse)
 async def ingest_dicom(request: Request, message: DICOMMessage, token: str = Depends(verify_token)):
+    bind_message_id(message.instance_uid)
     with processing_time_histogram.time():
         try:
             body = await request.body()
@@ -94,65 +321,182 @@ async def ingest_dicom(request: Request, message: DICOMMessage, token: str = Dep
             message_counter.labels(type='dicom', channel=message.channel_id).inc()
             
             # Forward to parser service
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://parser-service:8001/parse/dicom",
-                    content=body,
-                    headers={"Content-Type": "application/dicom"},
-                    params={
-                        "channel_id": message.channel_id,
-                        "study_uid": message.study_uid,
-                        "series_uid": message.series_uid,
-                        "instance_uid": message.instance_uid,
-                        "modality": message.modality
-                    }
-                )
-                response.raise_for_status()
+            validation_result = await forward_dicom(body, {
+                "channel_id": message.channel_id,
+                "study_uid": message.study_uid,
+                "series_uid": message.series_uid,
+                "instance_uid": message.instance_uid,
+                "modality": message.modality
+            })
                 
+            # The parser and hash writer know the instance by its UID
             return MessageResponse(
-                message_id=str(uuid.uuid4()),
+                message_id=message.instance_uid,
                 status="accepted",
                 timestamp=datetime.utcnow(),
-                validation_result=response.json()
+                validation_result=validation_result
             )
             
         except Exception as e:
             logger.error(f"Error processing DICOM message: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
 
+async def count_bytes(stream: AsyncIterator[bytes], counter: List[int]) -> AsyncIterator[bytes]:
+    async for chunk in stream:
+        counter[0] += len(chunk)
+        yield chunk
+
+@app.post("/ingest/dicom/stream", response_model=MessageResponse)
+async def ingest_dicom_stream(
+    request: Request,
+    channel_id: str = Header(..., alias="X-Channel-ID"),
+    study_uid: str = Header(..., alias="X-Study-UID"),
+    series_uid: str = Header(..., alias="X-Series-UID"),
+    instance_uid: str = Header(..., alias="X-Instance-UID"),
+    modality: str = Header(..., alias="X-Modality"),
+    token: str = Depends(verify_token)
+):
+    """Pipe a raw DICOM body to the parser chunk by chunk.
+
+    Metadata travels in X-* headers so the body is never buffered here.
+    """
+    bind_message_id(instance_uid)
+    with processing_time_histogram.time():
+        size = [0]
+        try:
+            message_counter.labels(type='dicom', channel=channel_id).inc()
+            
+            # Forward to parser service as a chunked upload
+            validation_result = await forward_dicom(count_bytes(request.stream(), size), {
+                "channel_id": channel_id,
+                "study_uid": study_uid,
+                "series_uid": series_uid,
+                "instance_uid": instance_uid,
+                "modality": modality
+            })
+            message_size_histogram.observe(size[0])
+                
+            return MessageResponse(
+                message_id=instance_uid,
+                status="accepted",
+                timestamp=datetime.utcnow(),
+                validation_result=validation_result
+            )
+            
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Parser rejected DICOM stream {instance_uid}: {e.response.text}")
+            # Pass on the parser's verdict (400 invalid DICOM, 413 header too large)
+            if 400 <= e.response.status_code < 500:
+                raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+            raise HTTPException(status_code=502, detail=e.response.text)
+        except HTTPException as e:
+            # Raised by the in-process parser in fused mode
+            logger.error(f"Parser rejected DICOM stream {instance_uid}: {e.detail}")
+            raise
+        except Exception as e:
+            logger.error(f"Error processing DICOM stream: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/ingest/fhir", response_model=MessageResponse)
 async def ingest_fhir(message: FHIRMessage, token: str = Depends(verify_token)):
+    bind_message_id(message.resource_id)
     with processing_time_histogram.time():
         try:
             message_counter.labels(type='fhir', channel=message.channel_id).inc()
             
             # Forward to parser service
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://parser-service:8001/parse/fhir",
-                    json={
-                        "channel_id": message.channel_id,
-                        "resource_type": message.resource_type,
-                        "resource_id": message.resource_id,
-                        "payload": message.payload
-                    }
-                )
-                response.raise_for_status()
+            validation_result = await forward_fhir(json.dumps(message.payload).encode(), {
+                "channel_id": message.channel_id,
+                "resource_type": message.resource_type,
+                "resource_id": message.resource_id
+            })
                 
+            # The parser and hash writer know the resource by its id
             return MessageResponse(
-                message_id=str(uuid.uuid4()),
+                message_id=message.resource_id,
                 status="accepted",
                 timestamp=datetime.utcnow(),
-                validation_result=response.json()
+                validation_result=validation_result
             )
             
         except Exception as e:
             logger.error(f"Error processing FHIR message: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/metrics", response_class=PlainTextResponse)
-async def metrics():
-    return generate_latest()
+def bulk_error_path(job_id: str) -> str:
+    return os.path.join(FHIR_BULK_ERROR_DIR, f"{job_id}.ndjson")
+
+@app.post("/ingest/fhir/bulk")
+async def ingest_fhir_bulk(
+    request: Request,
+    channel_id: str = Header(..., alias="X-Channel-ID"),
+    content_type: str = Header("application/fhir+ndjson"),
+    token: str = Depends(verify_token)
+):
+    """Stream an NDJSON export or a Bundle through the pipeline in batches.
+
+    `application/fhir+ndjson` (or any *ndjson type) is read line by line,
+    anything else as a Bundle entry by entry. Rejected resources are
+    written to an error file as OperationOutcomes.
+    """
+    job_id = uuid.uuid4().hex
+    job = BulkJob(
+        job_id,
+        forward=lambda content: forward_fhir_batch(content, channel_id),
+        error_path=bulk_error_path(job_id),
+        batch_size=FHIR_BULK_BATCH_SIZE,
+        concurrency=FHIR_BULK_CONCURRENCY
+    )
+    splitter = splitter_for(content_type, FHIR_BULK_MAX_RESOURCE_BYTES)
+    size = [0]
+    with processing_time_histogram.time():
+        try:
+            await job.run(iter_resources(count_bytes(request.stream(), size), splitter))
+            error = None
+        except BulkFormatError as e:
+            logger.error(f"FHIR bulk job {job_id} stopped: {str(e)}")
+            error = str(e)
+        finally:
+            message_size_histogram.observe(size[0])
+            message_counter.labels(type='fhir', channel=channel_id).inc(job.total)
+    
+    summary = {
+        **job.summary(),
+        "status": "aborted" if error else "completed",
+        "bytes": size[0],
+        "errors": f"/ingest/fhir/bulk/{job_id}/errors" if job.failed else None
+    }
+    if error:
+        # Resources before the malformed part were ingested; say how far it got
+        raise HTTPException(status_code=400, detail={**summary, "error": error})
+    return summary
+
+@app.get("/ingest/fhir/bulk/{job_id}/errors")
+async def fhir_bulk_errors(job_id: str, token: str = Depends(verify_token)):
+    try:
+        job_id = uuid.UUID(hex=job_id).hex
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    path = bulk_error_path(job_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No errors recorded for this job")
+    return FileResponse(path, media_type="application/fhir+ndjson")
+
+@app.get("/queue/status")
+async def queue_status():
+    return {
+        "async_mode": ASYNC_MODE,
+        "pipeline_mode": PIPELINE_MODE,
+        "depth": ingest_queue.depth,
+        "high_water": ingest_queue.high_water,
+        "slots": [slot.directory for slot in ingest_queue.slots]
+    }
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    # OpenMetrics, with message id exemplars, when the scraper accepts it
+    body, content_type = metrics_payload(request.headers.get("accept"))
+    return Response(content=body, media_type=content_type)
 
 @app.get("/health")
 async def health():
@@ -0,0 +1,102 @@
+import hashlib
+from io import BytesIO
+from typing import List, Optional
+
+import pydicom
+from pydicom.dataset import Dataset
+
+# (7FE0,0010) PixelData in little-endian byte order
+PIXEL_DATA_TAG = b"\xe0\x7f\x10\x00"
+# Tag, VR, reserved bytes and 32-bit length of an explicit VR OB/OW element
+PIXEL_DATA_HEADER_BYTES = 12
+
+# Tags the parser reports on; everything else is skipped while reading
+HEADER_TAGS = [
+    "PatientName",
+    "PatientID",
+    "StudyDate",
+    "StudyTime",
+    "AccessionNumber",
+    "ReferringPhysicianName",
+    "StudyInstanceUID",
+    "SeriesInstanceUID",
+    "SOPInstanceUID",
+    "Modality",
+]
+
+
+class HeaderTooLarge(ValueError):
+    pass
+
+
+class DicomHeaderReader:
+    """Consume a DICOM byte stream, keeping only what precedes the pixels.
+
+    Chunks are buffered until the top-level PixelData element starts, the
+    header is then parsed with `stop_before_pixels` and the buffer released.
+    The rest of the stream is only counted and, with `hash_stream`, fed to
+    a SHA-256 so the audit record still covers the pixel data.
+
+    PixelData tags inside sequences (icon images) or binary values are told
+    apart from the top-level element by where pydicom stops reading.
+    """
+
+    def __init__(self, max_header_bytes: int = 16 * 1024 * 1024, hash_stream: bool = True,
+                 tags: Optional[List[str]] = None):
+        self.max_header_bytes = max_header_bytes
+        self.tags = tags or HEADER_TAGS
+        self.size = 0
+        self.dataset: Optional[Dataset] = None
+        self._hash = hashlib.sha256() if hash_stream else None
+        self._buffer = bytearray()
+        self._search_from = 0
+
+    @property
+    def sha256(self) -> Optional[str]:
+        return self._hash.hexdigest() if self._hash is not None else None
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._hash is not None:
+            self._hash.update(chunk)
+        if self.dataset is not None:
+            return
+        self._buffer += chunk
+        while True:
+            position = self._buffer.find(PIXEL_DATA_TAG, self._search_from)
+            if position == -1:
+                # The tag may straddle the next chunk
+                self._search_from = max(0, len(self._buffer) - len(PIXEL_DATA_TAG) + 1)
+                break
+            if len(self._buffer) < position + PIXEL_DATA_HEADER_BYTES:
+                self._search_from = position
+                break
+            if self._try_parse(position):
+                return
+            self._search_from = position + 1
+        if len(self._buffer) > self.max_header_bytes:
+            raise HeaderTooLarge(f"DICOM header exceeds {self.max_header_bytes} bytes")
+
+    def finish(self) -> Dataset:
+        """Return the parsed header; parses the buffer if no pixels were seen."""
+        if self.dataset is None:
+            self.dataset = self._read(BytesIO(bytes(self._buffer)))
+            self._buffer = bytearray()
+        return self.dataset
+
+    def _try_parse(self, position: int) -> bool:
+        # Include the element header: stopping before PixelData seeks back to
+        # `position`, whereas running out of data leaves the file further on
+        fp = BytesIO(bytes(self._buffer[:position + PIXEL_DATA_HEADER_BYTES]))
+        try:
+            dataset = self._read(fp)
+        except Exception:
+            return False
+        if fp.tell() != position:
+            return False
+        self.dataset = dataset
+        self._buffer = bytearray()
+        return True
+
+    def _read(self, fp: BytesIO) -> Dataset:
+        return pydicom.dcmread(fp, stop_before_pixels=True, specific_tags=self.tags)
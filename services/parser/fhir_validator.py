@@ -0,0 +1,257 @@
+"""Fast structural validation of FHIR JSON resources.
+
+`construct_fhir_element` builds a full pydantic model for every resource
+and the parser throws it away. The fast path checks the same structure
+definitions (the fhir.resources model fields) without building models:
+element names, cardinality, required elements, choice-type groups and
+primitive formats. Each type's definition is compiled once per process
+into a `Schema` and cached.
+
+The fast path is conservative. It raises FastPathError for anything it
+does not accept outright, including valid input it does not check itself
+(e.g. url and base64Binary values, coercions pydantic would apply), and
+the caller then runs the full model, whose verdict is final.
+"""
+import datetime
+import math
+import typing
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fhir.resources import fhirtypes, get_fhir_model_class
+
+
+class FastPathError(ValueError):
+    """The fast path cannot accept a resource; validate it with the full model."""
+
+
+class Element(NamedTuple):
+    is_list: bool
+    # Checks a primitive value, or None for complex types
+    check: Optional[Callable[[Any, str], None]]
+    # Complex type name, or None for primitives
+    type_name: Optional[str]
+
+
+class Schema(NamedTuple):
+    type_name: str
+    elements: Dict[str, Element]
+    # Primitive elements need a value or an `_element` extension
+    required: Tuple[Tuple[str, ...], ...]
+    # Choice types such as value[x]: (group, member names, required)
+    choices: Tuple[Tuple[str, Tuple[str, ...], bool], ...]
+
+
+@lru_cache(maxsize=None)
+def model_class(resource_type: str):
+    return get_fhir_model_class(resource_type)
+
+
+def _fail(path: str, message: str):
+    raise FastPathError(f"{path}: {message}")
+
+
+def _check_string(type_) -> Callable[[Any, str], None]:
+    regex = getattr(type_, "regex", None)
+    min_length = getattr(type_, "min_length", None) or 0
+    max_length = getattr(type_, "max_length", None)
+
+    def check(value, path):
+        if not isinstance(value, str):
+            _fail(path, "expected a string")
+        if len(value) < min_length or (max_length is not None and len(value) > max_length):
+            _fail(path, "string length out of range")
+        # pydantic matches (not fullmatch) constrained strings; do the same
+        if regex is not None and not regex.match(value):
+            _fail(path, f"does not match {regex.pattern}")
+    return check
+
+
+def _check_boolean(value, path):
+    if not isinstance(value, bool):
+        _fail(path, "expected a boolean")
+
+
+def _check_integer(minimum: Optional[int]) -> Callable[[Any, str], None]:
+    def check(value, path):
+        if not isinstance(value, int) or isinstance(value, bool):
+            _fail(path, "expected an integer")
+        if minimum is not None and value < minimum:
+            _fail(path, f"must be >= {minimum}")
+    return check
+
+
+def _check_decimal(value, path):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        _fail(path, "expected a number")
+    if isinstance(value, float) and not math.isfinite(value):
+        _fail(path, "must be finite")
+
+
+def _check_temporal(type_, parse: Callable[[str], Any]) -> Callable[[Any, str], None]:
+    regex = type_.regex
+
+    def check(value, path):
+        if not isinstance(value, str) or not regex.fullmatch(value):
+            _fail(path, f"invalid {type_.__visit_name__}")
+        try:
+            parse(value)
+        except ValueError:
+            _fail(path, f"invalid {type_.__visit_name__}")
+    return check
+
+
+def _parse_date(value: str):
+    # Partial dates (YYYY, YYYY-MM) are valid; the regex covered them
+    if len(value) == 10:
+        datetime.date.fromisoformat(value)
+
+
+def _parse_date_time(value: str):
+    if len(value) > 10:
+        datetime.datetime.fromisoformat(value)
+    else:
+        _parse_date(value)
+
+
+def _unsupported(type_name: str) -> Callable[[Any, str], None]:
+    def check(value, path):
+        _fail(path, f"{type_name} values are checked by the full model only")
+    return check
+
+
+@lru_cache(maxsize=None)
+def _primitive_check(type_) -> Callable[[Any, str], None]:
+    # Models declare most boolean elements as plain bool
+    if issubclass(type_, (bool, fhirtypes.Boolean)):
+        return _check_boolean
+    if issubclass(type_, fhirtypes.PositiveInt):
+        return _check_integer(1)
+    if issubclass(type_, fhirtypes.UnsignedInt):
+        return _check_integer(0)
+    if issubclass(type_, fhirtypes.Integer64):
+        # integer64 is a JSON string; leave it to the full model
+        return _unsupported(type_.__name__)
+    if issubclass(type_, fhirtypes.Integer):
+        return _check_integer(None)
+    if issubclass(type_, fhirtypes.Decimal):
+        return _check_decimal
+    if issubclass(type_, fhirtypes.Instant):
+        return _check_temporal(type_, datetime.datetime.fromisoformat)
+    if issubclass(type_, fhirtypes.DateTime):
+        return _check_temporal(type_, _parse_date_time)
+    if issubclass(type_, fhirtypes.Date):
+        return _check_temporal(type_, _parse_date)
+    if issubclass(type_, fhirtypes.Time):
+        return _check_temporal(type_, datetime.time.fromisoformat)
+    if issubclass(type_, (fhirtypes.String, fhirtypes.Code, fhirtypes.Id, fhirtypes.Uri,
+                          fhirtypes.Markdown, fhirtypes.Oid, fhirtypes.Xhtml)):
+        return _check_string(type_)
+    # url, uuid, base64Binary and anything new
+    return _unsupported(type_.__name__)
+
+
+@lru_cache(maxsize=None)
+def compile_schema(type_name: str) -> Schema:
+    """Compile a FHIR type's model fields into a Schema, once per type."""
+    elements = {}
+    required = []
+    choices: Dict[str, Tuple[List[str], bool]] = {}
+    for field in model_class(type_name).__fields__.values():
+        if field.name in ("resource_type", "fhir_comments"):
+            continue
+        type_ = field.type_
+        # List[Optional[String]] for repeating primitives such as HumanName.given
+        if typing.get_origin(type_) is typing.Union:
+            args = [arg for arg in typing.get_args(type_) if arg is not type(None)]
+            if len(args) == 1:
+                type_ = args[0]
+        if isinstance(type_, type) and issubclass(type_, (bool, fhirtypes.Primitive)):
+            element = Element(field.shape != 1, _primitive_check(type_), None)
+        elif hasattr(type_, "fhir_type_name"):
+            element = Element(field.shape != 1, None, type_.fhir_type_name())
+        else:
+            element = Element(field.shape != 1, _unsupported(str(type_)), None)
+        elements[field.alias] = element
+
+        extra = field.field_info.extra
+        if field.required:
+            required.append((field.alias,))
+        elif extra.get("element_required"):
+            required.append((field.alias, "_" + field.alias))
+        if extra.get("one_of_many"):
+            members, _ = choices.setdefault(extra["one_of_many"], ([], extra.get("one_of_many_required", False)))
+            members.append(field.alias)
+    if type_name == "FHIRPrimitiveExtension":
+        # `_element` objects need at least one of these (a pre root validator)
+        required.append(("id", "extension", "fhir_comments"))
+    return Schema(
+        type_name=type_name,
+        elements=elements,
+        required=tuple(required),
+        choices=tuple((group, tuple(members), is_required) for group, (members, is_required) in choices.items()),
+    )
+
+
+def _validate_complex(value: Any, type_name: str, path: str):
+    if not isinstance(value, dict):
+        _fail(path, f"expected a {type_name} object")
+    if type_name in ("Resource", "DomainResource"):
+        # contained resources and the like name their own type
+        type_name = value.get("resourceType")
+        if not isinstance(type_name, str):
+            _fail(path, "resourceType missing")
+        try:
+            model_class(type_name)
+        except (LookupError, ValueError):
+            _fail(path, f"unknown resourceType {type_name}")
+    elif value.get("resourceType", type_name) != type_name:
+        _fail(path, f"resourceType must be {type_name}")
+    _validate_object(value, compile_schema(type_name), path)
+
+
+def _validate_object(value: Dict[str, Any], schema: Schema, path: str):
+    elements = schema.elements
+    for name, item in value.items():
+        if name in ("resourceType", "fhir_comments"):
+            continue
+        element = elements.get(name)
+        if element is None:
+            _fail(f"{path}.{name}", f"not an element of {schema.type_name}")
+        if item is None:
+            continue
+        item_path = f"{path}.{name}"
+        if element.is_list:
+            if not isinstance(item, list):
+                _fail(item_path, "expected a list")
+            for i, entry in enumerate(item):
+                if entry is None:
+                    _fail(f"{item_path}[{i}]", "null entries are checked by the full model only")
+                if element.check is not None:
+                    element.check(entry, f"{item_path}[{i}]")
+                else:
+                    _validate_complex(entry, element.type_name, f"{item_path}[{i}]")
+        elif element.check is not None:
+            element.check(item, item_path)
+        else:
+            _validate_complex(item, element.type_name, item_path)
+
+    for names in schema.required:
+        if all(value.get(name) is None for name in names):
+            _fail(f"{path}.{names[0]}", "required element missing")
+    for group, members, is_required in schema.choices:
+        present = sum(1 for name in members if value.get(name) is not None)
+        if present > 1 or (is_required and present == 0):
+            _fail(f"{path}.{group}[x]", "exactly one choice expected" if is_required else "at most one choice allowed")
+
+
+def validate_resource(payload: Any, resource_type: str):
+    """Check a resource against its structure definition.
+
+    Raises FastPathError when the resource is not accepted outright.
+    """
+    if not isinstance(payload, dict):
+        _fail(resource_type, "expected a JSON object")
+    if payload.get("resourceType", resource_type) != resource_type:
+        _fail(resource_type, f"resourceType must be {resource_type}")
+    _validate_object(payload, compile_schema(resource_type), resource_type)
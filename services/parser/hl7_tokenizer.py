@@ -0,0 +1,242 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+Data = Union[str, bytes, bytearray, memoryview]
+
+
+class TokenizerFallback(ValueError):
+    """The message needs the full python-hl7 parser."""
+
+
+class Segment:
+    """One segment of an HL7Message, addressed by offsets into its buffer.
+
+    Field boundaries are located on first access and only up to the field
+    requested; field text is materialized only when read.
+    """
+
+    __slots__ = ("message", "id", "start", "end", "_bounds", "_scanned_to")
+
+    def __init__(self, message: "HL7Message", segment_id: str, start: int, end: int):
+        self.message = message
+        self.id = segment_id
+        self.start = start
+        self.end = end
+        self._bounds: List[Tuple[int, int]] = []
+        self._scanned_to = start
+
+    def _scan(self, upto: Optional[int] = None):
+        # _bounds holds the raw split: [segment id, field 1, field 2, ...]
+        data = self.message.data
+        sep = self.message.field_sep
+        while self._scanned_to <= self.end and (upto is None or len(self._bounds) <= upto):
+            next_sep = data.find(sep, self._scanned_to, self.end)
+            if next_sep == -1:
+                next_sep = self.end
+            self._bounds.append((self._scanned_to, next_sep))
+            self._scanned_to = next_sep + 1
+
+    def _raw_index(self, number: int) -> Optional[int]:
+        # MSH-1 is the field separator itself, so MSH-n is raw field n - 1
+        if self.id == "MSH":
+            return None if number == 1 else number - 1
+        return number
+
+    def __len__(self) -> int:
+        """Field count including the segment id, as python-hl7 counts it."""
+        self._scan()
+        return len(self._bounds) + (1 if self.id == "MSH" else 0)
+
+    def field(self, number: int) -> Optional[str]:
+        """Raw text of field `number` (HL7 numbering), None if absent."""
+        raw = self._raw_index(number)
+        if raw is None:
+            return self.message.text(self.message.field_sep_offset, self.message.field_sep_offset + 1)
+        self._scan(raw)
+        if raw >= len(self._bounds):
+            return None
+        start, end = self._bounds[raw]
+        return self.message.text(start, end)
+
+    def __getitem__(self, number: int) -> str:
+        value = self.field(number)
+        return "" if value is None else value
+
+    def fields(self) -> List[str]:
+        """All fields in HL7 numbering; index 0 is the segment id."""
+        self._scan()
+        values = [self.message.text(start, end) for start, end in self._bounds]
+        if self.id == "MSH":
+            values.insert(1, self.message.field_sep_text)
+        return values
+
+
+class HL7Message:
+    """Single-pass, lazy HL7 v2 tokenizer over str or bytes.
+
+    Segment boundaries are found with one scan for segment terminators
+    (\\r, and \\n / \\r\\n when present); fields are located on demand.
+    Delimiters come from MSH-1/MSH-2. Messages the tokenizer does not
+    handle (no leading MSH, malformed encoding characters) raise
+    TokenizerFallback so callers can use python-hl7 instead.
+    """
+
+    def __init__(self, data: Data, encoding: str = "utf-8"):
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        self.data = data
+        self.encoding = encoding
+        self.is_bytes = isinstance(data, bytes)
+        whitespace = b" \t\r\n" if self.is_bytes else " \t\r\n"
+        self.start = len(data) - len(data.lstrip(whitespace))
+        self.end = len(data.rstrip(whitespace))
+
+        if self.text(self.start, self.start + 3) != "MSH" or self.end - self.start < 8:
+            raise TokenizerFallback("Message does not start with an MSH segment")
+        self.field_sep_offset = self.start + 3
+        self.field_sep = data[self.field_sep_offset:self.field_sep_offset + 1]
+        self.field_sep_text = self.text(self.field_sep_offset, self.field_sep_offset + 1)
+        encoding_end = data.find(self.field_sep, self.field_sep_offset + 1, self.end)
+        if encoding_end == -1:
+            encoding_end = self.end
+        encoding_chars = self.text(self.field_sep_offset + 1, encoding_end)
+        delimiters = self.field_sep_text + encoding_chars
+        if (len(encoding_chars) != 4 or len(set(delimiters)) != 5
+                or any(c.isalnum() or c in " \r\n" for c in delimiters)):
+            raise TokenizerFallback(f"Unsupported encoding characters {encoding_chars!r}")
+        self.component_sep, self.repetition_sep, self.escape_char, self.subcomponent_sep = encoding_chars
+
+        self._segments: Optional[List[Segment]] = None
+
+    def text(self, start: int, end: int) -> str:
+        if self.is_bytes:
+            return self.data[start:end].decode(self.encoding)
+        return self.data[start:end]
+
+    def _scan_segments(self) -> List[Segment]:
+        if self._segments is not None:
+            return self._segments
+        data = self.data
+        cr, lf = (b"\r", b"\n") if self.is_bytes else ("\r", "\n")
+        has_lf = data.find(lf, self.start, self.end) != -1
+        segments = []
+        pos = self.start
+        while pos < self.end:
+            end = data.find(cr, pos, self.end)
+            if has_lf:
+                lf_end = data.find(lf, pos, end if end != -1 else self.end)
+                if lf_end != -1:
+                    end = lf_end
+            if end == -1:
+                end = self.end
+            if end > pos:
+                segments.append(Segment(self, self.text(pos, min(pos + 3, end)), pos, end))
+            pos = end + 1
+        self._segments = segments
+        return segments
+
+    def __iter__(self) -> Iterator[Segment]:
+        return iter(self._scan_segments())
+
+    def segment(self, segment_id: str) -> Optional[Segment]:
+        for segment in self._scan_segments():
+            if segment.id == segment_id:
+                return segment
+        return None
+
+    def segments(self, segment_id: str) -> List[Segment]:
+        return [s for s in self._scan_segments() if s.id == segment_id]
+
+    def unescape(self, value: str) -> str:
+        return unescape(value, self.field_sep_text, self.component_sep, self.repetition_sep,
+                        self.escape_char, self.subcomponent_sep)
+
+    def field_index(self, segment_ids: Optional[Iterable[str]] = None) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+        return index_fields(((s.id, s.fields) for s in self._scan_segments()),
+                            self.component_sep, self.repetition_sep, self.subcomponent_sep, segment_ids)
+
+
+def index_fields(segments: Iterable[Tuple[str, Callable[[], List[str]]]], component_sep: str = "^",
+                 repetition_sep: str = "~", subcomponent_sep: str = "&",
+                 segment_ids: Optional[Iterable[str]] = None) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+    """Flatten segments into path -> values plus per-segment counts.
+
+    `segments` yields (segment id, fields getter) pairs where the getter
+    returns fields in HL7 numbering. Paths follow
+    SEG-field[.component[.subcomponent]]. Values of repeating segments and
+    field repetitions are appended in message order. Field paths are emitted
+    for every field position; component paths only for non-empty fields and
+    subcomponent paths only where a subcomponent separator occurs.
+    `segment_ids` limits which segments are indexed; the others are counted
+    but never split into fields.
+    """
+    wanted = set(segment_ids) if segment_ids else None
+    index: Dict[str, List[str]] = {}
+    counts: Dict[str, int] = {}
+    for segment_id, get_fields in segments:
+        counts[segment_id] = counts.get(segment_id, 0) + 1
+        if wanted is not None and segment_id not in wanted:
+            continue
+        fields = get_fields()
+        for number in range(1, len(fields)):
+            value = fields[number]
+            path = f"{segment_id}-{number}"
+            index.setdefault(path, []).append(value)
+            if not value or (segment_id == "MSH" and number <= 2):
+                continue
+            for repetition in value.split(repetition_sep):
+                for c, component in enumerate(repetition.split(component_sep), 1):
+                    index.setdefault(f"{path}.{c}", []).append(component)
+                    if subcomponent_sep in component:
+                        for sc, subcomponent in enumerate(component.split(subcomponent_sep), 1):
+                            index.setdefault(f"{path}.{c}.{sc}", []).append(subcomponent)
+    return index, counts
+
+
+# Escape sequences as python-hl7 resolves them (HL7 v2 chapter 2.10)
+_FORMATTING_ESCAPES = {
+    "H": "_", "N": "_",
+    ".br": "\r", ".sp": "\r", ".fi": "", ".nf": "",
+    ".in": "    ", ".ti": "    ", ".sk": " ", ".ce": "\r",
+}
+
+
+def unescape(value: str, field_sep: str = "|", component_sep: str = "^", repetition_sep: str = "~",
+             escape_char: str = "\\", subcomponent_sep: str = "&") -> str:
+    """Resolve HL7 escape sequences; unknown sequences are removed."""
+    if not value or escape_char not in value:
+        return value
+    delimiters = {"F": field_sep, "S": component_sep, "R": repetition_sep,
+                  "T": subcomponent_sep, "E": escape_char}
+    out = []
+    pos = 0
+    while True:
+        start = value.find(escape_char, pos)
+        if start == -1:
+            out.append(value[pos:])
+            break
+        end = value.find(escape_char, start + 1)
+        if end == -1:
+            # Unterminated sequence: drop it like python-hl7 does
+            out.append(value[pos:start])
+            break
+        out.append(value[pos:start])
+        sequence = value[start + 1:end]
+        pos = end + 1
+        if not sequence:
+            continue
+        if sequence in delimiters:
+            out.append(delimiters[sequence])
+        elif sequence in _FORMATTING_ESCAPES:
+            out.append(_FORMATTING_ESCAPES[sequence])
+        elif sequence.startswith(".") and sequence[:3] in _FORMATTING_ESCAPES:
+            try:
+                out.append(_FORMATTING_ESCAPES[sequence[:3]] * int(sequence[3:] or 1))
+            except ValueError:
+                pass
+        elif sequence[0] == "X":
+            hex_value = sequence[1:]
+            try:
+                out.append("".join(chr(int(hex_value[i:i + 2], 16)) for i in range(0, len(hex_value), 2)))
+            except ValueError:
+                pass
+    return "".join(out)
@@ -0,0 +1,364 @@
+"""Parsing logic shared by the parser service and fused ingress.
+
+Everything here is free of HTTP concerns: functions turn raw input into
+ParsedMessage objects and leave forwarding to the caller.
+"""
+import json
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import hl7
+from pydantic import BaseModel
+
+from common.canonical_json import ENCODING_CANONICAL, ENCODING_RAW, canonical_sha256, raw_sha256
+from common.executor import BoundedExecutor
+from common.instrumentation import stage
+from dicom_header import DicomHeaderReader
+from fhir_validator import FastPathError, model_class, validate_resource
+from hl7_tokenizer import HL7Message, TokenizerFallback, index_fields
+
+logger = logging.getLogger(__name__)
+
+# CPU-bound parsing (python-hl7/tokenizer, fhir.resources) runs in worker
+# processes; DICOM chunks are hashed and scanned on threads, since hashlib
+# releases the GIL. Both pools start on first use.
+parse_executor = BoundedExecutor("parse", default_kind="process")
+dicom_executor = BoundedExecutor("dicom", default_kind="thread")
+
+class ParsedMessage(BaseModel):
+    message_id: str
+    channel_id: str
+    message_type: str
+    parsed_data: Dict[str, Any]
+    timestamp: datetime
+    raw_size: int
+    # Digest recorded as sha256_payload in the hash chain, see payload_digest
+    payload_sha256: Optional[str] = None
+    payload_encoding: Optional[str] = None
+    # HL7 only: flat path -> values index and per-segment counts the
+    # validator's rules read; not part of the reported parsed_data
+    field_index: Optional[Dict[str, List[str]]] = None
+    segment_counts: Optional[Dict[str, int]] = None
+
+# What sha256_payload covers: the canonical parsed data ("jcs") or the
+# message bytes as received ("raw")
+PAYLOAD_HASH_MODE = os.getenv("PAYLOAD_HASH_MODE", ENCODING_CANONICAL)
+
+def payload_digest(parsed_data: Dict[str, Any], raw: Optional[bytes] = None) -> Tuple[str, str]:
+    """Hash a message for the chain while it is still on the parse worker.
+
+    Raw mode needs the message bytes; DICOM objects streamed without
+    DICOM_HASH_STREAM fall back to the canonical parsed data.
+    """
+    if PAYLOAD_HASH_MODE == ENCODING_RAW and raw is not None:
+        return raw_sha256(raw), ENCODING_RAW
+    return canonical_sha256(parsed_data), ENCODING_CANONICAL
+
+class HL7ParseRequest(BaseModel):
+    message_id: str
+    channel_id: str
+    payload: str
+    timestamp: str
+
+class HL7BatchParseRequest(BaseModel):
+    channel_id: str
+    messages: List[HL7ParseRequest] = []
+    batch_payload: Optional[str] = None
+
+BATCH_ENVELOPE_SEGMENTS = ("FHS", "BHS", "BTS", "FTS")
+
+def split_hl7_batch(payload: str) -> List[str]:
+    """Split an HL7 batch file (FHS/BHS ... BTS/FTS) into single messages."""
+    messages = []
+    current = []
+    for segment in payload.replace("\r\n", "\r").replace("\n", "\r").split("\r"):
+        # Drop MLLP framing bytes (VT / FS) around concatenated messages
+        segment = segment.strip("\x0b\x1c")
+        if not segment.strip():
+            continue
+        segment_id = segment[:3]
+        if segment_id in BATCH_ENVELOPE_SEGMENTS:
+            continue
+        if segment_id == "MSH" and current:
+            messages.append("\r".join(current))
+            current = []
+        current.append(segment)
+    if current:
+        messages.append("\r".join(current))
+    return messages
+
+# Segments included in the field index; empty means every segment
+HL7_INDEX_SEGMENTS = [s for s in os.getenv("HL7_INDEX_SEGMENTS", "").split(",") if s]
+
+def index_hl7_fields(payload: str) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+    """Flat path -> values index plus per-segment counts, see HL7Message.field_index."""
+    return HL7Message(payload).field_index(HL7_INDEX_SEGMENTS)
+
+def extract_hl7_fields(message) -> Dict[str, Any]:
+    """Pick the named fields the pipeline reports on.
+
+    Works on both an HL7Message and a python-hl7 Message: segments are
+    indexed by HL7 field number and `len()` counts the segment id.
+    """
+    msh = message.segment('MSH')
+    parsed_data = {
+        "message_type": str(msh[9]) if msh else None,
+        "message_control_id": str(msh[10]) if msh else None,
+        "sending_application": str(msh[3]) if msh else None,
+        "receiving_application": str(msh[5]) if msh else None,
+        "segments": {}
+    }
+    
+    # Extract patient data if present
+    pid = message.segment('PID')
+    if pid:
+        parsed_data["segments"]["PID"] = {
+            "patient_id": str(pid[3]) if len(pid) > 3 else None,
+            "patient_name": str(pid[5]) if len(pid) > 5 else None,
+            "date_of_birth": str(pid[7]) if len(pid) > 7 else None,
+            "gender": str(pid[8]) if len(pid) > 8 else None
+        }
+    
+    # Extract observations if present
+    obx_segments = []
+    for segment in message.segments('OBX'):
+        obx_segments.append({
+            "observation_id": str(segment[3]) if len(segment) > 3 else None,
+            "observation_value": str(segment[5]) if len(segment) > 5 else None,
+            "units": str(segment[6]) if len(segment) > 6 else None,
+            "reference_range": str(segment[7]) if len(segment) > 7 else None
+        })
+    
+    if obx_segments:
+        parsed_data["segments"]["OBX"] = obx_segments
+    return parsed_data
+
+class PythonHL7Message:
+    """Adapts python-hl7's lookups to return None for absent segments."""
+
+    def __init__(self, message):
+        self.message = message
+
+    def segment(self, segment_id: str):
+        segments = self.segments(segment_id)
+        return segments[0] if segments else None
+
+    def segments(self, segment_id: str):
+        return [s for s in self.message if str(s[0]) == segment_id]
+
+    def field_index(self, segment_ids: List[str]) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+        _, _, repetition_sep, component_sep, subcomponent_sep = self.message.separators[:5]
+        segments = ((str(s[0]), lambda s=s: [str(f) for f in s]) for s in self.message)
+        return index_fields(segments, component_sep, repetition_sep, subcomponent_sep, segment_ids)
+
+def build_hl7_parsed_message(request: HL7ParseRequest) -> ParsedMessage:
+    try:
+        with stage("hl7.parse", request.message_id):
+            message = HL7Message(request.payload)
+            parsed_data = extract_hl7_fields(message)
+            # Flat path -> values index used by the validator's rule lookups
+            field_index, segment_counts = message.field_index(HL7_INDEX_SEGMENTS)
+    except TokenizerFallback as e:
+        logger.info(f"Falling back to python-hl7 for message {request.message_id}: {str(e)}")
+        with stage("hl7.parse_fallback", request.message_id):
+            message = PythonHL7Message(hl7.parse(request.payload))
+            parsed_data = extract_hl7_fields(message)
+            field_index, segment_counts = message.field_index(HL7_INDEX_SEGMENTS)
+    
+    # The digest covers the extracted fields only, never the index, whose
+    # shape depends on HL7_INDEX_SEGMENTS and the parse path
+    with stage("payload.hash", request.message_id):
+        digest, encoding = payload_digest(parsed_data, request.payload.encode("utf-8"))
+    return ParsedMessage(
+        message_id=request.message_id,
+        channel_id=request.channel_id,
+        message_type="HL7",
+        parsed_data=parsed_data,
+        timestamp=datetime.fromisoformat(request.timestamp),
+        raw_size=len(request.payload),
+        payload_sha256=digest,
+        payload_encoding=encoding,
+        field_index=field_index,
+        segment_counts=segment_counts
+    )
+
+def parse_hl7_batch_items(request: HL7BatchParseRequest) -> Tuple[List[Dict[str, Any]], List[ParsedMessage]]:
+    """Parse every message of a batch, isolating failures per message.
+
+    Returns one result per message in request order plus the successfully
+    parsed messages, which still need validating.
+    """
+    items = list(request.messages)
+    if request.batch_payload:
+        timestamp = datetime.now(timezone.utc).isoformat()
+        for payload in split_hl7_batch(request.batch_payload):
+            items.append(HL7ParseRequest(
+                message_id=str(uuid.uuid4()),
+                channel_id=request.channel_id,
+                payload=payload,
+                timestamp=timestamp
+            ))
+    
+    results: List[Dict[str, Any]] = []
+    parsed_messages = []
+    for item in items:
+        try:
+            parsed_message = build_hl7_parsed_message(item)
+            parsed_messages.append(parsed_message)
+            results.append({"message_id": item.message_id, "parsed": parsed_message.parsed_data, "status": "success"})
+        except Exception as e:
+            logger.error(f"Error parsing HL7 message {item.message_id}: {str(e)}")
+            results.append({"message_id": item.message_id, "status": "error", "error": f"Invalid HL7 message: {str(e)}"})
+    return results, parsed_messages
+
+def attach_validations(results: List[Dict[str, Any]], validations: List[Dict[str, Any]]):
+    """Pair validator results, in order, with the successfully parsed messages."""
+    validated = iter(validations)
+    for result in results:
+        if result["status"] == "success":
+            result["validation"] = next(validated)
+
+# Upper bound on the bytes buffered before PixelData starts
+DICOM_MAX_HEADER_BYTES = int(os.getenv("DICOM_MAX_HEADER_BYTES", str(16 * 1024 * 1024)))
+# Hash the whole object, pixel data included, as it streams through
+DICOM_HASH_STREAM = os.getenv("DICOM_HASH_STREAM", "true").lower() in ("1", "true", "yes", "on")
+
+async def read_dicom_header(stream: AsyncIterator[bytes]) -> DicomHeaderReader:
+    # Only the header before PixelData is kept
+    reader = DicomHeaderReader(DICOM_MAX_HEADER_BYTES, DICOM_HASH_STREAM)
+    async for chunk in stream:
+        await dicom_executor.run(reader.feed, chunk, task="dicom_chunk")
+    await dicom_executor.run(reader.finish, task="dicom_header")
+    return reader
+
+def build_dicom_parsed_message(reader: DicomHeaderReader, channel_id: str, study_uid: str,
+                               series_uid: str, instance_uid: str, modality: str) -> ParsedMessage:
+    ds = reader.dataset
+    parsed_data = {
+        "study_instance_uid": study_uid,
+        "series_instance_uid": series_uid,
+        "sop_instance_uid": instance_uid,
+        "modality": modality,
+        "patient_name": str(ds.PatientName) if hasattr(ds, 'PatientName') else None,
+        "patient_id": str(ds.PatientID) if hasattr(ds, 'PatientID') else None,
+        "study_date": str(ds.StudyDate) if hasattr(ds, 'StudyDate') else None,
+        "study_time": str(ds.StudyTime) if hasattr(ds, 'StudyTime') else None,
+        "accession_number": str(ds.AccessionNumber) if hasattr(ds, 'AccessionNumber') else None,
+        "referring_physician": str(ds.ReferringPhysicianName) if hasattr(ds, 'ReferringPhysicianName') else None
+    }
+    if reader.sha256:
+        parsed_data["content_sha256"] = reader.sha256
+    
+    # The object was hashed as it streamed; its bytes are gone by now
+    if PAYLOAD_HASH_MODE == ENCODING_RAW and reader.sha256:
+        digest, encoding = reader.sha256, ENCODING_RAW
+    else:
+        with stage("payload.hash", instance_uid):
+            digest, encoding = payload_digest(parsed_data)
+    return ParsedMessage(
+        message_id=instance_uid,
+        channel_id=channel_id,
+        message_type="DICOM",
+        parsed_data=parsed_data,
+        timestamp=datetime.now(timezone.utc),
+        raw_size=reader.size,
+        payload_sha256=digest,
+        payload_encoding=encoding
+    )
+
+# Resource types checked by the fast path; others always build the full model
+FHIR_FAST_PATH_TYPES = [s for s in os.getenv("FHIR_FAST_PATH_TYPES", "Patient,Observation,DiagnosticReport,Encounter").split(",") if s]
+# Fraction of fast-path resources also validated with the full model
+FHIR_FULL_VALIDATION_SAMPLE_RATE = float(os.getenv("FHIR_FULL_VALIDATION_SAMPLE_RATE", "0"))
+
+def validate_fhir_resource(resource_type: str, payload: dict):
+    """Validate a FHIR resource, building the full model only when needed.
+
+    Resources the fast path does not accept outright, and a sample of those
+    it does, are validated with the fhir.resources model, whose verdict is
+    final.
+    """
+    if resource_type in FHIR_FAST_PATH_TYPES:
+        try:
+            validate_resource(payload, resource_type)
+        except FastPathError as e:
+            logger.debug(f"FHIR fast path declined {resource_type}: {str(e)}")
+        else:
+            if random.random() >= FHIR_FULL_VALIDATION_SAMPLE_RATE:
+                return
+            try:
+                model_class(resource_type).parse_obj(payload)
+            except Exception:
+                logger.warning(f"FHIR fast path accepted a {resource_type} the full model rejects")
+                raise
+            return
+    model_class(resource_type).parse_obj(payload)
+
+def fhir_parsed_message(channel_id: str, resource_type: str, resource_id: str, payload: Any,
+                        raw: bytes) -> ParsedMessage:
+    with stage("fhir.validate", resource_id):
+        validate_fhir_resource(resource_type, payload)
+    
+    parsed_data = {
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "data": payload
+    }
+    
+    # Extract common fields based on resource type
+    if resource_type == "Patient":
+        parsed_data["patient_id"] = payload.get("id")
+        parsed_data["patient_name"] = payload.get("name", [{}])[0].get("text") if payload.get("name") else None
+        
+    elif resource_type == "Observation":
+        parsed_data["observation_code"] = payload.get("code", {}).get("coding", [{}])[0].get("code")
+        parsed_data["observation_value"] = payload.get("valueQuantity", {}).get("value")
+        
+    with stage("payload.hash", resource_id):
+        digest, encoding = payload_digest(parsed_data, raw)
+    return ParsedMessage(
+        message_id=resource_id,
+        channel_id=channel_id,
+        message_type="FHIR",
+        parsed_data=parsed_data,
+        timestamp=datetime.now(timezone.utc),
+        raw_size=len(raw),
+        payload_sha256=digest,
+        payload_encoding=encoding
+    )
+
+def build_fhir_parsed_message(channel_id: str, resource_type: str, resource_id: str, body: bytes) -> ParsedMessage:
+    with stage("fhir.decode", resource_id):
+        payload = json.loads(body)
+    return fhir_parsed_message(channel_id, resource_type, resource_id, payload, body)
+
+def parse_fhir_batch_items(channel_id: str, body: bytes) -> Tuple[List[Dict[str, Any]], List[ParsedMessage]]:
+    """Parse NDJSON, one resource per line, isolating failures per line.
+
+    Blank lines are skipped; results follow the remaining lines in order.
+    Resources without an id get a generated message id.
+    """
+    results: List[Dict[str, Any]] = []
+    parsed_messages = []
+    for line in body.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            with stage("fhir.decode"):
+                payload = json.loads(line)
+            if not isinstance(payload, dict) or not isinstance(payload.get("resourceType"), str):
+                raise ValueError("expected a JSON object with a resourceType")
+            resource_type = payload["resourceType"]
+            resource_id = payload.get("id") or str(uuid.uuid4())
+            parsed_message = fhir_parsed_message(channel_id, resource_type, resource_id, payload, line)
+            parsed_messages.append(parsed_message)
+            # Parsed data is left out; bulk results stay small
+            results.append({"message_id": resource_id, "resource_type": resource_type, "status": "success"})
+        except Exception as e:
+            logger.error(f"Error parsing FHIR resource in batch: {str(e)}")
+            results.append({"message_id": None, "status": "error", "error": f"Invalid FHIR resource: {str(e)}"})
+    return results, parsed_messages
@@ -0,0 +1,567 @@
+"""Hash chain verification over the audit index or the S3 segment archive.
+
+Entries are streamed per shard in `seq` order in windows of a few thousand.
+Windows are verified on a process pool: every chain hash is recomputed and
+links and sequence numbers are checked inside the window. The main process
+then checks each window's boundary against the previous window in order,
+so the whole chain is verified without ever holding more than a few
+windows in memory.
+
+Progress is written to a checkpoint (per shard: last verified seq and
+chain hash). A later run can start from it and verify only what has been
+written since, or resume an interrupted run.
+
+Usage:
+    python chain_verifier.py [--source elasticsearch|s3] [--since-checkpoint]
+                             [--workers N] [--output report.json]
+"""
+import argparse
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GENESIS_HASH = "0" * 64
+ANCHOR_SHARD = "_anchor"
+ANCHOR_MESSAGE_TYPE = "CHAIN_ANCHOR"
+SEGMENT_MESSAGE_TYPE = "ARCHIVE_SEGMENT"
+UNSHARDED = "__unsharded__"
+MAX_PROBLEMS = 1000
+
+SOURCE_FIELDS = ["ts", "message_id", "msgType", "sha256_payload", "prevHash", "chainHash",
+                 "seq", "shard", "validation_data"]
+
+# (seq, ts, message_id, sha256_payload, prevHash, chainHash)
+Row = Tuple[int, str, str, str, str, str]
+
+_TS = re.compile(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(Z|[+-]\d\d:\d\d)$")
+
+
+def rfc3339_seconds(ts: str) -> str:
+    """Formats a stored timestamp as Go's time.RFC3339 does for hashing:
+    whole seconds, and `Z` for a zero offset."""
+    match = _TS.match(ts)
+    if match is None:
+        raise ValueError(f"unexpected timestamp {ts!r}")
+    offset = match.group(2)
+    if offset in ("+00:00", "-00:00"):
+        offset = "Z"
+    return match.group(1) + offset
+
+
+def chain_hash(ts: str, message_id: str, payload_hash: str, prev_hash: str) -> str:
+    data = f"{rfc3339_seconds(ts)}|{message_id}|{payload_hash}|{prev_hash}"
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def shard_genesis(shard: str) -> str:
+    if not shard:
+        return GENESIS_HASH
+    return hashlib.sha256(f"genesis|{shard}".encode()).hexdigest()
+
+
+def merkle_leaf(data: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + data).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> str:
+    """RFC 6962 tree hash, as computed by the hash writer."""
+    if not leaves:
+        return hashlib.sha256(b"").hexdigest()
+
+    def subtree(nodes: List[bytes]) -> bytes:
+        if len(nodes) == 1:
+            return nodes[0]
+        k = 1
+        while k * 2 < len(nodes):
+            k *= 2
+        return hashlib.sha256(b"\x01" + subtree(nodes[:k]) + subtree(nodes[k:])).digest()
+
+    return subtree(leaves).hex()
+
+
+def verify_inclusion(leaf_hash: str, index: int, size: int, path: List[str], root: str) -> bool:
+    """Checks a Merkle inclusion proof as served by the hash writer's
+    /proof endpoint (RFC 9162, section 2.1.3.2)."""
+    if index >= size:
+        return False
+    fn, sn = index, size - 1
+    r = bytes.fromhex(leaf_hash)
+    for node in path:
+        p = bytes.fromhex(node)
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = hashlib.sha256(b"\x01" + p + r).digest()
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            r = hashlib.sha256(b"\x01" + r + p).digest()
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r.hex() == root
+
+
+def anchor_root(heads: List[Dict[str, Any]]) -> str:
+    return merkle_root([merkle_leaf(f"{h['shard']}|{h['seq']}|{h['hash']}".encode()) for h in heads])
+
+
+def entry_row(entry: Dict[str, Any]) -> Row:
+    return (int(entry["seq"]), entry["ts"], entry["message_id"], entry["sha256_payload"],
+            entry["prevHash"], entry["chainHash"])
+
+
+def verify_window(shard: str, rows: List[Row]) -> Dict[str, Any]:
+    """Checks one window on its own; runs in a worker process."""
+    problems = []
+    prev = None
+    for seq, ts, message_id, payload, prev_hash, stored_hash in rows:
+        try:
+            computed = chain_hash(ts, message_id, payload, prev_hash)
+        except ValueError as e:
+            computed = None
+            problems.append(_problem("bad_entry", shard, seq, message_id, str(e)))
+        if computed is not None and computed != stored_hash:
+            problems.append(_problem("hash_mismatch", shard, seq, message_id,
+                                     "chainHash does not match the entry"))
+        if prev is not None:
+            if seq != prev[0] + 1:
+                problems.append(_problem("seq_gap", shard, seq, message_id, f"follows seq {prev[0]}"))
+            if prev_hash != prev[1]:
+                problems.append(_problem("broken_link", shard, seq, message_id,
+                                         "prevHash is not the previous chainHash"))
+        prev = (seq, stored_hash)
+    first, last = rows[0], rows[-1]
+    return {
+        "count": len(rows),
+        "first": (first[0], first[2], first[4]),
+        "last": (last[0], last[2], last[5]),
+        "problems": problems,
+    }
+
+
+def _problem(kind: str, shard: str, seq: Optional[int], message_id: Optional[str], detail: str) -> Dict[str, Any]:
+    return {"type": kind, "shard": shard, "seq": seq, "message_id": message_id, "detail": detail}
+
+
+class Checkpoint:
+    """Last verified position per shard, kept in a JSON file."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.shards: Dict[str, Dict[str, Any]] = {}
+        self.segment_key: Optional[str] = None
+        self.updated_at: Optional[str] = None
+
+    def load(self) -> "Checkpoint":
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.shards = data.get("shards", {})
+            self.segment_key = data.get("segment_key")
+            self.updated_at = data.get("updated_at")
+        return self
+
+    def save(self):
+        if not self.path:
+            return
+        self.updated_at = datetime.now(timezone.utc).isoformat()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"shards": self.shards, "segment_key": self.segment_key,
+                       "updated_at": self.updated_at}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class _ShardState:
+    def __init__(self, seq: int, chain_hash: str, message_id: Optional[str] = None):
+        self.seq = seq
+        self.chain_hash = chain_hash
+        self.message_id = message_id
+        self.verified = 0
+        self.first_seq: Optional[int] = None
+        # A shard stops advancing its checkpoint at the first problem
+        self.clean = True
+
+
+class ChainVerifier:
+    """Verifies windows of entries in order, several windows in flight.
+
+    `windows` yields `(shard, entries)` with each shard's entries in seq
+    order. Every shard starts from the checkpoint when `since_checkpoint`
+    is set, otherwise from its genesis hash at seq 0.
+    """
+
+    def __init__(self, checkpoint: Checkpoint, workers: int = 0, since_checkpoint: bool = False,
+                 checkpoint_every: int = 20):
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.since_checkpoint = since_checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.states: Dict[str, _ShardState] = {}
+        self.problems: List[Dict[str, Any]] = []
+        self.problem_count = 0
+        self.entries = 0
+        self.anchors = 0
+        self.segments = 0
+        # shard -> sorted [(seq, hash)] named by anchors
+        self.anchored: Dict[str, List[Tuple[int, str]]] = {}
+        self.segment_roots: Dict[str, str] = {}
+        self.sealed_roots: Dict[str, Tuple[str, str]] = {}
+        self._windows_done = 0
+
+    def start(self, shard: str) -> _ShardState:
+        state = self.states.get(shard)
+        if state is None:
+            saved = self.checkpoint.shards.get(shard) if self.since_checkpoint else None
+            if saved:
+                state = _ShardState(saved["seq"], saved["chain_hash"], saved.get("message_id"))
+            else:
+                state = _ShardState(0, shard_genesis(shard))
+            self.states[shard] = state
+        return state
+
+    def record(self, problem: Dict[str, Any]):
+        self.problem_count += 1
+        if len(self.problems) < MAX_PROBLEMS:
+            self.problems.append(problem)
+        state = self.states.get(problem["shard"])
+        if state is not None:
+            state.clean = False
+
+    def run(self, windows: Iterable[Tuple[str, List[Dict[str, Any]]]]):
+        pool = None
+        if self.workers > 0:
+            pool = ProcessPoolExecutor(max_workers=self.workers,
+                                       mp_context=multiprocessing.get_context("forkserver"))
+        pending: Deque[Tuple[str, List[Dict[str, Any]], Future]] = deque()
+        try:
+            for shard, entries in windows:
+                if not entries:
+                    continue
+                self.start(shard)
+                rows = [entry_row(entry) for entry in entries]
+                if pool is None:
+                    future: Future = Future()
+                    future.set_result(verify_window(shard, rows))
+                else:
+                    future = pool.submit(verify_window, shard, rows)
+                pending.append((shard, entries, future))
+                while len(pending) > max(1, self.workers * 2):
+                    self._finish(*pending.popleft())
+            while pending:
+                self._finish(*pending.popleft())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        self._check_segments()
+        self.checkpoint.save()
+
+    def _finish(self, shard: str, entries: List[Dict[str, Any]], future: Future):
+        result = future.result()
+        state = self.states[shard]
+        first_seq, first_id, first_prev = result["first"]
+        if first_seq != state.seq + 1:
+            self.record(_problem("seq_gap", shard, first_seq, first_id, f"follows seq {state.seq}"))
+        if first_prev != state.chain_hash:
+            self.record(_problem("broken_link", shard, first_seq, first_id,
+                                 "prevHash is not the previous chainHash"))
+        for problem in result["problems"]:
+            self.record(problem)
+
+        if shard == ANCHOR_SHARD:
+            self._collect_anchors(entries)
+        self._check_anchored(shard, entries)
+        for entry in entries:
+            if entry.get("msgType") == SEGMENT_MESSAGE_TYPE:
+                data = entry.get("validation_data") or {}
+                self.sealed_roots[data.get("segment_id")] = (entry["sha256_payload"], entry["message_id"])
+
+        if state.first_seq is None:
+            state.first_seq = first_seq
+        state.seq, state.message_id, state.chain_hash = result["last"]
+        state.verified += result["count"]
+        self.entries += result["count"]
+        if state.clean:
+            self.checkpoint.shards[shard] = {"seq": state.seq, "chain_hash": state.chain_hash,
+                                             "message_id": state.message_id}
+        self._windows_done += 1
+        if self._windows_done % self.checkpoint_every == 0:
+            self.checkpoint.save()
+
+    def _collect_anchors(self, entries: List[Dict[str, Any]]):
+        for entry in entries:
+            if entry.get("msgType") != ANCHOR_MESSAGE_TYPE:
+                continue
+            self.anchors += 1
+            heads = (entry.get("validation_data") or {}).get("heads") or []
+            if anchor_root(heads) != entry["sha256_payload"]:
+                self.record(_problem("anchor_root_mismatch", ANCHOR_SHARD, entry["seq"], entry["message_id"],
+                                     "root does not match the listed heads"))
+            for head in heads:
+                bisect.insort(self.anchored.setdefault(head["shard"], []), (head["seq"], head["hash"]))
+
+    def _check_anchored(self, shard: str, entries: List[Dict[str, Any]]):
+        anchored = self.anchored.get(shard)
+        if not anchored:
+            return
+        first, last = entries[0]["seq"], entries[-1]["seq"]
+        start = bisect.bisect_left(anchored, (first, ""))
+        end = bisect.bisect_right(anchored, (last, "\uffff"))
+        for seq, expected in anchored[start:end]:
+            entry = entries[seq - first] if 0 <= seq - first < len(entries) else None
+            if entry is None or entry["seq"] != seq:
+                continue
+            if entry["chainHash"] != expected:
+                self.record(_problem("anchor_head_mismatch", shard, seq, entry["message_id"],
+                                     "entry differs from the anchored head"))
+
+    def add_segment_root(self, segment_id: str, root: str):
+        self.segments += 1
+        self.segment_roots[segment_id] = root
+
+    def _check_segments(self):
+        for segment_id, root in self.segment_roots.items():
+            sealed = self.sealed_roots.get(segment_id)
+            if sealed is not None and sealed[0] != root:
+                self.record(_problem("segment_root_mismatch", "", None, sealed[1],
+                                     f"segment {segment_id} data does not match its recorded root"))
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ok": self.problem_count == 0,
+            "entries": self.entries,
+            "anchors": self.anchors,
+            "segments": self.segments,
+            "problem_count": self.problem_count,
+            "problems": self.problems,
+            "shards": {
+                shard: {
+                    "verified": state.verified,
+                    "first_seq": state.first_seq,
+                    "last_seq": state.seq,
+                    "head": state.chain_hash,
+                    "last_message_id": state.message_id,
+                }
+                for shard, state in sorted(self.states.items())
+            },
+        }
+
+
+class ElasticsearchSource:
+    """Streams entries per shard in seq order through a point-in-time with
+    search_after, so a year of indices is read page by page without
+    deep-paging costs and unaffected by concurrent writes."""
+
+    def __init__(self, es, index_pattern: str = "audit-*", page_size: int = 10000, keep_alive: str = "5m"):
+        self.es = es
+        self.index_pattern = index_pattern
+        self.page_size = page_size
+        self.keep_alive = keep_alive
+
+    def shards(self) -> List[str]:
+        response = self.es.search(index=self.index_pattern, body={
+            "size": 0,
+            "query": {"exists": {"field": "seq"}},
+            "aggs": {"shards": {"terms": {"field": "shard", "missing": UNSHARDED, "size": 10000}}},
+        })
+        buckets = response["aggregations"]["shards"]["buckets"]
+        shards = sorted("" if b["key"] == UNSHARDED else b["key"] for b in buckets)
+        # Anchors first, so their heads are known when the shards are read
+        if ANCHOR_SHARD in shards:
+            shards.remove(ANCHOR_SHARD)
+            shards.insert(0, ANCHOR_SHARD)
+        return shards
+
+    def windows(self, verifier: ChainVerifier) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        pit_id = self.es.open_point_in_time(index=self.index_pattern, keep_alive=self.keep_alive)["id"]
+        try:
+            for shard in self.shards():
+                after_seq = verifier.start(shard).seq
+                search_after = None
+                while True:
+                    body = {
+                        "size": self.page_size,
+                        "_source": SOURCE_FIELDS,
+                        "query": self._query(shard, after_seq),
+                        "pit": {"id": pit_id, "keep_alive": self.keep_alive},
+                        "sort": [{"seq": "asc"}, {"_shard_doc": "asc"}],
+                        "track_total_hits": False,
+                    }
+                    if search_after is not None:
+                        body["search_after"] = search_after
+                    response = self.es.search(body=body)
+                    pit_id = response.get("pit_id", pit_id)
+                    hits = response["hits"]["hits"]
+                    if not hits:
+                        break
+                    yield shard, [hit["_source"] for hit in hits]
+                    search_after = hits[-1]["sort"]
+        finally:
+            try:
+                self.es.close_point_in_time(body={"id": pit_id})
+            except Exception as e:
+                logger.warning(f"Failed to close point in time: {str(e)}")
+
+    @staticmethod
+    def _query(shard: str, after_seq: int) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"filter": [{"range": {"seq": {"gt": after_seq}}}]}
+        if shard:
+            query["filter"].append({"term": {"shard": shard}})
+        else:
+            query["must_not"] = [{"exists": {"field": "shard"}}]
+        return {"bool": query}
+
+
+class SegmentSource:
+    """Streams entries from the sealed segments in S3, in upload order.
+
+    Each segment's Merkle root is recomputed from its lines and compared
+    with the ARCHIVE_SEGMENT entry that recorded it. Shard windows end at
+    segment boundaries, so the checkpoint can name the last segment read.
+    """
+
+    def __init__(self, s3, bucket: str, prefix: str = "segments/", window_size: int = 10000):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.window_size = window_size
+
+    def keys(self, start_after: Optional[str]) -> Iterator[str]:
+        paginator = self.s3.get_paginator("list_objects_v2")
+        params = {"Bucket": self.bucket, "Prefix": self.prefix}
+        if start_after:
+            params["StartAfter"] = start_after
+        for page in paginator.paginate(**params):
+            for item in page.get("Contents", []):
+                if item["Key"].endswith(".jsonl.gz"):
+                    yield item["Key"]
+
+    def windows(self, verifier: ChainVerifier) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        start_after = verifier.checkpoint.segment_key if verifier.since_checkpoint else None
+        for key in self.keys(start_after):
+            body = self.s3.get_object(Bucket=self.bucket, Key=key)["Body"]
+            buffers: Dict[str, List[Dict[str, Any]]] = {}
+            leaves = []
+            with gzip.GzipFile(fileobj=body) as lines:
+                for line in lines:
+                    line = line.rstrip(b"\n")
+                    if not line:
+                        continue
+                    leaves.append(merkle_leaf(line))
+                    entry = json.loads(line)
+                    shard = entry.get("shard", "")
+                    # Entries before the checkpoint were verified already
+                    if entry.get("seq", 0) <= verifier.start(shard).seq and verifier.since_checkpoint:
+                        continue
+                    buffer = buffers.setdefault(shard, [])
+                    buffer.append(entry)
+                    if len(buffer) >= self.window_size:
+                        yield shard, buffer
+                        buffers[shard] = []
+            for shard, buffer in buffers.items():
+                yield shard, buffer
+            segment_id = os.path.basename(key)[:-len(".jsonl.gz")]
+            verifier.add_segment_root(segment_id, merkle_root(leaves))
+            verifier.checkpoint.segment_key = key
+
+
+def es_client_from_env(**kwargs):
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(
+        [f"http://{os.getenv('ES_HOST', 'localhost')}:{os.getenv('ES_PORT', '9200')}"],
+        basic_auth=(os.getenv('ES_USERNAME', 'elastic'), os.getenv('ES_PASSWORD', 'changeme')),
+        **kwargs
+    )
+
+
+def s3_client_from_env():
+    import boto3
+    return boto3.client(
+        's3',
+        endpoint_url=os.getenv('S3_ENDPOINT', 'http://localhost:9000'),
+        aws_access_key_id=os.getenv('S3_ACCESS_KEY', 'minioadmin'),
+        aws_secret_access_key=os.getenv('S3_SECRET_KEY', 'minioadmin'),
+        region_name=os.getenv('S3_REGION', 'us-east-1')
+    )
+
+
+def default_checkpoint_path(source: str) -> str:
+    return os.path.join(os.getenv("VERIFY_CHECKPOINT_DIR", "/var/lib/compliance/verify"),
+                        f"chain-{source}.json")
+
+
+def default_workers() -> int:
+    workers = os.getenv("VERIFY_WORKERS", "")
+    return int(workers) if workers else (os.cpu_count() or 1)
+
+
+def verify_chain(source: str = "elasticsearch", since_checkpoint: bool = False, workers: Optional[int] = None,
+                 checkpoint_path: Optional[str] = None, es=None, s3=None) -> Dict[str, Any]:
+    """Runs one verification and returns its report."""
+    checkpoint = Checkpoint(checkpoint_path or default_checkpoint_path(source)).load()
+    verifier = ChainVerifier(checkpoint, workers=default_workers() if workers is None else workers,
+                             since_checkpoint=since_checkpoint)
+    page_size = int(os.getenv("VERIFY_PAGE_SIZE", "10000"))
+    if source == "s3":
+        reader = SegmentSource(s3 or s3_client_from_env(), os.getenv("S3_BUCKET", "compliance-audit"),
+                               window_size=page_size)
+    elif source == "elasticsearch":
+        reader = ElasticsearchSource(es or es_client_from_env(),
+                                     f"{os.getenv('ES_INDEX_PREFIX', 'audit')}-*", page_size=page_size)
+    else:
+        raise ValueError(f"unknown source {source!r}")
+
+    started = datetime.now(timezone.utc)
+    verifier.run(reader.windows(verifier))
+    report = verifier.report()
+    report.update({
+        "source": source,
+        "mode": "incremental" if since_checkpoint else "full",
+        "started_at": started.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "checkpoint": checkpoint.path,
+    })
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Verify the audit hash chain")
+    parser.add_argument("--source", choices=["elasticsearch", "s3"], default="elasticsearch")
+    parser.add_argument("--since-checkpoint", action="store_true",
+                        help="start every shard at the last checkpoint (incremental or resumed run)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (0: verify inline)")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = verify_chain(args.source, args.since_checkpoint, args.workers, args.checkpoint)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    logger.info(f"Verified {report['entries']} entries in {len(report['shards'])} shards, "
+                f"{report['problem_count']} problems")
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""Pre-aggregated message counters for the reports.
+
+The hash writer counts every committed message per day × channel × message
+type × severity and adds the counts to one document per counter in the
+monthly `compliance-stats-YYYY.MM` indices (stats.go). A report for any
+period reads the period's counters instead of aggregating the audit
+indices, so its cost depends on the number of counters, not messages.
+Both are read with paged composite aggregations, which list every channel
+however many there are, and answered from the ES request cache while an
+index is unchanged.
+
+Counters lost to a crash of the hash writer, or written before it kept
+them, are rebuilt from the audit indices by the backfill:
+
+    python daily_stats.py backfill --from 2023-12-01 --to 2023-12-31
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Segment seals and shard anchors are chain entries, not messages
+INTERNAL_MESSAGE_TYPES = ["ARCHIVE_SEGMENT", "CHAIN_ANCHOR"]
+DIMENSIONS = ("channel_id", "msgType", "severity")
+PAGE_SIZE = 10000
+PREFERENCE = "compliance-reporter"
+
+
+def stats_prefix() -> str:
+    return os.getenv("STATS_INDEX_PREFIX", "compliance-stats")
+
+
+def stats_index(day: date, prefix: Optional[str] = None) -> str:
+    return f"{prefix or stats_prefix()}-{day.strftime('%Y.%m')}"
+
+
+def stats_doc_id(day: date, channel_id: str, msg_type: str, severity: str) -> str:
+    """The counter's document id; the hash writer uses the same."""
+    return "|".join([day.isoformat(), channel_id, msg_type, severity])
+
+
+def days(start: date, end: date) -> Iterator[date]:
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+def _search(es, index: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    # Aggregation-only searches are answered from the shard request cache
+    # until the index refreshes; one preference string sends every query to
+    # the same shard copies, so repeated reads agree and hit a warm cache
+    return es.search(index=index, body=body, ignore_unavailable=True, request_cache=True,
+                     preference=PREFERENCE)
+
+
+def _composite_pages(es, index: str, query: Dict[str, Any], sources: List[Dict[str, Any]],
+                     aggs: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """Yields every bucket of a composite aggregation, page by page."""
+    after = None
+    while True:
+        composite: Dict[str, Any] = {"size": PAGE_SIZE, "sources": sources}
+        if after is not None:
+            composite["after"] = after
+        counts: Dict[str, Any] = {"composite": composite}
+        if aggs:
+            counts["aggs"] = aggs
+        response = _search(es, index, {"size": 0, "query": query, "aggs": {"counts": counts}})
+        result = response.get("aggregations", {}).get("counts", {})
+        buckets = result.get("buckets", [])
+        yield from buckets
+        after = result.get("after_key")
+        if not after or len(buckets) < PAGE_SIZE:
+            return
+
+
+def read_counts(es, start: date, end: date, prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Returns the counters of the days from start to end, inclusive."""
+    sources = [{"day": {"date_histogram": {"field": "day", "calendar_interval": "1d", "format": "yyyy-MM-dd"}}}]
+    sources += [{field: {"terms": {"field": field}}} for field in DIMENSIONS]
+    query = {"range": {"day": {"gte": start.isoformat(), "lte": end.isoformat()}}}
+    return [{**bucket["key"], "count": int(bucket["count"]["value"])}
+            for bucket in _composite_pages(es, f"{prefix or stats_prefix()}-*", query, sources,
+                                           {"count": {"sum": {"field": "count"}}})]
+
+
+class CountsCache:
+    """Reads the counters of days, memoizing those of closed days.
+
+    A day is closed two UTC days after its date: its audit index, named in
+    the entries' own offset, is no longer written and the hash writer has
+    flushed its counts. Closed days are served from memory for `ttl`
+    seconds, so regenerating reports over a quarter reads only the days
+    still open; the ttl bounds how long a backfill goes unnoticed.
+    """
+
+    def __init__(self, es, index_prefix: str = "audit", ttl: float = 3600, max_days: int = 4096):
+        self.es = es
+        self.index_prefix = index_prefix
+        self.ttl = ttl
+        self.max_days = max_days
+        self._days: "OrderedDict[date, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def closed(day: date) -> bool:
+        return day <= datetime.now(timezone.utc).date() - timedelta(days=2)
+
+    def _get(self, day: date) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            cached = self._days.get(day)
+            if cached is None or time.monotonic() - cached[0] > self.ttl:
+                return None
+            self._days.move_to_end(day)
+            return cached[1]
+
+    def _put(self, day: date, counts: List[Dict[str, Any]]):
+        with self._lock:
+            self._days[day] = (time.monotonic(), counts)
+            self._days.move_to_end(day)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+
+    def counts(self, start: date, end: date, refresh: bool = False) -> List[Dict[str, Any]]:
+        """The counters of the days from start to end. Days without
+        counters, written before the hash writer kept them, are counted
+        from their audit index. refresh reads every day again."""
+        result: Dict[date, List[Dict[str, Any]]] = {}
+        missing = []
+        for day in days(start, end):
+            cached = None if refresh else self._get(day)
+            if cached is None:
+                missing.append(day)
+            else:
+                result[day] = cached
+        if missing:
+            by_day: Dict[str, List[Dict[str, Any]]] = {}
+            for count in read_counts(self.es, missing[0], missing[-1]):
+                by_day.setdefault(count["day"], []).append(count)
+            for day in missing:
+                counts = by_day.get(day.isoformat()) or count_day(self.es, day, self.index_prefix)
+                result[day] = counts
+                if self.closed(day):
+                    self._put(day, counts)
+        return [count for day in sorted(result) for count in result[day]]
+
+
+def _buckets(totals: Dict[str, int]) -> List[Dict[str, Any]]:
+    ordered = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+    return [{"key": key, "doc_count": count} for key, count in ordered]
+
+
+def summarize(counts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sums counters into the shape of the aggregations the reports were
+    built from, so the PDF and JSON renderers read either."""
+    totals: Dict[str, Dict[str, int]] = {field: {} for field in DIMENSIONS}
+    total = errors = 0
+    for count in counts:
+        n = count["count"]
+        total += n
+        if count["severity"] == "ERROR":
+            errors += n
+        for field in DIMENSIONS:
+            totals[field][count[field]] = totals[field].get(count[field], 0) + n
+    return {
+        "total_messages": {"value": total},
+        "by_type": {"buckets": _buckets(totals["msgType"])},
+        "by_severity": {"buckets": _buckets(totals["severity"])},
+        "by_channel": {"buckets": _buckets(totals["channel_id"])},
+        "error_messages": {"doc_count": errors},
+    }
+
+
+def period_summary(es, start: date, end: date) -> Dict[str, Any]:
+    return summarize(CountsCache(es, os.getenv("ES_INDEX_PREFIX", "audit")).counts(start, end))
+
+
+def count_day(es, day: date, index_prefix: str = "audit") -> List[Dict[str, Any]]:
+    """Counts a day's messages in its audit index with a composite
+    aggregation, page by page."""
+    sources = [{field: {"terms": {"field": field, "missing_bucket": True}}} for field in DIMENSIONS]
+    query = {"bool": {"must_not": {"terms": {"msgType": INTERNAL_MESSAGE_TYPES}}}}
+    counts = []
+    for bucket in _composite_pages(es, f"{index_prefix}-{day.strftime('%Y.%m.%d')}", query, sources):
+        key = {field: bucket["key"][field] or "" for field in DIMENSIONS}
+        counts.append({"day": day.isoformat(), **key, "count": bucket["doc_count"]})
+    return counts
+
+
+def backfill(es, start: date, end: date, index_prefix: str = "audit") -> Dict[str, int]:
+    """Rebuilds the counters of each day from its audit index.
+
+    A day's counters are replaced with the exact counts, so the backfill
+    can be repeated. Counts the hash writer flushes for a day while it is
+    being rebuilt can be lost; backfill days that are no longer written.
+    """
+    rebuilt = {}
+    for day in days(start, end):
+        counts = count_day(es, day, index_prefix)
+        index = stats_index(day)
+        es.delete_by_query(index=f"{stats_prefix()}-*", ignore_unavailable=True, refresh=True,
+                           body={"query": {"term": {"day": day.isoformat()}}})
+        if counts:
+            lines = []
+            for count in counts:
+                doc_id = stats_doc_id(day, count["channel_id"], count["msgType"], count["severity"])
+                lines.append(json.dumps({"index": {"_index": index, "_id": doc_id}}))
+                lines.append(json.dumps(count))
+            response = es.bulk(body="\n".join(lines) + "\n", refresh=True)
+            if response.get("errors"):
+                raise RuntimeError(f"Failed to write the counters of {day.isoformat()}")
+        rebuilt[day.isoformat()] = sum(count["count"] for count in counts)
+        logger.info(f"Rebuilt {len(counts)} counters for {day.isoformat()}: {rebuilt[day.isoformat()]} messages")
+    return rebuilt
+
+
+def _date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-aggregated message counters")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("backfill", help="rebuild the counters from the audit indices")
+    show = commands.add_parser("summary", help="print the summary of a period")
+    for command in (rebuild, show):
+        command.add_argument("--from", dest="start", type=_date, required=True, help="first day, YYYY-MM-DD")
+        command.add_argument("--to", dest="end", type=_date, required=True, help="last day, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+    if args.end < args.start:
+        parser.error("--to is before --from")
+
+    logging.basicConfig(level=logging.INFO)
+    from chain_verifier import es_client_from_env
+    es = es_client_from_env()
+    if args.command == "backfill":
+        result = backfill(es, args.start, args.end, os.getenv("ES_INDEX_PREFIX", "audit"))
+    else:
+        result = period_summary(es, args.start, args.end)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import logging
+import re
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class Severity(str, Enum):
+    OK = "OK"
+    WARN = "WARN"
+    ERROR = "ERROR"
+
+
+class ValidationRule(BaseModel):
+    id: str
+    name: str
+    description: str
+    segment: Optional[str] = None
+    field: Optional[int] = None
+    path: Optional[str] = None
+    operator: str
+    value: Optional[Any] = None
+    severity: Severity
+    message: str
+    active: bool = True
+
+
+class ValidationResult(BaseModel):
+    rule_id: str
+    passed: bool
+    severity: Severity
+    message: str
+    details: Optional[Dict[str, Any]] = None
+
+
+# Named keys older parsers emit for HL7 fields, used when no field index is sent
+HL7_FIELD_KEYS = {
+    "PID": {3: "patient_id", 5: "patient_name", 7: "date_of_birth", 8: "gender"},
+    "OBX": {3: "observation_id", 5: "observation_value", 6: "units", 7: "reference_range"},
+}
+
+# Segments that stand for a whole non-HL7 message type
+MESSAGE_TYPE_SEGMENTS = {"DICOM": "DICOM", "FHIR": "FHIR"}
+
+# Operators whose failure does not depend on the segment being present
+PRESENCE_OPERATORS = {"NOT_EMPTY"}
+
+HL7_PATH = re.compile(r"^([A-Z][A-Z0-9]{2})-(\d+)(?:\.(\d+))?(?:\.(\d+))?$")
+
+
+class InvalidRule(ValueError):
+    pass
+
+
+class CompiledRule:
+    """A rule turned into a check function plus prebuilt result objects.
+
+    Result objects are shared between messages and must not be mutated.
+    """
+
+    __slots__ = ("rule", "segment", "check", "requires_segment", "passed_result", "failed_result")
+
+    def __init__(self, rule: ValidationRule):
+        self.rule = rule
+        self.segment = rule_segment(rule)
+        self.check = _compile_check(rule)
+        self.requires_segment = rule.operator not in PRESENCE_OPERATORS
+        self.passed_result = ValidationResult(
+            rule_id=rule.id,
+            passed=True,
+            severity=Severity.OK,
+            message="Validation passed"
+        )
+        self.failed_result = ValidationResult(
+            rule_id=rule.id,
+            passed=False,
+            severity=rule.severity,
+            message=rule.message,
+            details={"rule": rule.dict()}
+        )
+
+    def evaluate(self, target: Any) -> ValidationResult:
+        try:
+            return self.passed_result if self.check(target) else self.failed_result
+        except Exception as e:
+            logger.error(f"Error applying rule {self.rule.id}: {str(e)}")
+            return ValidationResult(
+                rule_id=self.rule.id,
+                passed=False,
+                severity=Severity.ERROR,
+                message=f"Rule evaluation error: {str(e)}",
+                details={"error": str(e)}
+            )
+
+    def evaluate_timed(self, target: Any, observe: Callable[[str, float], None]) -> ValidationResult:
+        started = time.perf_counter()
+        result = self.evaluate(target)
+        observe(self.rule.id, time.perf_counter() - started)
+        return result
+
+
+def rule_path(rule: ValidationRule) -> Optional[str]:
+    """The field path a rule reads: explicit `path`, else SEG-field."""
+    if rule.path:
+        return rule.path
+    if rule.segment == "DICOM" and rule.operator == "IN_LIST":
+        return "modality"
+    if rule.segment and rule.segment not in MESSAGE_TYPE_SEGMENTS and rule.field:
+        return f"{rule.segment}-{rule.field}"
+    return None
+
+
+def rule_segment(rule: ValidationRule) -> Optional[str]:
+    if rule.path:
+        match = HL7_PATH.match(rule.path)
+        if match:
+            return match.group(1)
+    return rule.segment
+
+
+def lookup(field_index: Dict[str, List[Any]], path: str) -> List[Any]:
+    values = field_index.get(path)
+    # A field without components is its own first component (PID-3.1 == PID-3)
+    while values is None and path.endswith(".1"):
+        path = path[:-2]
+        values = field_index.get(path)
+    return values or []
+
+
+def _hl7_accessor(rule: ValidationRule) -> Callable[[Dict[str, List[Any]]], List[Any]]:
+    path = rule_path(rule)
+    if path is None:
+        return lambda field_index: []
+    if not HL7_PATH.match(path):
+        raise InvalidRule(f"Invalid field path for rule {rule.id}: {path}")
+    return lambda field_index: lookup(field_index, path)
+
+
+def _message_accessor(rule: ValidationRule) -> Callable[[Dict[str, Any]], List[Any]]:
+    key = rule_path(rule)
+
+    def get(parsed_data):
+        value = parsed_data.get(key) if key else None
+        return [] if value is None else [value]
+
+    return get
+
+
+def _compile_check(rule: ValidationRule) -> Callable[[Any], bool]:
+    if rule_segment(rule) in MESSAGE_TYPE_SEGMENTS:
+        get = _message_accessor(rule)
+    else:
+        get = _hl7_accessor(rule)
+
+    # Every occurrence (repeating segments, field repetitions) must pass
+    if rule.operator == "NOT_EMPTY":
+        def check(target):
+            values = get(target)
+            return bool(values) and all(value and str(value).strip() for value in values)
+    elif rule.operator == "REGEX":
+        try:
+            pattern = re.compile(rule.value)
+        except (re.error, TypeError) as e:
+            raise InvalidRule(f"Invalid regex for rule {rule.id}: {str(e)}")
+
+        def check(target):
+            values = get(target)
+            return bool(values) and all(value and pattern.match(str(value)) for value in values)
+    elif rule.operator == "IN_LIST":
+        allowed = frozenset(rule.value or [])
+
+        def check(target):
+            values = get(target)
+            return bool(values) and all(value in allowed for value in values)
+    else:
+        def check(target):
+            return True
+    return check
+
+
+def legacy_field_index(parsed_data: Dict[str, Any]) -> Tuple[Dict[str, List[Any]], Dict[str, int]]:
+    """Build a field index from the named `segments` of older parser output."""
+    index: Dict[str, List[Any]] = {}
+    counts: Dict[str, int] = {}
+    for segment, segment_data in (parsed_data.get("segments") or {}).items():
+        occurrences = segment_data if isinstance(segment_data, list) else [segment_data]
+        counts[segment] = len(occurrences)
+        for field, key in HL7_FIELD_KEYS.get(segment, {}).items():
+            for occurrence in occurrences:
+                if key in occurrence:
+                    index.setdefault(f"{segment}-{field}", []).append(occurrence[key])
+    return index, counts
+
+
+class RulePlan:
+    """Active rules compiled once and indexed by message type and segment.
+
+    HL7 rules are grouped per segment and read values from the parser's flat
+    field index; a rule is skipped when its segment is absent from the
+    message, except for presence checks such as NOT_EMPTY. DICOM and FHIR
+    rules read top-level keys of the parsed data. Rules without a segment or
+    path never apply.
+    """
+
+    def __init__(self, rules: List[ValidationRule]):
+        self.rule_count = 0
+        self.hl7_segments: Dict[str, List[CompiledRule]] = {}
+        self.whole_message: Dict[str, List[CompiledRule]] = {}
+        for rule in rules:
+            segment = rule_segment(rule)
+            if rule.path and not segment:
+                raise InvalidRule(f"Invalid field path for rule {rule.id}: {rule.path}")
+            if not rule.active or not segment:
+                continue
+            compiled = CompiledRule(rule)
+            message_type = MESSAGE_TYPE_SEGMENTS.get(segment)
+            if message_type:
+                self.whole_message.setdefault(message_type, []).append(compiled)
+            else:
+                self.hl7_segments.setdefault(segment, []).append(compiled)
+            self.rule_count += 1
+
+    def evaluate(self, data: Dict[str, Any],
+                 observe: Optional[Callable[[str, float], None]] = None) -> List[ValidationResult]:
+        """Applies the rules to a message. With observe, each rule's
+        evaluation time is passed to observe(rule_id, seconds)."""
+        message_type = data.get("message_type")
+        parsed_data = data.get("parsed_data") or {}
+        if message_type == "HL7":
+            return self._evaluate_hl7(data, parsed_data, observe)
+        compiled_rules = self.whole_message.get(message_type, ())
+        if observe is not None:
+            return [compiled.evaluate_timed(parsed_data, observe) for compiled in compiled_rules]
+        return [compiled.evaluate(parsed_data) for compiled in compiled_rules]
+
+    def _evaluate_hl7(self, data: Dict[str, Any], parsed_data: Dict[str, Any],
+                      observe: Optional[Callable[[str, float], None]] = None) -> List[ValidationResult]:
+        field_index = data.get("field_index")
+        segment_counts = data.get("segment_counts")
+        if field_index is None or segment_counts is None:
+            field_index, segment_counts = legacy_field_index(parsed_data)
+        results = []
+        for segment, compiled_rules in self.hl7_segments.items():
+            if not segment_counts.get(segment):
+                compiled_rules = [c for c in compiled_rules if not c.requires_segment]
+            if observe is not None:
+                results.extend(c.evaluate_timed(field_index, observe) for c in compiled_rules)
+            else:
+                results.extend(c.evaluate(field_index) for c in compiled_rules)
+        return results
+
+
+def overall_severity(results: List[ValidationResult]) -> Severity:
+    status = Severity.OK
+    for result in results:
+        if result.severity == Severity.ERROR:
+            return Severity.ERROR
+        if result.severity == Severity.WARN:
+            status = Severity.WARN
+    return status
@@ -0,0 +1,171 @@
+"""Validation logic shared by the validator service and fused ingress.
+
+Holds the rule set and its compiled plan, evaluates messages and forwards
+them to the hash writer. `rules_router` serves rule management wherever
+the rules live.
+"""
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from common import instrumentation
+from common.http_client import ServiceClient
+from rule_engine import InvalidRule, RulePlan, Severity, ValidationResult, ValidationRule, overall_severity
+
+logger = logging.getLogger(__name__)
+
+class ValidatedMessage(BaseModel):
+    message_id: str
+    channel_id: str
+    message_type: str
+    timestamp: datetime
+    validation_results: List[ValidationResult]
+    overall_status: Severity
+    hash_data: Optional[Dict[str, str]] = None
+    parsed_data: Optional[Dict[str, Any]] = None
+    # Set by the parser; otherwise the hash writer hashes parsed_data
+    payload_sha256: Optional[str] = None
+    payload_encoding: Optional[str] = None
+
+# In-memory rule storage (should be replaced with database)
+validation_rules = [
+    ValidationRule(
+        id="PID_NOT_EMPTY",
+        name="Patient ID Required",
+        description="PID-3 must not be empty",
+        segment="PID",
+        field=3,
+        operator="NOT_EMPTY",
+        severity=Severity.ERROR,
+        message="PID-3 (Patient ID) must not be empty"
+    ),
+    ValidationRule(
+        id="OBX_LOINC_VALID",
+        name="Valid LOINC Code",
+        description="OBX-3.1 of every OBX must contain valid LOINC code",
+        segment="OBX",
+        field=3,
+        path="OBX-3.1",
+        operator="REGEX",
+        value=r"^\d{1,5}-\d$",
+        severity=Severity.WARN,
+        message="OBX-3 should contain valid LOINC code format"
+    ),
+    ValidationRule(
+        id="DICOM_MODALITY_CHECK",
+        name="DICOM Modality Match",
+        description="DICOM modality must match worklist",
+        segment="DICOM",
+        field=None,
+        operator="IN_LIST",
+        value=["CT", "MR", "US", "XR", "CR", "DX"],
+        severity=Severity.WARN,
+        message="DICOM modality should be in approved list"
+    )
+]
+
+# Executable plan compiled from validation_rules; rebuilt on every /rules change
+rule_plan = RulePlan(validation_rules)
+
+def recompile_rules():
+    global rule_plan
+    rule_plan = RulePlan(validation_rules)
+
+hashwriter_client = ServiceClient("hashwriter", os.getenv("HASHWRITER_SERVICE_URL", "http://hashwriter-service:8003"))
+
+def hashwriter_json(validated_message: ValidatedMessage) -> str:
+    # With a digest the hash writer does not need the parsed data itself
+    exclude = {"hash_data", "parsed_data"} if validated_message.payload_sha256 else {"hash_data"}
+    return validated_message.json(exclude=exclude)
+
+async def forward_to_hashwriter(validated_message: ValidatedMessage):
+    response = await hashwriter_client.post(
+        "/hash",
+        content=hashwriter_json(validated_message),
+        headers={"Content-Type": "application/json"}
+    )
+    return response.json()
+
+async def forward_batch_to_hashwriter(validated_messages: List[ValidatedMessage]) -> List[Dict[str, Any]]:
+    body = '{"messages": [' + ", ".join(hashwriter_json(m) for m in validated_messages) + ']}'
+    response = await hashwriter_client.post(
+        "/hash/batch",
+        content=body,
+        headers={"Content-Type": "application/json"}
+    )
+    response.raise_for_status()
+    return response.json()["results"]
+
+def evaluate_message(data: dict) -> ValidatedMessage:
+    # Apply the rules that apply to this message type and its segments;
+    # a sample of messages also times each rule
+    observe = instrumentation.observe_rule if instrumentation.sample_rules() else None
+    with instrumentation.stage("rules.evaluate", data.get("message_id")):
+        results = rule_plan.evaluate(data, observe)
+    overall_status = overall_severity(results)
+    
+    timestamp = datetime.fromisoformat(data.get("timestamp")) if isinstance(data.get("timestamp"), str) else data.get("timestamp")
+    # The hash writer needs an offset (RFC 3339); naive times are UTC
+    if timestamp is not None and timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    
+    return ValidatedMessage(
+        message_id=data.get("message_id"),
+        channel_id=data.get("channel_id"),
+        message_type=data.get("message_type"),
+        timestamp=timestamp,
+        validation_results=results,
+        overall_status=overall_status,
+        parsed_data=data.get("parsed_data"),
+        payload_sha256=data.get("payload_sha256"),
+        payload_encoding=data.get("payload_encoding")
+    )
+
+def validation_response(validated_message: ValidatedMessage, hash_result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "validation_results": [r.dict() for r in validated_message.validation_results],
+        "overall_status": validated_message.overall_status,
+        "hash_data": hash_result
+    }
+
+rules_router = APIRouter()
+
+@rules_router.get("/rules")
+async def get_rules():
+    return {"rules": [rule.dict() for rule in validation_rules]}
+
+@rules_router.post("/rules")
+async def add_rule(rule: ValidationRule):
+    validation_rules.append(rule)
+    try:
+        recompile_rules()
+    except InvalidRule as e:
+        validation_rules.pop()
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Rule added", "rule_id": rule.id}
+
+@rules_router.put("/rules/{rule_id}")
+async def update_rule(rule_id: str, rule: ValidationRule):
+    for i, r in enumerate(validation_rules):
+        if r.id == rule_id:
+            validation_rules[i] = rule
+            try:
+                recompile_rules()
+            except InvalidRule as e:
+                validation_rules[i] = r
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"message": "Rule updated", "rule_id": rule_id}
+    raise HTTPException(status_code=404, detail="Rule not found")
+
+@rules_router.delete("/rules/{rule_id}")
+async def delete_rule(rule_id: str):
+    for i, r in enumerate(validation_rules):
+        if r.id == rule_id:
+            validation_rules.pop(i)
+            recompile_rules()
+            return {"message": "Rule deleted", "rule_id": rule_id}
+    raise HTTPException(status_code=404, detail="Rule not found")
@@ -0,0 +1,52 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SERVICES_DIR = os.path.join(os.path.dirname(__file__), '..', 'services')
+
+# Service images ship the shared `common` package next to main.py.
+sys.path.append(SERVICES_DIR)
+
+# Service modules are loaded by path here, which worker processes of a
+# process pool cannot re-import; parse on the event loop instead.
+os.environ.setdefault("PARSE_EXECUTOR", "inline")
+
+_loaded_modules = {}
+
+
+def load_service_module(service, module="main"):
+    """Import services/<service>/<module>.py without leaving it on sys.path.
+
+    Every service names its entry module `main`, so putting a second service
+    directory on sys.path would make `import main` ambiguous. Entry modules
+    are registered as `<service>_main`; other modules keep their own name.
+    """
+    name = f"{service}_main" if module == "main" else module
+    service_dir = os.path.abspath(os.path.join(SERVICES_DIR, service))
+    path = os.path.join(service_dir, f"{module}.py")
+    existing = sys.modules.get(name)
+    if existing is not None and os.path.abspath(getattr(existing, "__file__", "")) == path:
+        _loaded_modules[name] = existing
+    if name not in _loaded_modules:
+        spec = importlib.util.spec_from_file_location(name, path)
+        loaded = importlib.util.module_from_spec(spec)
+        sys.modules[name] = loaded
+        sys.path.insert(0, service_dir)
+        try:
+            spec.loader.exec_module(loaded)
+        finally:
+            sys.path.remove(service_dir)
+        _loaded_modules[name] = loaded
+    return _loaded_modules[name]
+
+
+@pytest.fixture(scope="session")
+def parser_service():
+    return load_service_module("parser")
+
+
+@pytest.fixture(scope="session")
+def ingress_service():
+    return load_service_module("ingress")
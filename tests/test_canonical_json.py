@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+
+from common.canonical_json import canonical_json, canonical_sha256, format_number
+from conftest import load_service_module
+
+VECTORS = os.path.join(os.path.dirname(__file__), "canonical_json_vectors.json")
+
+
+def test_matches_shared_vectors():
+    with open(VECTORS, encoding="utf-8") as f:
+        vectors = json.load(f)["vectors"]
+    for vector in vectors:
+        value = json.loads(vector["input"])
+        assert canonical_json(value) == vector["canonical"], vector["name"]
+        assert canonical_sha256(value) == vector["sha256"], vector["name"]
+
+
+def test_large_values_hash_in_chunks():
+    value = {"data": ["x" * 1000] * 500, "n": list(range(1000))}
+    assert canonical_sha256(value) == hashlib.sha256(canonical_json(value).encode()).hexdigest()
+
+
+def test_numbers_follow_ecmascript():
+    assert format_number(1.0) == "1"
+    assert format_number(-1e-7) == "-1e-7"
+    assert format_number(2 ** 60) == "1152921504606847000"
+    for bad in (float("nan"), float("inf")):
+        try:
+            format_number(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} accepted")
+
+
+def test_parser_digest_modes(monkeypatch):
+    parsing = load_service_module("parser", "parsing")
+    body = json.dumps({"resourceType": "Patient", "id": "p1", "name": [{"text": "Doe"}]}).encode()
+
+    parsed = parsing.build_fhir_parsed_message("FHIR", "Patient", "p1", body)
+    assert parsed.payload_encoding == "jcs"
+    assert parsed.payload_sha256 == canonical_sha256(parsed.parsed_data)
+    assert parsed.timestamp.tzinfo is not None
+
+    monkeypatch.setattr(parsing, "PAYLOAD_HASH_MODE", "raw")
+    parsed = parsing.build_fhir_parsed_message("FHIR", "Patient", "p1", body)
+    assert parsed.payload_encoding == "raw"
+    assert parsed.payload_sha256 == hashlib.sha256(body).hexdigest()
+
+
+def test_validator_forwards_digest_without_parsed_data():
+    validation = load_service_module("validator", "validation")
+    validated = validation.evaluate_message({
+        "message_id": "m1", "channel_id": "LAB", "message_type": "HL7",
+        "timestamp": "2023-12-01T12:00:00", "parsed_data": {"segments": {}},
+        "payload_sha256": "ab" * 32, "payload_encoding": "jcs",
+    })
+    sent = json.loads(validation.hashwriter_json(validated))
+    assert sent["payload_sha256"] == "ab" * 32
+    assert "parsed_data" not in sent
+    assert sent["timestamp"].endswith("Z") or sent["timestamp"].endswith("+00:00")
+
+    validated.payload_sha256 = None
+    assert json.loads(validation.hashwriter_json(validated))["parsed_data"] == {"segments": {}}
@@ -0,0 +1,199 @@
+import gzip
+import io
+import json
+
+from conftest import load_service_module
+
+verifier = load_service_module("reporter", "chain_verifier")
+
+
+def make_chain(shard, count, start=None):
+    prev = start["chainHash"] if start else verifier.shard_genesis(shard)
+    first = start["seq"] + 1 if start else 1
+    entries = []
+    for seq in range(first, first + count):
+        entry = {
+            "ts": f"2023-12-01T12:00:{seq % 60:02d}.{seq:09d}Z",
+            "message_id": f"{shard or 'm'}-{seq}",
+            "msgType": "ADT^A01",
+            "sha256_payload": verifier.chain_hash("2023-12-01T00:00:00Z", str(seq), "", ""),
+            "prevHash": prev,
+            "seq": seq,
+        }
+        if shard:
+            entry["shard"] = shard
+        entry["chainHash"] = verifier.chain_hash(entry["ts"], entry["message_id"], entry["sha256_payload"], prev)
+        prev = entry["chainHash"]
+        entries.append(entry)
+    return entries
+
+
+class FakeES:
+    """Serves search_after pages over a list of stored documents."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = []
+
+    def open_point_in_time(self, index, keep_alive):
+        return {"id": "pit-1"}
+
+    def close_point_in_time(self, body):
+        self.closed.append(body["id"])
+
+    def search(self, body, index=None):
+        if "aggs" in body:
+            keys = {doc.get("shard", verifier.UNSHARDED) for doc in self.docs}
+            return {"aggregations": {"shards": {"buckets": [{"key": k} for k in keys]}}}
+        query = body["query"]["bool"]
+        after = query["filter"][0]["range"]["seq"]["gt"]
+        shard = query["filter"][1]["term"]["shard"] if len(query["filter"]) > 1 else ""
+        if body.get("search_after"):
+            after = body["search_after"][0]
+        docs = sorted((d for d in self.docs if d.get("shard", "") == shard and d["seq"] > after),
+                      key=lambda d: d["seq"])[:body["size"]]
+        return {"pit_id": "pit-2", "hits": {"hits": [{"_source": d, "sort": [d["seq"], 0]} for d in docs]}}
+
+
+def run(docs, tmp_path, since_checkpoint=False, page_size=4):
+    checkpoint = verifier.Checkpoint(str(tmp_path / "chain.json")).load()
+    chain_verifier = verifier.ChainVerifier(checkpoint, since_checkpoint=since_checkpoint)
+    source = verifier.ElasticsearchSource(FakeES(docs), page_size=page_size)
+    chain_verifier.run(source.windows(chain_verifier))
+    return chain_verifier.report()
+
+
+def test_timestamps_are_hashed_as_go_formats_them():
+    assert verifier.rfc3339_seconds("2023-12-01T12:00:00.123456789Z") == "2023-12-01T12:00:00Z"
+    assert verifier.rfc3339_seconds("2023-12-01T12:00:00+00:00") == "2023-12-01T12:00:00Z"
+    assert verifier.rfc3339_seconds("2023-12-01T13:00:00.5+01:00") == "2023-12-01T13:00:00+01:00"
+    assert verifier.chain_hash("2023-12-01T12:00:00.9Z", "m1", "p", "0" * 64) == \
+        verifier.chain_hash("2023-12-01T12:00:00Z", "m1", "p", "0" * 64)
+
+
+def test_clean_chains_verify_across_pages(tmp_path):
+    docs = make_chain("", 10) + make_chain("LAB", 7)
+    report = run(docs, tmp_path)
+    assert report["ok"], report["problems"]
+    assert report["entries"] == 17
+    assert report["shards"][""]["last_seq"] == 10
+    assert report["shards"]["LAB"]["head"] == docs[-1]["chainHash"]
+
+
+def test_break_at_page_boundary_is_found(tmp_path):
+    docs = make_chain("", 12)
+    # Entry 5 starts the second page; its links to entries 4 and 6 are
+    # checked across the page boundary
+    docs[4]["prevHash"] = "f" * 64
+    docs[4]["chainHash"] = verifier.chain_hash(docs[4]["ts"], docs[4]["message_id"],
+                                               docs[4]["sha256_payload"], docs[4]["prevHash"])
+    del docs[9]
+    report = run(docs, tmp_path)
+    problems = {(p["type"], p["seq"]) for p in report["problems"]}
+    assert problems == {("broken_link", 5), ("broken_link", 6), ("seq_gap", 11), ("broken_link", 11)}
+    # The checkpoint stops at the last page before the first problem
+    saved = json.loads((tmp_path / "chain.json").read_text())
+    assert saved["shards"][""]["seq"] == 4
+
+
+def test_incremental_run_starts_at_checkpoint(tmp_path):
+    docs = make_chain("RAD", 6)
+    assert run(docs, tmp_path)["ok"]
+
+    # Entries before the checkpoint are not read again
+    docs[0]["chainHash"] = "0" * 64
+    docs += make_chain("RAD", 3, start=docs[-1])
+    report = run(docs, tmp_path, since_checkpoint=True)
+    assert report["ok"], report["problems"]
+    assert report["shards"]["RAD"]["first_seq"] == 7
+    assert report["entries"] == 3
+    assert not run(docs, tmp_path)["ok"]
+
+
+def test_anchor_heads_must_match_entries(tmp_path):
+    lab = make_chain("LAB", 5)
+    heads = [{"shard": "LAB", "seq": 5, "hash": lab[-1]["chainHash"]}]
+    anchor = make_chain(verifier.ANCHOR_SHARD, 1)[0]
+    anchor.update(msgType=verifier.ANCHOR_MESSAGE_TYPE, sha256_payload=verifier.anchor_root(heads),
+                  validation_data={"heads": heads})
+    anchor["chainHash"] = verifier.chain_hash(anchor["ts"], anchor["message_id"], anchor["sha256_payload"],
+                                              anchor["prevHash"])
+    assert run(lab + [anchor], tmp_path)["ok"]
+
+    lab[-1]["sha256_payload"] = "forged"
+    lab[-1]["chainHash"] = verifier.chain_hash(lab[-1]["ts"], lab[-1]["message_id"], "forged", lab[-1]["prevHash"])
+    report = run(lab + [anchor], tmp_path)
+    assert [p["type"] for p in report["problems"]] == ["anchor_head_mismatch"]
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_paginator(self, name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix, StartAfter=""):
+                yield {"Contents": [{"Key": k} for k in sorted(objects) if k > StartAfter]}
+
+        return Paginator()
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+def test_segment_roots_are_checked(tmp_path):
+    entries = make_chain("", 4)
+    lines = [json.dumps(entry).encode() for entry in entries[:3]]
+    root = verifier.merkle_root([verifier.merkle_leaf(line) for line in lines])
+    seal = entries[3]
+    seal.update(msgType=verifier.SEGMENT_MESSAGE_TYPE, validation_data={"segment_id": "seg1"},
+                sha256_payload=root)
+    seal["chainHash"] = verifier.chain_hash(seal["ts"], seal["message_id"], root, seal["prevHash"])
+    objects = {
+        "segments/2023/12/01/seg1.jsonl.gz": gzip.compress(b"\n".join(lines) + b"\n"),
+        "segments/2023/12/01/seg2.jsonl.gz": gzip.compress(json.dumps(seal).encode() + b"\n"),
+    }
+
+    def verify(objects):
+        checkpoint = verifier.Checkpoint(str(tmp_path / "s3.json"))
+        chain_verifier = verifier.ChainVerifier(checkpoint)
+        chain_verifier.run(verifier.SegmentSource(FakeS3(objects), "bucket").windows(chain_verifier))
+        return chain_verifier.report(), checkpoint
+
+    report, checkpoint = verify(objects)
+    assert report["ok"], report["problems"]
+    assert report["segments"] == 2 and report["entries"] == 4
+    assert checkpoint.segment_key == "segments/2023/12/01/seg2.jsonl.gz"
+
+    # The message type is not part of the chain hash, but it is archived
+    lines[1] = lines[1].replace(b"ADT", b"ORU")
+    objects["segments/2023/12/01/seg1.jsonl.gz"] = gzip.compress(b"\n".join(lines) + b"\n")
+    report, _ = verify(objects)
+    assert "segment_root_mismatch" in [p["type"] for p in report["problems"]]
+
+
+def audit_path(leaves, index):
+    """RFC 6962 PATH(m, D[n]), leaf to root."""
+    if len(leaves) == 1:
+        return []
+    k = 1
+    while k * 2 < len(leaves):
+        k *= 2
+    subtree = lambda nodes: bytes.fromhex(verifier.merkle_root(nodes))
+    if index < k:
+        return audit_path(leaves[:k], index) + [subtree(leaves[k:]).hex()]
+    return audit_path(leaves[k:], index - k) + [subtree(leaves[:k]).hex()]
+
+
+def test_inclusion_proofs_verify():
+    for size in range(1, 20):
+        leaves = [verifier.merkle_leaf(str(i).encode()) for i in range(size)]
+        root = verifier.merkle_root(leaves)
+        for i in range(size):
+            path = audit_path(leaves, i)
+            assert verifier.verify_inclusion(leaves[i].hex(), i, size, path, root)
+            if size > 1:
+                assert not verifier.verify_inclusion(leaves[(i + 1) % size].hex(), i, size, path, root)
+                assert not verifier.verify_inclusion(leaves[i].hex(), (i + 1) % size, size, path, root)
@@ -0,0 +1,129 @@
+import json
+from datetime import date
+
+from conftest import load_service_module
+
+daily_stats = load_service_module("reporter", "daily_stats")
+
+
+class FakeES:
+    """Stores counter documents and answers the composite aggregations
+    over them or over a list of audit documents."""
+
+    def __init__(self, audit):
+        self.audit = audit
+        self.stats = {}
+        self.searches = []
+
+    def search(self, index, body, ignore_unavailable=False, request_cache=False, preference=None):
+        assert request_cache and preference == daily_stats.PREFERENCE
+        self.searches.append(index)
+        composite = body["aggs"]["counts"]["composite"]
+        fields = [next(iter(source)) for source in composite["sources"]]
+        if index.endswith("-*"):
+            day_range = body["query"]["range"]["day"]
+            docs = [(d, d["count"]) for d in self.stats.values() if day_range["gte"] <= d["day"] <= day_range["lte"]]
+        else:
+            day = index.rsplit("-", 1)[1].replace(".", "-")
+            excluded = body["query"]["bool"]["must_not"]["terms"]["msgType"]
+            docs = [(d, 1) for d in self.audit if d["ts"][:10] == day and d["msgType"] not in excluded]
+
+        groups = {}
+        for doc, n in docs:
+            key = tuple(doc.get(field) for field in fields)
+            groups[key] = groups.get(key, 0) + n
+        order = lambda k: tuple(v or "" for v in k)
+        keys = sorted(groups, key=order)
+        if "after" in composite:
+            keys = [k for k in keys if order(k) > order(tuple(composite["after"][f] for f in fields))]
+        keys = keys[:composite["size"]]
+        buckets = []
+        for k in keys:
+            bucket = {"key": dict(zip(fields, k)), "doc_count": groups[k]}
+            if "aggs" in body["aggs"]["counts"]:
+                bucket["count"] = {"value": float(groups[k])}
+            buckets.append(bucket)
+        result = {"buckets": buckets}
+        if buckets:
+            result["after_key"] = buckets[-1]["key"]
+        return {"aggregations": {"counts": result}}
+
+    def delete_by_query(self, index, body, ignore_unavailable=False, refresh=False):
+        day = body["query"]["term"]["day"]
+        self.stats = {k: v for k, v in self.stats.items() if v["day"] != day}
+
+    def bulk(self, body, refresh=False):
+        lines = body.strip().split("\n")
+        for action, doc in zip(lines[::2], lines[1::2]):
+            self.stats[json.loads(action)["index"]["_id"]] = json.loads(doc)
+        return {"errors": False}
+
+
+def audit_doc(day, channel, msg_type, severity):
+    return {"ts": f"{day}T12:00:00Z", "channel_id": channel, "msgType": msg_type, "severity": severity}
+
+
+def test_summary_has_the_shape_of_the_report_aggregations():
+    counts = [
+        {"day": "2023-12-01", "channel_id": "LAB", "msgType": "ORU^R01", "severity": "INFO", "count": 5},
+        {"day": "2023-12-01", "channel_id": "LAB", "msgType": "ORU^R01", "severity": "ERROR", "count": 1},
+        {"day": "2023-12-02", "channel_id": "RAD", "msgType": "ADT^A01", "severity": "INFO", "count": 7},
+    ]
+    summary = daily_stats.summarize(counts)
+    assert summary["total_messages"]["value"] == 13
+    assert summary["error_messages"]["doc_count"] == 1
+    assert summary["by_channel"]["buckets"] == [{"key": "RAD", "doc_count": 7}, {"key": "LAB", "doc_count": 6}]
+    assert summary["by_severity"]["buckets"][0] == {"key": "INFO", "doc_count": 12}
+    assert daily_stats.summarize([])["total_messages"]["value"] == 0
+
+
+def test_backfill_rebuilds_exact_counters(monkeypatch):
+    monkeypatch.setattr(daily_stats, "PAGE_SIZE", 2)
+    audit = [audit_doc("2023-12-01", "LAB", "ORU^R01", "INFO")] * 3 + [
+        audit_doc("2023-12-01", "LAB", "ORU^R01", "ERROR"),
+        audit_doc("2023-12-01", "RAD", "ADT^A01", None),
+        audit_doc("2023-12-01", "_archive", "ARCHIVE_SEGMENT", "INFO"),
+        audit_doc("2023-12-02", "RAD", "ADT^A01", "WARNING"),
+    ]
+    es = FakeES(audit)
+    # A counter the audit index does not back is dropped
+    es.stats["stale"] = {"day": "2023-12-01", "channel_id": "OLD", "msgType": "X", "severity": "INFO", "count": 9}
+
+    assert daily_stats.backfill(es, date(2023, 12, 1), date(2023, 12, 2)) == {"2023-12-01": 5, "2023-12-02": 1}
+    assert "2023-12-01|LAB|ORU^R01|INFO" in es.stats
+    assert es.stats["2023-12-01|RAD|ADT^A01|"]["count"] == 1
+
+    # Repeating it changes nothing
+    daily_stats.backfill(es, date(2023, 12, 1), date(2023, 12, 2))
+    summary = daily_stats.period_summary(es, date(2023, 12, 1), date(2023, 12, 2))
+    assert summary["total_messages"]["value"] == 6
+    assert summary["error_messages"]["doc_count"] == 1
+    assert daily_stats.period_summary(es, date(2023, 12, 2), date(2023, 12, 2))["total_messages"]["value"] == 1
+
+
+def test_counter_ids_match_the_hashwriter():
+    assert daily_stats.stats_index(date(2023, 12, 1)) == "compliance-stats-2023.12"
+    assert daily_stats.stats_doc_id(date(2023, 12, 1), "LAB", "ORU^R01", "WARNING") == \
+        "2023-12-01|LAB|ORU^R01|WARNING"
+
+
+def test_closed_days_are_read_once(monkeypatch):
+    monkeypatch.setattr(daily_stats, "PAGE_SIZE", 2)
+    es = FakeES([audit_doc("2023-12-01", "RAD", "ADT^A01", "INFO")])
+    for i, channel in enumerate(["LAB", "RAD", "ICU"]):
+        es.stats[str(i)] = {"day": "2023-12-02", "channel_id": channel, "msgType": "ORU^R01",
+                            "severity": "INFO", "count": i + 1}
+    cache = daily_stats.CountsCache(es)
+    counts = cache.counts(date(2023, 12, 1), date(2023, 12, 2))
+    assert sum(count["count"] for count in counts) == 7
+    # Two pages of counters, then the audit index of the day without any
+    assert es.searches == ["compliance-stats-*", "compliance-stats-*", "audit-2023.12.01"]
+
+    es.searches.clear()
+    assert cache.counts(date(2023, 12, 1), date(2023, 12, 2)) == counts
+    assert es.searches == []
+
+    today = date.today()
+    cache.counts(today, today)
+    cache.counts(today, today)
+    assert es.searches.count("compliance-stats-*") == 2
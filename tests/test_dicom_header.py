@@ -0,0 +1,114 @@
+import hashlib
+from io import BytesIO
+
+import pydicom
+import pytest
+from fastapi.testclient import TestClient
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian, generate_uid
+
+from conftest import load_service_module
+
+dicom_header = load_service_module("parser", "dicom_header")
+
+
+def make_dicom(pixel_bytes=4096, icon=False, implicit=False, pixels=True):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian if implicit else ExplicitVRLittleEndian
+    ds.PatientName = "Doe^John"
+    ds.PatientID = "PAT001"
+    ds.StudyDate = "20231201"
+    ds.AccessionNumber = "ACC1"
+    ds.Modality = "CT"
+    if icon:
+        item = Dataset()
+        item.Rows = 1
+        item.Columns = 2
+        item.BitsAllocated = 8
+        item.PixelData = b"\x01\x02"
+        ds.IconImageSequence = Sequence([item])
+    if pixels:
+        ds.Rows = pixel_bytes // 256
+        ds.Columns = 256
+        ds.BitsAllocated = 8
+        ds.PixelData = bytes(range(256)) * (pixel_bytes // 256)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = implicit
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, write_like_original=False)
+    return buffer.getvalue()
+
+
+def feed(reader, data, chunk_size):
+    for offset in range(0, len(data), chunk_size):
+        reader.feed(data[offset:offset + chunk_size])
+    return reader.finish()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1 << 20])
+@pytest.mark.parametrize("icon", [False, True])
+@pytest.mark.parametrize("implicit", [False, True])
+def test_header_is_parsed_before_pixel_data(chunk_size, icon, implicit):
+    data = make_dicom(pixel_bytes=64 * 1024, icon=icon, implicit=implicit)
+    reader = dicom_header.DicomHeaderReader()
+    ds = feed(reader, data, chunk_size)
+    assert str(ds.PatientID) == "PAT001"
+    assert str(ds.AccessionNumber) == "ACC1"
+    assert "PixelData" not in ds
+    assert reader.size == len(data)
+    assert reader.sha256 == hashlib.sha256(data).hexdigest()
+
+
+def test_pixel_data_is_not_buffered():
+    data = make_dicom(pixel_bytes=256 * 1024)
+    reader = dicom_header.DicomHeaderReader(max_header_bytes=8 * 1024)
+    for offset in range(0, len(data), 4096):
+        reader.feed(data[offset:offset + 4096])
+        assert len(reader._buffer) <= 8 * 1024 + 4096
+    assert reader.dataset is not None
+    assert len(reader._buffer) == 0
+
+
+def test_object_without_pixel_data():
+    data = make_dicom(pixels=False)
+    ds = feed(dicom_header.DicomHeaderReader(), data, 100)
+    assert str(ds.PatientName) == "Doe^John"
+
+
+def test_oversized_header_is_rejected():
+    data = make_dicom(pixels=False)
+    reader = dicom_header.DicomHeaderReader(max_header_bytes=64)
+    with pytest.raises(dicom_header.HeaderTooLarge):
+        feed(reader, data, 32)
+
+
+def test_hashing_can_be_disabled():
+    reader = dicom_header.DicomHeaderReader(hash_stream=False)
+    feed(reader, make_dicom(), 1024)
+    assert reader.sha256 is None
+
+
+def test_parse_dicom_streams_body(parser_service, monkeypatch):
+    forwarded = []
+
+    async def fake_forward(parsed_message):
+        forwarded.append(parsed_message)
+        return {"status": "OK"}
+
+    monkeypatch.setattr(parser_service, "forward_to_validator", fake_forward)
+    data = make_dicom(pixel_bytes=128 * 1024)
+    response = TestClient(parser_service.app).post(
+        "/parse/dicom",
+        params={"channel_id": "ch", "study_uid": "1.2", "series_uid": "1.2.3",
+                "instance_uid": "1.2.3.4", "modality": "CT"},
+        content=iter(data[i:i + 8192] for i in range(0, len(data), 8192)),
+    )
+    assert response.status_code == 200
+    parsed = response.json()["parsed"]
+    assert parsed["patient_id"] == "PAT001"
+    assert parsed["content_sha256"] == hashlib.sha256(data).hexdigest()
+    assert forwarded[0].raw_size == len(data)
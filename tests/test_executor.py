@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+
+from common.executor import BoundedExecutor, executor_queue_seconds
+
+
+def sample_count(name, task):
+    for metric in executor_queue_seconds.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") and sample.labels == {"executor": name, "task": task}:
+                return sample.value
+    return 0
+
+
+def test_process_pool_runs_calls(monkeypatch):
+    monkeypatch.setenv("TESTPROC_EXECUTOR", "process")
+    executor = BoundedExecutor("testproc", workers=2)
+
+    async def main():
+        return await asyncio.gather(*(executor.run(pow, 2, n, task="pow") for n in range(8)))
+
+    try:
+        assert asyncio.run(main()) == [2 ** n for n in range(8)]
+    finally:
+        executor.shutdown()
+    assert sample_count("testproc", "pow") == 8
+
+
+def test_in_flight_calls_are_bounded():
+    executor = BoundedExecutor("testbound", default_kind="thread", workers=2, inflight_per_worker=1)
+    running = []
+    peak = []
+
+    def work():
+        running.append(1)
+        peak.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.gather(*(executor.run(work, task="sleep") for _ in range(6)))
+        return time.perf_counter() - started
+
+    try:
+        elapsed = asyncio.run(main())
+    finally:
+        executor.shutdown()
+    assert max(peak) <= 2
+    # Six 50 ms calls, two at a time
+    assert elapsed >= 0.14
+
+
+def test_inline_calls_run_on_the_loop():
+    executor = BoundedExecutor("testinline", default_kind="inline")
+    assert asyncio.run(executor.run(sum, [1, 2, 3])) == 6
+
+
+def test_exceptions_propagate():
+    executor = BoundedExecutor("testerror", default_kind="thread", workers=1)
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(executor.run(divmod, 1, 0))
+    executor.shutdown()
+
+
+def test_unknown_kind_is_rejected(monkeypatch):
+    monkeypatch.setenv("TESTKIND_EXECUTOR", "fibers")
+    with pytest.raises(ValueError):
+        BoundedExecutor("testkind")
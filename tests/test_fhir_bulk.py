@@ -0,0 +1,170 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import load_service_module
+
+fhir_bulk = load_service_module("ingress", "fhir_bulk")
+parsing = load_service_module("parser", "parsing")
+
+PATIENT = {"resourceType": "Patient", "id": "p1", "name": [{"text": "Jane \"}] Roe"}]}
+OBSERVATION = {"resourceType": "Observation", "id": "o1", "status": "final", "code": {"text": "Glucose"},
+               "valueQuantity": {"value": 5.4}}
+BUNDLE = {
+    "resourceType": "Bundle",
+    "id": "b1",
+    "type": "batch",
+    "link": [{"relation": "self", "url": "http://example.org/entry"}],
+    "entry": [
+        {"fullUrl": "urn:uuid:1", "resource": PATIENT, "request": {"method": "PUT", "url": "Patient/p1"}},
+        {"fullUrl": "resource", "request": {"method": "DELETE", "url": "Patient/p2"}},
+        {"resource": OBSERVATION},
+    ],
+    "signature": {"data": "entry"},
+}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def split(splitter, chunks):
+    resources = []
+    for chunk in chunks:
+        resources.extend(splitter.feed(chunk))
+    return resources + splitter.finish()
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 100000])
+def test_bundle_splitter_yields_resources(size):
+    body = json.dumps(BUNDLE, indent=2).encode()
+    resources = split(fhir_bulk.BundleSplitter(1 << 20), chunked(body, size))
+    assert [location for location, _ in resources] == [
+        "Bundle.entry[0].resource", "Bundle.entry[1]", "Bundle.entry[2].resource"
+    ]
+    assert json.loads(resources[0][1]) == PATIENT
+    assert resources[1][1] is None
+    assert json.loads(resources[2][1]) == OBSERVATION
+
+
+def test_bundle_splitter_bounds_memory():
+    splitter = fhir_bulk.BundleSplitter(1 << 20)
+    body = json.dumps({"resourceType": "Bundle", "entry": [{"resource": OBSERVATION}] * 2000}).encode()
+    for chunk in chunked(body, 4096):
+        splitter.feed(chunk)
+        assert len(splitter._buffer) < 4096 + 256
+    assert splitter.finish() == []
+
+    with pytest.raises(fhir_bulk.BulkFormatError):
+        split(fhir_bulk.BundleSplitter(64), [json.dumps(BUNDLE).encode()])
+
+
+@pytest.mark.parametrize("body", [b"[]", b'{"resourceType": "Bundle", "entry": [', b"x{}"])
+def test_bundle_splitter_rejects_malformed_input(body):
+    with pytest.raises(fhir_bulk.BulkFormatError):
+        split(fhir_bulk.BundleSplitter(1 << 20), [body])
+
+
+def test_ndjson_splitter_handles_chunk_boundaries():
+    body = (json.dumps(PATIENT) + "\n\n" + json.dumps(OBSERVATION) + "\r\n" + json.dumps(PATIENT)).encode()
+    resources = split(fhir_bulk.NDJSONSplitter(1 << 20), chunked(body, 5))
+    assert [location for location, _ in resources] == ["line 1", "line 3", "line 4"]
+    assert json.loads(resources[1][1]) == OBSERVATION
+
+
+def test_bulk_job_batches_in_order_and_records_errors(tmp_path):
+    sent = []
+
+    async def forward(content):
+        lines = content.split(b"\n")
+        sent.append(len(lines))
+        if len(sent) == 2:
+            raise httpx.ConnectError("parser down")
+        await asyncio.sleep(0.01 * (3 - len(sent)))
+        return [{"status": "error", "error": "bad"} if b"bad" in line else
+                {"status": "success", "validation": {"overall_status": "OK"}} for line in lines]
+
+    async def resources():
+        for i in range(7):
+            yield f"line {i + 1}", b'{"bad": 1}' if i == 0 else b"{}"
+        yield "Bundle.entry[7]", None
+
+    job = fhir_bulk.BulkJob("job1", forward, str(tmp_path / "job1.ndjson"), batch_size=3, concurrency=2)
+    asyncio.run(job.run(resources()))
+    assert sent == [3, 3, 1]
+    summary = job.summary()
+    assert (summary["total"], summary["succeeded"], summary["failed"]) == (8, 3, 5)
+    assert summary["validation"] == {"OK": 3}
+
+    outcomes = [json.loads(line) for line in (tmp_path / "job1.ndjson").read_text().splitlines()]
+    assert all(o["resourceType"] == "OperationOutcome" for o in outcomes)
+    assert [o["issue"][0]["expression"][0] for o in outcomes] == [
+        "Bundle.entry[7]", "line 1", "line 4", "line 5", "line 6"
+    ]
+
+
+def test_bulk_job_reports_resources_missing_from_results(tmp_path):
+    async def forward(content):
+        # Answers for all but the last line of the batch
+        return [{"status": "success", "validation": {"overall_status": "OK"}}
+                for _ in content.split(b"\n")[:-1]]
+
+    async def resources():
+        for i in range(3):
+            yield f"line {i + 1}", b"{}"
+
+    job = fhir_bulk.BulkJob("job2", forward, str(tmp_path / "job2.ndjson"), batch_size=3, concurrency=1)
+    asyncio.run(job.run(resources()))
+    summary = job.summary()
+    assert (summary["total"], summary["succeeded"], summary["failed"]) == (3, 2, 1)
+    outcomes = [json.loads(line) for line in (tmp_path / "job2.ndjson").read_text().splitlines()]
+    assert [o["issue"][0]["expression"][0] for o in outcomes] == ["line 3"]
+
+
+def test_parse_fhir_batch_items_isolates_errors():
+    body = b"\n".join([
+        json.dumps(OBSERVATION).encode(),
+        b"not json",
+        json.dumps({**OBSERVATION, "status": None}).encode(),
+        b"",
+        json.dumps({"resourceType": "Patient"}).encode(),
+    ])
+    results, parsed = parsing.parse_fhir_batch_items("lab", body)
+    assert [r["status"] for r in results] == ["success", "error", "error", "success"]
+    assert results[0]["message_id"] == "o1"
+    assert parsed[0].raw_size == len(json.dumps(OBSERVATION))
+    assert parsed[1].message_id == results[3]["message_id"]
+
+
+def test_ingest_fhir_bulk_streams_ndjson(ingress_service, monkeypatch, tmp_path):
+    batches = []
+
+    async def fake_forward(content, channel_id):
+        batches.append(content)
+        return [{"status": "error", "error": "Invalid FHIR resource"} if line == b"{}" else
+                {"status": "success", "validation": {"overall_status": "OK"}} for line in content.split(b"\n")]
+
+    monkeypatch.setattr(ingress_service, "forward_fhir_batch", fake_forward)
+    monkeypatch.setattr(ingress_service, "FHIR_BULK_ERROR_DIR", str(tmp_path))
+    monkeypatch.setattr(ingress_service, "FHIR_BULK_BATCH_SIZE", 2)
+    client = TestClient(ingress_service.app)
+    headers = {"Authorization": "Bearer test-token", "X-Channel-ID": "EHR", "Content-Type": "application/fhir+ndjson"}
+    body = "\n".join([json.dumps(PATIENT), "{}", json.dumps(OBSERVATION)]).encode()
+
+    response = client.post("/ingest/fhir/bulk", headers=headers, content=iter(chunked(body, 10)))
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary["status"], summary["total"], summary["succeeded"], summary["failed"]) == ("completed", 3, 2, 1)
+    assert len(batches) == 2
+
+    errors = client.get(summary["errors"], headers=headers)
+    assert errors.status_code == 200
+    assert json.loads(errors.text)["issue"][0]["expression"] == ["line 2"]
+
+    response = client.post("/ingest/fhir/bulk", headers={**headers, "Content-Type": "application/fhir+json"},
+                           content=b'{"resourceType": "Bundle", "entry": [')
+    assert response.status_code == 400
+    assert response.json()["detail"]["status"] == "aborted"
@@ -0,0 +1,140 @@
+import copy
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import load_service_module
+
+fhir_validator = load_service_module("parser", "fhir_validator")
+
+OBSERVATION = {
+    "resourceType": "Observation",
+    "id": "obs1",
+    "meta": {"lastUpdated": "2023-12-01T12:00:00Z"},
+    "status": "final",
+    "code": {"coding": [{"system": "http://loinc.org", "code": "2345-7", "display": "Glucose"}]},
+    "subject": {"reference": "Patient/pat1"},
+    "effectiveDateTime": "2023-12-01T12:00:00+01:00",
+    "valueQuantity": {"value": 5.4, "unit": "mmol/L"},
+    "referenceRange": [{"low": {"value": 3.9}, "high": {"value": 5.5}}],
+    "component": [{"code": {"text": "a"}, "valueInteger": 3}],
+    "contained": [{"resourceType": "Patient", "id": "p", "name": [{"family": "Roe", "given": ["Jane"]}]}],
+}
+PATIENT = {
+    "resourceType": "Patient",
+    "id": "pat1",
+    "active": True,
+    "name": [{"family": "Doe", "given": ["John"], "text": "John Doe"}],
+    "gender": "male",
+    "birthDate": "1980-01",
+}
+DIAGNOSTIC_REPORT = {
+    "resourceType": "DiagnosticReport",
+    "id": "dr1",
+    "status": "final",
+    "code": {"text": "CBC"},
+    "effectivePeriod": {"start": "2023-12-01", "end": "2023-12-02"},
+    "result": [{"reference": "Observation/obs1"}],
+}
+ENCOUNTER = {
+    "resourceType": "Encounter",
+    "id": "enc1",
+    "status": "completed",
+    "class": [{"coding": [{"code": "AMB"}]}],
+    "actualPeriod": {"start": "2023-12-01T10:00:00Z"},
+}
+
+
+def with_changes(resource, **changes):
+    resource = copy.deepcopy(resource)
+    for name, value in changes.items():
+        if value is None:
+            resource.pop(name, None)
+        else:
+            resource[name] = value
+    return resource
+
+
+@pytest.mark.parametrize("resource", [OBSERVATION, PATIENT, DIAGNOSTIC_REPORT, ENCOUNTER])
+def test_fast_path_accepts_valid_resources(resource):
+    fhir_validator.validate_resource(resource, resource["resourceType"])
+    fhir_validator.model_class(resource["resourceType"]).parse_obj(resource)
+
+
+@pytest.mark.parametrize("changes", [
+    {"unknown": 1},
+    {"status": None},
+    {"code": None},
+    {"status": "fi nal "},
+    {"id": ""},
+    {"valueString": "also a value"},
+    {"effectiveDateTime": "2023-02-30"},
+    {"category": {"text": "not a list"}},
+    {"valueQuantity": {"value": True}},
+    {"_status": {}},
+    {"resourceType": "Patient"},
+    {"contained": [{"resourceType": "Patient", "unknown": 1}]},
+])
+def test_fast_path_rejects_what_the_model_rejects(changes):
+    resource = with_changes(OBSERVATION, **changes)
+    with pytest.raises(fhir_validator.FastPathError):
+        fhir_validator.validate_resource(resource, "Observation")
+    with pytest.raises(Exception):
+        fhir_validator.model_class("Observation").parse_obj(resource)
+
+
+def test_fast_path_defers_values_it_does_not_check():
+    # Valid for the model, but coerced from a string; the full model decides
+    resource = with_changes(OBSERVATION, valueQuantity={"value": "5.4"})
+    with pytest.raises(fhir_validator.FastPathError):
+        fhir_validator.validate_resource(resource, "Observation")
+    fhir_validator.model_class("Observation").parse_obj(resource)
+
+
+def test_schema_is_compiled_once():
+    assert fhir_validator.compile_schema("Observation") is fhir_validator.compile_schema("Observation")
+    schema = fhir_validator.compile_schema("Observation")
+    assert ("status", "_status") in schema.required
+    assert any(group == "value" for group, _, _ in schema.choices)
+
+
+def test_parse_fhir_reads_the_request_body(parser_service, monkeypatch):
+    forwarded = []
+
+    async def fake_forward(parsed_message):
+        forwarded.append(parsed_message)
+        return {"overall_status": "OK"}
+
+    monkeypatch.setattr(parser_service, "forward_to_validator", fake_forward)
+    client = TestClient(parser_service.app)
+    body = json.dumps(OBSERVATION, indent=2).encode()
+    params = {"channel_id": "lab", "resource_type": "Observation", "resource_id": "obs1"}
+
+    response = client.post("/parse/fhir", content=body, params=params)
+    assert response.status_code == 200
+    assert response.json()["parsed"]["observation_code"] == "2345-7"
+    assert forwarded[0].raw_size == len(body)
+
+    response = client.post("/parse/fhir", content=json.dumps(with_changes(OBSERVATION, status=None)), params=params)
+    assert response.status_code == 400
+    assert len(forwarded) == 1
+
+
+def test_sampled_resources_also_build_the_model(monkeypatch):
+    parsing = load_service_module("parser", "parsing")
+    built = []
+    monkeypatch.setattr(parsing, "model_class", lambda resource_type: built.append(resource_type) or
+                        fhir_validator.model_class(resource_type))
+
+    monkeypatch.setattr(parsing, "FHIR_FULL_VALIDATION_SAMPLE_RATE", 0.0)
+    parsing.validate_fhir_resource("Observation", OBSERVATION)
+    assert built == []
+
+    monkeypatch.setattr(parsing, "FHIR_FULL_VALIDATION_SAMPLE_RATE", 1.0)
+    parsing.validate_fhir_resource("Observation", OBSERVATION)
+    assert built == ["Observation"]
+
+    # Types outside the fast path always build the model
+    parsing.validate_fhir_resource("Organization", {"resourceType": "Organization", "name": "Lab"})
+    assert built == ["Observation", "Organization"]
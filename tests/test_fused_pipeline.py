@@ -0,0 +1,78 @@
+import asyncio
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import load_service_module
+
+# fused_pipeline imports these as top-level modules, as in the ingress image
+parsing = load_service_module("parser", "parsing")
+validation = load_service_module("validator", "validation")
+fused_pipeline = load_service_module("ingress", "fused_pipeline")
+
+ORU_R01 = (
+    "MSH|^~\\&|LAB|FAC|EHR|FAC|20231201120500||ORU^R01|MSG002|P|2.5\r"
+    "PID|1||PAT002||Roe^Jane||19900101|F\r"
+    "OBX|1|NM|2345-7^Glucose^LN||5.4|mmol/L|3.9-5.5"
+)
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    hashed = []
+
+    async def fake_forward(validated_message):
+        hashed.append(validated_message)
+        return {"hash": f"h{len(hashed)}"}
+
+    async def fake_forward_batch(validated_messages):
+        hashed.extend(validated_messages)
+        return [{"hash": f"h{i}"} for i in range(len(validated_messages))]
+
+    monkeypatch.setattr(validation, "forward_to_hashwriter", fake_forward)
+    monkeypatch.setattr(validation, "forward_batch_to_hashwriter", fake_forward_batch)
+    return hashed
+
+
+@pytest.fixture
+def fused_ingress(ingress_service, monkeypatch, hashed):
+    monkeypatch.setattr(ingress_service, "FUSED", True)
+    monkeypatch.setattr(ingress_service, "fused_pipeline", fused_pipeline, raising=False)
+    return ingress_service
+
+
+def record(message_id="m1", payload=ORU_R01):
+    return {"message_id": message_id, "channel_id": "LAB", "payload": payload, "timestamp": "2023-12-01T12:05:00"}
+
+
+def test_parse_hl7_matches_parser_response(hashed):
+    result = asyncio.run(fused_pipeline.parse_hl7(record()))
+    assert result["status"] == "success"
+    assert result["parsed"]["segments"]["PID"]["patient_id"] == "PAT002"
+    assert set(result["validation"]) == {"validation_results", "overall_status", "hash_data"}
+    assert result["validation"]["hash_data"] == {"hash": "h1"}
+    assert hashed[0].message_id == "m1"
+
+
+def test_parse_hl7_batch_pairs_validations(hashed):
+    body = {"channel_id": "LAB", "messages": [record("a"), record("bad", "not hl7"), record("c")]}
+    results = asyncio.run(fused_pipeline.parse_hl7_batch(body))
+    assert [r["status"] for r in results] == ["success", "error", "success"]
+    assert results[2]["validation"]["message_id"] == "c"
+    assert [m.message_id for m in hashed] == ["a", "c"]
+
+
+def test_ingest_hl7_runs_in_process(fused_ingress):
+    response = TestClient(fused_ingress.app).post(
+        "/ingest/hl7",
+        headers={"Authorization": "Bearer test-token"},
+        json={"channel_id": "LAB", "payload": base64.b64encode(ORU_R01.encode()).decode()},
+    )
+    assert response.status_code == 200
+    assert response.json()["validation_result"]["validation"]["hash_data"] == {"hash": "h1"}
+
+
+def test_rejected_queued_message_is_permanent(fused_ingress):
+    with pytest.raises(fused_ingress.PermanentFailure):
+        asyncio.run(fused_ingress.process_queued_hl7(record(payload="not hl7")))
@@ -0,0 +1,144 @@
+import hl7
+import pytest
+
+from conftest import load_service_module
+
+tokenizer = load_service_module("parser", "hl7_tokenizer")
+parsing = load_service_module("parser", "parsing")
+
+MESSAGES = {
+    "adt": (
+        "MSH|^~\\&|SENDING_APP|SENDING_FAC|RECEIVING_APP|RECEIVING_FAC|20231201120000||ADT^A01|MSG001|P|2.5\r"
+        "PID|1||PAT001^^^HOSP~ALT9^^^MPI||Doe^John||19800101|M\r"
+        "PV1|1|I|WARD^101^A||||||||||||||||"
+    ),
+    "oru": (
+        "MSH|^~\\&|LAB|FAC|EHR|FAC|20231201120500||ORU^R01|MSG002|P|2.5\r"
+        "PID|1||PAT002||Roe^Jane||19900101|F\r"
+        + "\r".join(f"OBX|{i}|NM|{i}-7^Test {i}^LN||{i}.5|mmol/L|3.9-5.5" for i in range(1, 40))
+    ),
+    "escapes": (
+        "MSH|^~\\&|LAB|FAC|EHR|FAC|20231201120500||ORU^R01|MSG003|P|2.5\r"
+        "PID|1||PAT003||O\\F\\Brien^Pat\\T\\Co||19700101|U\r"
+        "OBX|1|TX|NOTE^Note||Line one\\.br\\Line two \\H\\bold\\N\\|||"
+    ),
+    "custom_delimiters": (
+        "MSH#:*!@#LAB#FAC#EHR#FAC#20231201120500##ORU:R01#MSG004#P#2.5\r"
+        "PID#1##PAT004:::HOSP*PAT004B##Doe:Jo@hn##19800101#M\r"
+        "OBX#1#NM#2345-7:Glucose:LN##5.4#mmol/L#3.9-5.5"
+    ),
+    "short_segments": (
+        "MSH|^~\\&|A|B|C|D|20231201||ADT^A08|MSG005|P|2.5\r"
+        "PID|1\r"
+        "OBX|1\r\r"
+    ),
+    "subcomponents": (
+        "MSH|^~\\&|A|B|C|D|20231201||ORU^R01|MSG006|P|2.5\r"
+        "PID|1||ID1^^^AUTH&1.2.3&ISO||Doe^John\r"
+        "OBX|1|CE|CODE&SUB^Text^LN~ALT&X^Alt||POS"
+    ),
+}
+
+
+def python_hl7_message(payload):
+    return parsing.PythonHL7Message(hl7.parse(payload))
+
+
+@pytest.mark.parametrize("name", sorted(MESSAGES))
+def test_extracted_fields_match_python_hl7(name):
+    payload = MESSAGES[name]
+    expected = parsing.extract_hl7_fields(python_hl7_message(payload))
+    assert parsing.extract_hl7_fields(tokenizer.HL7Message(payload)) == expected
+
+
+@pytest.mark.parametrize("name", sorted(MESSAGES))
+def test_field_index_matches_python_hl7(name):
+    payload = MESSAGES[name]
+    expected = python_hl7_message(payload).field_index([])
+    assert tokenizer.HL7Message(payload).field_index() == expected
+
+
+@pytest.mark.parametrize("name", sorted(MESSAGES))
+def test_segment_fields_match_python_hl7(name):
+    payload = MESSAGES[name]
+    reference = [[str(field) for field in segment] for segment in hl7.parse(payload)]
+    assert [segment.fields() for segment in tokenizer.HL7Message(payload)] == reference
+    assert [len(segment) for segment in tokenizer.HL7Message(payload)] == [len(s) for s in reference]
+
+
+@pytest.mark.parametrize("value", [
+    "plain",
+    "O\\F\\Brien\\S\\x\\R\\y\\T\\z\\E\\",
+    "a\\H\\bold\\N\\b",
+    "one\\.br\\two\\.sp2\\three\\.sk3\\four\\.in\\five\\.ti2\\six\\.ce\\",
+    "fill\\.fi\\nofill\\.nf\\",
+    "hex \\X41\\ \\X4142\\ \\Xe9\\",
+    "charset \\C2842\\ multi \\M2442\\ unknown \\Zfoo\\ end",
+    "empty \\\\ sequence",
+    "trailing \\unterminated",
+])
+def test_unescape_matches_python_hl7(value):
+    reference = hl7.parse(MESSAGES["adt"])
+    assert tokenizer.unescape(value) == reference.unescape(value)
+
+
+def test_unescape_drops_malformed_sequences():
+    # python-hl7 raises on a bad repeat count; like a bad hex escape, it is dropped
+    assert tokenizer.unescape("a\\.spx\\b") == "ab"
+    assert tokenizer.unescape("a\\X4G\\b") == "ab"
+
+
+def test_unescape_uses_message_delimiters():
+    message = tokenizer.HL7Message(MESSAGES["custom_delimiters"])
+    assert message.unescape("a!F!b!S!c!R!d!T!e") == "a#b:c*d@e"
+
+
+def test_bytes_input_matches_str():
+    payload = MESSAGES["escapes"]
+    from_bytes = tokenizer.HL7Message(memoryview(payload.encode("utf-8")))
+    from_str = tokenizer.HL7Message(payload)
+    assert [s.fields() for s in from_bytes] == [s.fields() for s in from_str]
+    assert from_bytes.field_index() == from_str.field_index()
+
+
+def test_newline_segment_terminators():
+    payload = MESSAGES["oru"].replace("\r", "\r\n")
+    message = tokenizer.HL7Message(payload)
+    assert [s.id for s in message][:3] == ["MSH", "PID", "OBX"]
+    assert message.segment("PID")[5] == "Roe^Jane"
+    assert tokenizer.HL7Message(MESSAGES["oru"].replace("\r", "\n")).field_index() == \
+        tokenizer.HL7Message(MESSAGES["oru"]).field_index()
+
+
+def test_fields_are_located_lazily():
+    message = tokenizer.HL7Message(MESSAGES["oru"])
+    pid = message.segment("PID")
+    obx = message.segments("OBX")[-1]
+    assert pid[3] == "PAT002"
+    # Only the fields up to PID-3 have been located; OBX was never split
+    assert len(pid._bounds) == 4
+    assert obx._bounds == []
+
+
+def test_index_can_be_limited_to_segments():
+    field_index, segment_counts = tokenizer.HL7Message(MESSAGES["oru"]).field_index(["PID"])
+    assert segment_counts == {"MSH": 1, "PID": 1, "OBX": 39}
+    assert field_index["PID-3"] == ["PAT002"]
+    assert not any(path.startswith(("MSH", "OBX")) for path in field_index)
+
+
+@pytest.mark.parametrize("payload", [
+    "FHS|^~\\&|A\rMSH|^~\\&|A|B|C|D|20231201||ADT^A01|MSG007|P|2.5\rPID|1||PAT007",
+    "MSH|^~|A|B|C|D|20231201||ADT^A01|MSG008|P|2.5\rPID|1||PAT008",
+])
+def test_unusual_messages_fall_back_to_python_hl7(payload):
+    with pytest.raises(tokenizer.TokenizerFallback):
+        tokenizer.HL7Message(payload)
+    request = parsing.HL7ParseRequest(
+        message_id="fallback", channel_id="test", payload=payload, timestamp="2023-12-01T12:00:00"
+    )
+    parsed_message = parsing.build_hl7_parsed_message(request)
+    parsed = parsed_message.parsed_data
+    assert parsed["message_type"] == "ADT^A01"
+    assert parsed["segments"]["PID"]["patient_id"].startswith("PAT")
+    assert parsed_message.segment_counts["PID"] == 1
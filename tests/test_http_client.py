@@ -0,0 +1,29 @@
+import asyncio
+
+from prometheus_client import generate_latest
+
+from common.http_client import ServiceClient
+
+
+def test_client_is_reused_until_closed(monkeypatch):
+    monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "7")
+    service_client = ServiceClient("test-reuse", "http://example.invalid")
+
+    async def run():
+        await service_client.start()
+        first = service_client.client
+        assert service_client.client is first
+        await service_client.close()
+        assert service_client._client is None
+
+    asyncio.run(run())
+    assert service_client.max_connections == 7
+
+
+def test_pool_stats_exposed_on_metrics():
+    service_client = ServiceClient("test-metrics", "http://example.invalid")
+    assert service_client.pool_stats()["open"] == 0
+
+    output = generate_latest().decode()
+    assert 'http_pool_connections{state="open",target="test-metrics"} 0.0' in output
+    assert 'http_pool_max_connections{target="test-metrics"} 100.0' in output
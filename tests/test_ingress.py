@@ -0,0 +1,102 @@
+import base64
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+DICOM_HEADERS = {
+    "Authorization": "Bearer test-token",
+    "Content-Type": "application/dicom",
+    "X-Channel-ID": "PACS",
+    "X-Study-UID": "1.2",
+    "X-Series-UID": "1.2.3",
+    "X-Instance-UID": "1.2.3.4",
+    "X-Modality": "CT",
+}
+
+
+def use_parser(ingress_service, monkeypatch, handler):
+    client = httpx.AsyncClient(base_url="http://parser", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(ingress_service.parser_client, "_client", client)
+
+
+def test_dicom_stream_is_piped_to_parser(ingress_service, monkeypatch):
+    received = {}
+
+    async def handler(request):
+        received["transfer_encoding"] = request.headers.get("Transfer-Encoding")
+        received["body"] = b"".join([chunk async for chunk in request.stream])
+        received["params"] = dict(request.url.params)
+        return httpx.Response(200, json={"status": "success"})
+
+    use_parser(ingress_service, monkeypatch, handler)
+    body = [bytes([i]) * 65536 for i in range(8)]
+    response = TestClient(ingress_service.app).post(
+        "/ingest/dicom/stream", headers=DICOM_HEADERS, content=iter(body)
+    )
+    assert response.status_code == 200
+    assert response.json()["message_id"] == "1.2.3.4"
+    assert received["body"] == b"".join(body)
+    # Forwarded as a stream rather than a buffered body
+    assert received["transfer_encoding"] == "chunked"
+    assert received["params"]["modality"] == "CT"
+
+
+def test_dicom_stream_passes_on_parser_rejection(ingress_service, monkeypatch):
+    async def handler(request):
+        await request.aread()
+        return httpx.Response(413, json={"detail": "DICOM header exceeds 16 bytes"})
+
+    use_parser(ingress_service, monkeypatch, handler)
+    response = TestClient(ingress_service.app).post(
+        "/ingest/dicom/stream", headers=DICOM_HEADERS, content=b"\x00" * 64
+    )
+    assert response.status_code == 413
+
+
+def test_dicom_stream_requires_metadata_headers(ingress_service):
+    headers = {k: v for k, v in DICOM_HEADERS.items() if k != "X-Instance-UID"}
+    response = TestClient(ingress_service.app).post("/ingest/dicom/stream", headers=headers, content=b"")
+    assert response.status_code == 422
+
+
+def b64(text):
+    return base64.b64encode(text.encode()).decode()
+
+
+def test_hl7_batch_isolates_undecodable_messages(ingress_service, monkeypatch):
+    forwarded = {}
+
+    async def handler(request):
+        body = json.loads(request.content)
+        forwarded["ids"] = [m["message_id"] for m in body["messages"]]
+        return httpx.Response(200, json={"results": [
+            {"message_id": m["message_id"], "status": "success"} for m in body["messages"]
+        ]})
+
+    use_parser(ingress_service, monkeypatch, handler)
+    response = TestClient(ingress_service.app).post("/ingest/hl7/batch", headers={"Authorization": "Bearer t"}, json={
+        "channel_id": "lab",
+        "messages": [
+            {"message_id": "m1", "payload": b64("MSH|^~\\&|A")},
+            {"message_id": "m2", "payload": "not base64!"},
+            {"message_id": "m3", "payload": base64.b64encode(b"\xff\xfe").decode()},
+            {"message_id": "m4", "payload": b64("MSH|^~\\&|B")},
+        ],
+    })
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(r["message_id"], r["status"]) for r in results] == [
+        ("m1", "success"), ("m2", "error"), ("m3", "error"), ("m4", "success")
+    ]
+    assert forwarded["ids"] == ["m1", "m4"]
+
+
+def test_hl7_batch_limit_counts_batch_file_messages(ingress_service, monkeypatch):
+    monkeypatch.setattr(ingress_service, "MAX_BATCH_SIZE", 2)
+    batch_file = "\r".join(["BHS|^~\\&|LAB"] + ["MSH|^~\\&|LAB|FAC"] * 3 + ["BTS|3"])
+    response = TestClient(ingress_service.app).post("/ingest/hl7/batch", headers={"Authorization": "Bearer t"}, json={
+        "channel_id": "lab",
+        "batch_payload": b64(batch_file),
+    })
+    assert response.status_code == 413
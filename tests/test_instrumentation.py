@@ -0,0 +1,62 @@
+import asyncio
+
+from common import instrumentation
+from common.executor import BoundedExecutor
+from common.instrumentation import stage
+
+
+def stage_count(name):
+    for metric in instrumentation.stage_seconds.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") and sample.labels == {"stage": name}:
+                return sample.value
+    return 0
+
+
+def parse_in_worker(message_id):
+    with stage("test.worker", message_id):
+        return message_id.upper()
+
+
+def test_stage_exemplar_is_served_as_openmetrics():
+    instrumentation.bind_message_id("MSG-EXEMPLAR")
+    with stage("test.exemplar"):
+        pass
+    body, content_type = instrumentation.metrics_payload("application/openmetrics-text; version=1.0.0")
+    assert content_type.startswith("application/openmetrics-text")
+    lines = [line for line in body.decode().splitlines() if 'stage="test.exemplar"' in line and " # " in line]
+    assert lines and 'message_id="MSG-EXEMPLAR"' in lines[0]
+
+    body, content_type = instrumentation.metrics_payload("text/plain")
+    assert content_type.startswith("text/plain")
+    assert b"MSG-EXEMPLAR" not in body
+
+
+def test_stages_in_worker_processes_are_observed_by_the_caller(monkeypatch):
+    monkeypatch.setenv("TESTSTAGE_EXECUTOR", "process")
+    executor = BoundedExecutor("teststage", workers=2)
+
+    async def main():
+        return await asyncio.gather(*(executor.run(parse_in_worker, f"m{n}") for n in range(4)))
+
+    try:
+        assert asyncio.run(main()) == ["M0", "M1", "M2", "M3"]
+    finally:
+        executor.shutdown()
+    assert stage_count("test.worker") == 4
+
+
+def test_inline_calls_replay_their_stages(monkeypatch):
+    monkeypatch.setenv("TESTINLINE_EXECUTOR", "inline")
+    executor = BoundedExecutor("testinline", workers=1)
+    before = stage_count("test.worker")
+    assert asyncio.run(executor.run(parse_in_worker, "m")) == "M"
+    assert stage_count("test.worker") == before + 1
+
+
+def test_disabled_stages_are_not_observed(monkeypatch):
+    monkeypatch.setattr(instrumentation, "ENABLED", False)
+    with stage("test.disabled", "MSG"):
+        pass
+    assert stage_count("test.disabled") == 0
+    assert not instrumentation.sample_rules()
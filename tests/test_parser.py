@@ -0,0 +1,88 @@
+from fastapi.testclient import TestClient
+
+from common.canonical_json import ENCODING_CANONICAL, canonical_sha256
+from conftest import load_service_module
+
+parsing = load_service_module("parser", "parsing")
+
+ADT_A01 = (
+    "MSH|^~\\&|SENDING_APP|SENDING_FAC|RECEIVING_APP|RECEIVING_FAC|20231201120000||ADT^A01|MSG001|P|2.5\r"
+    "PID|1||PAT001^^^HOSP||Doe^John||19800101|M"
+)
+ORU_R01 = (
+    "MSH|^~\\&|LAB|FAC|EHR|FAC|20231201120500||ORU^R01|MSG002|P|2.5\r"
+    "PID|1||PAT002||Roe^Jane||19900101|F\r"
+    "OBX|1|NM|2345-7^Glucose^LN||5.4|mmol/L|3.9-5.5"
+)
+
+
+def test_split_hl7_batch():
+    batch = "\r".join([
+        "FHS|^~\\&|SENDER",
+        "BHS|^~\\&|SENDER",
+        ADT_A01,
+        ORU_R01,
+        "BTS|2",
+        "FTS|1",
+    ])
+    messages = parsing.split_hl7_batch(batch)
+    assert messages == [ADT_A01, ORU_R01]
+
+
+def test_split_hl7_batch_strips_mllp_framing():
+    framed = "\x0b" + ADT_A01 + "\x1c\r\x0b" + ORU_R01 + "\x1c\r"
+    assert parsing.split_hl7_batch(framed) == [ADT_A01, ORU_R01]
+
+
+def test_parse_hl7_batch_keeps_order_and_isolates_errors(parser_service, monkeypatch):
+    forwarded = []
+
+    async def fake_forward(parsed_messages):
+        forwarded.extend(parsed_messages)
+        return [{"overall_status": "OK", "message_id": m.message_id} for m in parsed_messages]
+
+    monkeypatch.setattr(parser_service, "forward_batch_to_validator", fake_forward)
+    client = TestClient(parser_service.app)
+
+    response = client.post("/parse/hl7/batch", json={
+        "channel_id": "lab",
+        "messages": [
+            {"message_id": "m1", "channel_id": "lab", "payload": ADT_A01, "timestamp": "2023-12-01T12:00:00"},
+            {"message_id": "m2", "channel_id": "lab", "payload": "not hl7", "timestamp": "2023-12-01T12:00:00"},
+        ],
+        "batch_payload": "BHS|^~\\&|LAB\r" + ORU_R01 + "\rBTS|1",
+    })
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["success", "error", "success"]
+    assert results[0]["message_id"] == "m1"
+    assert results[0]["validation"]["message_id"] == "m1"
+    assert results[2]["parsed"]["message_type"] == "ORU^R01"
+    # The validator's index travels beside the parsed data, not in it
+    assert "field_index" not in results[2]["parsed"]
+    assert len(forwarded) == 2
+    assert forwarded[1].segment_counts == {"MSH": 1, "PID": 1, "OBX": 1}
+
+
+def test_field_index_covers_repeating_segments():
+    message = ORU_R01 + "\rOBX|2|NM|718-7^Hemoglobin^LN||13.5|g/dL"
+    field_index, segment_counts = parsing.index_hl7_fields(message)
+    assert segment_counts == {"MSH": 1, "PID": 1, "OBX": 2}
+    assert field_index["MSH-9"] == ["ORU^R01"]
+    assert field_index["MSH-9.2"] == ["R01"]
+    assert field_index["MSH-2"] == ["^~\\&"]
+    assert field_index["OBX-3.1"] == ["2345-7", "718-7"]
+    assert field_index["PID-5.2"] == ["Jane"]
+
+
+def test_payload_digest_ignores_the_field_index(monkeypatch):
+    monkeypatch.setattr(parsing, "PAYLOAD_HASH_MODE", ENCODING_CANONICAL)
+    request = parsing.HL7ParseRequest(
+        message_id="m1", channel_id="lab", payload=ORU_R01, timestamp="2023-12-01T12:00:00"
+    )
+    expected = canonical_sha256(parsing.extract_hl7_fields(parsing.HL7Message(ORU_R01)))
+    digests = set()
+    for segments in ([], ["MSH", "PID"]):
+        monkeypatch.setattr(parsing, "HL7_INDEX_SEGMENTS", segments)
+        digests.add(parsing.build_hl7_parsed_message(request).payload_sha256)
+    assert digests == {expected}
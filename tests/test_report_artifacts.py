@@ -0,0 +1,48 @@
+import json
+from datetime import date, datetime
+
+from conftest import load_service_module
+
+artifacts = load_service_module("reporter", "report_artifacts")
+
+SUMMARY = {
+    "total_messages": {"value": 200},
+    "by_type": {"buckets": [{"key": "ORU^R01", "doc_count": 150}, {"key": "ADT^A01", "doc_count": 50}]},
+    "by_severity": {"buckets": [{"key": "INFO", "doc_count": 197}, {"key": "ERROR", "doc_count": 3}]},
+    "by_channel": {"buckets": [{"key": "LAB", "doc_count": 200}]},
+    "error_messages": {"doc_count": 3},
+}
+
+
+def test_metrics_are_computed_once_for_both_renderings():
+    metrics = artifacts.report_metrics(SUMMARY)
+    assert metrics == {"total_messages": 200, "error_count": 3, "error_rate": 0.015, "khzg_compliant": False}
+    assert artifacts.report_metrics({})["error_rate"] == 0
+
+    report = json.loads(artifacts.render_json(datetime(2023, 12, 1), SUMMARY))
+    assert report["summary"] == metrics
+    assert report["by_type"] == {"ORU^R01": 150, "ADT^A01": 50}
+    assert report["report_date"] == "2023-12-01T00:00:00"
+
+
+def test_pdf_is_rendered_in_memory():
+    pdf = artifacts.render_pdf(datetime(2023, 12, 1), SUMMARY)
+    assert pdf.startswith(b"%PDF") and pdf.rstrip().endswith(b"%%EOF")
+
+
+def test_content_hash_follows_the_summary():
+    day = date(2023, 12, 1)
+    digest = artifacts.content_hash(day, SUMMARY)
+    assert artifacts.content_hash(day, json.loads(json.dumps(SUMMARY))) == digest
+    assert artifacts.content_hash(date(2023, 12, 2), SUMMARY) != digest
+    changed = dict(SUMMARY, error_messages={"doc_count": 4})
+    assert artifacts.content_hash(day, changed) != digest
+
+
+def test_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "reports" / "cache.json")
+    cache = artifacts.ReportCache(path).load()
+    assert cache.get(date(2023, 12, 1)) is None
+    cache.put(date(2023, 12, 1), "abc")
+    cache.save()
+    assert artifacts.ReportCache(path).load().get(date(2023, 12, 1)) == "abc"
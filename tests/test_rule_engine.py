@@ -0,0 +1,125 @@
+from conftest import load_service_module
+
+rule_engine = load_service_module("validator", "rule_engine")
+RulePlan = rule_engine.RulePlan
+ValidationRule = rule_engine.ValidationRule
+Severity = rule_engine.Severity
+
+
+def make_rule(rule_id, segment, field, operator, value=None, severity=Severity.WARN, path=None):
+    return ValidationRule(
+        id=rule_id,
+        name=rule_id,
+        description=rule_id,
+        segment=segment,
+        field=field,
+        path=path,
+        operator=operator,
+        value=value,
+        severity=severity,
+        message=f"{rule_id} failed",
+    )
+
+
+RULES = [
+    make_rule("PID3", "PID", 3, "NOT_EMPTY", severity=Severity.ERROR),
+    make_rule("OBX3", "OBX", 3, "REGEX", r"^\d{1,5}-\d$"),
+    make_rule("MODALITY", "DICOM", None, "IN_LIST", ["CT", "MR"]),
+]
+
+
+def hl7(segments):
+    return {"message_type": "HL7", "parsed_data": {"segments": segments}}
+
+
+def test_only_applicable_rules_are_evaluated():
+    plan = RulePlan(RULES)
+    results = plan.evaluate(hl7({"PID": {"patient_id": "123"}}))
+    # OBX is absent, so the LOINC regex does not apply
+    assert [r.rule_id for r in results] == ["PID3"]
+
+    results = plan.evaluate({"message_type": "DICOM", "parsed_data": {"modality": "XA"}})
+    assert [(r.rule_id, r.passed) for r in results] == [("MODALITY", False)]
+
+
+def test_presence_rules_fail_when_segment_missing():
+    plan = RulePlan(RULES)
+    results = plan.evaluate(hl7({}))
+    assert [(r.rule_id, r.passed, r.severity) for r in results] == [("PID3", False, Severity.ERROR)]
+
+
+def test_regex_and_prebuilt_results():
+    plan = RulePlan(RULES)
+    ok = plan.evaluate(hl7({"PID": {"patient_id": "1"}, "OBX": [{"observation_id": "2345-7"}]}))
+    bad = plan.evaluate(hl7({"PID": {"patient_id": "1"}, "OBX": [{"observation_id": "GLU"}]}))
+    assert ok[1].passed and not bad[1].passed
+    assert bad[1].details == {"rule": RULES[1].dict()}
+    # Failure payloads are built at compile time and shared between messages
+    again = plan.evaluate(hl7({"PID": {"patient_id": "1"}, "OBX": [{"observation_id": "X"}]}))
+    assert again[1] is bad[1]
+
+
+def test_inactive_and_segmentless_rules_are_not_compiled():
+    inactive = make_rule("OFF", "PID", 3, "NOT_EMPTY")
+    inactive.active = False
+    plan = RulePlan(RULES + [inactive, make_rule("NOSEG", None, None, "NOT_EMPTY")])
+    assert plan.rule_count == 3
+
+
+def test_invalid_regex_is_rejected_at_compile_time():
+    try:
+        RulePlan([make_rule("BAD", "OBX", 3, "REGEX", "(")])
+    except rule_engine.InvalidRule:
+        pass
+    else:
+        raise AssertionError("invalid regex compiled")
+
+
+def indexed(field_index, segment_counts):
+    return {
+        "message_type": "HL7",
+        "parsed_data": {},
+        "field_index": field_index,
+        "segment_counts": segment_counts,
+    }
+
+
+def test_field_paths_cover_any_segment_and_component():
+    plan = RulePlan([
+        make_rule("MSH9", "MSH", 9, "NOT_EMPTY"),
+        make_rule("EVENT", None, None, "IN_LIST", ["A01", "A04"], path="MSH-9.2"),
+    ])
+    message = indexed({"MSH-9": ["ADT^A08"], "MSH-9.1": ["ADT"], "MSH-9.2": ["A08"]}, {"MSH": 1})
+    assert [(r.rule_id, r.passed) for r in plan.evaluate(message)] == [("MSH9", True), ("EVENT", False)]
+
+
+def test_repeating_segments_are_all_checked():
+    plan = RulePlan([make_rule("LOINC", "OBX", 3, "REGEX", r"^\d{1,5}-\d$", path="OBX-3.1")])
+    good = indexed({"OBX-3.1": ["2345-7", "718-7"]}, {"OBX": 2})
+    bad = indexed({"OBX-3.1": ["2345-7", "GLU"]}, {"OBX": 2})
+    assert plan.evaluate(good)[0].passed
+    assert not plan.evaluate(bad)[0].passed
+
+
+def test_first_component_falls_back_to_plain_field():
+    plan = RulePlan([make_rule("PID31", None, None, "NOT_EMPTY", path="PID-3.1")])
+    assert plan.evaluate(indexed({"PID-3": ["12345"]}, {"PID": 1}))[0].passed
+
+
+def test_invalid_path_is_rejected():
+    try:
+        RulePlan([make_rule("BADPATH", None, None, "NOT_EMPTY", path="PID3")])
+    except rule_engine.InvalidRule:
+        pass
+    else:
+        raise AssertionError("invalid path compiled")
+
+
+def test_timed_evaluation_reports_each_applied_rule():
+    plan = RulePlan(RULES)
+    message = hl7({"PID": {"patient_id": ""}, "OBX": [{"observation_id": "2345-7"}]})
+    observed = []
+    results = plan.evaluate(message, lambda rule_id, seconds: observed.append((rule_id, seconds)))
+    assert results == plan.evaluate(message)
+    assert [rule_id for rule_id, _ in observed] == [r.rule_id for r in results]
+    assert all(seconds >= 0 for _, seconds in observed)
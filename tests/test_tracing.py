@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI, Request
+
+from common import tracing
+from common.http_client import ServiceClient
+from common.instrumentation import bind_message_id, stage
+
+HEADER = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def test_traceparent_is_parsed_and_validated():
+    span = tracing.parse_traceparent(HEADER)
+    assert (span.trace_id, span.span_id, span.sampled) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert not tracing.parse_traceparent(HEADER[:-1] + "0").sampled
+    for header in [None, "", "garbage", HEADER + "-extra", "ff" + HEADER[2:],
+                   "00-00000000000000000000000000000000-00f067aa0ba902b7-01",
+                   "00-4bf92f3577b34da6a3ce929d0e0e4736-0000000000000000-01"]:
+        assert tracing.parse_traceparent(header) is None
+
+
+def make_apps():
+    downstream = FastAPI()
+    downstream.add_middleware(tracing.TraceMiddleware, service="down")
+    seen = {}
+
+    @downstream.post("/work")
+    async def work(request: Request):
+        seen["traceparent"] = request.headers.get("traceparent")
+        with stage("down.work"):
+            pass
+        return {}
+
+    client = ServiceClient("down", "http://down")
+    client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=downstream), base_url="http://down")
+
+    upstream = FastAPI()
+    upstream.add_middleware(tracing.TraceMiddleware, service="up")
+
+    @upstream.post("/ingest")
+    async def ingest():
+        bind_message_id("MSG-1")
+        with stage("up.decode", "MSG-1"):
+            pass
+        response = await client.post("/work", json={})
+        response.raise_for_status()
+        return {}
+
+    return upstream, seen
+
+
+def test_spans_follow_the_message_across_services(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracing.configure(str(path))
+    upstream, seen = make_apps()
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream), base_url="http://up") as client:
+            response = await client.post("/ingest", headers={"traceparent": HEADER})
+            assert response.status_code == 200
+
+    try:
+        asyncio.run(run())
+    finally:
+        tracing.configure(None)
+
+    spans = {span["name"]: span for span in map(json.loads, path.read_text().splitlines())}
+    assert set(spans) == {"up POST /ingest", "up.decode", "forward.down", "down POST /work", "down.work"}
+    assert {span["trace_id"] for span in spans.values()} == {"4bf92f3577b34da6a3ce929d0e0e4736"}
+    root = spans["up POST /ingest"]
+    assert root["parent_id"] == "00f067aa0ba902b7" and root["message_id"] == "MSG-1"
+    assert spans["up.decode"]["parent_id"] == root["span_id"]
+    assert spans["forward.down"]["parent_id"] == root["span_id"]
+    # The downstream request is a child of the forward span
+    assert seen["traceparent"] == f"00-{root['trace_id']}-{spans['forward.down']['span_id']}-01"
+    assert spans["down POST /work"]["parent_id"] == spans["forward.down"]["span_id"]
+    assert spans["down.work"]["parent_id"] == spans["down POST /work"]["span_id"]
+
+
+def test_unsampled_traces_are_passed_on_but_not_recorded(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracing.configure(str(path))
+    upstream, seen = make_apps()
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream), base_url="http://up") as client:
+            await client.post("/ingest", headers={"traceparent": HEADER[:-1] + "0"})
+
+    try:
+        asyncio.run(run())
+    finally:
+        tracing.configure(None)
+
+    assert not path.exists()
+    assert seen["traceparent"].startswith("00-4bf92f3577b34da6a3ce929d0e0e4736-") and seen["traceparent"].endswith("-00")
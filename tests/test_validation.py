@@ -4,6 +4,7 @@ import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'services', 'validator'))
+import main
 from main import app, ValidationRule, Severity
 
 client = TestClient(app)
@@ -132,4 +133,44 @@ def test_delete_rule():
     
     # Verify it's gone
     response = client.delete(f"/rules/{rule_id}")
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def test_validate_batch(monkeypatch):
+    async def fake_forward(validated_messages):
+        return [{"chain_hash": f"hash-{m.message_id}"} for m in validated_messages]
+
+    monkeypatch.setattr(main, "forward_batch_to_hashwriter", fake_forward)
+    messages = [
+        {
+            "message_id": f"BATCH_{i}",
+            "channel_id": "test-channel",
+            "message_type": "HL7",
+            "timestamp": "2023-10-15T12:00:00",
+            "parsed_data": {"segments": {"PID": {"patient_id": patient_id}}}
+        }
+        for i, patient_id in enumerate(["123", ""])
+    ]
+
+    response = client.post("/validate/batch", json={"messages": messages})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["message_id"] for r in results] == ["BATCH_0", "BATCH_1"]
+    assert results[1]["overall_status"] == "ERROR"
+    assert results[0]["hash_data"] == {"chain_hash": "hash-BATCH_0"}
+
+
+def test_add_rule_with_invalid_regex_is_rejected():
+    rule = {
+        "id": "BAD_REGEX",
+        "name": "Broken regex",
+        "description": "Unbalanced parenthesis",
+        "segment": "OBX",
+        "field": 3,
+        "operator": "REGEX",
+        "value": "(",
+        "severity": "WARN",
+        "message": "never evaluated"
+    }
+    response = client.post("/rules", json=rule)
+    assert response.status_code == 400
+    assert all(r["id"] != "BAD_REGEX" for r in client.get("/rules").json()["rules"])